@@ -49,6 +49,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so request latency covers every other middleware.
+    'admin_app.metrics.MetricsMiddleware',
+    'admin_app.db_router.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -82,12 +85,72 @@ WSGI_APPLICATION = 'admin_api.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# SQLite unless DB_ENGINE=postgresql; the tests run on SQLite. On PostgreSQL:
+# - each process keeps a psycopg pool of DB_POOL_MIN_SIZE to DB_POOL_MAX_SIZE
+#   connections (size it so workers x max size stays under max_connections);
+#   DB_POOL_MAX_SIZE=0 keeps one persistent connection per thread instead, for
+#   up to DB_CONN_MAX_AGE seconds. Either way connections are checked before
+#   reuse.
+# - statements running longer than DB_STATEMENT_TIMEOUT_MS are cancelled (run
+#   migrations on big tables with DB_STATEMENT_TIMEOUT_MS=0).
+# - a query run DB_PREPARE_THRESHOLD times on one connection becomes a
+#   server-side prepared statement, which covers the hot create/booking
+#   queries. Leave it empty behind PgBouncer in transaction mode.
+DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite3')
+
+if DB_ENGINE == 'postgresql':
+    DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 10))
+    DB_PREPARE_THRESHOLD = os.getenv('DB_PREPARE_THRESHOLD', '5')
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('DB_NAME', 'admin'),
+            'USER': os.getenv('DB_USER', 'postgres'),
+            'PASSWORD': os.getenv('DB_PASSWORD', ''),
+            'HOST': os.getenv('DB_HOST', 'localhost'),
+            'PORT': os.getenv('DB_PORT', '5432'),
+            'CONN_MAX_AGE': 0 if DB_POOL_MAX_SIZE else int(os.getenv('DB_CONN_MAX_AGE', 600)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'options': f"-c statement_timeout={int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 5000))}",
+                'server_side_binding': bool(DB_PREPARE_THRESHOLD),
+                'prepare_threshold': int(DB_PREPARE_THRESHOLD) if DB_PREPARE_THRESHOLD else None,
+            },
+        }
     }
-}
+    if DB_POOL_MAX_SIZE:
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+            'max_size': DB_POOL_MAX_SIZE,
+            'timeout': float(os.getenv('DB_POOL_TIMEOUT', 10)),
+        }
+
+    # Streaming replicas of the same database, one alias per host in
+    # DB_REPLICA_HOSTS (comma-separated); everything else matches default.
+    for index, host in enumerate(h for h in os.getenv('DB_REPLICA_HOSTS', '').split(',') if h):
+        DATABASES[f'replica_{index}'] = {
+            **DATABASES['default'],
+            'HOST': host,
+            'OPTIONS': dict(DATABASES['default']['OPTIONS']),
+            'TEST': {'MIRROR': 'default'},
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
+    }
+
+# Reads go to a healthy replica, writes and read-your-writes to default (see
+# admin_app/db_router.py). Replicas lagging more than DB_REPLICA_MAX_LAG_SECONDS
+# are skipped; a client that wrote reads from default for
+# DB_REPLICA_STICKY_SECONDS, which must exceed the maximum lag.
+DB_REPLICAS = [alias for alias in DATABASES if alias.startswith('replica_')]
+DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv('DB_REPLICA_MAX_LAG_SECONDS', 5))
+DB_REPLICA_STICKY_SECONDS = int(os.getenv('DB_REPLICA_STICKY_SECONDS', 15))
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv('DB_REPLICA_CHECK_INTERVAL', 2))
+DATABASE_ROUTERS = ['admin_app.db_router.ReplicaRouter']
 
 
 # Password validation
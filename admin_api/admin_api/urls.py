@@ -15,8 +15,11 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path
+from django.urls import path, include
+from admin_app.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('admins/', include('admin_app.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
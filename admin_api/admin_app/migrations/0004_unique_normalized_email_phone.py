@@ -0,0 +1,50 @@
+# Generated by Django 5.1.1 on 2026-10-18 09:38
+
+from django.db import migrations, models
+
+
+PHONE_SEPARATORS = str.maketrans("", "", " -().")
+
+
+def normalize_contacts(apps, schema_editor):
+    """Store emails and phones normalised, so the unique constraints apply to the canonical values."""
+    Admin = apps.get_model('admin_app', 'Admin')
+    seen = {"email": {}, "phone": {}}
+    clashes = []
+    for row in Admin.objects.order_by('pk').iterator():
+        email = row.email.strip().lower()
+        phone = row.phone.strip().translate(PHONE_SEPARATORS)
+        if phone.startswith("00"):
+            phone = "+" + phone[2:]
+        for field, value in (("email", email), ("phone", phone)):
+            first = seen[field].setdefault(value, row.pk)
+            if first != row.pk:
+                clashes.append(f"{field} {value!r}: admin ids {first} and {row.pk}")
+        if (email, phone) != (row.email, row.phone):
+            Admin.objects.filter(pk=row.pk).update(email=email, phone=phone)
+    if clashes:
+        raise RuntimeError("Merge or remove these duplicate accounts, then migrate again:\n" + "\n".join(clashes))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('admin_app', '0003_admin_created_at_admin_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_contacts, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='admin',
+            name='email',
+            field=models.EmailField(max_length=254),
+        ),
+        migrations.AddConstraint(
+            model_name='admin',
+            constraint=models.UniqueConstraint(fields=('email',), name='admin_unique_email'),
+        ),
+        migrations.AddConstraint(
+            model_name='admin',
+            constraint=models.UniqueConstraint(fields=('phone',), name='admin_unique_phone'),
+        ),
+    ]
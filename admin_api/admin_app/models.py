@@ -2,9 +2,16 @@ from django.db import models
 
 class Admin(models.Model):
     admin_id =models.AutoField(primary_key=True)
-    email = models.EmailField(unique=True)
+    # Stored normalised (see accounts.py); unique via the constraints below.
+    email = models.EmailField()
     phone = models.CharField(max_length=15)
     first_name = models.CharField(max_length=50)
     last_name = models.CharField(max_length=50)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["email"], name="admin_unique_email"),
+            models.UniqueConstraint(fields=["phone"], name="admin_unique_phone"),
+        ]
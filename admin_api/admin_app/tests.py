@@ -1,3 +1,148 @@
-from django.test import TestCase
+import io
+import os
+import threading
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from prometheus_client import REGISTRY
+
+from . import db_router
+from .accounts import duplicate_field
+from .coldstart import run_cold_start
+from .models import Admin
+
+
+def signup(client, email, phone):
+    return client.post("/admins/", {
+        "email": email, "phone": phone, "first_name": "Jane", "last_name": "Doe",
+    }, content_type="application/json")
+
+
+class AddAdminViewTests(TestCase):
+    def test_creates_admin_with_normalized_contacts(self):
+        with self.assertNumQueries(3):  # SAVEPOINT, INSERT, RELEASE SAVEPOINT
+            response = signup(self.client, " Jane@Example.com", "0044 20 7946 0958")
+        self.assertEqual(response.status_code, 201)
+        data = response.json()["data"]
+        self.assertEqual((data["email"], data["phone"]), ("jane@example.com", "+442079460958"))
+
+    def test_duplicates_map_to_error_codes(self):
+        Admin.objects.create(email="jane@example.com", phone="+15550000001", first_name="J", last_name="D")
+        response = signup(self.client, "JANE@example.com", "+15550000002")
+        self.assertEqual((response.status_code, response.json()["code"]), (400, "DUPLICATE_EMAIL"))
+        response = signup(self.client, "john@example.com", "+1-555-000-0001")
+        self.assertEqual((response.status_code, response.json()["code"]), (400, "DUPLICATE_PHONE"))
+
+    def test_duplicate_field(self):
+        Admin.objects.create(email="jane@example.com", phone="+15550000001", first_name="J", last_name="D")
+        with self.assertRaises(IntegrityError) as error, transaction.atomic():
+            Admin.objects.create(email="john@example.com", phone="+15550000001", first_name="J", last_name="D")
+        self.assertEqual(duplicate_field(error.exception, Admin), "phone")
+
+    def test_missing_and_invalid_fields(self):
+        response = self.client.post("/admins/", {"email": "jane@example.com"}, content_type="application/json")
+        self.assertEqual(response.json()["code"], "BAD_REQUEST")
+        response = signup(self.client, "jane@example.com", "12")
+        self.assertEqual(response.json()["code"], "INVALID_PHONE")
+
+
+class ConcurrentSignupTests(TransactionTestCase):
+    def test_racing_signups_create_one_admin(self):
+        workers = 8
+        barrier = threading.Barrier(workers)
+        codes = []
+
+        def race(n):
+            barrier.wait()
+            try:
+                while True:
+                    response = signup(self.client_class(), "racer@example.com", f"+1555100{n:04d}")
+                    # The shared in-memory test database fails instead of waiting on
+                    # a concurrent writer; a real database makes the INSERT wait.
+                    if "is locked" not in response.json().get("details", ""):
+                        break
+                codes.append(response.json().get("code", response.status_code))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=race, args=(n,)) for n in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(codes, key=str), sorted([201] + ["DUPLICATE_EMAIL"] * (workers - 1), key=str))
+        self.assertEqual(Admin.objects.filter(email="racer@example.com").count(), 1)
+
+
+class MetricsTests(TestCase):
+    def test_requests_are_timed_per_view(self):
+        labels = {"view": "add-admin", "method": "POST", "status": "201"}
+        before = REGISTRY.get_sample_value("http_request_duration_seconds_count", labels) or 0
+        self.assertEqual(signup(self.client, "jane@example.com", "+15550000001").status_code, 201)
+        self.assertEqual(REGISTRY.get_sample_value("http_request_duration_seconds_count", labels), before + 1)
+
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'db_queries_per_request_count{view="add-admin"}', response.content)
+
+
+class ColdStartTests(SimpleTestCase):
+    # Generous enough for slow CI runners; see passenger's test_coldstart.
+    budget_seconds = float(os.getenv("COLD_START_BUDGET_SECONDS", "1.5"))
+
+    def test_wsgi_cold_start_loads_views(self):
+        loaded = run_cold_start("wsgi").modules
+        self.assertIn("admin_app.views", loaded)
+
+    def test_cold_start_within_budget(self):
+        for target in ["wsgi", "check"]:
+            with self.subTest(target=target):
+                seconds = min(run_cold_start(target).seconds for _ in range(3))
+                self.assertLess(seconds, self.budget_seconds)
+
+    def test_profile_imports_command(self):
+        out = io.StringIO()
+        call_command("profile_imports", "--top", "3", stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith("wsgi: "))
+        self.assertEqual(len(lines), 5)
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        monitor = db_router.ReplicaMonitor(["replica_0"], background=False)
+        with mock.patch.object(db_router, "replica_lag", return_value=0.0):
+            monitor.check()
+        patcher = mock.patch.object(db_router, "_monitor", monitor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.router = db_router.ReplicaRouter()
+
+    @override_settings(DB_REPLICAS=["replica_0"])
+    def test_reads_go_to_replicas_until_the_client_writes(self):
+        routes = []
+
+        def view(request):
+            routes.append(self.router.db_for_read(Admin))
+            if request.method == "POST":
+                self.router.db_for_write(Admin)
+            return HttpResponse()
+
+        middleware = db_router.ReplicaPinningMiddleware(view)
+        self.assertNotIn(db_router.PIN_COOKIE, middleware(RequestFactory().get("/")).cookies)
+        response = middleware(RequestFactory().post("/"))
+        self.assertIn(db_router.PIN_COOKIE, response.cookies)
+        pinned = RequestFactory().get("/")
+        pinned.COOKIES[db_router.PIN_COOKIE] = "1"
+        middleware(pinned)
+        self.assertEqual(routes, ["replica_0", "default", "default"])
+
+    @override_settings(DB_REPLICAS=["replica_0"])
+    def test_lagging_replica_falls_back_to_default(self):
+        with mock.patch.object(db_router, "replica_lag", return_value=60.0):
+            db_router._monitor.check()
+        self.assertEqual(self.router.db_for_read(Admin), "default")
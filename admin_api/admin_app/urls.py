@@ -0,0 +1,6 @@
+from django.urls import path
+from .views import AddAdminView
+
+urlpatterns = [
+    path('', AddAdminView.as_view(), name='add-admin'),
+]
@@ -1,2 +1,84 @@
-from django.shortcuts import render
+from django.db import IntegrityError
+from django.http import JsonResponse
+from rest_framework import status
+from rest_framework.views import APIView
 
+from .accounts import create_account, duplicate_field, normalize_email, normalize_phone
+from .models import Admin
+
+
+ERROR_MESSAGES = {
+    "MISSING_FIELDS": "The [email, phone, first_name, last_name] fields are required.",
+    "DUPLICATE_EMAIL": "A user with this email address already exists.",
+    "DUPLICATE_PHONE": "A user with this phone number already exists.",
+    "INVALID_PHONE": "The phone number must have 7 to 15 digits, optionally prefixed with '+'.",
+    "SERVER_ERROR": "An error occured while creating the admin profile.",
+}
+
+
+class AddAdminView(APIView):
+    """Create an admin account with a single INSERT.
+
+    Email and phone are normalised and unique in the database, so duplicates
+    (including concurrent signups) surface as an IntegrityError.
+    """
+
+    def post(self, request):
+        email = request.data.get('email')
+        phone = request.data.get('phone')
+        first_name = request.data.get('first_name')
+        last_name = request.data.get('last_name')
+
+        if not all([email, phone, first_name, last_name]):
+            return JsonResponse({
+                "error": ERROR_MESSAGES["MISSING_FIELDS"],
+                "code": "BAD_REQUEST"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        email = normalize_email(str(email))
+        phone = normalize_phone(str(phone))
+        if phone is None:
+            return JsonResponse({
+                "error": ERROR_MESSAGES["INVALID_PHONE"],
+                "code": "INVALID_PHONE"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            # One INSERT; the unique constraints catch duplicates, even concurrent ones.
+            admin = create_account(
+                Admin,
+                email=email,
+                phone=phone,
+                first_name=first_name,
+                last_name=last_name
+            )
+        except IntegrityError as e:
+            field = duplicate_field(e, Admin)
+            if field is None:
+                return JsonResponse({
+                    "error": ERROR_MESSAGES["SERVER_ERROR"],
+                    "details": str(e)
+                }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            code = "DUPLICATE_EMAIL" if field == "email" else "DUPLICATE_PHONE"
+            return JsonResponse({
+                "error": ERROR_MESSAGES[code],
+                "code": code
+            }, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return JsonResponse({
+                "error": ERROR_MESSAGES["SERVER_ERROR"],
+                "details": str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return JsonResponse({
+            "message": "Admin created successfully.",
+            "data": {
+                "admin_id": admin.admin_id,
+                "email": admin.email,
+                "phone": admin.phone,
+                "first_name": admin.first_name,
+                "last_name": admin.last_name,
+                "created_at": admin.created_at,
+                "updated_at": admin.updated_at,
+            }
+        }, status=status.HTTP_201_CREATED)
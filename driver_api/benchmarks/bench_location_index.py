@@ -0,0 +1,138 @@
+"""Driver location update and query rates.
+
+Run from driver_api/:
+
+    python -m benchmarks.bench_location_index --drivers 50000
+    python -m benchmarks.bench_location_index --redis-url redis://localhost:6379/15
+
+Drivers are spread over a 30km x 30km city and move a few metres per ping.
+Reports, per backend:
+
+- single: one `update` call per ping;
+- batch: `update_many` with --batch pings per call, as the batch endpoint does;
+- query: fresh drivers in a 3x3 block of cells around a random point;
+- endpoint (memory only): POST driver/locations/ through Django in-process,
+  i.e. including JSON parsing and validation but no network.
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "driver_api.settings")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+import django  # noqa: E402
+
+django.setup()
+
+from driver import geohash  # noqa: E402
+from driver.location_index import InMemoryLocationIndex, LocationUpdate, RedisLocationIndex  # noqa: E402
+
+CENTER = (37.7749, -122.4194)
+SPAN = 0.27  # degrees, about 30km
+# Precision 6 cell size in degrees, used to build the 3x3 block.
+CELL_LAT, CELL_LON = 0.0055, 0.011
+
+
+def random_pings(drivers, count, seed=11):
+    rng = random.Random(seed)
+    positions = {
+        driver_id: (CENTER[0] + rng.uniform(-SPAN / 2, SPAN / 2), CENTER[1] + rng.uniform(-SPAN / 2, SPAN / 2))
+        for driver_id in range(1, drivers + 1)
+    }
+    pings = []
+    for _ in range(count):
+        driver_id = rng.randint(1, drivers)
+        lat, lon = positions[driver_id]
+        lat, lon = lat + rng.uniform(-1e-4, 1e-4), lon + rng.uniform(-1e-4, 1e-4)
+        positions[driver_id] = (lat, lon)
+        pings.append(LocationUpdate(driver_id, lat, lon))
+    return positions, pings
+
+
+def block(lat, lon, precision):
+    return {
+        geohash.encode(lat + dy * CELL_LAT, lon + dx * CELL_LON, precision)
+        for dy in (-1, 0, 1) for dx in (-1, 0, 1)
+    }
+
+
+def rate(count, elapsed):
+    return f"{count / elapsed:>12,.0f}/s{elapsed / count * 1e6:>10.1f} us"
+
+
+def bench_index(label, index, positions, pings, batch, queries):
+    index.update_many([LocationUpdate(d, lat, lon) for d, (lat, lon) in positions.items()])
+
+    n = min(len(pings), 20000)
+    start = time.perf_counter()
+    for driver_id, lat, lon, *_ in pings[:n]:
+        index.update(driver_id, lat, lon)
+    print(f"{label:<10}{'single':<10}{rate(n, time.perf_counter() - start)}")
+
+    start = time.perf_counter()
+    for i in range(0, len(pings), batch):
+        index.update_many(pings[i:i + batch])
+    print(f"{label:<10}{'batch':<10}{rate(len(pings), time.perf_counter() - start)}")
+
+    rng = random.Random(5)
+    points = [(CENTER[0] + rng.uniform(-SPAN / 3, SPAN / 3), CENTER[1] + rng.uniform(-SPAN / 3, SPAN / 3))
+              for _ in range(queries)]
+    cell_blocks = [block(lat, lon, index.precision) for lat, lon in points]
+    found = 0
+    start = time.perf_counter()
+    for cells in cell_blocks:
+        found += len(index.drivers_in_cells(cells))
+    print(f"{label:<10}{'query':<10}{rate(queries, time.perf_counter() - start)}   ~{found // queries} drivers/query")
+
+
+def bench_endpoint(pings, batch):
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+    from driver.location_index import reset_location_index
+
+    setup_test_environment()  # allows the test client's 'testserver' host
+    reset_location_index()
+    client = Client()
+    bodies = [
+        json.dumps({"updates": [{"driver_id": d, "latitude": lat, "longitude": lon} for d, lat, lon, *_ in pings[i:i + batch]]})
+        for i in range(0, len(pings), batch)
+    ]
+    start = time.perf_counter()
+    for body in bodies:
+        response = client.post("/driver/locations/", body, content_type="application/json")
+        assert response.status_code == 200, response.content
+    print(f"{'django':<10}{'endpoint':<10}{rate(len(pings), time.perf_counter() - start)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--drivers", type=int, default=50000)
+    parser.add_argument("--pings", type=int, default=200000)
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=5000)
+    parser.add_argument("--precision", type=int, default=6)
+    parser.add_argument("--redis-url", help="also benchmark RedisLocationIndex against this (scratch) database")
+    args = parser.parse_args()
+
+    positions, pings = random_pings(args.drivers, args.pings)
+    print(f"drivers={args.drivers} pings={args.pings} batch={args.batch} precision={args.precision}")
+    print(f"{'backend':<10}{'op':<10}{'rate':>14}{'per op':>13}")
+    bench_index("memory", InMemoryLocationIndex(precision=args.precision), positions, pings, args.batch, args.queries)
+    if args.redis_url:
+        import redis
+
+        client = redis.Redis.from_url(args.redis_url)
+        index = RedisLocationIndex(client, precision=args.precision, prefix="bench")
+        try:
+            bench_index("redis", index, positions, pings, args.batch, args.queries)
+        finally:
+            for key in client.scan_iter("bench:*", count=10000):
+                client.delete(key)
+    bench_endpoint(pings, min(args.batch, 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Nearest-driver query latency over synthetic fleets.
+
+Run from driver_api/:
+
+    python -m benchmarks.bench_matching --fleets 10000 100000 1000000
+
+90% of drivers cluster around five city centres (sigma ~5km), the rest are
+spread over a 400km x 400km region; 80% are available and 20% drive premium.
+Dense queries start near a city centre, sparse ones anywhere in the region,
+where the search has to widen ring by ring (up to --max-cells) before giving up.
+"""
+import argparse
+import os
+import random
+import time
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "driver_api.settings")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+import django  # noqa: E402
+
+django.setup()
+
+from driver.location_index import InMemoryLocationIndex, LocationUpdate  # noqa: E402
+from driver.matching import nearest_drivers  # noqa: E402
+
+CITIES = [(37.77, -122.42), (37.34, -121.89), (38.58, -121.49), (36.74, -119.79), (37.95, -121.29)]
+REGION = (35.5, -123.5, 39.5, -119.5)
+
+
+def fleet(size, rng):
+    for driver_id in range(1, size + 1):
+        if rng.random() < 0.9:
+            lat, lon = rng.choice(CITIES)
+            lat, lon = rng.gauss(lat, 0.045), rng.gauss(lon, 0.055)
+        else:
+            lat, lon = rng.uniform(REGION[0], REGION[2]), rng.uniform(REGION[1], REGION[3])
+        yield LocationUpdate(
+            driver_id, lat, lon, None, "premium" if rng.random() < 0.2 else "standard", rng.random() < 0.8
+        )
+
+
+def queries(kind, count, rng):
+    if kind == "dense":
+        return [(rng.gauss(lat, 0.03), rng.gauss(lon, 0.03)) for lat, lon in (rng.choice(CITIES) for _ in range(count))]
+    return [(rng.uniform(REGION[0], REGION[2]), rng.uniform(REGION[1], REGION[3])) for _ in range(count)]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fleets", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--radius-km", type=float, default=5.0)
+    parser.add_argument("--max-cells", type=int, default=2500)
+    parser.add_argument("--precision", type=int, default=6)
+    args = parser.parse_args()
+
+    print(f"k={args.k} radius={args.radius_km}km precision={args.precision} max_cells={args.max_cells}")
+    print(f"{'drivers':>9} {'area':<7}{'p50 ms':>9}{'p99 ms':>9}{'found':>7}{'cells':>8}{'complete':>10}")
+    for size in args.fleets:
+        rng = random.Random(size)
+        index = InMemoryLocationIndex(precision=args.precision, ttl=3600)
+        updates = list(fleet(size, rng))
+        for i in range(0, len(updates), 10000):
+            index.update_many(updates[i:i + 10000])
+        del updates
+
+        for kind in ("dense", "sparse"):
+            latencies, found, cells, complete = [], 0, 0, 0
+            for lat, lon in queries(kind, args.queries, rng):
+                start = time.perf_counter()
+                result = nearest_drivers(
+                    index, lat, lon, k=args.k, radius_km=args.radius_km, max_cells=args.max_cells
+                )
+                latencies.append(time.perf_counter() - start)
+                found += len(result.drivers)
+                cells += result.cells
+                complete += result.complete
+            n = len(latencies)
+            print(f"{size:>9} {kind:<7}{percentile(latencies, 0.5) * 1e3:>9.3f}{percentile(latencies, 0.99) * 1e3:>9.3f}"
+                  f"{found / n:>7.1f}{cells / n:>8.0f}{complete / n:>9.0%}")
+
+
+if __name__ == "__main__":
+    main()
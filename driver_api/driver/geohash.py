@@ -0,0 +1,117 @@
+BASE32_CODES = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def encode(latitude, longitude, precision=7):
+    """Encode a coordinate the same way `ngeohash.encode` does in geo_estimator,
+    so hashes computed here always match the ones the Node service returns."""
+    min_lat, max_lat = -90.0, 90.0
+    min_lon, max_lon = -180.0, 180.0
+    chars = []
+    bits = 0
+    hash_value = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (max_lon + min_lon) / 2
+            if longitude > mid:
+                hash_value = (hash_value << 1) + 1
+                min_lon = mid
+            else:
+                hash_value = hash_value << 1
+                max_lon = mid
+        else:
+            mid = (max_lat + min_lat) / 2
+            if latitude > mid:
+                hash_value = (hash_value << 1) + 1
+                min_lat = mid
+            else:
+                hash_value = hash_value << 1
+                max_lat = mid
+        even = not even
+
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32_CODES[hash_value])
+            bits = 0
+            hash_value = 0
+    return "".join(chars)
+
+
+def _bits(precision):
+    """Number of (latitude, longitude) bits in a geohash of this precision."""
+    total = 5 * precision
+    return total // 2, (total + 1) // 2
+
+
+def cell_size(precision):
+    """(height, width) of a cell in degrees."""
+    lat_bits, lon_bits = _bits(precision)
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def cell_index(latitude, longitude, precision):
+    """Row and column of the cell containing a coordinate."""
+    lat_bits, lon_bits = _bits(precision)
+    height, width = cell_size(precision)
+    row = min(int((latitude + 90.0) / height), (1 << lat_bits) - 1)
+    col = min(int((longitude + 180.0) / width), (1 << lon_bits) - 1)
+    return row, col
+
+
+def _spread(x):
+    """Move bit i of a 32-bit integer to bit 2i."""
+    x &= 0xFFFFFFFF
+    x = (x | (x << 16)) & 0x0000FFFF0000FFFF
+    x = (x | (x << 8)) & 0x00FF00FF00FF00FF
+    x = (x | (x << 4)) & 0x0F0F0F0F0F0F0F0F
+    x = (x | (x << 2)) & 0x3333333333333333
+    x = (x | (x << 1)) & 0x5555555555555555
+    return x
+
+
+def encode_index(row, col, precision):
+    """Geohash of the cell at a row and column; matches `encode` for points inside it."""
+    # Bits interleave starting with longitude, so longitude holds the last
+    # bit when the total is odd and latitude when it is even.
+    if precision % 2:
+        value = _spread(col) | (_spread(row) << 1)
+    else:
+        value = (_spread(col) << 1) | _spread(row)
+    return "".join([BASE32_CODES[(value >> shift) & 31] for shift in range(5 * (precision - 1), -1, -5)])
+
+
+def decode(hash_value):
+    """Centre (latitude, longitude) of a geohash cell."""
+    precision = len(hash_value)
+    value = 0
+    for char in hash_value:
+        value = (value << 5) | BASE32_CODES.index(char)
+    row = col = 0
+    for i in range(5 * precision - 1, -1, -1):
+        bit = (value >> i) & 1
+        if (5 * precision - 1 - i) % 2 == 0:
+            col = (col << 1) | bit
+        else:
+            row = (row << 1) | bit
+    height, width = cell_size(precision)
+    return -90.0 + (row + 0.5) * height, -180.0 + (col + 0.5) * width
+
+
+def ring(row, col, radius, precision):
+    """Cells exactly `radius` steps (Chebyshev distance) from a cell.
+
+    Longitude wraps around the antimeridian; rows past a pole are skipped.
+    """
+    if radius == 0:
+        return [encode_index(row, col, precision)]
+    lat_bits, lon_bits = _bits(precision)
+    rows, cols = 1 << lat_bits, 1 << lon_bits
+    cells = []
+    for d_row in range(-radius, radius + 1):
+        r = row + d_row
+        if not 0 <= r < rows:
+            continue
+        step = 1 if abs(d_row) == radius else 2 * radius
+        for d_col in range(-radius, radius + 1, step):
+            cells.append(encode_index(r, (col + d_col) % cols, precision))
+    return cells
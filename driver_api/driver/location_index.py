@@ -0,0 +1,290 @@
+"""Live driver positions, bucketed by geohash cell.
+
+Drivers report their position every few seconds, so positions are kept out
+of the SQL database entirely. Two interchangeable backends implement the
+same interface:
+
+- ``InMemoryLocationIndex`` lives in the worker process. Fastest, but each
+  process sees only the drivers that reported to it, so it only suits a
+  single-process deployment (one worker, many threads).
+- ``RedisLocationIndex`` is shared by every process and node.
+
+Each position carries the driver's ride type and whether they can take a
+ride, so matching never needs a second lookup. A driver that stops
+reporting drops out of queries after DRIVER_LOCATION_TTL seconds. Updates
+carrying an older timestamp than the one already stored (out-of-order
+delivery) are ignored.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+
+from . import geohash
+
+DriverLocation = namedtuple(
+    "DriverLocation", ["driver_id", "latitude", "longitude", "geohash", "timestamp", "ride_type", "available"]
+)
+LocationUpdate = namedtuple(
+    "LocationUpdate", ["driver_id", "latitude", "longitude", "timestamp", "ride_type", "available"],
+    defaults=[None, "standard", True],
+)
+
+
+class InMemoryLocationIndex:
+    """Per-process index: driver -> location and cell -> set of drivers."""
+
+    def __init__(self, precision=6, ttl=30):
+        self.precision = precision
+        self.ttl = ttl
+        # Ordered by arrival of the last update, so stale drivers sit at the front.
+        self._drivers = OrderedDict()
+        self._cells = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.time()
+
+    def update(self, driver_id, latitude, longitude, timestamp=None, ride_type="standard", available=True):
+        """Store a position. Returns False if a newer one is already stored."""
+        return self.update_many([LocationUpdate(driver_id, latitude, longitude, timestamp, ride_type, available)]) == 1
+
+    def update_many(self, updates):
+        """Store LocationUpdate tuples under one lock. Returns how many were applied."""
+        now = time.time()
+        # Hash outside the lock; it is the expensive part of an update.
+        prepared = [
+            DriverLocation(
+                driver_id, latitude, longitude, geohash.encode(latitude, longitude, self.precision),
+                timestamp or now, ride_type, available,
+            )
+            for driver_id, latitude, longitude, timestamp, ride_type, available in updates
+        ]
+        applied = 0
+        with self._lock:
+            for location in prepared:
+                driver_id = location.driver_id
+                current = self._drivers.get(driver_id)
+                if current is not None:
+                    if location.timestamp < current.timestamp:
+                        continue
+                    if current.geohash != location.geohash:
+                        self._discard(current.geohash, driver_id)
+                    self._drivers.move_to_end(driver_id)
+                self._drivers[driver_id] = location
+                self._cells.setdefault(location.geohash, set()).add(driver_id)
+                applied += 1
+            if now - self._last_sweep >= 1:
+                self._expire(now)
+        return applied
+
+    def remove(self, driver_id):
+        with self._lock:
+            current = self._drivers.pop(driver_id, None)
+            if current is not None:
+                self._discard(current.geohash, driver_id)
+
+    def get(self, driver_id):
+        location = self._drivers.get(driver_id)
+        if location is None or location.timestamp < time.time() - self.ttl:
+            return None
+        return location
+
+    def drivers_in_cells(self, cells):
+        """Fresh locations of every driver in the given geohash cells."""
+        cutoff = time.time() - self.ttl
+        found = []
+        with self._lock:
+            for cell in cells:
+                for driver_id in self._cells.get(cell, ()):
+                    location = self._drivers[driver_id]
+                    if location.timestamp >= cutoff:
+                        found.append(location)
+        return found
+
+    def supply(self, precision):
+        """Available, fresh drivers per geohash cell of the given (coarser) precision."""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            locations = list(self._drivers.values())
+        counts = {}
+        for location in locations:
+            if location.available and location.timestamp >= cutoff:
+                cell = location.geohash[:precision]
+                counts[cell] = counts.get(cell, 0) + 1
+        return counts
+
+    def expire(self):
+        with self._lock:
+            return self._expire(time.time())
+
+    def _expire(self, now):
+        cutoff = now - self.ttl
+        expired = 0
+        while self._drivers:
+            driver_id, location = next(iter(self._drivers.items()))
+            if location.timestamp >= cutoff:
+                break
+            del self._drivers[driver_id]
+            self._discard(location.geohash, driver_id)
+            expired += 1
+        self._last_sweep = now
+        return expired
+
+    def _discard(self, cell, driver_id):
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(driver_id)
+            if not members:
+                del self._cells[cell]
+
+    def __len__(self):
+        return len(self._drivers)
+
+
+# Moves the driver between cell sets atomically. Cell members carry the
+# position ("id|lat|lon|ride_type|available") so a cell query is a single
+# round trip. Cell keys are derived inside the script, so this needs a single
+# Redis, not a cluster.
+UPDATE_SCRIPT = """
+local prev = redis.call('HMGET', KEYS[1], 'cell', 'member', 'ts')
+if prev[3] and tonumber(prev[3]) > tonumber(ARGV[5]) then
+    return 0
+end
+local member = ARGV[1] .. '|' .. ARGV[2] .. '|' .. ARGV[3] .. '|' .. ARGV[8] .. '|' .. ARGV[9]
+if prev[1] then
+    redis.call('ZREM', ARGV[7] .. prev[1], prev[2])
+end
+local cell_key = ARGV[7] .. ARGV[4]
+redis.call('ZADD', cell_key, ARGV[5], member)
+redis.call('EXPIRE', cell_key, ARGV[6])
+redis.call('HSET', KEYS[1], 'cell', ARGV[4], 'member', member, 'ts', ARGV[5])
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+return 1
+"""
+
+
+class RedisLocationIndex:
+    """Shared index: a hash per driver and a sorted set per cell, scored by timestamp."""
+
+    def __init__(self, client, precision=6, ttl=30, prefix="drivers"):
+        self.client = client
+        self.precision = precision
+        self.ttl = ttl
+        self.prefix = prefix
+        self._update_script = client.register_script(UPDATE_SCRIPT)
+
+    def _driver_key(self, driver_id):
+        return f"{self.prefix}:driver:{driver_id}"
+
+    @property
+    def _cell_prefix(self):
+        return f"{self.prefix}:cell:"
+
+    def update(self, driver_id, latitude, longitude, timestamp=None, ride_type="standard", available=True):
+        return self.update_many([LocationUpdate(driver_id, latitude, longitude, timestamp, ride_type, available)]) == 1
+
+    def update_many(self, updates):
+        now = time.time()
+        # Keys outlive the TTL a little so a query can still see the last position.
+        key_ttl = int(self.ttl) + 1
+        pipe = self.client.pipeline(transaction=False)
+        for driver_id, latitude, longitude, timestamp, ride_type, available in updates:
+            cell = geohash.encode(latitude, longitude, self.precision)
+            self._update_script(
+                keys=[self._driver_key(driver_id)],
+                args=[
+                    driver_id, repr(latitude), repr(longitude), cell, timestamp or now, key_ttl, self._cell_prefix,
+                    ride_type, int(bool(available)),
+                ],
+                client=pipe,
+            )
+        return sum(pipe.execute())
+
+    def remove(self, driver_id):
+        key = self._driver_key(driver_id)
+        cell, member = self.client.hmget(key, "cell", "member")
+        pipe = self.client.pipeline(transaction=False)
+        if cell is not None:
+            pipe.zrem(self._cell_prefix + cell.decode(), member)
+        pipe.delete(key)
+        pipe.execute()
+
+    def get(self, driver_id):
+        cell, member, ts = self.client.hmget(self._driver_key(driver_id), "cell", "member", "ts")
+        if member is None or float(ts) < time.time() - self.ttl:
+            return None
+        return self._parse(member, cell.decode(), float(ts))
+
+    def drivers_in_cells(self, cells):
+        cutoff = time.time() - self.ttl
+        pipe = self.client.pipeline(transaction=False)
+        for cell in cells:
+            key = self._cell_prefix + cell
+            pipe.zremrangebyscore(key, "-inf", f"({cutoff}")
+            pipe.zrangebyscore(key, cutoff, "+inf", withscores=True)
+        results = pipe.execute()
+        return [
+            self._parse(member, cell, score)
+            for cell, members in zip(cells, results[1::2])
+            for member, score in members
+        ]
+
+    def supply(self, precision, chunk_size=500):
+        cutoff = time.time() - self.ttl
+        cell_keys = list(self.client.scan_iter(match=f"{self._cell_prefix}*", count=1000))
+        counts = {}
+        offset = len(self._cell_prefix)
+        for start in range(0, len(cell_keys), chunk_size):
+            chunk = cell_keys[start:start + chunk_size]
+            pipe = self.client.pipeline(transaction=False)
+            for key in chunk:
+                pipe.zrangebyscore(key, cutoff, "+inf")
+            for key, members in zip(chunk, pipe.execute()):
+                available = sum(1 for member in members if member.endswith(b"|1"))
+                if available:
+                    cell = key[offset:offset + precision].decode()
+                    counts[cell] = counts.get(cell, 0) + available
+        return counts
+
+    def expire(self):
+        # Cells are trimmed on read and driver keys expire on their own.
+        return 0
+
+    def _parse(self, member, cell, timestamp):
+        driver_id, latitude, longitude, ride_type, available = member.decode().split("|")
+        return DriverLocation(
+            int(driver_id), float(latitude), float(longitude), cell, timestamp, ride_type, available == "1"
+        )
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_location_index():
+    """Return the process-wide driver location index, building it on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                if settings.DRIVER_LOCATION_BACKEND == "redis":
+                    import redis
+
+                    _index = RedisLocationIndex(
+                        redis.Redis.from_url(settings.DRIVER_LOCATION_REDIS_URL),
+                        precision=settings.DRIVER_LOCATION_GEOHASH_PRECISION,
+                        ttl=settings.DRIVER_LOCATION_TTL,
+                    )
+                else:
+                    _index = InMemoryLocationIndex(
+                        precision=settings.DRIVER_LOCATION_GEOHASH_PRECISION,
+                        ttl=settings.DRIVER_LOCATION_TTL,
+                    )
+    return _index
+
+
+def reset_location_index():
+    """Drop the cached instance so the next call rebuilds it from settings."""
+    global _index
+    with _index_lock:
+        _index = None
@@ -0,0 +1,81 @@
+"""k-nearest available driver search.
+
+Candidates come from the location index one ring of geohash cells at a time,
+starting with the pickup's own cell, and are ranked exactly by haversine
+distance. The search stops as soon as no unscanned cell can hold a closer
+driver than the k-th best found, once the whole radius has been scanned, or
+after `max_cells` cells. Dense areas therefore answer from a ring or two,
+and sparse areas cost at most `max_cells` lookups; in the last case the
+result is flagged incomplete rather than the query running unbounded.
+"""
+import heapq
+import math
+from collections import namedtuple
+
+from . import geohash
+
+# Same sphere as the geo estimator's haversine-distance package.
+EARTH_RADIUS_KM = 6378.137
+KM_PER_DEGREE = math.pi / 180 * EARTH_RADIUS_KM
+
+Match = namedtuple("Match", ["driver_id", "latitude", "longitude", "distance_km", "geohash", "ride_type"])
+MatchResult = namedtuple("MatchResult", ["drivers", "rings", "cells", "complete"])
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def nearest_drivers(index, latitude, longitude, k=5, radius_km=5.0, ride_type=None, max_cells=2500):
+    """The k closest available drivers within radius_km, nearest first.
+
+    `ride_type` restricts matches to drivers reporting that ride type.
+    """
+    precision = index.precision
+    row, col = geohash.cell_index(*geohash.decode(geohash.encode(latitude, longitude, precision)), precision)
+    height_deg, width_deg = geohash.cell_size(precision)
+    height_km = height_deg * KM_PER_DEGREE
+
+    best = []  # max-heap on distance via negation, at most k entries
+    cells = 0
+    ring = 0
+    complete = True
+    while True:
+        ring_cells = geohash.ring(row, col, ring, precision)
+        if ring and cells + len(ring_cells) > max_cells:
+            complete = False
+            break
+        cells += len(ring_cells)
+
+        for location in index.drivers_in_cells(ring_cells):
+            if not location.available or (ride_type and location.ride_type != ride_type):
+                continue
+            distance = haversine_km(latitude, longitude, location.latitude, location.longitude)
+            if distance > radius_km:
+                continue
+            entry = (-distance, location.driver_id, location)
+            if len(best) < k:
+                heapq.heappush(best, entry)
+            elif entry > best[0]:
+                heapq.heapreplace(best, entry)
+
+        # Every unscanned cell is at least `ring` whole cells away in some
+        # direction; cells are narrowest at the block's most polar row.
+        polar_lat = min(90.0, abs(latitude) + (ring + 1) * height_deg)
+        width_km = width_deg * KM_PER_DEGREE * math.cos(math.radians(polar_lat))
+        covered_km = ring * min(height_km, width_km)
+        if covered_km >= radius_km:
+            break
+        if len(best) == k and -best[0][0] <= covered_km:
+            break
+        ring += 1
+
+    drivers = [
+        Match(location.driver_id, location.latitude, location.longitude, -neg_distance, location.geohash, location.ride_type)
+        for neg_distance, _, location in sorted(best, reverse=True)
+    ]
+    return MatchResult(drivers, ring + 1 if complete else ring, cells, complete)
@@ -0,0 +1,136 @@
+# Shared by passenger_api, driver_api and admin_api, which are built from
+# separate Docker contexts, so each carries a copy; passenger_api's adds its
+# own metrics. Keep the shared definitions in sync:
+# passenger_api/passenger/tests/test_shared_modules.py checks them.
+"""Prometheus metrics for this service, exported at /metrics.
+
+MetricsMiddleware records, labelled by the resolved URL name so that path
+parameters do not multiply series:
+
+- http_request_duration_seconds: latency histogram by view, method and status;
+- http_requests_in_progress: requests being served, by method;
+- db_queries_per_request and db_query_duration_per_request_seconds: how many
+  queries a request ran and how long they took in total, by view.
+
+Multi-worker servers (gunicorn, uvicorn --workers) keep one registry per
+worker. Set PROMETHEUS_MULTIPROC_DIR to an empty directory shared by the
+workers before they start, and /metrics adds up every worker's values.
+"""
+import contextvars
+import os
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Gauge, Histogram, generate_latest, multiprocess,
+)
+
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time spent serving a request.", ["view", "method", "status"]
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "Requests being served.", ["method"], multiprocess_mode="livesum"
+)
+DB_QUERIES = Histogram(
+    "db_queries_per_request", "Database queries run while serving a request.", ["view"],
+    buckets=QUERY_COUNT_BUCKETS,
+)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_per_request_seconds", "Total database query time while serving a request.", ["view"]
+)
+
+# [queries, seconds] for the request being served in this context, if any.
+_request_queries = contextvars.ContextVar("request_queries", default=None)
+
+
+def _count_query(execute, sql, params, many, context):
+    totals = _request_queries.get()
+    if totals is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        totals[0] += 1
+        totals[1] += time.perf_counter() - started
+
+
+def _install_query_counter(connection, **kwargs):
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+connection_created.connect(_install_query_counter)
+
+
+def view_label(request):
+    match = getattr(request, "resolver_match", None)
+    return match.view_name if match is not None else "<unresolved>"
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token, started = self._start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            totals = self._finish(request, token)
+        self._observe(request, response, started, totals)
+        return response
+
+    async def __acall__(self, request):
+        token, started = self._start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            totals = self._finish(request, token)
+        self._observe(request, response, started, totals)
+        return response
+
+    def _start(self, request):
+        # Connections opened before this module was imported missed the signal.
+        for connection in connections.all(initialized_only=True):
+            _install_query_counter(connection)
+        REQUESTS_IN_PROGRESS.labels(request.method).inc()
+        return _request_queries.set([0, 0.0]), time.perf_counter()
+
+    def _finish(self, request, token):
+        REQUESTS_IN_PROGRESS.labels(request.method).dec()
+        totals = _request_queries.get()
+        _request_queries.reset(token)
+        return totals
+
+    def _observe(self, request, response, started, totals):
+        view = view_label(request)
+        REQUEST_DURATION.labels(view, request.method, response.status_code).observe(time.perf_counter() - started)
+        DB_QUERIES.labels(view).observe(totals[0])
+        DB_QUERY_DURATION.labels(view).observe(totals[1])
+
+
+def metrics_registry():
+    if not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def metrics_view(request):
+    """Every metric of this process, or of all workers in multiprocess mode."""
+    return HttpResponse(generate_latest(metrics_registry()), content_type=CONTENT_TYPE_LATEST)
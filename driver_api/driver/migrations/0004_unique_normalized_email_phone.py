@@ -0,0 +1,50 @@
+# Generated by Django 5.1.1 on 2026-10-18 09:38
+
+from django.db import migrations, models
+
+
+PHONE_SEPARATORS = str.maketrans("", "", " -().")
+
+
+def normalize_contacts(apps, schema_editor):
+    """Store emails and phones normalised, so the unique constraints apply to the canonical values."""
+    Driver = apps.get_model('driver', 'Driver')
+    seen = {"email": {}, "phone": {}}
+    clashes = []
+    for row in Driver.objects.order_by('pk').iterator():
+        email = row.email.strip().lower()
+        phone = row.phone.strip().translate(PHONE_SEPARATORS)
+        if phone.startswith("00"):
+            phone = "+" + phone[2:]
+        for field, value in (("email", email), ("phone", phone)):
+            first = seen[field].setdefault(value, row.pk)
+            if first != row.pk:
+                clashes.append(f"{field} {value!r}: driver ids {first} and {row.pk}")
+        if (email, phone) != (row.email, row.phone):
+            Driver.objects.filter(pk=row.pk).update(email=email, phone=phone)
+    if clashes:
+        raise RuntimeError("Merge or remove these duplicate accounts, then migrate again:\n" + "\n".join(clashes))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('driver', '0003_driver_created_at_driver_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_contacts, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='driver',
+            name='email',
+            field=models.EmailField(max_length=254),
+        ),
+        migrations.AddConstraint(
+            model_name='driver',
+            constraint=models.UniqueConstraint(fields=('email',), name='driver_unique_email'),
+        ),
+        migrations.AddConstraint(
+            model_name='driver',
+            constraint=models.UniqueConstraint(fields=('phone',), name='driver_unique_phone'),
+        ),
+    ]
@@ -2,9 +2,24 @@ from django.db import models
 
 class Driver(models.Model):
     driver_id =models.AutoField(primary_key=True)
-    email = models.EmailField(unique=True)
+    # Stored normalised (see accounts.py); unique via the constraints below.
+    email = models.EmailField()
     phone = models.CharField(max_length=15)
     first_name = models.CharField(max_length=50)
     last_name = models.CharField(max_length=50)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["email"], name="driver_unique_email"),
+            models.UniqueConstraint(fields=["phone"], name="driver_unique_phone"),
+        ]
+        indexes = [
+            # Keyset pagination (see pagination.py). The included columns make
+            # listings index-only on PostgreSQL; SQLite ignores them.
+            models.Index(
+                fields=["created_at", "driver_id"], name="driver_created_idx",
+                include=["email", "phone", "first_name", "last_name", "updated_at"],
+            ),
+        ]
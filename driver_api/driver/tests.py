@@ -1,3 +1,422 @@
-from django.test import TestCase
+import datetime
+import io
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from prometheus_client import REGISTRY
+
+from . import db_router, geohash, schema
+from .coldstart import run_cold_start
+from .models import Driver
+from .location_index import (
+    InMemoryLocationIndex,
+    LocationUpdate,
+    RedisLocationIndex,
+    get_location_index,
+    reset_location_index,
+)
+from .matching import haversine_km, nearest_drivers
+
+SF = (37.7749, -122.4194)
+OAKLAND = (37.8044, -122.2711)
+
+
+class InMemoryLocationIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = InMemoryLocationIndex(precision=6, ttl=30)
+
+    def test_update_buckets_driver_by_cell(self):
+        self.index.update(1, *SF)
+        cell = geohash.encode(*SF, precision=6)
+        self.assertEqual([loc.driver_id for loc in self.index.drivers_in_cells([cell])], [1])
+        self.assertEqual(self.index.get(1).geohash, cell)
+
+    def test_moving_driver_leaves_old_cell(self):
+        self.index.update(1, *SF)
+        self.index.update(1, *OAKLAND)
+        self.assertEqual(self.index.drivers_in_cells([geohash.encode(*SF, precision=6)]), [])
+        self.assertEqual(len(self.index.drivers_in_cells([geohash.encode(*OAKLAND, precision=6)])), 1)
+
+    def test_out_of_order_update_is_ignored(self):
+        now = time.time()
+        self.assertTrue(self.index.update(1, *OAKLAND, timestamp=now))
+        self.assertFalse(self.index.update(1, *SF, timestamp=now - 5))
+        self.assertEqual(self.index.get(1).latitude, OAKLAND[0])
+
+    def test_supply_counts_available_drivers_per_cell(self):
+        self.index.update_many([
+            LocationUpdate(1, *SF),
+            LocationUpdate(2, *SF, available=False),
+            LocationUpdate(3, *OAKLAND),
+            LocationUpdate(4, *SF, timestamp=time.time() - 60),
+        ])
+        self.assertEqual(self.index.supply(4), {"9q8y": 1, "9q9p": 1})
+
+    def test_stale_drivers_expire(self):
+        self.index.update(1, *SF, timestamp=time.time() - 60)
+        self.index.update(2, *SF)
+        cell = geohash.encode(*SF, precision=6)
+        self.assertEqual([loc.driver_id for loc in self.index.drivers_in_cells([cell])], [2])
+        self.assertIsNone(self.index.get(1))
+        self.assertEqual(self.index.expire(), 1)
+        self.assertEqual(len(self.index), 1)
+
+
+class GeohashTests(SimpleTestCase):
+    def test_encode_index_matches_encode(self):
+        for precision in range(1, 10):
+            cell = geohash.encode(*SF, precision=precision)
+            row, col = geohash.cell_index(*geohash.decode(cell), precision)
+            self.assertEqual(geohash.encode_index(row, col, precision), cell)
+
+    def test_ring_sizes_and_antimeridian_wrap(self):
+        row, col = geohash.cell_index(0.0, 179.999, 4)
+        self.assertEqual(len(geohash.ring(row, col, 1, 4)), 8)
+        self.assertEqual(len(set(geohash.ring(row, col, 2, 4))), 16)
+        self.assertIn(geohash.encode(0.0, -179.99, 4), geohash.ring(row, col, 1, 4))
+
+
+class NearestDriversTests(SimpleTestCase):
+    def setUp(self):
+        self.index = InMemoryLocationIndex(precision=6, ttl=30)
+
+    def test_ranks_by_distance_and_filters(self):
+        self.index.update_many([
+            LocationUpdate(1, SF[0] + 0.010, SF[1]),
+            LocationUpdate(2, SF[0] + 0.002, SF[1]),
+            LocationUpdate(3, SF[0] + 0.001, SF[1], available=False),
+            LocationUpdate(4, SF[0] + 0.005, SF[1], ride_type="premium"),
+            LocationUpdate(5, *OAKLAND),
+        ])
+        result = nearest_drivers(self.index, *SF, k=3, radius_km=5)
+        self.assertEqual([match.driver_id for match in result.drivers], [2, 4, 1])
+        self.assertTrue(result.complete)
+        self.assertAlmostEqual(result.drivers[0].distance_km, haversine_km(*SF, SF[0] + 0.002, SF[1]))
+
+        premium = nearest_drivers(self.index, *SF, k=3, radius_km=5, ride_type="premium")
+        self.assertEqual([match.driver_id for match in premium.drivers], [4])
+
+    def test_stops_early_when_k_found_nearby(self):
+        self.index.update_many([LocationUpdate(i, SF[0], SF[1] + i * 1e-4) for i in range(1, 6)])
+        result = nearest_drivers(self.index, *SF, k=2, radius_km=20)
+        self.assertEqual(len(result.drivers), 2)
+        self.assertLessEqual(result.rings, 3)
+
+    def test_sparse_area_is_bounded(self):
+        self.index.update(1, *OAKLAND)
+        result = nearest_drivers(self.index, *SF, k=1, radius_km=25, max_cells=200)
+        self.assertEqual(result.drivers, [])
+        self.assertFalse(result.complete)
+        self.assertLessEqual(result.cells, 200)
+
+
+@unittest.skipUnless(os.getenv("DRIVER_LOCATION_TEST_REDIS_URL"), "set DRIVER_LOCATION_TEST_REDIS_URL to run")
+class RedisLocationIndexTests(SimpleTestCase):
+    def setUp(self):
+        import redis
+
+        self.client = redis.Redis.from_url(os.environ["DRIVER_LOCATION_TEST_REDIS_URL"])
+        self.index = RedisLocationIndex(self.client, precision=6, ttl=30, prefix=f"test-{os.getpid()}")
+
+    def tearDown(self):
+        for key in self.client.scan_iter(f"{self.index.prefix}:*"):
+            self.client.delete(key)
+
+    def test_update_move_and_query(self):
+        now = time.time()
+        self.assertEqual(self.index.update_many([LocationUpdate(1, *SF, now), LocationUpdate(2, *SF, now)]), 2)
+        self.index.update(1, *OAKLAND)
+        self.assertFalse(self.index.update(2, *OAKLAND, timestamp=now - 5))
+        in_sf = self.index.drivers_in_cells([geohash.encode(*SF, precision=6)])
+        self.assertEqual([loc.driver_id for loc in in_sf], [2])
+        self.assertEqual(self.index.get(1).geohash, geohash.encode(*OAKLAND, precision=6))
+
+    def test_supply(self):
+        self.index.update_many([
+            LocationUpdate(1, *SF), LocationUpdate(2, *SF, available=False), LocationUpdate(3, *OAKLAND),
+        ])
+        self.assertEqual(self.index.supply(4), {"9q8y": 1, "9q9p": 1})
+
+    def test_stale_drivers_are_not_returned(self):
+        self.index.update(1, *SF, timestamp=time.time() - 60)
+        self.assertEqual(self.index.drivers_in_cells([geohash.encode(*SF, precision=6)]), [])
+        self.assertIsNone(self.index.get(1))
+
+
+@override_settings(DRIVER_LOCATION_BACKEND="memory", DRIVER_LOCATION_BATCH_MAX=3)
+class DriverLocationViewTests(SimpleTestCase):
+    def setUp(self):
+        reset_location_index()
+        self.addCleanup(reset_location_index)
+
+    def test_report_and_read_location(self):
+        response = self.client.post(
+            "/driver/7/location/", {"latitude": SF[0], "longitude": SF[1]}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()["data"]["applied"])
+
+        response = self.client.get("/driver/7/location/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["data"]["geohash"], geohash.encode(*SF, precision=6))
+
+    def test_unknown_driver_location(self):
+        response = self.client.get("/driver/8/location/")
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()["code"], "LOCATION_NOT_FOUND")
+
+    def test_invalid_location(self):
+        response = self.client.post(
+            "/driver/7/location/", {"latitude": 91, "longitude": 0}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["code"], "INVALID_LOCATION")
+
+    def test_batch_reports_invalid_updates_by_index(self):
+        updates = [
+            {"driver_id": 1, "latitude": SF[0], "longitude": SF[1]},
+            {"driver_id": 2, "latitude": "north", "longitude": SF[1]},
+            {"driver_id": 3, "latitude": OAKLAND[0], "longitude": OAKLAND[1]},
+        ]
+        response = self.client.post("/driver/locations/", {"updates": updates}, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        data = response.json()["data"]
+        self.assertEqual(data["applied"], 2)
+        self.assertEqual([error["index"] for error in data["errors"]], [1])
+
+    def test_batch_too_large(self):
+        updates = [{"driver_id": i, "latitude": SF[0], "longitude": SF[1]} for i in range(1, 5)]
+        response = self.client.post("/driver/locations/", {"updates": updates}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["code"], "BATCH_TOO_LARGE")
+
+    def test_nearby_drivers(self):
+        get_location_index().update_many([
+            LocationUpdate(1, SF[0] + 0.004, SF[1]),
+            LocationUpdate(2, SF[0] + 0.001, SF[1]),
+        ])
+        response = self.client.get("/driver/nearby/", {"geohash": geohash.encode(*SF, precision=7), "k": 5})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()["data"]
+        self.assertEqual([driver["driver_id"] for driver in data["drivers"]], [2, 1])
+        self.assertTrue(data["complete"])
+
+    def test_supply(self):
+        get_location_index().update_many([LocationUpdate(1, *SF), LocationUpdate(2, *SF)])
+        response = self.client.get("/driver/supply/", {"precision": 5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["data"]["cells"], {geohash.encode(*SF, precision=5): 2})
+
+        response = self.client.get("/driver/supply/", {"precision": 7})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["code"], "INVALID_PRECISION")
+
+    def test_nearby_drivers_requires_pickup(self):
+        response = self.client.get("/driver/nearby/", {"k": 5})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["code"], "MISSING_PICKUP")
+
+
+def signup(client, email, phone):
+    return client.post("/driver/", {
+        "email": email, "phone": phone, "first_name": "Jane", "last_name": "Doe",
+    }, content_type="application/json")
+
+
+class AddDriverViewTests(TestCase):
+    def test_creates_driver_with_normalized_contacts(self):
+        with self.assertNumQueries(3):  # SAVEPOINT, INSERT, RELEASE SAVEPOINT
+            response = signup(self.client, " Jane@Example.com", "+1 (555) 000-0001")
+        self.assertEqual(response.status_code, 201)
+        data = response.json()["data"]
+        self.assertEqual((data["email"], data["phone"]), ("jane@example.com", "+15550000001"))
+
+    def test_duplicates_map_to_error_codes(self):
+        Driver.objects.create(email="jane@example.com", phone="+15550000001", first_name="J", last_name="D")
+        response = signup(self.client, "JANE@example.com", "+15550000002")
+        self.assertEqual((response.status_code, response.json()["code"]), (400, "DUPLICATE_EMAIL"))
+        response = signup(self.client, "john@example.com", "+1 555 000 0001")
+        self.assertEqual((response.status_code, response.json()["code"]), (400, "DUPLICATE_PHONE"))
+
+    def test_missing_and_invalid_fields(self):
+        response = self.client.post("/driver/", {"phone": "+15550000001"}, content_type="application/json")
+        self.assertEqual(response.json()["code"], "BAD_REQUEST")
+        response = signup(self.client, "jane@example.com", "call me")
+        self.assertEqual(response.json()["code"], "INVALID_PHONE")
+
+
+class DriverListViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Driver.objects.bulk_create(
+            Driver(email=f"driver{n}@example.com", phone=f"+1555{n:07d}", first_name="Jane", last_name="Doe")
+            for n in range(12)
+        )
+        # Half the drivers share a timestamp, so paging relies on the driver_id tie-break.
+        base = timezone.now() - datetime.timedelta(days=1)
+        for n, driver_id in enumerate(Driver.objects.order_by("driver_id").values_list("driver_id", flat=True)):
+            Driver.objects.filter(pk=driver_id).update(created_at=base + datetime.timedelta(minutes=n % 6 if n < 6 else 0))
+        cls.expected = list(Driver.objects.order_by("-created_at", "-driver_id").values_list("driver_id", flat=True))
+
+    def test_cursor_walks_every_driver_once(self):
+        seen, params = [], {"limit": 5, "fields": "driver_id"}
+        while True:
+            with self.assertNumQueries(1):
+                data = self.client.get("/driver/", params).json()["data"]
+            self.assertNotIn("count", data)
+            seen += [row["driver_id"] for row in data["drivers"]]
+            if data["next_cursor"] is None:
+                break
+            params["cursor"] = data["next_cursor"]
+        self.assertEqual(seen, self.expected)
+
+    def test_projection_and_count(self):
+        data = self.client.get("/driver/", {"fields": "email,phone", "count": "1", "limit": 3}).json()["data"]
+        self.assertEqual(data["count"], 12)
+        self.assertEqual([list(row) for row in data["drivers"]], [["email", "phone"]] * 3)
+
+    def test_invalid_queries(self):
+        for params, code in [({"fields": "password"}, "INVALID_FIELDS"), ({"limit": 0}, "INVALID_LIMIT"),
+                             ({"cursor": "nope"}, "INVALID_CURSOR")]:
+            response = self.client.get("/driver/", params)
+            self.assertEqual((response.status_code, response.json()["code"]), (400, code))
+
+
+class ConcurrentSignupTests(TransactionTestCase):
+    def test_racing_signups_create_one_driver(self):
+        workers = 8
+        barrier = threading.Barrier(workers)
+        codes = []
+
+        def race(n):
+            barrier.wait()
+            try:
+                while True:
+                    response = signup(self.client_class(), f"racer{n}@example.com", "+15551000000")
+                    # The shared in-memory test database fails instead of waiting on
+                    # a concurrent writer; a real database makes the INSERT wait.
+                    if "is locked" not in response.json().get("details", ""):
+                        break
+                codes.append(response.json().get("code", response.status_code))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=race, args=(n,)) for n in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(codes, key=str), sorted([201] + ["DUPLICATE_PHONE"] * (workers - 1), key=str))
+        self.assertEqual(Driver.objects.filter(phone="+15551000000").count(), 1)
+
+
+class MetricsTests(TestCase):
+    def test_requests_are_timed_per_view(self):
+        labels = {"view": "add-driver", "method": "GET", "status": "200"}
+        before = REGISTRY.get_sample_value("http_request_duration_seconds_count", labels) or 0
+        self.assertEqual(self.client.get("/driver/").status_code, 200)
+        self.assertEqual(REGISTRY.get_sample_value("http_request_duration_seconds_count", labels), before + 1)
+
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'db_queries_per_request_count{view="add-driver"}', response.content)
+
+
+class ColdStartTests(SimpleTestCase):
+    # Generous enough for slow CI runners; see passenger's test_coldstart.
+    budget_seconds = float(os.getenv("COLD_START_BUDGET_SECONDS", "1.5"))
+
+    def test_wsgi_cold_start_skips_schema_views(self):
+        loaded = run_cold_start("wsgi").modules
+        self.assertIn("driver.views", loaded)
+        self.assertNotIn("drf_spectacular.views", loaded)
+
+    def test_cold_start_within_budget(self):
+        for target in ["wsgi", "check"]:
+            with self.subTest(target=target):
+                seconds = min(run_cold_start(target).seconds for _ in range(3))
+                self.assertLess(seconds, self.budget_seconds)
+
+    def test_profile_imports_command(self):
+        out = io.StringIO()
+        call_command("profile_imports", "--top", "3", stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith("wsgi: "))
+        self.assertEqual(len(lines), 5)
+
+
+class SchemaTests(SimpleTestCase):
+    def setUp(self):
+        schema.reset_schema()
+        self.addCleanup(schema.reset_schema)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.schema_file = os.path.join(directory.name, "openapi.yml")
+
+    def test_prebuilt_schema_is_served_with_an_etag(self):
+        with open(self.schema_file, "wb") as f:
+            f.write(b"openapi: 3.0.3\n")
+        with override_settings(OPENAPI_SCHEMA_FILE=self.schema_file):
+            response = self.client.get("/passenger/schema/")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, b"openapi: 3.0.3\n")
+            not_modified = self.client.get("/passenger/schema/", HTTP_IF_NONE_MATCH=response["ETag"])
+            self.assertEqual(not_modified.status_code, 304)
+
+    def test_missing_schema_is_503_outside_debug(self):
+        with override_settings(OPENAPI_SCHEMA_FILE=self.schema_file):
+            response = self.client.get("/passenger/schema/")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()["code"], "SCHEMA_NOT_BUILT")
+
+    def test_debug_generates_the_schema_live(self):
+        with override_settings(DEBUG=True, OPENAPI_SCHEMA_FILE=self.schema_file):
+            response = self.client.get("/passenger/schema/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"/driver/", response.content)
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        monitor = db_router.ReplicaMonitor(["replica_0"], background=False)
+        with mock.patch.object(db_router, "replica_lag", return_value=0.0):
+            monitor.check()
+        patcher = mock.patch.object(db_router, "_monitor", monitor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.router = db_router.ReplicaRouter()
+
+    @override_settings(DB_REPLICAS=["replica_0"])
+    def test_reads_go_to_replicas_until_the_client_writes(self):
+        routes = []
+
+        def view(request):
+            routes.append(self.router.db_for_read(Driver))
+            if request.method == "POST":
+                self.router.db_for_write(Driver)
+            return HttpResponse()
+
+        middleware = db_router.ReplicaPinningMiddleware(view)
+        self.assertNotIn(db_router.PIN_COOKIE, middleware(RequestFactory().get("/")).cookies)
+        response = middleware(RequestFactory().post("/"))
+        self.assertIn(db_router.PIN_COOKIE, response.cookies)
+        pinned = RequestFactory().get("/")
+        pinned.COOKIES[db_router.PIN_COOKIE] = "1"
+        middleware(pinned)
+        self.assertEqual(routes, ["replica_0", "default", "default"])
+
+    @override_settings(DB_REPLICAS=["replica_0"])
+    def test_lagging_replica_falls_back_to_default(self):
+        with mock.patch.object(db_router, "replica_lag", return_value=60.0):
+            db_router._monitor.check()
+        self.assertEqual(self.router.db_for_read(Driver), "default")
@@ -1,6 +1,10 @@
 from django.urls import path
-from .views import AddDriverView
+from .views import AddDriverView, DriverLocationView, DriverLocationBatchView, NearbyDriversView, DriverSupplyView
 
 urlpatterns = [
-    path('', AddDriverView.as_view(), name='add-driver')
+    path('', AddDriverView.as_view(), name='add-driver'),
+    path('<int:driver_id>/location/', DriverLocationView.as_view(), name='driver-location'),
+    path('locations/', DriverLocationBatchView.as_view(), name='driver-locations-batch'),
+    path('nearby/', NearbyDriversView.as_view(), name='nearby-drivers'),
+    path('supply/', DriverSupplyView.as_view(), name='driver-supply'),
 ]
\ No newline at end of file
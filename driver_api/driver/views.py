@@ -1,10 +1,22 @@
-from drf_spectacular.utils import extend_schema, OpenApiExample
+import time
+
+from drf_spectacular.utils import extend_schema, OpenApiExample, OpenApiParameter
+from django.conf import settings
 from django.shortcuts import render
 from rest_framework.views import APIView
 from django.http import JsonResponse
 from rest_framework import status
 from .models import Driver
+from .location_index import LocationUpdate, get_location_index
+from .matching import nearest_drivers
+from . import geohash
 from django.core.exceptions import ValidationError
+from django.db import IntegrityError
+from .pagination import PageQueryError, keyset_page, parse_page_query
+from .accounts import create_account, duplicate_field, normalize_email, normalize_phone
+
+
+DRIVER_LIST_FIELDS = ["driver_id", "email", "phone", "first_name", "last_name", "created_at", "updated_at"]
 
 
 class AddDriverView(APIView):
@@ -52,7 +64,7 @@ class AddDriverView(APIView):
     )
 
     def post(self, request):
-        email = request.data.get('email').strip().lower()
+        email = request.data.get('email')
         phone = request.data.get('phone')
         first_name = request.data.get('first_name')
         last_name = request.data.get('last_name')
@@ -62,22 +74,19 @@ class AddDriverView(APIView):
                 "error": "The [email, phone, first_name, last_name] fields are required.",
                 "code": "BAD_REQUEST"
             }, status=status.HTTP_400_BAD_REQUEST)
-        
-        if Driver.objects.filter(email=email).exists():
-            return JsonResponse(
-                {
-                    "error": "A user with this email address already exists."
-                 }, status=status.HTTP_400_BAD_REQUEST,
-            )
-        if Driver.objects.filter(phone=phone).exists():
-            return JsonResponse(
-                {
-                    "error": "A user with this phone number already exists."
-                 }, status=status.HTTP_400_BAD_REQUEST,
-            )
-        
-        try: 
-            driver = Driver.objects.create(
+
+        email = normalize_email(str(email))
+        phone = normalize_phone(str(phone))
+        if phone is None:
+            return JsonResponse({
+                "error": ERROR_MESSAGES["INVALID_PHONE"],
+                "code": "INVALID_PHONE"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            # One INSERT; the unique constraints catch duplicates, even concurrent ones.
+            driver = create_account(
+                Driver,
                 email=email,
                 phone=phone,
                 first_name=first_name,
@@ -105,9 +114,510 @@ class AddDriverView(APIView):
                 "details": e.message_dict
             }, status=status.HTTP_400_BAD_REQUEST)
         
+        except IntegrityError as e:
+            field = duplicate_field(e, Driver)
+            if field is None:
+                return JsonResponse({
+                    "error": "An error occured while creating your user profile.",
+                    "details": str(e)
+                }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            code = "DUPLICATE_EMAIL" if field == "email" else "DUPLICATE_PHONE"
+            return JsonResponse({
+                "error": ERROR_MESSAGES[code],
+                "code": code
+            }, status=status.HTTP_400_BAD_REQUEST)
+
         except Exception as e:
             return JsonResponse({
                 "error": "An error occured while creating your user profile.",
                 "details": str(e)
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR,)
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter("fields", str, description=f"Comma-separated columns to return, from {DRIVER_LIST_FIELDS} (default all)."),
+            OpenApiParameter("limit", int, description="Drivers per page (default LIST_DEFAULT_LIMIT, at most LIST_MAX_LIMIT)."),
+            OpenApiParameter("cursor", str, description="next_cursor from the previous page; omit for the first page."),
+            OpenApiParameter("count", bool, description="Also return the total number of drivers (scans the table)."),
+        ],
+        responses={
+            200: {
+                "type": "object",
+                "properties": {
+                    "data": {
+                        "type": "object",
+                        "properties": {
+                            "drivers": {
+                                "type": "array",
+                                "items": {
+                                    "type": "object",
+                                    "properties": {
+                                        "driver_id": {"type": "integer", "example": 1},
+                                        "email": {"type": "string", "example": "test@example.com"},
+                                        "created_at": {"type": "string", "example": "2023-01-01T00:00:00Z"},
+                                    }
+                                }
+                            },
+                            "next_cursor": {"type": "string", "nullable": True, "example": "WyIyMDIzLTAxLTAxVDAwOjAwOjAwKzAwOjAwIiwxXQ"},
+                            "count": {"type": "integer", "example": 1},
+                        }
+                    },
+                }
+            },
+            400: {
+                "type": "object",
+                "properties": {
+                    "error": {"type": "string", "example": "limit must be an integer between 1 and 500."},
+                    "details": {"type": "string", "example": "Invalid limit: 0"},
+                    "code": {"type": "string", "example": "INVALID_LIMIT"},
+                }
+            },
+        },
+        description="Keyset-paginated driver listing, newest first. next_cursor is null on the last page; "
+                    "count is only returned when requested."
+    )
+    def get(self, request):
+        try:
+            query = parse_page_query(
+                request.query_params, DRIVER_LIST_FIELDS, settings.LIST_DEFAULT_LIMIT, settings.LIST_MAX_LIMIT
+            )
+        except PageQueryError as e:
+            return JsonResponse({
+                "error": ERROR_MESSAGES[e.code].format(
+                    allowed_fields=DRIVER_LIST_FIELDS, max_limit=settings.LIST_MAX_LIMIT
+                ),
+                "details": e.details,
+                "code": e.code,
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        page = keyset_page(Driver.objects.all(), query.fields, query.limit, query.cursor, query.with_count)
+        data = {"drivers": page.rows, "next_cursor": page.next_cursor}
+        if page.count is not None:
+            data["count"] = page.count
+        return JsonResponse({"data": data}, status=status.HTTP_200_OK)
         
+
+
+ERROR_MESSAGES = {
+    "DUPLICATE_EMAIL": "A user with this email address already exists.",
+    "DUPLICATE_PHONE": "A user with this phone number already exists.",
+    "INVALID_PHONE": "The phone number must have 7 to 15 digits, optionally prefixed with '+'.",
+    "INVALID_LOCATION": "latitude and longitude are required and must be numbers within range.",
+    "INVALID_TIMESTAMP": "timestamp must be a number of seconds since the epoch.",
+    "INVALID_RIDE_TYPE": "Invalid ride_type '{ride_type}'. Allowed values are {valid_ride_types}.",
+    "INVALID_AVAILABILITY": "available must be true or false.",
+    "MISSING_UPDATES": "The [updates] field is required and must be a non-empty list.",
+    "BATCH_TOO_LARGE": "A batch can contain at most {max_updates} updates.",
+    "LOCATION_NOT_FOUND": "No recent location for this driver.",
+    "MISSING_PICKUP": "Either latitude and longitude or a geohash are required.",
+    "INVALID_GEOHASH": "geohash must be a valid geohash string.",
+    "INVALID_K": "k must be an integer between 1 and {max_k}.",
+    "INVALID_RADIUS": "radius_km must be a number greater than 0 and at most {max_radius_km}.",
+    "INVALID_FIELDS": "fields must be a comma-separated list of {allowed_fields}.",
+    "INVALID_LIMIT": "limit must be an integer between 1 and {max_limit}.",
+    "INVALID_CURSOR": "cursor must be a next_cursor returned by a previous page.",
+    "INVALID_PRECISION": "precision must be an integer between 1 and {max_precision}.",
+}
+
+
+VALID_RIDE_TYPES = ["standard", "premium"]
+
+
+class LocationError(ValueError):
+    def __init__(self, code, details=None, **message_args):
+        super().__init__(code)
+        self.code = code
+        self.details = details
+        self.message_args = message_args
+
+    def as_dict(self):
+        error = {"error": ERROR_MESSAGES[self.code].format(**self.message_args), "code": self.code}
+        if self.details:
+            error["details"] = self.details
+        return error
+
+
+def parse_location(data):
+    """Return (latitude, longitude, timestamp, ride_type, available) from an update, or raise LocationError."""
+    if not isinstance(data, dict):
+        raise LocationError("INVALID_LOCATION", f"Update must be an object, got: {data}")
+    lat, lon = data.get("latitude"), data.get("longitude")
+    if not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in (lat, lon)):
+        raise LocationError("INVALID_LOCATION", f"Invalid latitude ({lat}) or longitude ({lon}).")
+    if not (-90 <= lat <= 90) or not (-180 <= lon <= 180):
+        raise LocationError("INVALID_LOCATION", f"Invalid latitude ({lat}) or longitude ({lon}) range.")
+
+    timestamp = data.get("timestamp")
+    if timestamp is not None:
+        if not isinstance(timestamp, (int, float)) or isinstance(timestamp, bool) or timestamp <= 0:
+            raise LocationError("INVALID_TIMESTAMP", f"Invalid timestamp: {timestamp}")
+        # Device clocks drift; never let one claim a position from the future.
+        timestamp = min(timestamp, time.time())
+
+    ride_type = data.get("ride_type", "standard")
+    if ride_type not in VALID_RIDE_TYPES:
+        raise LocationError("INVALID_RIDE_TYPE", ride_type=ride_type, valid_ride_types=VALID_RIDE_TYPES)
+    available = data.get("available", True)
+    if not isinstance(available, bool):
+        raise LocationError("INVALID_AVAILABILITY", f"Invalid available: {available}")
+    return lat, lon, timestamp, ride_type, available
+
+
+def location_data(location):
+    return {
+        "driver_id": location.driver_id,
+        "latitude": location.latitude,
+        "longitude": location.longitude,
+        "geohash": location.geohash,
+        "timestamp": location.timestamp,
+        "ride_type": location.ride_type,
+        "available": location.available,
+    }
+
+
+class DriverLocationView(APIView):
+    @extend_schema(
+        request={
+            "application/json": {
+                "type": "object",
+                "properties": {
+                    "latitude": {"type": "number", "example": 37.7749},
+                    "longitude": {"type": "number", "example": -122.4194},
+                    "timestamp": {"type": "number", "example": 1734357600.0},
+                    "ride_type": {"type": "string", "example": "standard"},
+                    "available": {"type": "boolean", "example": True},
+                },
+                "required": ["latitude", "longitude"]
+            }
+        },
+        responses={
+            200: {
+                "type": "object",
+                "properties": {
+                    "message": {"type": "string", "example": "Location updated."},
+                    "data": {
+                        "type": "object",
+                        "properties": {
+                            "driver_id": {"type": "integer", "example": 1},
+                            "applied": {"type": "boolean", "example": True},
+                        }
+                    },
+                }
+            },
+            400: {
+                "type": "object",
+                "properties": {
+                    "error": {"type": "string", "example": ERROR_MESSAGES["INVALID_LOCATION"]},
+                    "details": {"type": "string", "example": "Invalid latitude (91) or longitude (0) range."},
+                    "code": {"type": "string", "example": "INVALID_LOCATION"},
+                }
+            },
+        },
+        description="Report a driver's current position. `applied` is false when a newer position was already "
+                    "reported. Positions expire after DRIVER_LOCATION_TTL seconds without an update."
+    )
+    def post(self, request, driver_id):
+        try:
+            update = LocationUpdate(driver_id, *parse_location(request.data))
+        except LocationError as e:
+            return JsonResponse(e.as_dict(), status=status.HTTP_400_BAD_REQUEST)
+
+        applied = get_location_index().update_many([update]) == 1
+        return JsonResponse({
+            "message": "Location updated.",
+            "data": {"driver_id": driver_id, "applied": applied}
+        }, status=status.HTTP_200_OK)
+
+    @extend_schema(
+        responses={
+            200: {
+                "type": "object",
+                "properties": {
+                    "data": {
+                        "type": "object",
+                        "properties": {
+                            "driver_id": {"type": "integer", "example": 1},
+                            "latitude": {"type": "number", "example": 37.7749},
+                            "longitude": {"type": "number", "example": -122.4194},
+                            "geohash": {"type": "string", "example": "9q8yyk"},
+                            "timestamp": {"type": "number", "example": 1734357600.0},
+                            "ride_type": {"type": "string", "example": "standard"},
+                            "available": {"type": "boolean", "example": True},
+                        }
+                    },
+                }
+            },
+            404: {
+                "type": "object",
+                "properties": {
+                    "error": {"type": "string", "example": ERROR_MESSAGES["LOCATION_NOT_FOUND"]},
+                    "code": {"type": "string", "example": "LOCATION_NOT_FOUND"},
+                }
+            },
+        },
+        description="Last reported position of a driver, if it has not expired."
+    )
+    def get(self, request, driver_id):
+        location = get_location_index().get(driver_id)
+        if location is None:
+            return JsonResponse({
+                "error": ERROR_MESSAGES["LOCATION_NOT_FOUND"],
+                "code": "LOCATION_NOT_FOUND"
+            }, status=status.HTTP_404_NOT_FOUND)
+        return JsonResponse({"data": location_data(location)}, status=status.HTTP_200_OK)
+
+
+class DriverLocationBatchView(APIView):
+    @extend_schema(
+        request={
+            "application/json": {
+                "type": "object",
+                "properties": {
+                    "updates": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "driver_id": {"type": "integer", "example": 1},
+                                "latitude": {"type": "number", "example": 37.7749},
+                                "longitude": {"type": "number", "example": -122.4194},
+                                "timestamp": {"type": "number", "example": 1734357600.0},
+                                "ride_type": {"type": "string", "example": "standard"},
+                                "available": {"type": "boolean", "example": True},
+                            },
+                            "required": ["driver_id", "latitude", "longitude"]
+                        }
+                    }
+                },
+                "required": ["updates"]
+            }
+        },
+        responses={
+            200: {
+                "type": "object",
+                "properties": {
+                    "message": {"type": "string", "example": "Locations updated."},
+                    "data": {
+                        "type": "object",
+                        "properties": {
+                            "applied": {"type": "integer", "example": 499},
+                            "stale": {"type": "integer", "example": 0},
+                            "errors": {
+                                "type": "array",
+                                "items": {
+                                    "type": "object",
+                                    "properties": {
+                                        "index": {"type": "integer", "example": 3},
+                                        "error": {"type": "string", "example": ERROR_MESSAGES["INVALID_LOCATION"]},
+                                        "code": {"type": "string", "example": "INVALID_LOCATION"},
+                                    }
+                                }
+                            },
+                        }
+                    },
+                }
+            },
+            400: {
+                "type": "object",
+                "properties": {
+                    "error": {"type": "string", "example": ERROR_MESSAGES["MISSING_UPDATES"]},
+                    "code": {"type": "string", "example": "BAD_REQUEST"},
+                }
+            },
+        },
+        description="Report many driver positions at once, e.g. from a gateway that aggregates device pings. "
+                    "Invalid updates are reported by index and do not reject the rest of the batch."
+    )
+    def post(self, request):
+        updates = request.data.get("updates")
+        if not isinstance(updates, list) or not updates:
+            return JsonResponse({
+                "error": ERROR_MESSAGES["MISSING_UPDATES"],
+                "code": "BAD_REQUEST"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        max_updates = settings.DRIVER_LOCATION_BATCH_MAX
+        if len(updates) > max_updates:
+            return JsonResponse({
+                "error": ERROR_MESSAGES["BATCH_TOO_LARGE"].format(max_updates=max_updates),
+                "code": "BATCH_TOO_LARGE"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        valid = []
+        errors = []
+        for index, update in enumerate(updates):
+            try:
+                fields = parse_location(update)
+                driver_id = update.get("driver_id")
+                if not isinstance(driver_id, int) or isinstance(driver_id, bool) or driver_id < 1:
+                    raise LocationError("INVALID_LOCATION", f"Invalid driver_id: {driver_id}")
+            except LocationError as e:
+                errors.append({"index": index, **e.as_dict()})
+                continue
+            valid.append(LocationUpdate(driver_id, *fields))
+
+        applied = get_location_index().update_many(valid) if valid else 0
+        return JsonResponse({
+            "message": "Locations updated.",
+            "data": {"applied": applied, "stale": len(valid) - applied, "errors": errors}
+        }, status=status.HTTP_200_OK)
+
+
+class NearbyDriversView(APIView):
+    @extend_schema(
+        parameters=[
+            OpenApiParameter("latitude", float, description="Pickup latitude (or pass geohash)."),
+            OpenApiParameter("longitude", float, description="Pickup longitude (or pass geohash)."),
+            OpenApiParameter("geohash", str, description="Pickup geohash, e.g. a booking's pickup_geohash."),
+            OpenApiParameter("ride_type", str, description="Only drivers reporting this ride type."),
+            OpenApiParameter("k", int, description="Number of drivers to return (default MATCHING_DEFAULT_K)."),
+            OpenApiParameter("radius_km", float, description="Search radius (default MATCHING_DEFAULT_RADIUS_KM)."),
+        ],
+        responses={
+            200: {
+                "type": "object",
+                "properties": {
+                    "data": {
+                        "type": "object",
+                        "properties": {
+                            "drivers": {
+                                "type": "array",
+                                "items": {
+                                    "type": "object",
+                                    "properties": {
+                                        "driver_id": {"type": "integer", "example": 1},
+                                        "latitude": {"type": "number", "example": 37.7751},
+                                        "longitude": {"type": "number", "example": -122.4180},
+                                        "distance_km": {"type": "number", "example": 0.13},
+                                        "geohash": {"type": "string", "example": "9q8yyk"},
+                                        "ride_type": {"type": "string", "example": "standard"},
+                                    }
+                                }
+                            },
+                            "complete": {"type": "boolean", "example": True},
+                            "rings": {"type": "integer", "example": 2},
+                            "cells": {"type": "integer", "example": 9},
+                        }
+                    },
+                }
+            },
+            400: {
+                "type": "object",
+                "properties": {
+                    "error": {"type": "string", "example": ERROR_MESSAGES["MISSING_PICKUP"]},
+                    "code": {"type": "string", "example": "MISSING_PICKUP"},
+                }
+            },
+        },
+        description="The k nearest available drivers within radius_km of a pickup, nearest first. "
+                    "`complete` is false when the search hit MATCHING_MAX_CELLS before covering the radius."
+    )
+    def get(self, request):
+        try:
+            latitude, longitude, ride_type, k, radius_km = self.parse_query(request.query_params)
+        except LocationError as e:
+            return JsonResponse(e.as_dict(), status=status.HTTP_400_BAD_REQUEST)
+
+        result = nearest_drivers(
+            get_location_index(), latitude, longitude, k=k, radius_km=radius_km, ride_type=ride_type,
+            max_cells=settings.MATCHING_MAX_CELLS,
+        )
+        return JsonResponse({
+            "data": {
+                "drivers": [
+                    {**match._asdict(), "distance_km": round(match.distance_km, 3)} for match in result.drivers
+                ],
+                "complete": result.complete,
+                "rings": result.rings,
+                "cells": result.cells,
+            }
+        }, status=status.HTTP_200_OK)
+
+    def parse_query(self, params):
+        if params.get("geohash"):
+            hash_value = params["geohash"].lower()
+            if any(char not in geohash.BASE32_CODES for char in hash_value) or len(hash_value) > 12:
+                raise LocationError("INVALID_GEOHASH", f"Invalid geohash: {params['geohash']}")
+            latitude, longitude = geohash.decode(hash_value)
+        elif params.get("latitude") is not None and params.get("longitude") is not None:
+            try:
+                latitude, longitude = float(params["latitude"]), float(params["longitude"])
+            except ValueError:
+                raise LocationError("INVALID_LOCATION", f"Invalid latitude ({params['latitude']}) or longitude ({params['longitude']}).")
+            if not (-90 <= latitude <= 90) or not (-180 <= longitude <= 180):
+                raise LocationError("INVALID_LOCATION", f"Invalid latitude ({latitude}) or longitude ({longitude}) range.")
+        else:
+            raise LocationError("MISSING_PICKUP")
+
+        ride_type = params.get("ride_type") or None
+        if ride_type is not None and ride_type not in VALID_RIDE_TYPES:
+            raise LocationError("INVALID_RIDE_TYPE", ride_type=ride_type, valid_ride_types=VALID_RIDE_TYPES)
+
+        max_k = settings.MATCHING_MAX_K
+        try:
+            k = int(params.get("k", settings.MATCHING_DEFAULT_K))
+        except ValueError:
+            k = 0
+        if not 1 <= k <= max_k:
+            raise LocationError("INVALID_K", f"Invalid k: {params.get('k')}", max_k=max_k)
+
+        max_radius_km = settings.MATCHING_MAX_RADIUS_KM
+        try:
+            radius_km = float(params.get("radius_km", settings.MATCHING_DEFAULT_RADIUS_KM))
+        except ValueError:
+            radius_km = 0
+        if not 0 < radius_km <= max_radius_km:
+            raise LocationError("INVALID_RADIUS", f"Invalid radius_km: {params.get('radius_km')}", max_radius_km=max_radius_km)
+
+        return latitude, longitude, ride_type, k, radius_km
+
+
+
+class DriverSupplyView(APIView):
+    @extend_schema(
+        parameters=[
+            OpenApiParameter("precision", int, description="Geohash precision of the cells (default 5, at most DRIVER_LOCATION_GEOHASH_PRECISION)."),
+        ],
+        responses={
+            200: {
+                "type": "object",
+                "properties": {
+                    "data": {
+                        "type": "object",
+                        "properties": {
+                            "precision": {"type": "integer", "example": 5},
+                            "cells": {"type": "object", "example": {"9q8yy": 42, "9q8yz": 17}},
+                        }
+                    },
+                }
+            },
+            400: {
+                "type": "object",
+                "properties": {
+                    "error": {"type": "string", "example": ERROR_MESSAGES["INVALID_PRECISION"]},
+                    "code": {"type": "string", "example": "INVALID_PRECISION"},
+                }
+            },
+        },
+        description="Number of available drivers with a fresh location in each geohash cell. "
+                    "Polled by the passenger service to price surge; cells without available drivers are omitted."
+    )
+    def get(self, request):
+        max_precision = settings.DRIVER_LOCATION_GEOHASH_PRECISION
+        try:
+            precision = int(request.query_params.get("precision", min(5, max_precision)))
+        except ValueError:
+            precision = 0
+        if not 1 <= precision <= max_precision:
+            error = LocationError(
+                "INVALID_PRECISION", f"Invalid precision: {request.query_params.get('precision')}",
+                max_precision=max_precision,
+            )
+            return JsonResponse(error.as_dict(), status=status.HTTP_400_BAD_REQUEST)
+
+        return JsonResponse({
+            "data": {
+                "precision": precision,
+                "cells": get_location_index().supply(precision),
+            }
+        }, status=status.HTTP_200_OK)
@@ -0,0 +1,75 @@
+// Dumps estimator outputs for a fixed set of trips so the Python port in
+// passenger_api/passenger/estimation.py can be checked against this service.
+//
+//   node -r ts-node/register/transpile-only scripts/parity_fixture.js > ../passenger_api/passenger/tests/fixtures/geo_estimator_parity.json
+
+const geohashService = require("../src/services/geohashService").default;
+const distanceService = require("../src/services/distanceService").default;
+const fareService = require("../src/services/fareService").default;
+
+// mulberry32: small seeded PRNG so the fixture is reproducible.
+function prng(seed) {
+    return function () {
+        seed |= 0;
+        seed = (seed + 0x6d2b79f5) | 0;
+        let t = Math.imul(seed ^ (seed >>> 15), 1 | seed);
+        t = (t + Math.imul(t ^ (t >>> 7), 61 | t)) ^ t;
+        return ((t ^ (t >>> 14)) >>> 0) / 4294967296;
+    };
+}
+
+const random = prng(20241216);
+const round6 = (x) => Math.round(x * 1e6) / 1e6;
+const trips = [];
+
+// Edge cases: cell boundaries, poles, antimeridian, identical points.
+const edges = [
+    [[0, 0], [0, 0.01]],
+    [[45, 90], [45.000001, 90.000001]],
+    [[22.5, -45], [22.5, 45]],
+    [[90, 180], [-90, -180]],
+    [[-89.9, 179.99], [-89.9, -179.99]],
+    [[37.7749, -122.4194], [37.8044, -122.2711]],
+    [[40.7128, -74.006], [34.0522, -118.2437]],
+    [[51.5074, -0.1278], [51.5074, -0.1278]],
+    [[10, 20], [10.00001, 20.00001]],
+];
+for (const [[a, b], [c, d]] of edges) {
+    for (const ride_type of ["standard", "premium"]) {
+        trips.push({ pickup: [a, b], dropoff: [c, d], ride_type });
+    }
+}
+
+// City-scale trips around random centres plus arbitrary long-haul ones.
+for (let i = 0; i < 400; i++) {
+    const lat = round6(random() * 170 - 85);
+    const lng = round6(random() * 360 - 180);
+    const spread = i % 4 === 0 ? 20 : 0.2;
+    trips.push({
+        pickup: [lat, lng],
+        dropoff: [
+            round6(Math.max(-90, Math.min(90, lat + (random() - 0.5) * spread))),
+            round6(Math.max(-180, Math.min(180, lng + (random() - 0.5) * spread))),
+        ],
+        ride_type: random() < 0.5 ? "standard" : "premium",
+    });
+}
+trips.push({ pickup: [10, 20], dropoff: [30, 40], ride_type: "luxury" });
+
+const cases = trips.map(({ pickup, dropoff, ride_type }) => {
+    const pickup_location = { latitude: pickup[0], longitude: pickup[1] };
+    const dropoff_location = { latitude: dropoff[0], longitude: dropoff[1] };
+    const result = {
+        pickup_geohash: geohashService.encode(pickup[0], pickup[1]),
+        dropoff_geohash: geohashService.encode(dropoff[0], dropoff[1]),
+        distance_km: distanceService.calculate(pickup_location, dropoff_location),
+    };
+    try {
+        result.estimated_fare = fareService.calculateFare(result.distance_km, ride_type);
+    } catch (err) {
+        result.error = err.message;
+    }
+    return { pickup_location, dropoff_location, ride_type, ...result };
+});
+
+process.stdout.write(JSON.stringify(cases, null, 1) + "\n");
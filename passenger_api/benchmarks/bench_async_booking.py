@@ -0,0 +1,139 @@
+"""Sync WSGI vs async ASGI booking throughput at a fixed worker count.
+
+Starts the stub estimator, then serves the passenger API twice with the same
+number of worker processes -- gunicorn sync workers for rides/book/ and
+uvicorn for rides/book/async/ -- and drives each with the same number of
+concurrent clients. The estimate cache is disabled so every booking waits
+on the estimator. Run from passenger_api/:
+
+    python -m benchmarks.bench_async_booking --workers 2 --concurrency 200 --latency-ms 50
+"""
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+BOOKING = {
+    "pickup_location": {"latitude": 37.7749, "longitude": -122.4194},
+    "dropoff_location": {"latitude": 37.8044, "longitude": -122.2711},
+    "ride_type": "standard",
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout}s")
+
+
+def start(cmd, env):
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    return proc
+
+
+def stop(proc):
+    os.killpg(proc.pid, signal.SIGTERM)
+    proc.wait(timeout=10)
+
+
+async def drive(url, concurrency, duration):
+    latencies = []
+    errors = 0
+    stop_at = time.monotonic() + duration
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=30)) as client:
+        async def worker():
+            nonlocal errors
+            while time.monotonic() < stop_at:
+                start_at = time.perf_counter()
+                try:
+                    async with client.post(url, json=BOOKING) as response:
+                        await response.read()
+                        ok = response.status == 201
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    ok = False
+                if ok:
+                    latencies.append(time.perf_counter() - start_at)
+                else:
+                    errors += 1
+
+        started = time.monotonic()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.monotonic() - started
+    return latencies, errors, elapsed
+
+
+def report(label, latencies, errors, elapsed):
+    latencies.sort()
+    p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1e3 if latencies else float("nan")
+    print(f"{label:<22}{len(latencies) / elapsed:>10.1f}{p(0.5):>10.1f}{p(0.99):>10.1f}"
+          f"{(statistics.mean(latencies) * 1e3 if latencies else float('nan')):>10.1f}{errors:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+
+    stub_port, app_port = free_port(), free_port()
+    env = dict(
+        os.environ,
+        SECRET_KEY=os.getenv("SECRET_KEY", "benchmark"),
+        DEBUG="True",
+        STUB_LATENCY_MS=str(args.latency_ms),
+        GEOES_NODE_API_URL=f"http://127.0.0.1:{stub_port}/api/estimate",
+        GEOES_POOL_MAXSIZE=str(args.concurrency),
+        GEOES_ASYNC_MAX_CONNECTIONS=str(args.concurrency),
+        ESTIMATE_CACHE_ENABLED="False",
+    )
+
+    stub = start([sys.executable, "-m", "uvicorn", "benchmarks.stub_estimator:app",
+                  "--port", str(stub_port), "--log-level", "warning", "--no-access-log"], env)
+    try:
+        wait_for_port(stub_port)
+        servers = [
+            ("wsgi sync (gunicorn)", "/passenger/rides/book/",
+             [sys.executable, "-m", "gunicorn", "passenger_api.wsgi:application",
+              "--workers", str(args.workers), "--bind", f"127.0.0.1:{app_port}", "--log-level", "warning"]),
+            ("asgi async (uvicorn)", "/passenger/rides/book/async/",
+             [sys.executable, "-m", "uvicorn", "passenger_api.asgi:application",
+              "--workers", str(args.workers), "--port", str(app_port), "--log-level", "warning", "--no-access-log"]),
+        ]
+        print(f"workers={args.workers} concurrency={args.concurrency} estimator latency={args.latency_ms}ms")
+        print(f"{'server':<22}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}{'errors':>8}")
+        for label, path, cmd in servers:
+            server = start(cmd, env)
+            try:
+                wait_for_port(app_port)
+                asyncio.run(drive(f"http://127.0.0.1:{app_port}{path}", 8, 1))  # warm up
+                report(label, *asyncio.run(drive(f"http://127.0.0.1:{app_port}{path}", args.concurrency, args.duration)))
+            finally:
+                stop(server)
+    finally:
+        stop(stub)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Booking latency with the logging pipeline off, synchronous and queued.
+
+Run from passenger_api/:
+
+    RIDE_WRITE_MODE=sync python -m benchmarks.bench_booking_logging --bookings 10000 --rounds 10
+
+(sync ride writes keep the write-behind flusher from adding noise.)
+
+Posts rides/book/ in-process (GEO_ESTIMATION_MODE=local, fresh test
+database) under each logging setup below and reports latency percentiles.
+Every setup but "off" logs each booking's DEBUG line, except where sampled;
+"sync file" is a plain FileHandler, which formats and writes on the request
+thread the way LOGGING did before the queue. The "slow disk" setups add
+--slow-write-ms to every flush, standing in for a contended or networked disk.
+"""
+import argparse
+import copy
+import logging
+import logging.config
+import os
+import statistics
+import tempfile
+import time
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "passenger_api.settings")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("GEO_ESTIMATION_MODE", "local")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+from rest_framework.test import APIClient  # noqa: E402
+
+from passenger.log import QueueingHandler  # noqa: E402
+
+SLOW_WRITE_SECONDS = 0.001
+
+
+class SlowFileHandler(logging.FileHandler):
+    def flush(self):
+        super().flush()
+        time.sleep(SLOW_WRITE_SECONDS)
+
+
+class SlowQueueingHandler(QueueingHandler):
+    def _write(self, records):
+        super()._write(records)
+        time.sleep(SLOW_WRITE_SECONDS)
+
+BOOKING = {
+    "pickup_location": {"latitude": 37.7749, "longitude": -122.4194},
+    "dropoff_location": {"latitude": 37.8044, "longitude": -122.2711},
+    "ride_type": "standard",
+}
+
+
+def logging_config(log_file, level, handler_class, sample_rate):
+    config = copy.deepcopy(settings.LOGGING)
+    config["loggers"]["passenger"]["level"] = level
+    config["filters"]["booking_debug_sample"]["rate"] = sample_rate
+    handler = {"class": handler_class, "filename": log_file, "formatter": "json"}
+    if handler_class.endswith("FileHandler"):
+        handler["level"] = "DEBUG"
+    config["handlers"]["file"] = handler
+    return config
+
+
+def bench(client, bookings):
+    samples = []
+    for _ in range(bookings):
+        began = time.perf_counter()
+        response = client.post("/passenger/rides/book/", BOOKING, format="json")
+        samples.append((time.perf_counter() - began) * 1e6)
+        assert response.status_code == 201, response.data
+    return samples
+
+
+def summary(samples):
+    samples = sorted(samples)
+    return statistics.median(samples), samples[int(len(samples) * 0.99) - 1], statistics.fmean(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bookings", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--slow-write-ms", type=float, default=1.0)
+    args = parser.parse_args()
+    global SLOW_WRITE_SECONDS
+    SLOW_WRITE_SECONDS = args.slow_write_ms / 1000
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+    client = APIClient()
+    bench(client, 200)  # warm up imports and caches
+
+    setups = [
+        ("off", "CRITICAL", "passenger.log.QueueingHandler", 1.0),
+        ("sync file, DEBUG", "DEBUG", "logging.FileHandler", 1.0),
+        ("queued, DEBUG", "DEBUG", "passenger.log.QueueingHandler", 1.0),
+        ("queued, DEBUG 1%", "DEBUG", "passenger.log.QueueingHandler", 0.01),
+        ("queued, INFO", "INFO", "passenger.log.QueueingHandler", 1.0),
+        ("slow disk, sync", "DEBUG", "benchmarks.bench_booking_logging.SlowFileHandler", 1.0),
+        ("slow disk, queued", "DEBUG", "benchmarks.bench_booking_logging.SlowQueueingHandler", 1.0),
+    ]
+    # Setups take turns, so background noise (write-behind flushes, GC) hits them alike.
+    samples = {name: [] for name, *_ in setups}
+    with tempfile.TemporaryDirectory() as directory:
+        for _ in range(args.rounds):
+            for index, (name, level, handler_class, rate) in enumerate(setups):
+                log_file = os.path.join(directory, f"{index}.log")
+                # dictConfig adds logger filters without removing earlier ones.
+                logging.getLogger("passenger.booking").filters.clear()
+                logging.config.dictConfig(logging_config(log_file, level, handler_class, rate))
+                samples[name] += bench(client, args.bookings // args.rounds)
+                for handler in logging.getLogger("passenger").handlers:
+                    handler.flush()
+    print(f"{'logging':<20}{'p50 us':>9}{'p99 us':>9}{'mean us':>9}")
+    for name, *_ in setups:
+        p50, p99, mean = summary(samples[name])
+        print(f"{name:<20}{p50:>9.0f}{p99:>9.0f}{mean:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""Booking latency behind a burst of welcome emails: one shared queue against dedicated queues.
+
+Run from passenger_api/:
+
+    python -m benchmarks.bench_celery_queues --email-tasks 30 --bookings 20
+
+Real Celery workers run in subprocesses, with kombu's filesystem transport
+standing in for RabbitMQ and an on-disk SQLite database. Each run queues a
+burst of send_welcome_emails tasks (--batch passengers each, every email
+taking --smtp-ms), then one process_ride_booking every --interval seconds
+(GEO_ESTIMATION_MODE=local). A booking's latency runs from queueing to its
+Ride row being stored.
+
+- "one queue" is the old setup: every task on one queue, one prefork worker
+  with --concurrency processes, Celery's default prefetch of 4 per process
+  and early acks. Bookings wait behind every email task queued before them.
+- "dedicated" is the current CELERY_* settings: bookings on a prefork worker,
+  emails on a thread-pool worker, splitting --concurrency between them.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "passenger_api.settings")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("GEO_ESTIMATION_MODE", "local")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.mail.backends import locmem  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+
+from passenger_api.celery import app  # noqa: E402
+
+ONE_QUEUE = {
+    "CELERY_TASK_ROUTES": {}, "CELERY_TASK_DEFAULT_QUEUE": "celery",
+    "CELERY_WORKER_PREFETCH_MULTIPLIER": 4, "CELERY_TASK_ACKS_LATE": False,
+}
+MODES = {
+    # name: (app.conf overrides, [(queue, pool, share of --concurrency)])
+    "one queue": (ONE_QUEUE, [("celery", "prefork", 1.0)]),
+    "dedicated": ({}, [("bookings", "prefork", 0.5), ("notifications", "threads", 0.5)]),
+}
+
+BOOKING = {
+    "passenger_id": None,
+    "pickup_location": {"latitude": 37.7749, "longitude": -122.4194},
+    "dropoff_location": {"latitude": 37.8044, "longitude": -122.2711},
+    "ride_type": "standard",
+    "surge_multiplier": 1.0,
+    "status": "queued",
+    "booking_time": "2024-12-16 14:00:00",
+}
+
+
+class SlowSMTPBackend(locmem.EmailBackend):
+    """locmem, taking BENCH_SMTP_MS per message like a remote relay."""
+
+    def send_messages(self, messages):
+        time.sleep(float(os.environ["BENCH_SMTP_MS"]) / 1000 * len(messages))
+        return super().send_messages(messages)
+
+
+def configure(broker_dir, database, mode):
+    """Point this process at the benchmark's broker, database and task topology."""
+    # The app reads CELERY_-prefixed keys, so overrides use them too.
+    app.conf.update(
+        CELERY_BROKER_URL="filesystem://",
+        CELERY_BROKER_TRANSPORT_OPTIONS={
+            "data_folder_in": broker_dir, "data_folder_out": broker_dir, "control_folder": broker_dir,
+            "polling_interval": 0.05,
+        },
+        **MODES[mode][0],
+    )
+    connection.settings_dict["NAME"] = database
+    connection.settings_dict["OPTIONS"]["timeout"] = 30
+    settings.EMAIL_BACKEND = f"{__name__}.SlowSMTPBackend"
+    settings.WELCOME_EMAIL_RATE = 0
+
+
+def run_worker(broker_dir, database, mode, queue, pool, concurrency, ready_file):
+    """Runs in a subprocess: one Celery worker consuming `queue`."""
+    from celery import signals
+
+    configure(broker_dir, database, mode)
+    signals.worker_ready.connect(lambda **kwargs: open(ready_file, "w").close(), weak=False)
+    app.worker_main([
+        "worker", "-Q", queue, "-P", pool, "-c", str(concurrency), "-n", f"{queue}@bench",
+        "--loglevel=WARNING", "--without-heartbeat", "--without-gossip", "--without-mingle",
+    ])
+
+
+def run_mode(mode, args, broker_dir, database):
+    """Runs in a subprocess: start the workers, queue the burst and the bookings, return booking latencies."""
+    from passenger.models import Passenger, Ride
+    from passenger.tasks import process_ride_booking, send_welcome_emails
+
+    os.makedirs(broker_dir)
+    configure(broker_dir, database, mode)
+    passenger_ids = list(Passenger.objects.order_by("pk").values_list("pk", flat=True))
+    workers = []
+    for queue, pool, share in MODES[mode][1]:
+        ready_file = os.path.join(broker_dir, f"{queue}.ready")
+        concurrency = max(1, round(args.concurrency * share))
+        spec = json.dumps([broker_dir, database, mode, queue, pool, concurrency, ready_file])
+        workers.append((ready_file, subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.bench_celery_queues", "--worker", spec],
+            env={**os.environ, "BENCH_SMTP_MS": str(args.smtp_ms)},
+            stdout=subprocess.DEVNULL,
+        )))
+    try:
+        while not all(os.path.exists(ready_file) for ready_file, _ in workers):
+            time.sleep(0.1)
+
+        for start in range(0, args.email_tasks * args.batch, args.batch):
+            send_welcome_emails.delay(passenger_ids[start:start + args.batch])
+        queued_at = {}
+        for _ in range(args.bookings):
+            ride_id = str(uuid.uuid4())
+            queued_at[ride_id] = time.time()
+            process_ride_booking.delay({**BOOKING, "ride_id": ride_id})
+            time.sleep(args.interval)
+
+        deadline = time.time() + args.timeout
+        while Ride.objects.filter(ride_id__in=list(queued_at)).count() < len(queued_at) and time.time() < deadline:
+            time.sleep(0.1)
+        stored = dict(Ride.objects.filter(ride_id__in=list(queued_at)).values_list("ride_id", "created_at"))
+        latencies = sorted(stored[uuid.UUID(ride_id)].timestamp() - queued_at[ride_id]
+                           for ride_id in queued_at if uuid.UUID(ride_id) in stored)
+        Ride.objects.all().delete()
+        return latencies
+    finally:
+        for _, worker in workers:
+            worker.terminate()
+        for _, worker in workers:
+            worker.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--email-tasks", type=int, default=30)
+    parser.add_argument("--batch", type=int, default=20, help="Passengers per email task.")
+    parser.add_argument("--smtp-ms", type=float, default=50)
+    parser.add_argument("--bookings", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=0.2, help="Seconds between bookings.")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--mode", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(*json.loads(args.worker))
+        return
+    if args.mode:
+        # Celery caches routes and queues once it has published, so each topology gets its own process.
+        mode, broker_dir, database = json.loads(args.mode)
+        print(json.dumps(run_mode(mode, args, broker_dir, database)))
+        return
+
+    from passenger.models import Passenger
+
+    setup_test_environment()
+    with tempfile.TemporaryDirectory() as directory:
+        connection.settings_dict["TEST"]["NAME"] = os.path.join(directory, "bench.sqlite3")
+        database = connection.creation.create_test_db(verbosity=0)
+        Passenger.objects.bulk_create(
+            Passenger(email=f"rider{n}@example.com", phone=f"+1{n:010d}", first_name="Ada", last_name="Lovelace")
+            for n in range(args.email_tasks * args.batch)
+        )
+        connection.close()
+
+        print(f"{args.email_tasks} email tasks x {args.batch} emails x {args.smtp_ms:g} ms, "
+              f"then {args.bookings} bookings every {args.interval:g}s; {args.concurrency} worker slots")
+        print(f"{'topology':<12}{'stored':>8}{'p50 s':>8}{'p90 s':>8}{'max s':>8}")
+        for mode in MODES:
+            spec = json.dumps([mode, os.path.join(directory, mode.replace(" ", "-")), database])
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_celery_queues", *sys.argv[1:], "--mode", spec],
+                stdout=subprocess.PIPE, text=True, check=True,
+            ).stdout
+            latencies = json.loads(output.splitlines()[-1])
+            if not latencies:
+                print(f"{mode:<12}{0:>8}")
+                continue
+            p90 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.9))]
+            print(f"{mode:<12}{len(latencies):>8}{statistics.median(latencies):>8.2f}{p90:>8.2f}{latencies[-1]:>8.2f}")
+
+if __name__ == "__main__":
+    main()
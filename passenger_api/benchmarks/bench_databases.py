@@ -0,0 +1,149 @@
+"""Signup and booking throughput on SQLite against PostgreSQL, pooled or not.
+
+Run from passenger_api/, with a PostgreSQL server to point DB_HOST and friends at
+(for example `docker run -p 5432:5432 -e POSTGRES_HOST_AUTH_METHOD=trust postgres:16`):
+
+    DB_HOST=localhost python -m benchmarks.bench_databases --workers 4 --seconds 10
+
+Each configuration runs in its own interpreter with the DB_* settings below
+and a fresh test database (an on-disk file for SQLite). --workers processes
+then post passengers/ (signups) or rides/book/ (GEO_ESTIMATION_MODE=local,
+RIDE_WRITE_MODE=sync, so one Ride INSERT per booking) in a loop until time is up.
+Each request ends with close_old_connections(), as request_finished does
+outside tests:
+
+- "sqlite" reopens the file each request and serializes writers;
+- "postgresql" opens a new server connection each request (no pool);
+- "postgresql pooled" checks connections out of the psycopg pool, with
+  server-side prepared statements for the repeated queries.
+
+Configurations whose server cannot be reached are reported and skipped.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "passenger_api.settings")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("GEO_ESTIMATION_MODE", "local")
+os.environ.setdefault("RIDE_WRITE_MODE", "sync")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import OperationalError, close_old_connections, connection  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+from rest_framework.test import APIClient  # noqa: E402
+
+CONFIGS = {
+    "sqlite": {"DB_ENGINE": "sqlite3"},
+    "postgresql": {"DB_ENGINE": "postgresql", "DB_POOL_MAX_SIZE": "0", "DB_CONN_MAX_AGE": "0", "DB_PREPARE_THRESHOLD": ""},
+    "postgresql pooled": {"DB_ENGINE": "postgresql"},
+}
+
+BOOKING = {
+    "pickup_location": {"latitude": 37.7749, "longitude": -122.4194},
+    "dropoff_location": {"latitude": 37.8044, "longitude": -122.2711},
+    "ride_type": "standard",
+}
+
+
+def signup(client, worker, n):
+    person = {
+        "email": f"rider{worker}-{n}@example.com",
+        "phone": f"+1{worker:03d}{n:08d}",
+        "first_name": "Ada",
+        "last_name": "Lovelace",
+    }
+    return client.post("/passenger/passengers/", person, format="json").status_code == 201
+
+
+def book(client, worker, n):
+    return client.post("/passenger/rides/book/", BOOKING, format="json").status_code == 201
+
+
+WORKLOADS = {"signup": signup, "booking": book}
+
+
+def start_worker():
+    setup_test_environment()  # lets the test client's "testserver" host through
+
+
+def worker(args):
+    """Runs in a spawned process: request `workload` in a loop from `start` to `deadline`."""
+    workload, test_db_name, index, start, deadline = args
+    connection.settings_dict["NAME"] = test_db_name
+    client = APIClient(raise_request_exception=False)
+    request = WORKLOADS[workload]
+    ok = failed = 0
+    time.sleep(max(0.0, start - time.time()))
+    while time.time() < deadline:
+        if request(client, index, ok + failed):
+            ok += 1
+        else:
+            failed += 1
+        close_old_connections()
+    connection.close()
+    return ok, failed
+
+
+def run_config(name, workers, seconds):
+    """Benchmark one configuration; this process was started with its DB_* env."""
+    setup_test_environment()
+    with tempfile.TemporaryDirectory() as directory:
+        if connection.vendor == "sqlite":
+            connection.settings_dict["TEST"]["NAME"] = os.path.join(directory, "bench.sqlite3")
+        try:
+            test_db_name = connection.creation.create_test_db(verbosity=0)
+        except OperationalError as e:
+            return {"config": name, "skipped": str(e).splitlines()[0]}
+        connection.close()
+
+        results = {"config": name}
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(workers, initializer=start_worker) as pool:
+            for workload in WORKLOADS:
+                # Workers take about a second to start; they all begin together.
+                start = time.time() + 2
+                jobs = [(workload, test_db_name, index, start, start + seconds) for index in range(workers)]
+                counts = pool.map(worker, jobs)
+                results[workload] = [sum(ok for ok, _ in counts) / seconds, sum(failed for _, failed in counts)]
+        connection.creation.destroy_test_db(test_db_name, verbosity=0)
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--config", choices=sorted(CONFIGS), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.config:
+        print(json.dumps(run_config(args.config, args.workers, args.seconds)))
+        return
+
+    print(f"{'database':<20}{'signups/s':>11}{'failed':>8}{'bookings/s':>12}{'failed':>8}")
+    for name, env in CONFIGS.items():
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_databases", "--config", name,
+             "--workers", str(args.workers), "--seconds", str(args.seconds)],
+            env={**os.environ, **env}, capture_output=True, text=True, check=True,
+        ).stdout
+        result = json.loads(output.splitlines()[-1])
+        if "skipped" in result:
+            print(f"{name:<20}skipped: {result['skipped']}")
+            continue
+        (signups, signups_failed), (bookings, bookings_failed) = result["signup"], result["booking"]
+        print(f"{name:<20}{signups:>11,.0f}{signups_failed:>8}{bookings:>12,.0f}{bookings_failed:>8}")
+
+
+if __name__ == "__main__":
+    main()
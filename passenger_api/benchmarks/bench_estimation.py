@@ -0,0 +1,70 @@
+"""Per-trip cost of the in-process ride estimator.
+
+Run from passenger_api/:
+
+    python -m benchmarks.bench_estimation --trips 100000
+
+Compares `estimation.estimate` called in a loop against `estimation.estimate_batch`
+for growing batch sizes. For reference, one call to the Node service costs at
+least a loopback round trip (hundreds of microseconds) before any work is done.
+"""
+import argparse
+import random
+import time
+
+from passenger import estimation
+
+
+def random_trips(n, seed=7):
+    rng = random.Random(seed)
+    trips = []
+    for _ in range(n):
+        lat, lng = rng.uniform(-60, 60), rng.uniform(-180, 180)
+        trips.append((
+            lat, lng,
+            lat + rng.uniform(-0.2, 0.2), lng + rng.uniform(-0.2, 0.2),
+            rng.choice(["standard", "premium"]),
+        ))
+    return trips
+
+
+def bench_scalar(trips):
+    start = time.perf_counter()
+    for p_lat, p_lng, d_lat, d_lng, ride_type in trips:
+        try:
+            estimation.estimate(
+                {"latitude": p_lat, "longitude": p_lng},
+                {"latitude": d_lat, "longitude": d_lng},
+                ride_type,
+            )
+        except estimation.EstimationError:
+            pass
+    return time.perf_counter() - start
+
+
+def bench_batch(trips):
+    columns = list(zip(*trips))
+    start = time.perf_counter()
+    estimation.estimate_batch(*columns)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trips", type=int, default=100000)
+    args = parser.parse_args()
+
+    trips = random_trips(args.trips)
+    scalar = bench_scalar(trips)
+    print(f"{'mode':<18}{'trips':>10}{'total ms':>12}{'us/trip':>10}")
+    print(f"{'scalar':<18}{len(trips):>10}{scalar * 1e3:>12.1f}{scalar / len(trips) * 1e6:>10.2f}")
+
+    size = 1
+    while size <= len(trips):
+        elapsed = bench_batch(trips[:size])
+        print(f"{'batch':<18}{size:>10}{elapsed * 1e3:>12.2f}{elapsed / size * 1e6:>10.2f}")
+        size *= 10
+
+
+if __name__ == "__main__":
+    main()
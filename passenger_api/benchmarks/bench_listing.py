@@ -0,0 +1,97 @@
+"""Passenger listing: keyset pages against OFFSET pages, shallow and deep.
+
+Run from passenger_api/:
+
+    python -m benchmarks.bench_listing --rows 1000000 --limit 10
+
+Fills a fresh test database (in-memory SQLite unless DATABASES points
+elsewhere) and times GET passengers/ at page 1 and at the last pages, next to
+what Django admin style pagination costs at the same depth: an OFFSET query
+plus a count(*). Deep keyset pages start from a cursor made from the row just
+before the page, which is what a client holds after paging that far.
+"""
+import argparse
+import datetime
+import os
+import statistics
+import time
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "passenger_api.settings")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connection  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+from django.utils import timezone  # noqa: E402
+from rest_framework.test import APIClient  # noqa: E402
+
+from passenger.models import Passenger  # noqa: E402
+from passenger.pagination import encode_cursor  # noqa: E402
+
+
+def fill(rows, batch=50000):
+    base = timezone.now() - datetime.timedelta(days=365)
+    field = Passenger._meta.get_field("created_at")
+    with connection.cursor() as cursor:
+        for start in range(0, rows, batch):
+            params = []
+            for n in range(start, min(rows, start + batch)):
+                # Ten signups per second, so timestamps repeat as they do in real traffic.
+                created_at = field.get_db_prep_save(base + datetime.timedelta(seconds=n // 10), connection)
+                params.append((f"rider{n}@example.com", f"+1{n:010d}", "Ada", "Lovelace", created_at, created_at))
+            cursor.executemany(
+                "INSERT INTO passenger_passenger (email, phone, first_name, last_name, created_at, updated_at) "
+                "VALUES (%s, %s, %s, %s, %s, %s)", params,
+            )
+
+
+def timed(call, repeat):
+    samples = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        call()
+        samples.append((time.perf_counter() - began) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+    began = time.perf_counter()
+    fill(args.rows)
+    print(f"filled {args.rows:,} passengers in {time.perf_counter() - began:.1f}s")
+    client = APIClient()
+    ordered = Passenger.objects.order_by("-created_at", "-passenger_id")
+
+    print(f"{'page':>10}{'keyset ms':>12}{'OFFSET+count ms':>18}")
+    last_page = args.rows // args.limit
+    for page in sorted({1, 10, 1000, last_page // 2, last_page}):
+        offset = (page - 1) * args.limit
+        cursor = None
+        if offset:
+            before = ordered.values("created_at", "passenger_id")[offset - 1]
+            cursor = encode_cursor(before["created_at"], before["passenger_id"])
+        params = {"limit": args.limit, **({"cursor": cursor} if cursor else {})}
+
+        def keyset():
+            response = client.get("/passenger/passengers/", params)
+            assert response.status_code == 200 and response.data["data"]["passengers"]
+
+        def offset_page():
+            Passenger.objects.count()
+            assert list(ordered.values()[offset:offset + args.limit])
+
+        print(f"{page:>10,}{timed(keyset, args.repeat):>12.2f}{timed(offset_page, args.repeat):>18.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Bulk passenger import against creating passengers one request at a time.
+
+Run from passenger_api/:
+
+    python -m benchmarks.bench_passenger_import --rows 200000 --baseline-rows 2000
+
+Both paths run in-process against a fresh test database (in-memory SQLite
+unless DATABASES points elsewhere), so the numbers compare database work and
+request handling, not network. 1% of the imported rows duplicate an earlier
+row and are rejected.
+"""
+import argparse
+import json
+import os
+import time
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "passenger_api.settings")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connection  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+from rest_framework.test import APIClient  # noqa: E402
+
+from passenger.models import Passenger  # noqa: E402
+
+
+def person(n):
+    return {
+        "email": f"rider{n}@example.com",
+        "phone": f"+1{n:010d}",
+        "first_name": "Ada",
+        "last_name": "Lovelace",
+    }
+
+
+def bench_endpoint_loop(client, start, count):
+    began = time.perf_counter()
+    for n in range(start, start + count):
+        response = client.post("/passenger/passengers/", person(n), format="json")
+        assert response.status_code == 201, response.data
+    return time.perf_counter() - began
+
+
+def bench_bulk(client, start, count):
+    lines = []
+    for n in range(start, start + count):
+        lines.append(json.dumps(person(n - 1 if n % 100 == 99 else n)))
+    body = "\n".join(lines) + "\n"
+    began = time.perf_counter()
+    response = client.generic("POST", "/passenger/passengers/import/", body, content_type="application/x-ndjson")
+    elapsed = time.perf_counter() - began
+    assert response.status_code == 200, response.data
+    return elapsed, response.data["data"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--baseline-rows", type=int, default=2000)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+    client = APIClient()
+
+    loop = bench_endpoint_loop(client, 0, args.baseline_rows)
+    loop_rate = args.baseline_rows / loop
+    print(f"{'path':<22}{'rows':>9}{'seconds':>10}{'rows/s':>11}")
+    print(f"{'POST passengers/':<22}{args.baseline_rows:>9}{loop:>10.2f}{loop_rate:>11,.0f}")
+
+    bulk, data = bench_bulk(client, args.baseline_rows, args.rows)
+    bulk_rate = args.rows / bulk
+    print(f"{'POST passengers/import/':<22}{args.rows:>9}{bulk:>10.2f}{bulk_rate:>11,.0f}")
+    print(f"created {data['created']}, rejected {data['rejected']}; speed-up {bulk_rate / loop_rate:.0f}x; "
+          f"{Passenger.objects.count()} passengers in the database")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Passenger signup: check-then-insert against a single constrained INSERT.
+
+Run from passenger_api/:
+
+    python -m benchmarks.bench_signup --signups 5000
+
+"before" replays the old view body (an exists() query per unique field, then
+the INSERT); "after" is the current view body, a single INSERT that lets the
+unique constraints reject duplicates. Both run in-process against
+a fresh test database (in-memory SQLite unless DATABASES points elsewhere), so
+a networked database widens the gap by one round trip per saved query.
+"""
+import argparse
+import os
+import time
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "passenger_api.settings")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import IntegrityError, connection  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+
+from passenger.accounts import create_account  # noqa: E402
+from passenger.models import Passenger  # noqa: E402
+
+
+def person(n):
+    return {
+        "email": f"rider{n}@example.com",
+        "phone": f"+1{n:010d}",
+        "first_name": "Ada",
+        "last_name": "Lovelace",
+    }
+
+
+def check_then_insert(values):
+    if Passenger.objects.filter(email=values["email"]).exists():
+        return False
+    if Passenger.objects.filter(phone=values["phone"]).exists():
+        return False
+    Passenger.objects.create(**values)
+    return True
+
+
+def single_insert(values):
+    try:
+        create_account(Passenger, **values)
+    except IntegrityError:
+        return False
+    return True
+
+
+def bench(signup, start, count):
+    statements = []
+
+    def count_statement(execute, sql, params, many, context):
+        statements.append(sql)
+        return execute(sql, params, many, context)
+
+    began = time.perf_counter()
+    with connection.execute_wrapper(count_statement):
+        for n in range(start, start + count):
+            assert signup(person(n))
+    return time.perf_counter() - began, len(statements)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--signups", type=int, default=5000)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+
+    print(f"{'path':<20}{'signups':>9}{'seconds':>10}{'signups/s':>11}{'queries/signup':>16}")
+    for offset, (name, signup) in enumerate([("check-then-insert", check_then_insert), ("single INSERT", single_insert)]):
+        elapsed, statements = bench(signup, offset * args.signups, args.signups)
+        print(f"{name:<20}{args.signups:>9}{elapsed:>10.2f}{args.signups / elapsed:>11,.0f}"
+              f"{statements / args.signups:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
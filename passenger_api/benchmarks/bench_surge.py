@@ -0,0 +1,98 @@
+"""Replay a peak booking stream through the surge engine.
+
+Run from passenger_api/:
+
+    python -m benchmarks.bench_surge --rate 2000 --minutes 10
+
+Bookings arrive at --rate per simulated second, their pickups drawn from a
+skewed set of --hot-cells city cells plus a uniform background. Every
+--interval simulated seconds the engine takes a supply sample and recomputes,
+as its background thread does in production. Each booking goes through the
+same calls as the booking view (pickup cell, record demand, read multiplier).
+
+The engine keeps up when the replay finishes faster than the simulated time
+and one recomputation takes a small fraction of the interval.
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "passenger_api.settings")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+import django  # noqa: E402
+
+django.setup()
+
+from passenger.surge import SurgeEngine  # noqa: E402
+
+
+def pickups(count, hot_cells, rng):
+    centres = [(rng.uniform(-50, 60), rng.uniform(-180, 180)) for _ in range(hot_cells)]
+    weights = [1 / (rank + 1) for rank in range(hot_cells)]
+    points = []
+    for centre in rng.choices(centres, weights, k=count):
+        if rng.random() < 0.1:
+            points.append((rng.uniform(-50, 60), rng.uniform(-180, 180)))
+        else:
+            points.append((rng.gauss(centre[0], 0.05), rng.gauss(centre[1], 0.05)))
+    return points
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=int, default=2000, help="bookings per simulated second")
+    parser.add_argument("--minutes", type=float, default=10)
+    parser.add_argument("--hot-cells", type=int, default=500)
+    parser.add_argument("--interval", type=float, default=5.0, help="recompute interval, seconds")
+    parser.add_argument("--precision", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    seconds = int(args.minutes * 60)
+    stream = pickups(args.rate * seconds, args.hot_cells, rng)
+    engine = SurgeEngine(precision=args.precision, background=False)
+    supply_cells = {engine.cell(*point) for point in stream[:50000]}
+    supply = {cell: rng.randint(1, 40) for cell in supply_cells}
+
+    record_time = 0.0
+    recompute_times = []
+    next_refresh = 0.0
+    surging = 0
+    for second in range(seconds):
+        batch = stream[second * args.rate:(second + 1) * args.rate]
+        start = time.perf_counter()
+        for i, (lat, lon) in enumerate(batch):
+            now = second + i / args.rate
+            cell = engine.cell(lat, lon)
+            engine.record_demand(cell, now)
+            engine.multiplier(cell)
+        record_time += time.perf_counter() - start
+
+        if second + 1 >= next_refresh:
+            start = time.perf_counter()
+            engine.record_supply(supply, second + 1)
+            surging = engine.recompute(second + 1)
+            recompute_times.append(time.perf_counter() - start)
+            next_refresh += args.interval
+
+    lookups = [engine.cell(*point) for point in stream[:100000]]
+    start = time.perf_counter()
+    for cell in lookups:
+        engine.multiplier(cell)
+    lookup_ns = (time.perf_counter() - start) / len(lookups) * 1e9
+
+    bookings = len(stream)
+    stats = engine.stats()
+    print(f"replayed {bookings} bookings ({args.rate}/s for {seconds}s) in {record_time:.2f}s "
+          f"-> {bookings / record_time:,.0f} bookings/s, {record_time / bookings * 1e6:.2f} us/booking")
+    print(f"recompute every {args.interval}s over {stats['demand_cells']} demand / {stats['supply_cells']} supply cells: "
+          f"median {statistics.median(recompute_times) * 1e3:.1f} ms, max {max(recompute_times) * 1e3:.1f} ms, "
+          f"{surging} cells surging")
+    print(f"multiplier lookup: {lookup_ns:.0f} ns")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Welcome emails: one task per passenger against batched delivery.
+
+Run from passenger_api/:
+
+    python -m benchmarks.bench_welcome_email --passengers 2000 --backend file --handshake-ms 20
+
+"per task" replays the old send_welcome_email body for every passenger: a
+get() for the passenger, then send_mail(), which opens and closes a mail
+connection. "batched" is welcome.deliver() on batches of
+WELCOME_EMAIL_BATCH_SIZE: one query and one connection per batch. Both run
+in-process with the rate limit off, against a fresh test database and
+Django's file or locmem backend. --handshake-ms adds a pause to every
+connection opened, standing in for an SMTP relay's connect, EHLO,
+STARTTLS and AUTH round trips, which the local backends do not have.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "passenger_api.settings")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core import mail  # noqa: E402
+from django.core.mail import send_mail  # noqa: E402
+from django.core.mail.backends import filebased, locmem  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+
+from passenger import welcome  # noqa: E402
+from passenger.models import Passenger  # noqa: E402
+
+HANDSHAKE_SECONDS = 0.0
+
+
+class HandshakeMixin:
+    """Pauses HANDSHAKE_SECONDS whenever a connection is opened."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connected = False
+
+    def open(self):
+        if not self.connected:
+            time.sleep(HANDSHAKE_SECONDS)
+            self.connected = True
+        return super().open()
+
+    def close(self):
+        self.connected = False
+        return super().close()
+
+
+class FileBackend(HandshakeMixin, filebased.EmailBackend):
+    pass
+
+
+class LocmemBackend(HandshakeMixin, locmem.EmailBackend):
+    def send_messages(self, messages):
+        # Like the SMTP and file backends, a connection the caller did not open lasts one call.
+        if self.connected:
+            return super().send_messages(messages)
+        self.open()
+        try:
+            return super().send_messages(messages)
+        finally:
+            self.close()
+
+
+BACKENDS = {"file": f"{__name__}.FileBackend", "locmem": f"{__name__}.LocmemBackend"}
+
+
+def per_task(passenger_ids):
+    for passenger_id in passenger_ids:
+        passenger = Passenger.objects.get(passenger_id=passenger_id)
+        send_mail(
+            subject=welcome.SUBJECT,
+            message=f"Hello {passenger.first_name},\n\nWelcome to Uberv!",
+            from_email=welcome.FROM_EMAIL,
+            recipient_list=[passenger.email],
+        )
+
+
+def batched(passenger_ids):
+    size = settings.WELCOME_EMAIL_BATCH_SIZE
+    for start in range(0, len(passenger_ids), size):
+        welcome.deliver(passenger_ids[start:start + size])
+
+
+def bench(send, passenger_ids):
+    mail.outbox = []
+    queries = []
+
+    def count_query(execute, sql, params, many, context):
+        queries.append(sql)
+        return execute(sql, params, many, context)
+
+    began = time.perf_counter()
+    with connection.execute_wrapper(count_query):
+        send(passenger_ids)
+    return time.perf_counter() - began, len(queries)
+
+
+def main():
+    global HANDSHAKE_SECONDS
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--passengers", type=int, default=2000)
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="file")
+    parser.add_argument("--handshake-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    HANDSHAKE_SECONDS = args.handshake_ms / 1000
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+    Passenger.objects.bulk_create(
+        Passenger(email=f"rider{n}@example.com", phone=f"+1{n:010d}", first_name="Ada", last_name="Lovelace")
+        for n in range(args.passengers)
+    )
+    passenger_ids = list(Passenger.objects.order_by("pk").values_list("pk", flat=True))
+
+    print(f"{args.backend} backend, {args.handshake_ms:g} ms per connection")
+    print(f"{'path':<12}{'emails':>8}{'seconds':>10}{'emails/s':>10}{'queries':>9}")
+    with tempfile.TemporaryDirectory() as directory:
+        settings.EMAIL_BACKEND = BACKENDS[args.backend]
+        settings.EMAIL_FILE_PATH = directory
+        for name, send in [("per task", per_task), ("batched", batched)]:
+            elapsed, queries = bench(send, passenger_ids)
+            print(f"{name:<12}{len(passenger_ids):>8}{elapsed:>10.2f}{len(passenger_ids) / elapsed:>10,.0f}{queries:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""End-to-end load test: signup and booking traffic against a running stack.
+
+Starts the stub estimator (benchmarks/stub_estimator.py) and the passenger
+API under gunicorn on a fresh database, then sends --rps requests per second
+for --duration seconds, split between the endpoints by --mix. Run from
+passenger_api/:
+
+    python -m benchmarks.loadtest --rps 200 --duration 30 --out loadtest/$(git rev-parse --short HEAD).json
+    python -m benchmarks.loadtest --rps 200 --latency-dist lognormal --error-rate 0.05 --compare loadtest/abc1234.json
+
+Arrivals are open-loop: requests go out on a Poisson schedule (or evenly
+spaced with --arrival constant) whether or not earlier ones have answered,
+as real clients do, so a slow server builds a backlog instead of slowing
+the load down. Latency is measured from when a request was due, which
+counts the time it waited for a free connection too.
+
+Per endpoint the report gives requests sent, answers by status, throughput
+of successful (2xx) answers and their p50/p95/p99/max latency. --out writes
+it as JSON with the commit and the settings; --compare prints the change
+against an earlier file.
+
+The database is a throwaway SQLite file, migrated first. With
+DB_ENGINE=postgresql in the environment, DB_NAME and friends are used as
+given: point them at a disposable database. Server settings go through
+--env, e.g. --env RIDE_BOOKING_MODE=queued --env ADMISSION_GLOBAL_RATE=150.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import aiohttp
+
+from benchmarks.bench_async_booking import free_port, start, wait_for_port
+
+ENDPOINTS = {
+    "signup": "/passenger/passengers/",
+    "book": "/passenger/rides/book/",
+}
+# Bookings start and end somewhere in a ~20 km box around San Francisco.
+CENTER = (37.7749, -122.4194)
+SPREAD = 0.1
+
+
+class Endpoint:
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.sent = 0
+        self.statuses = Counter()
+        self.latencies = []
+
+    def record(self, status, seconds):
+        self.statuses[status] += 1
+        if isinstance(status, int) and 200 <= status < 300:
+            self.latencies.append(seconds)
+
+    def summary(self, duration):
+        latencies = sorted(self.latencies)
+
+        def percentile(q):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1e3, 2)
+
+        return {
+            "sent": self.sent,
+            "ok": len(latencies),
+            "statuses": {str(status): count for status, count in sorted(self.statuses.items(), key=str)},
+            "throughput_rps": round(len(latencies) / duration, 2),
+            "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99),
+            "max_ms": round(latencies[-1] * 1e3, 2) if latencies else None,
+        }
+
+
+class Traffic:
+    """Request bodies: unique passengers for signups, scattered trips for bookings."""
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.run = int(time.time())
+        self.signups = 0
+
+    def point(self):
+        return {
+            "latitude": round(CENTER[0] + self.rng.uniform(-SPREAD, SPREAD), 6),
+            "longitude": round(CENTER[1] + self.rng.uniform(-SPREAD, SPREAD), 6),
+        }
+
+    def body(self, name):
+        if name == "signup":
+            self.signups += 1
+            return {
+                "email": f"load{self.run}-{self.signups}@example.com",
+                "phone": f"+1{(self.run * 1000 + self.signups) % 10 ** 10:010d}",
+                "first_name": "Load",
+                "last_name": "Test",
+            }
+        return {"pickup_location": self.point(), "dropoff_location": self.point(), "ride_type": "standard"}
+
+
+def parse_mix(text):
+    weights = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"Unknown endpoint {name!r}; choose from {sorted(ENDPOINTS)}.")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+async def run_load(base_url, args, traffic):
+    rng = traffic.rng
+    endpoints = {name: Endpoint(name, ENDPOINTS[name]) for name in args.mix}
+    names, weights = list(args.mix), list(args.mix.values())
+
+    connector = aiohttp.TCPConnector(limit=args.max_connections)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+
+        async def send(endpoint, body, due):
+            try:
+                async with session.post(base_url + endpoint.path, json=body) as response:
+                    await response.read()
+                    status = response.status
+            except asyncio.TimeoutError:
+                status = "timeout"
+            except aiohttp.ClientError as e:
+                status = type(e).__name__
+            endpoint.record(status, time.perf_counter() - due)
+
+        tasks = []
+        started = time.perf_counter()
+        due = started
+        while due < started + args.duration:
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            endpoint = endpoints[rng.choices(names, weights)[0]]
+            endpoint.sent += 1
+            tasks.append(asyncio.create_task(send(endpoint, traffic.body(endpoint.name), due)))
+            due += rng.expovariate(args.rps) if args.arrival == "poisson" else 1 / args.rps
+        # Answers still due count against the run; the timeout bounds the wait.
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+    return endpoints, elapsed
+
+
+def stop(proc, timeout=10):
+    # After an overload run the server may still be working through its backlog.
+    os.killpg(proc.pid, signal.SIGTERM)
+    try:
+        proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+        proc.wait()
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if dirty else "")
+
+
+def print_report(results, baseline=None):
+    print(f"{'endpoint':<10}{'sent':>8}{'ok':>8}{'ok/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}  statuses")
+    fmt = lambda value: f"{value:>9.1f}" if value is not None else f"{'-':>9}"
+    for name, row in results["endpoints"].items():
+        statuses = " ".join(f"{status}:{count}" for status, count in row["statuses"].items())
+        print(f"{name:<10}{row['sent']:>8}{row['ok']:>8}{row['throughput_rps']:>9.1f}"
+              f"{fmt(row['p50_ms'])}{fmt(row['p95_ms'])}{fmt(row['p99_ms'])}{fmt(row['max_ms'])}  {statuses}")
+    if baseline is None:
+        return
+
+    print(f"\nagainst {baseline.get('commit') or 'baseline'} ({baseline['started_at']}):")
+    for name, row in results["endpoints"].items():
+        before = baseline["endpoints"].get(name)
+        if before is None:
+            continue
+        changes = []
+        for key in ["throughput_rps", "p50_ms", "p95_ms", "p99_ms"]:
+            if row[key] is None or not before[key]:
+                continue
+            changes.append(f"{key} {before[key]:g} -> {row[key]:g} ({(row[key] - before[key]) / before[key]:+.0%})")
+        print(f"{name:<10}" + ", ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rps", type=float, default=100, help="Requests per second, all endpoints together.")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds of traffic.")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("book=9,signup=1"),
+                        help="Endpoints and their weights (default book=9,signup=1).")
+    parser.add_argument("--arrival", choices=["poisson", "constant"], default="poisson")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes.")
+    parser.add_argument("--threads", type=int, default=8, help="Threads per gunicorn worker.")
+    parser.add_argument("--latency-ms", type=float, default=50, help="Stub estimator latency (median).")
+    parser.add_argument("--latency-dist", choices=["fixed", "exponential", "lognormal"], default="fixed")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="lognormal shape.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of estimator calls answered 503.")
+    parser.add_argument("--max-connections", type=int, default=1000, help="Client connections open at once.")
+    parser.add_argument("--timeout", type=float, default=30, help="Seconds before a request counts as timed out.")
+    parser.add_argument("--warmup", type=float, default=2, help="Seconds of traffic sent before measuring.")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="Extra server setting.")
+    parser.add_argument("--out", help="Write the results to this JSON file.")
+    parser.add_argument("--compare", help="A previous --out file to compare against.")
+    args = parser.parse_args()
+
+    stub_port, app_port = free_port(), free_port()
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(
+            os.environ,
+            SECRET_KEY=os.getenv("SECRET_KEY", "loadtest"),
+            DEBUG="True",
+            LOG_LEVEL=os.getenv("LOG_LEVEL", "WARNING"),
+            LOG_FILE=os.path.join(directory, "passenger.log"),
+            PROMETHEUS_MULTIPROC_DIR=os.path.join(directory, "prometheus"),
+            GEOES_NODE_API_URL=f"http://127.0.0.1:{stub_port}/api/estimate",
+            STUB_LATENCY_MS=str(args.latency_ms),
+            STUB_LATENCY_DIST=args.latency_dist,
+            STUB_LATENCY_SIGMA=str(args.latency_sigma),
+            STUB_ERROR_RATE=str(args.error_rate),
+        )
+        if env.get("DB_ENGINE", "sqlite3") != "postgresql":
+            env["DB_NAME"] = os.path.join(directory, "loadtest.sqlite3")
+        env.update(item.split("=", 1) for item in args.env)
+        os.makedirs(env["PROMETHEUS_MULTIPROC_DIR"])
+        subprocess.run([sys.executable, "manage.py", "migrate", "--verbosity", "0"], env=env, check=True)
+
+        stub = start([sys.executable, "-m", "uvicorn", "benchmarks.stub_estimator:app",
+                      "--port", str(stub_port), "--log-level", "warning", "--no-access-log"], env)
+        try:
+            wait_for_port(stub_port)
+            server = start([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "passenger_api.wsgi:application",
+                            "--workers", str(args.workers), "--threads", str(args.threads),
+                            "--bind", f"127.0.0.1:{app_port}", "--graceful-timeout", "5", "--log-level", "warning"], env)
+            try:
+                wait_for_port(app_port)
+                base_url = f"http://127.0.0.1:{app_port}"
+                traffic = Traffic(random.Random(args.seed))
+                if args.warmup:
+                    warmup = argparse.Namespace(**{**vars(args), "duration": args.warmup})
+                    asyncio.run(run_load(base_url, warmup, traffic))
+                started_at = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+                endpoints, elapsed = asyncio.run(run_load(base_url, args, traffic))
+            finally:
+                stop(server)
+        finally:
+            stop(stub)
+
+    results = {
+        "commit": git_commit(),
+        "started_at": started_at,
+        "config": {
+            key: value for key, value in vars(args).items() if key not in ("out", "compare")
+        },
+        "elapsed_s": round(elapsed, 2),
+        "endpoints": {name: endpoint.summary(args.duration) for name, endpoint in endpoints.items()},
+    }
+    print(f"{args.rps:g} req/s for {args.duration:g}s ({args.arrival}), {args.workers} workers x {args.threads} threads, "
+          f"estimator {args.latency_ms:g} ms {args.latency_dist}, {args.error_rate:.0%} errors")
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
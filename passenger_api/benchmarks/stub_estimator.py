@@ -0,0 +1,82 @@
+"""Stand-in for the Node geo estimator's POST /api/estimate.
+
+Answers with the real estimate (computed by passenger.estimation) after an
+artificial delay, so benchmarks measure how the passenger service waits on
+I/O rather than the estimator itself. Configured through the environment:
+
+    STUB_LATENCY_MS=50 uvicorn benchmarks.stub_estimator:app --port 3999
+
+- STUB_LATENCY_MS: the delay, or its median for the random distributions.
+- STUB_LATENCY_DIST: 'fixed' (default), 'exponential', or 'lognormal' with
+  shape STUB_LATENCY_SIGMA (default 0.5; 1.0 gives a long tail).
+- STUB_ERROR_RATE: fraction of requests answered with STUB_ERROR_STATUS
+  (default 503) after the delay, like an overloaded estimator.
+"""
+import asyncio
+import json
+import math
+import os
+import random
+
+from passenger import estimation
+
+LATENCY = float(os.getenv("STUB_LATENCY_MS", 50)) / 1000
+LATENCY_DIST = os.getenv("STUB_LATENCY_DIST", "fixed")
+LATENCY_SIGMA = float(os.getenv("STUB_LATENCY_SIGMA", 0.5))
+ERROR_RATE = float(os.getenv("STUB_ERROR_RATE", 0))
+ERROR_STATUS = int(os.getenv("STUB_ERROR_STATUS", 503))
+
+
+def latency():
+    if LATENCY_DIST == "exponential":
+        return random.expovariate(math.log(2) / LATENCY) if LATENCY else 0.0
+    if LATENCY_DIST == "lognormal":
+        return random.lognormvariate(math.log(LATENCY), LATENCY_SIGMA) if LATENCY else 0.0
+    return LATENCY
+
+
+async def _send_json(send, status, body):
+    payload = json.dumps(body).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())],
+    })
+    await send({"type": "http.response.body", "body": payload})
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+    if scope["method"] != "POST" or scope["path"] != "/api/estimate":
+        await _send_json(send, 404, {"error": "Not found."})
+        return
+
+    await asyncio.sleep(latency())
+    if ERROR_RATE and random.random() < ERROR_RATE:
+        await _send_json(send, ERROR_STATUS, {"error": "Injected failure."})
+        return
+    try:
+        payload = json.loads(body)
+        result = estimation.estimate(payload["pickup_location"], payload["dropoff_location"], payload["ride_type"])
+    except estimation.EstimationError as e:
+        await _send_json(send, 500, {"error": str(e)})
+        return
+    except (ValueError, KeyError, TypeError):
+        await _send_json(send, 400, {"error": "Missing required fields."})
+        return
+    await _send_json(send, 200, result)
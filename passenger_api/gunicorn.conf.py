@@ -0,0 +1,12 @@
+# gunicorn -c gunicorn.conf.py passenger_api.wsgi:application
+#
+# With several workers, set PROMETHEUS_MULTIPROC_DIR to an empty directory so
+# /metrics aggregates every worker (see passenger/metrics.py).
+import os
+
+
+def child_exit(server, worker):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,67 @@
+# Shared by passenger_api, driver_api and admin_api, which are built from
+# separate Docker contexts, so each carries a copy. Keep the copies in sync:
+# passenger_api/passenger/tests/test_shared_modules.py checks them.
+"""Normalisation and uniqueness of account emails and phones.
+
+Email and phone are stored normalised and are unique in the database, so an
+account is created with a single INSERT: a duplicate comes back from the
+database as an IntegrityError, which ``duplicate_field`` maps to the field
+that clashed. There is no check-then-insert window for concurrent signups
+to slip through.
+"""
+from django.db import connections, router, transaction
+
+PHONE_SEPARATORS = str.maketrans("", "", " -().")
+
+
+def normalize_email(email):
+    return email.strip().lower()
+
+
+def normalize_phone(phone):
+    """Strip separators and turn a leading 00 into +. Returns None when invalid."""
+    phone = phone.strip().translate(PHONE_SEPARATORS)
+    if phone.startswith("00"):
+        phone = "+" + phone[2:]
+    digits = phone[1:] if phone.startswith("+") else phone
+    if not (digits.isascii() and digits.isdigit()) or not 7 <= len(digits) <= 15:
+        return None
+    return phone if len(phone) <= 15 else None
+
+
+def unique_constraint_name(model, field):
+    return f"{model._meta.model_name}_unique_{field}"
+
+
+def duplicate_field(error, model, fields=("email", "phone")):
+    """The unique field an IntegrityError from inserting `model` is about, or None.
+
+    PostgreSQL reports the constraint name (psycopg exposes it on the cause);
+    SQLite reports ``table.column``.
+    """
+    diag = getattr(error.__cause__, "diag", None)
+    constraint = getattr(diag, "constraint_name", None)
+    message = str(error)
+    for field in fields:
+        name = unique_constraint_name(model, field)
+        if constraint is not None:
+            if constraint == name:
+                return field
+        elif name in message or f"{model._meta.db_table}.{field}" in message:
+            return field
+    return None
+
+
+def create_account(model, using=None, **values):
+    """INSERT one account row, on `using` or wherever the routers send it.
+
+    In autocommit mode this is a single statement, and a failed INSERT leaves
+    nothing to roll back. Inside an outer transaction (ATOMIC_REQUESTS, tests)
+    the INSERT runs in a savepoint so an IntegrityError does not break it.
+    """
+    manager = model.objects if using is None else model.objects.db_manager(using)
+    using = using or router.db_for_write(model)
+    if not connections[using].in_atomic_block:
+        return manager.create(**values)
+    with transaction.atomic(using=using):
+        return manager.create(**values)
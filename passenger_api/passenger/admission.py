@@ -0,0 +1,337 @@
+"""Admission control for the booking paths (rides/book/ and rides/book/async/).
+
+Two token buckets decide whether a booking is let in at all, before any
+validation, database or estimator work:
+
+- the global bucket caps bookings across every web process at
+  ADMISSION_GLOBAL_RATE per second (burst ADMISSION_GLOBAL_BURST); when it
+  is empty the service is overloaded and answers 503;
+- each client's bucket caps that client at ADMISSION_CLIENT_RATE (burst
+  ADMISSION_CLIENT_BURST); an empty one answers 429.
+
+Both carry a Retry-After header with the seconds until a token is due. A
+rate of 0 turns a bucket off.
+
+The shared state lives in the ``admission`` cache alias when it is Redis,
+updated by a Lua script so concurrent processes cannot overdraw a bucket.
+The local fast path keeps most requests off Redis: the global bucket leases
+ADMISSION_LEASE_SIZE tokens at a time and hands them out in-process, and a
+per-process bucket per client turns away a client already over its limit
+here without asking Redis. If Redis fails, the per-process buckets decide
+alone. Without Redis (no REDIS_URL) the buckets are per process.
+
+Concurrency on the estimator call itself is limited separately, by
+services.get_upstream_limiter().
+"""
+import functools
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from django.http import JsonResponse
+from rest_framework import status
+from rest_framework.response import Response
+
+from .metrics import (
+    ADMISSION_ADMITTED, ADMISSION_GLOBAL_TOKENS, ADMISSION_REDIS_ERRORS, ADMISSION_REJECTED, ADMISSION_TRACKED_CLIENTS,
+)
+
+logger = logging.getLogger('passenger')
+
+ERROR_MESSAGES = {
+    "RATE_LIMITED": "Too many ride requests from this client. Retry after {retry_after} seconds.",
+    "OVERLOADED": "The service is overloaded. Retry after {retry_after} seconds.",
+}
+
+# Refills KEYS[1] at ARGV[1] tokens/s up to ARGV[2], then takes up to ARGV[3]
+# whole tokens. Returns {granted, seconds until the next token, tokens left}.
+# Uses the Redis clock, so web hosts with skewed clocks agree.
+TAKE_SCRIPT = """
+local rate, burst, want = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+local tokens = tonumber(state[1]) or burst
+local at = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - at) * rate)
+local granted = math.min(want, math.floor(tokens))
+tokens = tokens - granted
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'at', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+local wait = 0
+if tokens < 1 then
+    wait = (1 - tokens) / rate
+end
+return {granted, tostring(wait), tostring(tokens)}
+"""
+
+
+class TokenBucket:
+    """In-process token bucket: `rate` tokens per second, holding at most `burst`."""
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self._tokens = float(burst)
+        self._at = clock()
+        self._lock = threading.Lock()
+
+    def take(self, n=1):
+        """Take up to `n` tokens. Returns (granted, seconds until the next token)."""
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._at) * self.rate)
+            self._at = now
+            granted = min(n, int(self._tokens))
+            self._tokens -= granted
+            wait = (1 - self._tokens) / self.rate if self._tokens < 1 else 0.0
+            return granted, wait
+
+    def level(self):
+        """Tokens in the bucket now."""
+        with self._lock:
+            return min(self.burst, self._tokens + (self.clock() - self._at) * self.rate)
+
+
+class RedisTokenBucket:
+    """A token bucket shared by every process, kept in Redis under `key`.
+
+    `script` is TAKE_SCRIPT registered on a Redis client.
+    """
+
+    def __init__(self, script, key, rate, burst):
+        self.script = script
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+
+    def take(self, n=1):
+        granted, wait, tokens = self.script(keys=[self.key], args=[self.rate, self.burst, n])
+        self._tokens = float(tokens)
+        return int(granted), float(wait)
+
+    def level(self):
+        """Tokens in the bucket after the last take; refills since are not counted."""
+        return self._tokens
+
+
+class LeasedBucket:
+    """Hands out tokens leased from a shared bucket `lease` at a time.
+
+    Tokens held here for longer than `lease_ttl` seconds are dropped, so an
+    idle process does not sit on capacity and release it as a burst later.
+    """
+
+    def __init__(self, shared, lease, lease_ttl=1.0, clock=time.monotonic):
+        self.shared = shared
+        self.lease = lease
+        self.lease_ttl = lease_ttl
+        self.clock = clock
+        self._tokens = 0
+        self._leased_at = 0.0
+        self._lock = threading.Lock()
+
+    def take(self):
+        with self._lock:
+            now = self.clock()
+            if self._tokens and now - self._leased_at > self.lease_ttl:
+                self._tokens = 0
+            if not self._tokens:
+                self._tokens, wait = self.shared.take(self.lease)
+                self._leased_at = now
+                if not self._tokens:
+                    return 0, wait
+            self._tokens -= 1
+            return 1, 0.0
+
+    def level(self):
+        """The shared bucket's level as last seen."""
+        return self.shared.level()
+
+
+class AdmissionController:
+    """Admits or sheds bookings; see the module docstring.
+
+    `client` is the shared Redis client, or None for per-process buckets.
+    """
+
+    def __init__(self, global_rate=0, global_burst=0, client_rate=0, client_burst=0,
+                 lease=10, max_clients=10000, client=None, clock=time.monotonic):
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.max_clients = max_clients
+        self.clock = clock
+        self._script = client.register_script(TAKE_SCRIPT) if client is not None else None
+        self._global_local = TokenBucket(global_rate, global_burst, clock) if global_rate else None
+        self._global = self._global_local
+        if global_rate and self._script is not None:
+            self._global = LeasedBucket(
+                RedisTokenBucket(self._script, "admission:global", global_rate, global_burst), lease, clock=clock
+            )
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"admitted": 0, "rate_limited": 0, "overloaded": 0, "redis_errors": 0}
+
+    def _incr(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def _client_bucket(self, client_id):
+        with self._lock:
+            bucket = self._clients.get(client_id)
+            if bucket is None:
+                bucket = self._clients[client_id] = TokenBucket(self.client_rate, self.client_burst, self.clock)
+                while len(self._clients) > self.max_clients:
+                    self._clients.popitem(last=False)
+                ADMISSION_TRACKED_CLIENTS.set(len(self._clients))
+            else:
+                self._clients.move_to_end(client_id)
+            return bucket
+
+    def _take_shared(self, shared, local):
+        """Take a token from `shared`, or from `local` alone when Redis fails."""
+        try:
+            return shared()
+        except Exception as e:
+            self._incr("redis_errors")
+            ADMISSION_REDIS_ERRORS.inc()
+            logger.warning("Admission control falling back to per-process buckets: %s", e)
+            return local()
+
+    def admit(self, client_id):
+        """Returns None to admit the request, or (reason, retry_after) to shed it."""
+        if self.client_rate:
+            local = self._client_bucket(client_id)
+            granted, wait = local.take()
+            if granted and self._script is not None:
+                shared = RedisTokenBucket(self._script, f"admission:client:{client_id}", self.client_rate, self.client_burst)
+                granted, wait = self._take_shared(shared.take, lambda: (1, 0.0))
+            if not granted:
+                return self._shed("rate_limited", wait)
+
+        if self._global is not None:
+            granted, wait = self._take_shared(self._global.take, self._global_local.take)
+            ADMISSION_GLOBAL_TOKENS.set(self._global.level())
+            if not granted:
+                return self._shed("overloaded", wait)
+
+        self._incr("admitted")
+        ADMISSION_ADMITTED.inc()
+        return None
+
+    async def aadmit(self, client_id):
+        """Async version of admit, for views running on the event loop."""
+        if self._script is None:
+            return self.admit(client_id)
+        # A lease or client check may go to Redis; do not block the loop on it.
+        return await sync_to_async(self.admit, thread_sensitive=False)(client_id)
+
+    def _shed(self, reason, wait):
+        self._incr(reason)
+        ADMISSION_REJECTED.labels(reason).inc()
+        return reason, max(1, math.ceil(wait))
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+            counters["tracked_clients"] = len(self._clients)
+        if self._global is not None:
+            counters["global_tokens"] = round(self._global.level(), 2)
+        shed = counters["rate_limited"] + counters["overloaded"]
+        total = counters["admitted"] + shed
+        counters["shed_ratio"] = round(shed / total, 4) if total else 0.0
+        return counters
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def _redis_client():
+    cache = caches["admission"]
+    if not isinstance(cache, RedisCache):
+        return None
+    return cache._cache.get_client(write=True)
+
+
+def get_admission_controller():
+    """Return the process-wide controller, building it on first use."""
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController(
+                    global_rate=settings.ADMISSION_GLOBAL_RATE,
+                    global_burst=settings.ADMISSION_GLOBAL_BURST,
+                    client_rate=settings.ADMISSION_CLIENT_RATE,
+                    client_burst=settings.ADMISSION_CLIENT_BURST,
+                    lease=settings.ADMISSION_LEASE_SIZE,
+                    max_clients=settings.ADMISSION_MAX_CLIENTS,
+                    client=_redis_client(),
+                )
+    return _controller
+
+
+def reset_admission_controller():
+    """Drop the cached instance so the next call rebuilds it from settings."""
+    global _controller
+    with _controller_lock:
+        _controller = None
+
+
+def client_id(request):
+    """Who a request counts against: ADMISSION_CLIENT_HEADER if set, else the peer address."""
+    if settings.ADMISSION_CLIENT_HEADER:
+        value = request.headers.get(settings.ADMISSION_CLIENT_HEADER)
+        if value:
+            # X-Forwarded-For lists the original client first.
+            return value.split(",")[0].strip()
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def shed_response(reason, retry_after, response_class=Response):
+    """The 429/503 answer for a shed request; pass JsonResponse for plain Django views."""
+    code, status_code = {
+        "rate_limited": ("RATE_LIMITED", status.HTTP_429_TOO_MANY_REQUESTS),
+        "overloaded": ("OVERLOADED", status.HTTP_503_SERVICE_UNAVAILABLE),
+    }[reason]
+    response = response_class({
+        "error": ERROR_MESSAGES[code].format(retry_after=retry_after),
+        "code": code,
+    }, status=status_code)
+    response["Retry-After"] = str(retry_after)
+    return response
+
+
+def admitted(handler):
+    """Decorate an APIView handler so it only runs for requests the controller admits."""
+
+    @functools.wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        shed = get_admission_controller().admit(client_id(request))
+        if shed is not None:
+            return shed_response(*shed)
+        return handler(view, request, *args, **kwargs)
+
+    return wrapper
+
+
+def aadmitted(handler):
+    """Like @admitted, for the async handlers of plain Django views."""
+
+    @functools.wraps(handler)
+    async def wrapper(view, request, *args, **kwargs):
+        shed = await get_admission_controller().aadmit(client_id(request))
+        if shed is not None:
+            return shed_response(*shed, response_class=JsonResponse)
+        return await handler(view, request, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,28 @@
+"""Progress of queued ride bookings.
+
+The web tier and the Celery workers are separate processes, so the status
+lives in the shared ``bookings`` cache alias (Redis in deployments). Entries
+expire after BOOKING_STATUS_TTL; a ride that made it to the database can
+still be looked up there afterwards.
+"""
+from django.core.cache import caches
+from django.conf import settings
+
+QUEUED = "queued"
+PROCESSING = "processing"
+FAILED = "failed"
+
+
+def _key(ride_id):
+    return f"booking:{ride_id}"
+
+
+def set_status(ride_id, status, **fields):
+    caches["bookings"].set(
+        _key(ride_id), {"ride_id": str(ride_id), "status": status, **fields},
+        timeout=settings.BOOKING_STATUS_TTL,
+    )
+
+
+def get_status(ride_id):
+    return caches["bookings"].get(_key(ride_id))
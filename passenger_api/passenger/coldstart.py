@@ -0,0 +1,71 @@
+# Shared by passenger_api, driver_api and admin_api, which are built from
+# separate Docker contexts, so each carries a copy. Keep the copies in sync:
+# passenger_api/passenger/tests/test_shared_modules.py checks them.
+"""Cold-start measurement: how long a fresh interpreter takes to get ready.
+
+Each target runs in a new ``python`` process from BASE_DIR, the way a
+deploy starts it:
+
+- ``wsgi``: import the WSGI application and load the URLconf, which is
+  what a gunicorn worker does before it can serve its first request;
+- ``check``: ``manage.py check``, which imports every app and URLconf.
+
+``run_cold_start`` returns the wall time and the modules left in
+``sys.modules``; with ``importtime=True`` the stderr of
+``python -X importtime`` is kept for ``parse_importtime``.
+"""
+import os
+import subprocess
+import sys
+import time
+from collections import namedtuple
+
+from django.conf import settings
+
+TARGETS = {
+    "wsgi": (
+        "import importlib\n"
+        "from django.urls import get_resolver\n"
+        "importlib.import_module({wsgi_module!r})\n"
+        "get_resolver().url_patterns\n"
+    ),
+    "check": (
+        "from django.core.management import execute_from_command_line\n"
+        "execute_from_command_line(['manage.py', 'check'])\n"
+    ),
+}
+
+_MODULES_MARKER = "--- sys.modules ---"
+
+ColdStart = namedtuple("ColdStart", ["target", "seconds", "modules", "importtime"])
+ImportTime = namedtuple("ImportTime", ["module", "self_us", "cumulative_us"])
+
+
+def run_cold_start(target, importtime=False):
+    """Run `target` in a fresh interpreter and time it."""
+    code = TARGETS[target].format(wsgi_module=settings.WSGI_APPLICATION.rpartition(".")[0])
+    code += f"import sys\nprint({_MODULES_MARKER!r})\nprint('\\n'.join(sys.modules))\n"
+    args = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    env = {**os.environ, "DJANGO_SETTINGS_MODULE": os.environ.get("DJANGO_SETTINGS_MODULE", settings.SETTINGS_MODULE)}
+
+    started = time.perf_counter()
+    result = subprocess.run(args, cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+    seconds = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f"Cold start of {target!r} failed:\n{result.stderr}")
+
+    modules = set(result.stdout.partition(_MODULES_MARKER)[2].split())
+    return ColdStart(target, seconds, modules, result.stderr if importtime else "")
+
+
+def parse_importtime(stderr):
+    """ImportTime rows from `python -X importtime` output, in import order."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, module = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue  # the header line
+        rows.append(ImportTime(module.strip(), int(self_us), int(cumulative_us)))
+    return rows
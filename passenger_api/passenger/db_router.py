@@ -0,0 +1,258 @@
+# Shared by passenger_api, driver_api and admin_api, which are built from
+# separate Docker contexts, so each carries a copy. Keep the copies in sync:
+# passenger_api/passenger/tests/test_shared_modules.py checks them.
+"""Read/write splitting between the primary ("default") and read replicas.
+
+Writes always go to default. Reads go to a random healthy replica listed
+in DB_REPLICAS, except in these cases, which read from default:
+
+- inside a transaction on default, so reads see its writes;
+- for the rest of a request that is not GET/HEAD/OPTIONS, or that has
+  written;
+- for DB_REPLICA_STICKY_SECONDS after a client's write.
+  ReplicaPinningMiddleware sets a short-lived cookie, so the client reads
+  its own writes even when the next request lands on another worker;
+- inside ``use_primary()``, e.g. a Celery task loading a row that a
+  request has just created;
+- while no replica is healthy. A background thread checks each replica
+  every DB_REPLICA_CHECK_INTERVAL seconds and skips any that fail the
+  check or lag more than DB_REPLICA_MAX_LAG_SECONDS. Replicas are not
+  used until their first check passes.
+
+Keep DB_REPLICA_STICKY_SECONDS above DB_REPLICA_MAX_LAG_SECONDS. Then
+any replica a pinned client falls back to has already replayed its
+write.
+"""
+import contextlib
+import contextvars
+import logging
+import random
+import threading
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__package__)
+
+PIN_COOKIE = "read_primary"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# Zero when the replica has replayed everything it received (an idle
+# primary sends nothing, so the last replay timestamp alone would drift).
+LAG_SQL = (
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() "
+    "THEN 0 ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+class _Pin:
+    """Per-request (or per use_primary block) routing state."""
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+_pin = contextvars.ContextVar("db_pin", default=None)
+
+
+def _primary_required():
+    pin = _pin.get()
+    if pin is not None and (pin.pinned or pin.wrote):
+        return True
+    return connections[DEFAULT_DB_ALIAS].in_atomic_block
+
+
+@contextlib.contextmanager
+def use_primary():
+    """Route every read in the block to default."""
+    outer = _pin.get()
+    pin = _Pin(pinned=True)
+    token = _pin.set(pin)
+    try:
+        yield
+    finally:
+        _pin.reset(token)
+        if outer is not None and pin.wrote:
+            outer.wrote = True
+
+
+def replica_lag(alias):
+    """Seconds `alias` trails the primary by; 0 for backends without replication."""
+    connection = connections[alias]
+    if connection.vendor != "postgresql":
+        return 0.0
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(LAG_SQL)
+            lag = cursor.fetchone()[0]
+    finally:
+        # Never hold a replica connection between checks; a dead one is noticed next time.
+        connection.close()
+    return float(lag or 0)
+
+
+class ReplicaMonitor:
+    """Tracks which replicas are fit to read from.
+
+    ``check()`` tests every replica once. With ``background=True`` a daemon
+    thread calls it every ``check_interval`` seconds, started on first use;
+    ``healthy()`` itself never touches the network.
+    """
+
+    def __init__(self, replicas, max_lag=5.0, check_interval=2.0, background=True):
+        self.replicas = list(replicas)
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.background = background
+        self._healthy = ()
+        self._lags = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def healthy(self):
+        if self.background:
+            self._ensure_started()
+        return self._healthy
+
+    def lags(self):
+        """Last measured lag per replica; None for one that failed its check."""
+        return dict(self._lags)
+
+    def check(self):
+        healthy = []
+        for alias in self.replicas:
+            try:
+                lag = replica_lag(alias)
+            except DatabaseError as e:
+                logger.warning("Replica %s failed its health check: %s", alias, e)
+                lag = None
+            if lag is not None and lag > self.max_lag:
+                logger.warning("Replica %s is %.1fs behind; reading from default instead.", alias, lag)
+            elif lag is not None:
+                healthy.append(alias)
+            self._lags[alias] = lag
+        self._healthy = tuple(healthy)
+        return self._healthy
+
+    def _ensure_started(self):
+        # A thread started before a fork does not survive in the child.
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="replica-monitor", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Replica health check failed.")
+            self._stopping.wait(self.check_interval)
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+
+_monitor = None
+_monitor_lock = threading.Lock()
+
+
+def get_replica_monitor():
+    """Return the process-wide replica monitor, building it on first use."""
+    global _monitor
+    if _monitor is None:
+        with _monitor_lock:
+            if _monitor is None:
+                _monitor = ReplicaMonitor(
+                    settings.DB_REPLICAS,
+                    max_lag=settings.DB_REPLICA_MAX_LAG_SECONDS,
+                    check_interval=settings.DB_REPLICA_CHECK_INTERVAL,
+                )
+    return _monitor
+
+
+def reset_replica_monitor():
+    """Stop and drop the cached instance so the next call rebuilds it from settings."""
+    global _monitor
+    with _monitor_lock:
+        monitor, _monitor = _monitor, None
+    if monitor is not None:
+        monitor.stop()
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not settings.DB_REPLICAS or _primary_required():
+            return DEFAULT_DB_ALIAS
+        healthy = get_replica_monitor().healthy()
+        return random.choice(healthy) if healthy else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        pin = _pin.get()
+        if pin is not None:
+            pin.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Every alias holds the same data.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaPinningMiddleware:
+    """Pins a request to default when it writes or its client wrote recently."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not settings.DB_REPLICAS:
+            return self.get_response(request)
+        pin = self._pin_for(request)
+        token = _pin.set(pin)
+        try:
+            response = self.get_response(request)
+        finally:
+            _pin.reset(token)
+        return self._remember(pin, response)
+
+    async def __acall__(self, request):
+        if not settings.DB_REPLICAS:
+            return await self.get_response(request)
+        pin = self._pin_for(request)
+        token = _pin.set(pin)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _pin.reset(token)
+        return self._remember(pin, response)
+
+    def _pin_for(self, request):
+        return _Pin(pinned=request.method not in SAFE_METHODS or PIN_COOKIE in request.COOKIES)
+
+    def _remember(self, pin, response):
+        if pin.wrote:
+            response.set_cookie(
+                PIN_COOKIE, "1", max_age=settings.DB_REPLICA_STICKY_SECONDS, httponly=True, samesite="Lax",
+            )
+        return response
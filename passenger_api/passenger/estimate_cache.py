@@ -0,0 +1,197 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import geohash
+from .metrics import ESTIMATE_CACHE_ERRORS, ESTIMATE_CACHE_HITS, ESTIMATE_CACHE_MISSES
+
+
+# The Prometheus series behind each stats() counter.
+_METRICS = {
+    "local_hits": ESTIMATE_CACHE_HITS.labels("local"),
+    "remote_hits": ESTIMATE_CACHE_HITS.labels("remote"),
+    "misses": ESTIMATE_CACHE_MISSES,
+    "remote_errors": ESTIMATE_CACHE_ERRORS.labels("remote"),
+}
+
+
+class LRUCache:
+    """Thread-safe in-process LRU with a per-entry TTL."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class EstimateCache:
+    """Two-tier cache for geo estimator responses.
+
+    Lookups hit the in-process LRU first and then the shared Django cache
+    alias (Redis in deployments). Keys are the pickup/dropoff geohash cells
+    plus ride type and the pricing version, so any trip starting and ending
+    in the same pair of cells reuses one estimate. Bumping
+    GEO_PRICING_VERSION orphans every existing key in all processes at once.
+    """
+
+    def __init__(self, local, remote_alias="estimates", remote_ttl=300, precision=7, version="1"):
+        self.local = local
+        self.remote_alias = remote_alias
+        self.remote_ttl = remote_ttl
+        self.precision = precision
+        self.version = version
+        self._counters = {"local_hits": 0, "remote_hits": 0, "misses": 0, "remote_errors": 0}
+        self._lock = threading.Lock()
+
+    @property
+    def remote(self):
+        return caches[self.remote_alias]
+
+    def make_key(self, pickup_location, dropoff_location, ride_type):
+        pickup_cell = geohash.encode(pickup_location["latitude"], pickup_location["longitude"], self.precision)
+        dropoff_cell = geohash.encode(dropoff_location["latitude"], dropoff_location["longitude"], self.precision)
+        return f"estimate:v{self.version}:{ride_type}:{pickup_cell}:{dropoff_cell}"
+
+    def _incr(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+        _METRICS[counter].inc()
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            self._incr("local_hits")
+            return value
+
+        try:
+            value = self.remote.get(key)
+        except Exception:
+            # A Redis outage must never fail a booking; fall through to the estimator.
+            self._incr("remote_errors")
+            value = None
+
+        if value is not None:
+            self._incr("remote_hits")
+            self.local.set(key, value)
+            return value
+
+        self._incr("misses")
+        return None
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        try:
+            self.remote.set(key, value, timeout=self.remote_ttl)
+        except Exception:
+            self._incr("remote_errors")
+
+    async def aget(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            self._incr("local_hits")
+            return value
+
+        try:
+            value = await self.remote.aget(key)
+        except Exception:
+            self._incr("remote_errors")
+            value = None
+
+        if value is not None:
+            self._incr("remote_hits")
+            self.local.set(key, value)
+            return value
+
+        self._incr("misses")
+        return None
+
+    async def aset(self, key, value):
+        self.local.set(key, value)
+        try:
+            await self.remote.aset(key, value, timeout=self.remote_ttl)
+        except Exception:
+            self._incr("remote_errors")
+
+    def invalidate(self):
+        """Drop every cached estimate, e.g. after pricing parameters change.
+
+        Clears this process's LRU and the shared tier. Other processes keep
+        their local entries until LOCAL_TTL expires; bump GEO_PRICING_VERSION
+        instead when that window is not acceptable.
+        """
+        self.local.clear()
+        self.remote.clear()
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        lookups = counters["local_hits"] + counters["remote_hits"] + counters["misses"]
+        counters["local_size"] = len(self.local)
+        counters["hit_ratio"] = (
+            (counters["local_hits"] + counters["remote_hits"]) / lookups if lookups else 0.0
+        )
+        return counters
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_estimate_cache():
+    """Return the process-wide estimate cache, building it on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EstimateCache(
+                    local=LRUCache(
+                        maxsize=settings.ESTIMATE_CACHE_LOCAL_MAXSIZE,
+                        ttl=settings.ESTIMATE_CACHE_LOCAL_TTL,
+                    ),
+                    remote_alias="estimates",
+                    remote_ttl=settings.ESTIMATE_CACHE_REMOTE_TTL,
+                    precision=settings.ESTIMATE_CACHE_GEOHASH_PRECISION,
+                    version=settings.GEO_PRICING_VERSION,
+                )
+    return _cache
+
+
+def reset_estimate_cache():
+    """Drop the cached instance so the next call rebuilds it from settings."""
+    global _cache
+    with _cache_lock:
+        _cache = None
+
+
+def invalidate_estimate_cache():
+    get_estimate_cache().invalidate()
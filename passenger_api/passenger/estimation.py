@@ -0,0 +1,159 @@
+"""In-process port of the geo_estimator pipeline.
+
+Mirrors geo_estimator/src/services: geohash at precision 7, the
+`haversine-distance` formula (equatorial radius, same operation order) and
+`Math.round`-style rounding to cents, so responses match the Node service.
+`estimate` handles one trip; `estimate_batch` handles many with NumPy.
+"""
+import math
+
+import numpy as np
+
+from . import geohash
+
+BASE_RATE = 2
+RIDE_TYPE_MULTIPLIERS = {
+    "standard": 1.0,
+    "premium": 1.5,
+}
+EARTH_RADIUS_M = 6378137
+GEOHASH_PRECISION = 7
+
+INVALID_DISTANCE = "Invalid distance for fare calculation."
+INVALID_RIDE_TYPE = "Invalid ride type."
+
+_BASE32 = np.frombuffer(geohash.BASE32_CODES.encode(), dtype="S1")
+
+
+class EstimationError(ValueError):
+    pass
+
+
+def _js_round(x):
+    """Math.round: nearest integer, halves rounded towards +infinity."""
+    r = math.floor(x)
+    return r + 1 if x - r >= 0.5 else r
+
+
+def _to_rad(x):
+    return x * math.pi / 180.0
+
+
+def _hav(x):
+    s = math.sin(x / 2)
+    return s * s
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    a_lat, b_lat = _to_rad(lat1), _to_rad(lat2)
+    a_lng, b_lng = _to_rad(lon1), _to_rad(lon2)
+    ht = _hav(b_lat - a_lat) + math.cos(a_lat) * math.cos(b_lat) * _hav(b_lng - a_lng)
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(ht))
+
+
+def distance_km(pickup_location, dropoff_location):
+    meters = haversine_m(
+        pickup_location["latitude"], pickup_location["longitude"],
+        dropoff_location["latitude"], dropoff_location["longitude"],
+    )
+    return _js_round((meters / 1000) * 100) / 100
+
+
+def calculate_fare(distance, ride_type):
+    if math.isnan(distance) or distance <= 0:
+        raise EstimationError(INVALID_DISTANCE)
+    if ride_type not in RIDE_TYPE_MULTIPLIERS:
+        raise EstimationError(INVALID_RIDE_TYPE)
+    return _js_round((distance * BASE_RATE * RIDE_TYPE_MULTIPLIERS[ride_type]) * 100) / 100
+
+
+def estimate(pickup_location, dropoff_location, ride_type):
+    """Return the same body the Node `/api/estimate` endpoint responds with."""
+    distance = distance_km(pickup_location, dropoff_location)
+    return {
+        "message": "Ride estimate calculated successfully",
+        "data": {
+            "pickup_geohash": geohash.encode(
+                pickup_location["latitude"], pickup_location["longitude"], GEOHASH_PRECISION
+            ),
+            "dropoff_geohash": geohash.encode(
+                dropoff_location["latitude"], dropoff_location["longitude"], GEOHASH_PRECISION
+            ),
+            "distance_km": distance,
+            "estimated_fare": calculate_fare(distance, ride_type),
+        },
+    }
+
+
+def encode_geohash_batch(lats, lons, precision=GEOHASH_PRECISION):
+    """Vectorised `geohash.encode`: the same bisection, run on whole arrays."""
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    n = lats.shape[0]
+    min_lat, max_lat = np.full(n, -90.0), np.full(n, 90.0)
+    min_lon, max_lon = np.full(n, -180.0), np.full(n, 180.0)
+    codes = np.zeros((n, precision), dtype=np.uint8)
+
+    for i in range(precision * 5):
+        if i % 2 == 0:
+            mid = (max_lon + min_lon) / 2
+            upper = lons > mid
+            min_lon = np.where(upper, mid, min_lon)
+            max_lon = np.where(upper, max_lon, mid)
+        else:
+            mid = (max_lat + min_lat) / 2
+            upper = lats > mid
+            min_lat = np.where(upper, mid, min_lat)
+            max_lat = np.where(upper, max_lat, mid)
+        char = i // 5
+        codes[:, char] = (codes[:, char] << 1) | upper
+
+    chars = np.ascontiguousarray(_BASE32[codes])
+    return chars.view(f"S{precision}").ravel().astype(str)
+
+
+def _js_round_array(x):
+    r = np.floor(x)
+    return np.where(x - r >= 0.5, r + 1, r)
+
+
+def distance_km_batch(pickup_lats, pickup_lons, dropoff_lats, dropoff_lons):
+    a_lat = np.asarray(pickup_lats, dtype=np.float64) * math.pi / 180.0
+    b_lat = np.asarray(dropoff_lats, dtype=np.float64) * math.pi / 180.0
+    a_lng = np.asarray(pickup_lons, dtype=np.float64) * math.pi / 180.0
+    b_lng = np.asarray(dropoff_lons, dtype=np.float64) * math.pi / 180.0
+    s_lat = np.sin((b_lat - a_lat) / 2)
+    s_lng = np.sin((b_lng - a_lng) / 2)
+    ht = s_lat * s_lat + np.cos(a_lat) * np.cos(b_lat) * (s_lng * s_lng)
+    meters = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(ht))
+    return _js_round_array((meters / 1000) * 100) / 100
+
+
+def estimate_batch(pickup_lats, pickup_lons, dropoff_lats, dropoff_lons, ride_types):
+    """Estimate many trips at once.
+
+    Returns a dict of parallel arrays (`pickup_geohash`, `dropoff_geohash`,
+    `distance_km`, `estimated_fare`) plus `errors`, a list holding the error
+    message for trips the Node service would reject and None otherwise.
+    Rejected trips have a NaN fare.
+    """
+    distance = distance_km_batch(pickup_lats, pickup_lons, dropoff_lats, dropoff_lons)
+    ride_types = np.asarray(ride_types, dtype=object)
+    multipliers = np.array([RIDE_TYPE_MULTIPLIERS.get(rt, np.nan) for rt in ride_types], dtype=np.float64)
+
+    bad_distance = np.isnan(distance) | (distance <= 0)
+    bad_ride_type = np.isnan(multipliers)
+    fare = _js_round_array((distance * BASE_RATE * multipliers) * 100) / 100
+    fare[bad_distance | bad_ride_type] = np.nan
+
+    errors = [None] * len(distance)
+    for i in np.flatnonzero(bad_distance | bad_ride_type):
+        errors[i] = INVALID_DISTANCE if bad_distance[i] else INVALID_RIDE_TYPE
+
+    return {
+        "pickup_geohash": encode_geohash_batch(pickup_lats, pickup_lons),
+        "dropoff_geohash": encode_geohash_batch(dropoff_lats, dropoff_lons),
+        "distance_km": distance,
+        "estimated_fare": fare,
+        "errors": errors,
+    }
@@ -0,0 +1,37 @@
+BASE32_CODES = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def encode(latitude, longitude, precision=7):
+    """Encode a coordinate the same way `ngeohash.encode` does in geo_estimator,
+    so hashes computed here always match the ones the Node service returns."""
+    min_lat, max_lat = -90.0, 90.0
+    min_lon, max_lon = -180.0, 180.0
+    chars = []
+    bits = 0
+    hash_value = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (max_lon + min_lon) / 2
+            if longitude > mid:
+                hash_value = (hash_value << 1) + 1
+                min_lon = mid
+            else:
+                hash_value = hash_value << 1
+                max_lon = mid
+        else:
+            mid = (max_lat + min_lat) / 2
+            if latitude > mid:
+                hash_value = (hash_value << 1) + 1
+                min_lat = mid
+            else:
+                hash_value = hash_value << 1
+                max_lat = mid
+        even = not even
+
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32_CODES[hash_value])
+            bits = 0
+            hash_value = 0
+    return "".join(chars)
@@ -0,0 +1,209 @@
+"""Idempotency-Key support for POST endpoints that clients retry.
+
+A request carrying an ``Idempotency-Key`` header runs once; its response is
+kept in the ``idempotency`` cache alias (Redis in deployments) for
+IDEMPOTENCY_TTL seconds and replayed, with an ``Idempotent-Replayed: true``
+header, to any repeat of the same request. Keys are scoped per endpoint.
+
+While the first request is running, it holds a lock on the key. A duplicate
+that arrives meanwhile waits up to IDEMPOTENCY_WAIT for the stored response
+instead of redoing the work, and gets a 409 if it is still not there.
+
+Only final answers are kept: 5xx responses (estimator down, queue
+unavailable, ...) are not stored, so a retry tries again. Reusing a key with
+a different body is refused with a 422. If the cache is unreachable the
+request runs as if it had no key.
+
+@aidempotent does the same for the async handlers of plain Django views,
+running the cache calls in worker threads. rides/book/ and
+rides/book/async/ share the "ride-booking" scope, so a retry on either
+route replays a booking made on the other.
+"""
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+from drf_spectacular.utils import OpenApiParameter
+from rest_framework import status
+from rest_framework.response import Response
+
+logger = logging.getLogger('passenger')
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL = 0.05  # seconds
+
+ERROR_MESSAGES = {
+    "INVALID_IDEMPOTENCY_KEY": f"{HEADER} must be 1 to {MAX_KEY_LENGTH} printable ASCII characters.",
+    "IDEMPOTENCY_KEY_REUSED": f"This {HEADER} was already used with a different request body.",
+    "IDEMPOTENCY_KEY_IN_USE": f"A request with this {HEADER} is still being processed. Retry shortly.",
+}
+
+# For extend_schema(parameters=[...]) on views using @idempotent.
+SCHEMA_PARAMETER = OpenApiParameter(
+    HEADER, str, OpenApiParameter.HEADER,
+    description=f"Repeats with the same key within IDEMPOTENCY_TTL replay the first response instead of "
+                f"running again. At most {MAX_KEY_LENGTH} characters.",
+)
+
+
+def _cache():
+    return caches["idempotency"]
+
+
+def _key(scope, key):
+    return f"idempotency:{scope}:{key}"
+
+
+def _lock_key(scope, key):
+    return f"idempotency-lock:{scope}:{key}"
+
+
+def fingerprint(data):
+    """A digest of the request body, so a key reused for a different request is caught."""
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _valid(key):
+    return 0 < len(key) <= MAX_KEY_LENGTH and key.isascii() and key.isprintable()
+
+
+def _error(code, status_code, response_class=Response):
+    return response_class({"error": ERROR_MESSAGES[code], "code": code}, status=status_code)
+
+
+def _replay(stored, request_fingerprint, response_class=Response):
+    if stored["fingerprint"] != request_fingerprint:
+        return _error("IDEMPOTENCY_KEY_REUSED", status.HTTP_422_UNPROCESSABLE_ENTITY, response_class)
+    response = response_class(stored["data"], status=stored["status"])
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def _store(cache, cache_key, request_fingerprint, response_status, data, key):
+    try:
+        cache.set(cache_key, {
+            "fingerprint": request_fingerprint,
+            "status": response_status,
+            "data": data,
+        }, timeout=settings.IDEMPOTENCY_TTL)
+    except Exception as e:
+        logger.warning("Could not store the response for idempotency key %s: %s", key, e)
+
+
+def _release(cache, lock_key, token):
+    try:
+        # The lock may have expired and been taken by a later request.
+        if cache.get(lock_key) == token:
+            cache.delete(lock_key)
+    except Exception:
+        logger.warning("Could not release idempotency lock %s", lock_key)
+
+
+def idempotent(scope):
+    """Decorate an APIView handler so repeats with the same Idempotency-Key replay its response."""
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(view, request, *args, **kwargs):
+            key = request.headers.get(HEADER)
+            if key is None:
+                return handler(view, request, *args, **kwargs)
+            if not _valid(key):
+                return _error("INVALID_IDEMPOTENCY_KEY", status.HTTP_400_BAD_REQUEST)
+
+            cache = _cache()
+            cache_key, lock_key = _key(scope, key), _lock_key(scope, key)
+            request_fingerprint = fingerprint(request.data)
+            token = uuid.uuid4().hex
+            deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT
+            try:
+                while True:
+                    stored = cache.get(cache_key)
+                    if stored is not None:
+                        return _replay(stored, request_fingerprint)
+                    if cache.add(lock_key, token, timeout=settings.IDEMPOTENCY_LOCK_TTL):
+                        break
+                    if time.monotonic() >= deadline:
+                        return _error("IDEMPOTENCY_KEY_IN_USE", status.HTTP_409_CONFLICT)
+                    time.sleep(POLL_INTERVAL)
+            except Exception as e:
+                logger.warning("Idempotency cache unavailable, running %s without it: %s", scope, e)
+                return handler(view, request, *args, **kwargs)
+
+            try:
+                response = handler(view, request, *args, **kwargs)
+                if response.status_code < 500:
+                    _store(cache, cache_key, request_fingerprint, response.status_code, response.data, key)
+                return response
+            finally:
+                _release(cache, lock_key, token)
+
+        return wrapper
+
+    return decorator
+
+
+def _json_body(request):
+    """The body as parsed JSON, as DRF's request.data would give it; raw text when it is not JSON."""
+    try:
+        return json.loads(request.body or b"{}")
+    except ValueError:
+        return request.body.decode("utf-8", errors="replace")
+
+
+def aidempotent(scope):
+    """Like @idempotent, for the async handlers of plain Django views answering JsonResponse."""
+
+    def in_thread(func, *args, **kwargs):
+        # The cache client blocks; keep it off the event loop.
+        return sync_to_async(func, thread_sensitive=False)(*args, **kwargs)
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(view, request, *args, **kwargs):
+            key = request.headers.get(HEADER)
+            if key is None:
+                return await handler(view, request, *args, **kwargs)
+            if not _valid(key):
+                return _error("INVALID_IDEMPOTENCY_KEY", status.HTTP_400_BAD_REQUEST, JsonResponse)
+
+            cache = _cache()
+            cache_key, lock_key = _key(scope, key), _lock_key(scope, key)
+            request_fingerprint = fingerprint(_json_body(request))
+            token = uuid.uuid4().hex
+            deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT
+            try:
+                while True:
+                    stored = await in_thread(cache.get, cache_key)
+                    if stored is not None:
+                        return _replay(stored, request_fingerprint, JsonResponse)
+                    if await in_thread(cache.add, lock_key, token, timeout=settings.IDEMPOTENCY_LOCK_TTL):
+                        break
+                    if time.monotonic() >= deadline:
+                        return _error("IDEMPOTENCY_KEY_IN_USE", status.HTTP_409_CONFLICT, JsonResponse)
+                    await asyncio.sleep(POLL_INTERVAL)
+            except Exception as e:
+                logger.warning("Idempotency cache unavailable, running %s without it: %s", scope, e)
+                return await handler(view, request, *args, **kwargs)
+
+            try:
+                response = await handler(view, request, *args, **kwargs)
+                if response.status_code < 500:
+                    data = json.loads(response.content)
+                    await in_thread(_store, cache, cache_key, request_fingerprint, response.status_code, data, key)
+                return response
+            finally:
+                await in_thread(_release, cache, lock_key, token)
+
+        return wrapper
+
+    return decorator
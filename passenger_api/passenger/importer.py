@@ -0,0 +1,304 @@
+"""Bulk passenger import from NDJSON or CSV.
+
+Rows are streamed and handled in chunks of PASSENGER_IMPORT_CHUNK_SIZE:
+
+1. each row is validated and its email and phone normalised;
+2. duplicates inside the file are caught with in-memory sets;
+3. duplicates against the database are found with one query per chunk,
+   matching the chunk's emails and phones at once;
+4. the surviving rows are written with one multi-row INSERT.
+
+The INSERT is a single ``executemany`` built from the model's metadata
+rather than ``bulk_create``: on SQLite, preparing every value through the
+ORM costs about four times as much as the write itself. If it still fails
+(a passenger created concurrently between the check and the insert), the
+chunk is retried row by row so only the conflicting rows are rejected.
+Every rejected row is reported with its 1-based row number (data rows,
+header excluded) and an error code.
+
+Emails and phones are stored normalised (see passenger.accounts), so
+existing passengers are matched on exact values.
+
+With sharding on (see passenger.sharding), duplicates are looked up in the
+PassengerKey directory on default instead. Each chunk's keys are inserted
+there first, to allocate its ids, then each shard gets its passengers in a
+transaction of its own. A shard that fails frees its rows' keys and rejects
+them with WRITE_FAILED while the other shards' rows stand, so the client can
+resend exactly the rejected rows.
+
+Imported passengers are welcomed like signups (see passenger.welcome).
+"""
+import csv
+import functools
+import json
+import logging
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.validators import EmailValidator
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, IntegrityError, connections, router, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import sharding, welcome
+from .accounts import duplicate_field, normalize_email, normalize_phone
+from .models import Passenger, PassengerKey
+
+logger = logging.getLogger('passenger')
+
+REQUIRED_FIELDS = ["email", "phone", "first_name", "last_name"]
+INSERT_FIELDS = REQUIRED_FIELDS + ["created_at", "updated_at"]
+
+REJECT_MESSAGES = {
+    "INVALID_ROW": "The row could not be parsed.",
+    "MISSING_FIELDS": "The [email, phone, first_name, last_name] fields are required.",
+    "INVALID_EMAIL": "The email address is not valid.",
+    "INVALID_PHONE": "The phone number must have 7 to 15 digits, optionally prefixed with '+'.",
+    "INVALID_NAME": "first_name and last_name must be at most 50 characters.",
+    "DUPLICATE_EMAIL": "A user with this email address already exists.",
+    "DUPLICATE_PHONE": "A user with this phone number already exists.",
+    "WRITE_FAILED": "The passenger could not be stored; this row was not imported and can be sent again.",
+}
+
+ImportResult = namedtuple("ImportResult", ["rows", "created", "rejected", "rejects"])
+
+
+class ImportRejected(ValueError):
+    def __init__(self, code):
+        super().__init__(REJECT_MESSAGES[code])
+        self.code = code
+
+
+_email_validator = EmailValidator()
+
+
+@functools.lru_cache(maxsize=4096)
+def _valid_email_domain(domain):
+    # Imports are dominated by a handful of domains; validate each once.
+    return _email_validator.validate_domain_part(domain)
+
+
+def is_valid_email(email):
+    """Same rules as Django's validate_email, which EmailField uses."""
+    if len(email) > 254 or "@" not in email:
+        return False
+    user_part, domain_part = email.rsplit("@", 1)
+    return bool(_email_validator.user_regex.match(user_part)) and _valid_email_domain(domain_part)
+
+
+def clean_row(row):
+    """Validate one parsed row and return the Passenger field values, normalised."""
+    if not isinstance(row, dict):
+        raise ImportRejected("INVALID_ROW")
+    values = {field: row.get(field) for field in REQUIRED_FIELDS}
+    if not all(isinstance(value, str) and value.strip() for value in values.values()):
+        raise ImportRejected("MISSING_FIELDS")
+
+    email = normalize_email(values["email"])
+    if not is_valid_email(email):
+        raise ImportRejected("INVALID_EMAIL")
+
+    phone = normalize_phone(values["phone"])
+    if phone is None:
+        raise ImportRejected("INVALID_PHONE")
+
+    first_name, last_name = values["first_name"].strip(), values["last_name"].strip()
+    if len(first_name) > 50 or len(last_name) > 50:
+        raise ImportRejected("INVALID_NAME")
+    return {"email": email, "phone": phone, "first_name": first_name, "last_name": last_name}
+
+
+def read_ndjson(lines):
+    """Yield one dict per non-blank line (None for lines that are not JSON objects)."""
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", errors="replace")
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def read_csv(lines):
+    """Yield one dict per CSV record; the first line is the header."""
+    text = (line.decode("utf-8", errors="replace") if isinstance(line, bytes) else line for line in lines)
+    yield from csv.DictReader(text)
+
+
+READERS = {"ndjson": read_ndjson, "csv": read_csv}
+
+
+class PassengerImporter:
+    """Imports parsed rows; see the module docstring for the pipeline.
+
+    Keeps the emails and phones seen so far in memory to reject duplicates
+    within the file, roughly 100 bytes per imported row. At most
+    ``max_reported_rejects`` rejects (None for all) are kept in the result;
+    ``rejected`` always has the full count.
+    """
+
+    def __init__(self, chunk_size=1000, max_reported_rejects=1000):
+        self.chunk_size = chunk_size
+        self.max_reported_rejects = max_reported_rejects
+        self.sharded = sharding.enabled()
+        # Where existing emails and phones are looked up.
+        self.directory = PassengerKey if self.sharded else Passenger
+        self.using = DEFAULT_DB_ALIAS if self.sharded else router.db_for_write(Passenger)
+        self._seen_emails = set()
+        self._seen_phones = set()
+        self.rows = 0
+        self.created = 0
+        self.rejected = 0
+        self.rejects = []
+
+    def run(self, rows):
+        chunk = []
+        for row in rows:
+            self.rows += 1
+            try:
+                values = clean_row(row)
+            except ImportRejected as e:
+                self._reject(self.rows, e.code)
+                continue
+            chunk.append((self.rows, values))
+            if len(chunk) >= self.chunk_size:
+                self._import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self._import_chunk(chunk)
+        return ImportResult(self.rows, self.created, self.rejected, self.rejects)
+
+    def _reject(self, row_number, code, email=None):
+        self.rejected += 1
+        if self.max_reported_rejects is None or len(self.rejects) < self.max_reported_rejects:
+            reject = {"row": row_number, "code": code, "error": REJECT_MESSAGES[code]}
+            if email is not None:
+                reject["email"] = email
+            self.rejects.append(reject)
+
+    def _import_chunk(self, chunk):
+        fresh = []
+        for row_number, values in chunk:
+            if values["email"] in self._seen_emails:
+                self._reject(row_number, "DUPLICATE_EMAIL", values["email"])
+            elif values["phone"] in self._seen_phones:
+                self._reject(row_number, "DUPLICATE_PHONE", values["email"])
+            else:
+                self._seen_emails.add(values["email"])
+                self._seen_phones.add(values["phone"])
+                fresh.append((row_number, values))
+        if not fresh:
+            return
+
+        emails = [values["email"] for _, values in fresh]
+        phones = [values["phone"] for _, values in fresh]
+        taken_emails, taken_phones = set(), set()
+        existing = self.directory.objects.using(self.using).filter(Q(email__in=emails) | Q(phone__in=phones))
+        for email, phone in existing.values_list("email", "phone"):
+            taken_emails.add(email)
+            taken_phones.add(phone)
+
+        new = []
+        for row_number, values in fresh:
+            if values["email"] in taken_emails:
+                self._reject(row_number, "DUPLICATE_EMAIL", values["email"])
+            elif values["phone"] in taken_phones:
+                self._reject(row_number, "DUPLICATE_PHONE", values["email"])
+            else:
+                new.append((row_number, values))
+        if new and self.sharded:
+            self._insert_sharded(new)
+        elif new:
+            self._insert(new)
+
+    def _welcome(self, emails):
+        """Queue welcome emails for passengers just inserted without their ids."""
+        if settings.WELCOME_EMAILS:
+            created = Passenger.objects.using(self.using).filter(email__in=emails)
+            welcome.queue_welcome_emails(list(created.values_list("passenger_id", flat=True)), bulk=True)
+
+    def _insert_sql(self):
+        connection = connections[self.using]
+        quote = connection.ops.quote_name
+        opts = Passenger._meta
+        columns = ", ".join(quote(opts.get_field(name).column) for name in INSERT_FIELDS)
+        placeholders = ", ".join(["%s"] * len(INSERT_FIELDS))
+        return f"INSERT INTO {quote(opts.db_table)} ({columns}) VALUES ({placeholders})"
+
+    def _insert(self, new):
+        connection = connections[self.using]
+        now = Passenger._meta.get_field("created_at").get_db_prep_save(timezone.now(), connection)
+        params = [
+            (values["email"], values["phone"], values["first_name"], values["last_name"], now, now)
+            for _, values in new
+        ]
+        try:
+            with transaction.atomic(using=self.using), connection.cursor() as cursor:
+                cursor.executemany(self._insert_sql(), params)
+            self.created += len(new)
+            self._welcome([values["email"] for _, values in new])
+            return
+        except DatabaseError:
+            pass
+
+        # Someone else created one of these passengers after the check; find which.
+        for row_number, values in new:
+            try:
+                with transaction.atomic(using=self.using):
+                    passenger = Passenger.objects.using(self.using).create(**values)
+                self.created += 1
+                welcome.queue_welcome_emails([passenger.pk], bulk=True)
+            except IntegrityError as e:
+                code = "DUPLICATE_PHONE" if duplicate_field(e, Passenger) == "phone" else "DUPLICATE_EMAIL"
+                self._reject(row_number, code, values["email"])
+
+    def _insert_sharded(self, new):
+        keys = [PassengerKey(email=values["email"], phone=values["phone"]) for _, values in new]
+        try:
+            with transaction.atomic(using=self.using):
+                PassengerKey.objects.using(self.using).bulk_create(keys)
+        except IntegrityError:
+            keys = None
+        if keys is not None:
+            by_shard = {}
+            for (row_number, values), key in zip(new, keys):
+                passenger = Passenger(passenger_id=key.pk, **values)
+                by_shard.setdefault(sharding.shard_for_passenger(key.pk), []).append((row_number, passenger))
+            created = []
+            for alias, rows in by_shard.items():
+                passengers = [passenger for _, passenger in rows]
+                try:
+                    with transaction.atomic(using=alias):
+                        Passenger.objects.using(alias).bulk_create(passengers)
+                except DatabaseError as e:
+                    # Shards already written keep their rows; this one's are
+                    # reported so a retry resends only them.
+                    logger.warning("Importing %d passengers into %s failed: %s", len(rows), alias, e)
+                    PassengerKey.objects.using(self.using).filter(pk__in=[p.pk for p in passengers]).delete()
+                    for row_number, passenger in rows:
+                        self._seen_emails.discard(passenger.email)
+                        self._seen_phones.discard(passenger.phone)
+                        self._reject(row_number, "WRITE_FAILED", passenger.email)
+                    continue
+                created.extend(passenger.pk for passenger in passengers)
+            self.created += len(created)
+            welcome.queue_welcome_emails(created, bulk=True)
+            return
+
+        # Someone else created one of these passengers after the check; find which.
+        for row_number, values in new:
+            try:
+                passenger = sharding.create_passenger(**values)
+                self.created += 1
+                welcome.queue_welcome_emails([passenger.pk], bulk=True)
+            except IntegrityError as e:
+                code = "DUPLICATE_PHONE" if duplicate_field(e, PassengerKey) == "phone" else "DUPLICATE_EMAIL"
+                self._reject(row_number, code, values["email"])
+
+
+def import_passengers(lines, format="ndjson", chunk_size=1000, max_reported_rejects=1000):
+    """Parse `lines` (str or bytes) in the given format and import them."""
+    importer = PassengerImporter(chunk_size=chunk_size, max_reported_rejects=max_reported_rejects)
+    return importer.run(READERS[format](lines))
@@ -0,0 +1,159 @@
+"""Non-blocking, structured logging for the passenger service.
+
+Request threads never touch the log file. ``QueueingHandler`` puts each
+record on an in-process queue and returns; a background thread drains the
+queue, formats the records as JSON lines (``JsonFormatter``) and writes each
+batch with a single write and flush.
+
+Records are formatted on that thread, so pass values as %-style arguments or
+``extra`` fields rather than pre-formatting them, and do not mutate them after
+the call. A disabled level then costs one ``isEnabledFor`` check.
+
+``DebugSampler`` keeps only a fraction of the DEBUG records of a hot-path
+logger (e.g. one line per booking); INFO and above always pass.
+
+The queue is bounded. If the disk stalls and it fills up, new records are
+dropped and counted instead of blocking requests, and the count is reported
+once writing catches up. ``logging.shutdown`` (run at exit) flushes the
+queue; the writer thread restarts after a fork.
+"""
+import datetime
+import json
+import logging
+import queue
+import random
+import threading
+
+# Attributes every LogRecord has; anything else on a record came from `extra`.
+RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+_STOP = object()
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message, extra fields, exception."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class DebugSampler(logging.Filter):
+    """Pass a `rate` fraction of DEBUG records, and every record above DEBUG."""
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
+class QueueingHandler(logging.Handler):
+    """Queues records for a background thread that appends them to `filename`."""
+
+    def __init__(self, filename, max_queue=10000, batch_size=500, level=logging.NOTSET):
+        super().__init__(level)
+        self.filename = filename
+        self.batch_size = batch_size
+        self._queue = queue.Queue(max_queue)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stream = None
+        self.dropped = 0
+
+    def handle(self, record):
+        # No handler lock: the queue is already thread-safe. Only the drop
+        # count takes it, and only while the queue is full.
+        rv = self.filter(record)
+        if rv:
+            self.emit(record)
+        return rv
+
+    def emit(self, record):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+    def _ensure_started(self):
+        # A thread started before a fork does not survive in the child.
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = batch[-1] is _STOP
+            records = batch[:-1] if stopping else batch
+            try:
+                self._write(records)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stopping:
+                return
+
+    def _write(self, records):
+        lines = []
+        for record in records:
+            try:
+                lines.append(self.format(record))
+            except Exception:
+                self.handleError(record)
+        with self.lock:
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            lines.append(self.format(logging.makeLogRecord({
+                "name": __name__, "levelno": logging.WARNING, "levelname": "WARNING",
+                "msg": "Log queue was full; dropped %d records.", "args": (dropped,),
+            })))
+        if not lines:
+            return
+        try:
+            if self._stream is None:
+                self._stream = open(self.filename, "a", encoding="utf-8")
+            self._stream.write("\n".join(lines) + "\n")
+            self._stream.flush()
+        except Exception:
+            if records:
+                self.handleError(records[-1])
+
+    def flush(self):
+        """Block until every queued record is written."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def close(self):
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join(5)
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        super().close()
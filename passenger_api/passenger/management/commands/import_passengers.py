@@ -0,0 +1,51 @@
+import json
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from passenger.importer import import_passengers
+
+
+class Command(BaseCommand):
+    help = "Bulk-import passengers from an NDJSON or CSV file ('-' reads stdin)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to import, or '-' for stdin.")
+        parser.add_argument(
+            "--format", choices=["ndjson", "csv"],
+            help="Input format. Defaults to csv for *.csv files and ndjson otherwise.",
+        )
+        parser.add_argument("--chunk-size", type=int, default=settings.PASSENGER_IMPORT_CHUNK_SIZE)
+        parser.add_argument("--rejects", help="Write every rejected row to this file as NDJSON.")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["format"] or ("csv" if path.lower().endswith(".csv") else "ndjson")
+        try:
+            source = sys.stdin if path == "-" else open(path, encoding="utf-8", newline="")
+        except OSError as e:
+            raise CommandError(f"Cannot open {path}: {e}")
+
+        try:
+            result = import_passengers(
+                source,
+                format=file_format,
+                chunk_size=options["chunk_size"],
+                max_reported_rejects=None if options["rejects"] else 20,
+            )
+        finally:
+            if source is not sys.stdin:
+                source.close()
+
+        if options["rejects"]:
+            with open(options["rejects"], "w", encoding="utf-8") as rejects_file:
+                for reject in result.rejects:
+                    rejects_file.write(json.dumps(reject) + "\n")
+        else:
+            for reject in result.rejects:
+                self.stderr.write(f"row {reject['row']}: {reject['code']} {reject.get('email', '')}".rstrip())
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result.created} of {result.rows} passengers ({result.rejected} rejected)."
+        ))
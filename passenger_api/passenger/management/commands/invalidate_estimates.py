@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from passenger.estimate_cache import get_estimate_cache
+
+
+class Command(BaseCommand):
+    help = "Clear the shared fare/geohash estimate cache after pricing parameters change."
+
+    def handle(self, *args, **options):
+        cache = get_estimate_cache()
+        cache.invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f"Estimate cache cleared (pricing version {cache.version})."
+        ))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from passenger.coldstart import TARGETS, parse_importtime, run_cold_start
+
+
+class Command(BaseCommand):
+    help = "Profile a cold start of this service with `python -X importtime` and list the slowest imports."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--target", choices=sorted(TARGETS), default="wsgi",
+            help="wsgi: load the WSGI app and URLconf; check: run `manage.py check`.",
+        )
+        parser.add_argument("--top", type=int, default=25, help="How many modules to list.")
+
+    def handle(self, *args, **options):
+        try:
+            result = run_cold_start(options["target"], importtime=True)
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        imports = parse_importtime(result.importtime)
+        total_ms = sum(row.self_us for row in imports) / 1000
+        self.stdout.write(
+            f"{result.target}: {result.seconds * 1000:.0f} ms wall, "
+            f"{total_ms:.0f} ms importing {len(imports)} modules"
+        )
+        self.stdout.write(f"{'cumulative ms':>14} {'self ms':>9}  module")
+        for row in sorted(imports, key=lambda row: row.cumulative_us, reverse=True)[:options["top"]]:
+            self.stdout.write(f"{row.cumulative_us / 1000:>14.1f} {row.self_us / 1000:>9.1f}  {row.module}")
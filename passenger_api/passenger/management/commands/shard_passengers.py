@@ -0,0 +1,102 @@
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from passenger import sharding
+from passenger.models import Passenger, PassengerKey, Ride, ShardSlot
+
+
+class Command(BaseCommand):
+    help = (
+        "Manage the passenger shard map. init: create it (existing data on default stays there until "
+        "rebalanced); status: slots and rows per database; rebalance: spread the slots evenly over "
+        "PASSENGER_SHARDS; move: move the given slots to --to."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["init", "status", "rebalance", "move"])
+        parser.add_argument("slots", nargs="*", type=int, help="Slots to move (move only).")
+        parser.add_argument("--to", help="Database alias to move the slots to (move only).")
+        parser.add_argument("--dry-run", action="store_true", help="Print the moves without making them.")
+        parser.add_argument(
+            "--wait", type=float,
+            help="Seconds to wait for other processes to see the new map before the final copy. "
+                 "Defaults to PASSENGER_SHARD_MAP_TTL.",
+        )
+
+    def handle(self, *args, **options):
+        if not settings.PASSENGER_SHARDS:
+            raise CommandError("Sharding is off; set PASSENGER_SHARD_COUNT first.")
+        getattr(self, options["action"])(options)
+
+    def init(self, options):
+        if ShardSlot.objects.using(DEFAULT_DB_ALIAS).exists():
+            raise CommandError("The shard map already exists; use rebalance or move.")
+        if Passenger.objects.using(DEFAULT_DB_ALIAS).exists() or Ride.objects.using(DEFAULT_DB_ALIAS).exists():
+            self.adopt_default()
+            layout = [DEFAULT_DB_ALIAS] * sharding.SLOT_COUNT
+        else:
+            layout = sharding.even_layout(settings.PASSENGER_SHARDS)
+        ShardSlot.objects.using(DEFAULT_DB_ALIAS).bulk_create(
+            ShardSlot(slot=slot, alias=alias) for slot, alias in enumerate(layout)
+        )
+        sharding.reset_shard_map()
+        self.stdout.write(self.style.SUCCESS(f"Created the shard map on {', '.join(sorted(set(layout)))}."))
+
+    def adopt_default(self):
+        """List default's passengers in the directory, so ids, emails and phones stay unique."""
+        passengers = Passenger.objects.using(DEFAULT_DB_ALIAS).values_list("passenger_id", "email", "phone")
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            PassengerKey.objects.using(DEFAULT_DB_ALIAS).bulk_create(
+                (PassengerKey(passenger_id=pk, email=email, phone=phone) for pk, email, phone in passengers.iterator()),
+                batch_size=1000,
+                ignore_conflicts=True,
+            )
+            # New ids continue after the adopted ones.
+            connection = connections[DEFAULT_DB_ALIAS]
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [PassengerKey]):
+                    cursor.execute(sql)
+        self.stdout.write(f"Kept the passengers on {DEFAULT_DB_ALIAS} there; run rebalance to spread them out.")
+
+    def status(self, options):
+        slots = Counter(sharding.ShardMap(ttl=0).assignments())
+        self.stdout.write(f"{'database':<16}{'slots':>8}{'passengers':>12}{'rides':>10}")
+        for alias in sorted(set(slots) | set(settings.PASSENGER_SHARDS)):
+            passengers = Passenger.objects.using(alias).count()
+            rides = Ride.objects.using(alias).count()
+            self.stdout.write(f"{alias:<16}{slots[alias]:>8}{passengers:>12}{rides:>10}")
+
+    def rebalance(self, options):
+        assignments = sharding.ShardMap(ttl=0).assignments()
+        plan = sharding.rebalance_plan(assignments, settings.PASSENGER_SHARDS)
+        if not plan:
+            self.stdout.write("The slots are already balanced.")
+        self.run_plan(plan, options)
+
+    def move(self, options):
+        target = options["to"]
+        if not options["slots"] or target is None:
+            raise CommandError("move needs the slots to move and --to.")
+        if target not in connections.settings:
+            raise CommandError(f"Unknown database {target}.")
+        unknown = [slot for slot in options["slots"] if not 0 <= slot < sharding.SLOT_COUNT]
+        if unknown:
+            raise CommandError(f"Slots run from 0 to {sharding.SLOT_COUNT - 1}: {unknown}")
+        assignments = sharding.ShardMap(ttl=0).assignments()
+        plan = defaultdict(list)
+        for slot in sorted(set(options["slots"])):
+            if assignments[slot] != target:
+                plan[(assignments[slot], target)].append(slot)
+        self.run_plan(plan, options)
+
+    def run_plan(self, plan, options):
+        for (source, target), slots in plan.items():
+            self.stdout.write(f"{len(slots)} slots from {source} to {target}")
+            if options["dry_run"]:
+                continue
+            passengers, rides = sharding.move_slots(slots, source, target, wait=options["wait"])
+            self.stdout.write(self.style.SUCCESS(f"  moved {passengers} passengers and {rides} rides"))
@@ -0,0 +1,274 @@
+# Shared by passenger_api, driver_api and admin_api, which are built from
+# separate Docker contexts, so each carries a copy; passenger_api's adds its
+# own metrics. Keep the shared definitions in sync:
+# passenger_api/passenger/tests/test_shared_modules.py checks them.
+"""Prometheus metrics for this service, exported at /metrics.
+
+MetricsMiddleware records, labelled by the resolved URL name so that path
+parameters do not multiply series:
+
+- http_request_duration_seconds: latency histogram by view, method and status;
+- http_requests_in_progress: requests being served, by method;
+- db_queries_per_request and db_query_duration_per_request_seconds: how many
+  queries a request ran and how long they took in total, by view.
+
+Fare estimates (services.get_fare_and_hashed_location and its async twin)
+record geo_estimate_duration_seconds by source (cache, estimator, local, or
+fallback for local estimates standing in for a failed estimator call) and
+outcome, and count failures in geo_estimate_errors_total by exception. The
+estimate cache counts estimate_cache_hits_total by tier (local LRU, remote
+Redis), estimate_cache_misses_total and estimate_cache_errors_total (failed
+Redis calls); the hit rate is hits over hits plus misses. Celery
+tasks record celery_task_queue_wait_seconds (published to started) and
+celery_task_duration_seconds by task and final state.
+
+Load shedding (passenger.admission and the estimator concurrency limit)
+counts bookings let in (admission_admitted_total) and refused
+(admission_rejected_total, by reason: rate_limited is the client bucket,
+overloaded the global one, upstream_busy the estimator cap), and Redis
+failures that left a process on its own buckets. Per process,
+admission_global_bucket_tokens is the global bucket's level as last seen and
+admission_tracked_clients the client buckets held. geo_estimates_in_flight
+over geo_estimate_concurrency_limit is how saturated the estimator cap is.
+
+Multi-worker servers (gunicorn, uvicorn --workers) keep one registry per
+worker. Set PROMETHEUS_MULTIPROC_DIR to an empty directory shared by the
+workers before they start, and /metrics adds up every worker's values.
+"""
+import contextvars
+import os
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
+
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time spent serving a request.", ["view", "method", "status"]
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "Requests being served.", ["method"], multiprocess_mode="livesum"
+)
+DB_QUERIES = Histogram(
+    "db_queries_per_request", "Database queries run while serving a request.", ["view"],
+    buckets=QUERY_COUNT_BUCKETS,
+)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_per_request_seconds", "Total database query time while serving a request.", ["view"]
+)
+GEO_ESTIMATE_DURATION = Histogram(
+    "geo_estimate_duration_seconds", "Time to resolve a fare estimate.", ["source", "outcome"]
+)
+GEO_ESTIMATE_ERRORS = Counter(
+    "geo_estimate_errors_total", "Fare estimates that failed, by exception.", ["error"]
+)
+ESTIMATE_CACHE_HITS = Counter(
+    "estimate_cache_hits_total", "Estimate cache lookups answered, by tier.", ["tier"]
+)
+ESTIMATE_CACHE_MISSES = Counter(
+    "estimate_cache_misses_total", "Estimate cache lookups that found nothing in either tier."
+)
+ESTIMATE_CACHE_ERRORS = Counter(
+    "estimate_cache_errors_total", "Estimate cache calls that failed, by tier.", ["tier"]
+)
+ADMISSION_REJECTED = Counter(
+    "admission_rejected_total", "Bookings shed before any work, by reason.", ["reason"]
+)
+ADMISSION_ADMITTED = Counter(
+    "admission_admitted_total", "Bookings let in by admission control."
+)
+ADMISSION_REDIS_ERRORS = Counter(
+    "admission_redis_errors_total", "Shared bucket calls that failed, falling back to per-process buckets."
+)
+ADMISSION_GLOBAL_TOKENS = Gauge(
+    "admission_global_bucket_tokens", "Tokens in the global admission bucket as last seen by this process.",
+    multiprocess_mode="liveall",
+)
+ADMISSION_TRACKED_CLIENTS = Gauge(
+    "admission_tracked_clients", "Client buckets held by this process.", multiprocess_mode="liveall"
+)
+GEO_ESTIMATES_IN_FLIGHT = Gauge(
+    "geo_estimates_in_flight", "Calls to the geo estimator running now.", multiprocess_mode="livesum"
+)
+GEO_ESTIMATE_CONCURRENCY_LIMIT = Gauge(
+    "geo_estimate_concurrency_limit", "Estimator calls a process may run at once (GEOES_MAX_CONCURRENCY; 0 is no limit).",
+    multiprocess_mode="livesum",
+)
+TASK_QUEUE_WAIT = Histogram(
+    "celery_task_queue_wait_seconds", "Time between publishing a task and a worker starting it.", ["task"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300),
+)
+TASK_DURATION = Histogram(
+    "celery_task_duration_seconds", "Time spent running a task.", ["task", "state"]
+)
+
+# [queries, seconds] for the request being served in this context, if any.
+_request_queries = contextvars.ContextVar("request_queries", default=None)
+
+
+def _count_query(execute, sql, params, many, context):
+    totals = _request_queries.get()
+    if totals is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        totals[0] += 1
+        totals[1] += time.perf_counter() - started
+
+
+def _install_query_counter(connection, **kwargs):
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+connection_created.connect(_install_query_counter)
+
+
+def view_label(request):
+    match = getattr(request, "resolver_match", None)
+    return match.view_name if match is not None else "<unresolved>"
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token, started = self._start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            totals = self._finish(request, token)
+        self._observe(request, response, started, totals)
+        return response
+
+    async def __acall__(self, request):
+        token, started = self._start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            totals = self._finish(request, token)
+        self._observe(request, response, started, totals)
+        return response
+
+    def _start(self, request):
+        # Connections opened before this module was imported missed the signal.
+        for connection in connections.all(initialized_only=True):
+            _install_query_counter(connection)
+        REQUESTS_IN_PROGRESS.labels(request.method).inc()
+        return _request_queries.set([0, 0.0]), time.perf_counter()
+
+    def _finish(self, request, token):
+        REQUESTS_IN_PROGRESS.labels(request.method).dec()
+        totals = _request_queries.get()
+        _request_queries.reset(token)
+        return totals
+
+    def _observe(self, request, response, started, totals):
+        view = view_label(request)
+        REQUEST_DURATION.labels(view, request.method, response.status_code).observe(time.perf_counter() - started)
+        DB_QUERIES.labels(view).observe(totals[0])
+        DB_QUERY_DURATION.labels(view).observe(totals[1])
+
+
+def metrics_registry():
+    if not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def metrics_view(request):
+    """Every metric of this process, or of all workers in multiprocess mode."""
+    return HttpResponse(generate_latest(metrics_registry()), content_type=CONTENT_TYPE_LATEST)
+
+
+class GeoEstimateTimer:
+    """Times one fare estimate; set ``source`` once it is known (default: the estimator)."""
+
+    def __init__(self):
+        self.source = "estimator"
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        outcome = "ok" if exc_type is None else "error"
+        GEO_ESTIMATE_DURATION.labels(self.source, outcome).observe(time.perf_counter() - self.started)
+        if exc_type is not None:
+            GEO_ESTIMATE_ERRORS.labels(exc_type.__name__).inc()
+        return False
+
+
+# Start times of the tasks this worker process is running, by task id.
+_task_started = {}
+
+
+def _stamp_task(headers=None, **kwargs):
+    # Custom headers reach the worker as attributes of task.request.
+    if headers is not None:
+        headers.setdefault("published_at", time.time())
+
+
+def _task_prerun(task_id=None, task=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+    published_at = getattr(task.request, "published_at", None)
+    # Retries keep the original stamp; only the first delivery measures queueing.
+    if published_at is not None and not task.request.retries:
+        TASK_QUEUE_WAIT.labels(task.name).observe(max(0.0, time.time() - published_at))
+
+
+def _task_postrun(task_id=None, task=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        TASK_DURATION.labels(task.name, state or "UNKNOWN").observe(time.perf_counter() - started)
+
+
+def _serve_worker_metrics(**kwargs):
+    """Expose the worker's metrics on CELERY_METRICS_PORT, if set.
+
+    Prefork pool processes write to PROMETHEUS_MULTIPROC_DIR; this runs in the
+    parent, which reads them all.
+    """
+    port = os.getenv("CELERY_METRICS_PORT")
+    if port:
+        from prometheus_client import start_http_server
+
+        start_http_server(int(port), registry=metrics_registry())
+
+
+def _mark_worker_process_dead(pid=None, **kwargs):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid or os.getpid())
+
+
+def connect_task_signals():
+    """Hook the task metrics into Celery; passenger.tasks calls this on import."""
+    from celery import signals
+
+    for signal, receiver in [
+        (signals.before_task_publish, _stamp_task),
+        (signals.task_prerun, _task_prerun),
+        (signals.task_postrun, _task_postrun),
+        (signals.worker_ready, _serve_worker_metrics),
+        (signals.worker_process_shutdown, _mark_worker_process_dead),
+    ]:
+        signal.connect(receiver, weak=False, dispatch_uid=f"passenger.metrics.{receiver.__name__}")
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.1 on 2026-10-18 09:17
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passenger', '0004_passenger_created_at_passenger_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Ride',
+            fields=[
+                ('ride_id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('pickup_latitude', models.FloatField()),
+                ('pickup_longitude', models.FloatField()),
+                ('dropoff_latitude', models.FloatField()),
+                ('dropoff_longitude', models.FloatField()),
+                ('pickup_geohash', models.CharField(max_length=12)),
+                ('dropoff_geohash', models.CharField(max_length=12)),
+                ('ride_type', models.CharField(choices=[('standard', 'Standard'), ('premium', 'Premium')], max_length=20)),
+                ('estimated_fare', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('distance_km', models.FloatField()),
+                ('status', models.CharField(choices=[('requested', 'Requested'), ('accepted', 'Accepted'), ('in_progress', 'In progress'), ('completed', 'Completed'), ('cancelled', 'Cancelled')], default='requested', max_length=20)),
+                ('requested_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('passenger', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='rides', to='passenger.passenger')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['passenger', '-requested_at'], name='ride_passenger_requested_idx'), models.Index(fields=['status'], name='ride_status_idx'), models.Index(fields=['pickup_geohash'], name='ride_pickup_geohash_idx')],
+            },
+        ),
+    ]
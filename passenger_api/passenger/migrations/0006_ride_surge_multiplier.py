@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 09:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passenger', '0005_ride'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ride',
+            name='surge_multiplier',
+            field=models.DecimalField(decimal_places=2, default=1, max_digits=4),
+        ),
+    ]
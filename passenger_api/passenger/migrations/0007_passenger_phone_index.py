@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 09:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passenger', '0006_ride_surge_multiplier'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='passenger',
+            name='phone',
+            field=models.CharField(db_index=True, max_length=15),
+        ),
+    ]
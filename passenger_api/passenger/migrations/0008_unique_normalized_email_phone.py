@@ -0,0 +1,55 @@
+# Generated by Django 5.1.1 on 2026-10-18 09:38
+
+from django.db import migrations, models
+
+
+PHONE_SEPARATORS = str.maketrans("", "", " -().")
+
+
+def normalize_contacts(apps, schema_editor):
+    """Store emails and phones normalised, so the unique constraints apply to the canonical values."""
+    Passenger = apps.get_model('passenger', 'Passenger')
+    seen = {"email": {}, "phone": {}}
+    clashes = []
+    for row in Passenger.objects.using(schema_editor.connection.alias).order_by('pk').iterator():
+        email = row.email.strip().lower()
+        phone = row.phone.strip().translate(PHONE_SEPARATORS)
+        if phone.startswith("00"):
+            phone = "+" + phone[2:]
+        for field, value in (("email", email), ("phone", phone)):
+            first = seen[field].setdefault(value, row.pk)
+            if first != row.pk:
+                clashes.append(f"{field} {value!r}: passenger ids {first} and {row.pk}")
+        if (email, phone) != (row.email, row.phone):
+            Passenger.objects.using(schema_editor.connection.alias).filter(pk=row.pk).update(email=email, phone=phone)
+    if clashes:
+        raise RuntimeError("Merge or remove these duplicate accounts, then migrate again:\n" + "\n".join(clashes))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passenger', '0007_passenger_phone_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_contacts, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='passenger',
+            name='email',
+            field=models.EmailField(max_length=254),
+        ),
+        migrations.AlterField(
+            model_name='passenger',
+            name='phone',
+            field=models.CharField(max_length=15),
+        ),
+        migrations.AddConstraint(
+            model_name='passenger',
+            constraint=models.UniqueConstraint(fields=('email',), name='passenger_unique_email'),
+        ),
+        migrations.AddConstraint(
+            model_name='passenger',
+            constraint=models.UniqueConstraint(fields=('phone',), name='passenger_unique_phone'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.1 on 2026-10-18 09:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passenger', '0008_unique_normalized_email_phone'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='passenger',
+            index=models.Index(fields=['created_at', 'passenger_id'], include=('email', 'phone', 'first_name', 'last_name', 'updated_at'), name='passenger_created_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.1 on 2026-10-18 10:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passenger', '0009_passenger_created_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShardSlot',
+            fields=[
+                ('slot', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('alias', models.CharField(max_length=64)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PassengerKey',
+            fields=[
+                ('passenger_id', models.AutoField(primary_key=True, serialize=False)),
+                ('email', models.EmailField(max_length=254)),
+                ('phone', models.CharField(max_length=15)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('email',), name='passengerkey_unique_email'), models.UniqueConstraint(fields=('phone',), name='passengerkey_unique_phone')],
+            },
+        ),
+    ]
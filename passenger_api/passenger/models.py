@@ -1,10 +1,99 @@
+import uuid
+
 from django.db import models
+from django.utils import timezone
 
 class Passenger(models.Model):
     passenger_id =models.AutoField(primary_key=True)
-    email = models.EmailField(unique=True)
+    # Stored normalised (see accounts.py); unique via the constraints below.
+    email = models.EmailField()
     phone = models.CharField(max_length=15)
     first_name = models.CharField(max_length=50)
     last_name = models.CharField(max_length=50)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["email"], name="passenger_unique_email"),
+            models.UniqueConstraint(fields=["phone"], name="passenger_unique_phone"),
+        ]
+        indexes = [
+            # Keyset pagination (see pagination.py). The included columns make
+            # listings index-only on PostgreSQL; SQLite ignores them.
+            models.Index(
+                fields=["created_at", "passenger_id"], name="passenger_created_idx",
+                include=["email", "phone", "first_name", "last_name", "updated_at"],
+            ),
+        ]
+
+
+class Ride(models.Model):
+    STATUS_REQUESTED = "requested"
+    STATUS_ACCEPTED = "accepted"
+    STATUS_IN_PROGRESS = "in_progress"
+    STATUS_COMPLETED = "completed"
+    STATUS_CANCELLED = "cancelled"
+    STATUS_CHOICES = [
+        (STATUS_REQUESTED, "Requested"),
+        (STATUS_ACCEPTED, "Accepted"),
+        (STATUS_IN_PROGRESS, "In progress"),
+        (STATUS_COMPLETED, "Completed"),
+        (STATUS_CANCELLED, "Cancelled"),
+    ]
+    RIDE_TYPE_CHOICES = [
+        ("standard", "Standard"),
+        ("premium", "Premium"),
+    ]
+
+    ride_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    # Indexed together with requested_at below, for ride history.
+    passenger = models.ForeignKey(
+        Passenger, null=True, blank=True, on_delete=models.SET_NULL, related_name="rides", db_index=False
+    )
+    pickup_latitude = models.FloatField()
+    pickup_longitude = models.FloatField()
+    dropoff_latitude = models.FloatField()
+    dropoff_longitude = models.FloatField()
+    pickup_geohash = models.CharField(max_length=12)
+    dropoff_geohash = models.CharField(max_length=12)
+    ride_type = models.CharField(max_length=20, choices=RIDE_TYPE_CHOICES)
+    # Already applied to estimated_fare; kept to explain the price later.
+    surge_multiplier = models.DecimalField(max_digits=4, decimal_places=2, default=1)
+    estimated_fare = models.DecimalField(max_digits=10, decimal_places=2)
+    distance_km = models.FloatField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_REQUESTED)
+    requested_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["passenger", "-requested_at"], name="ride_passenger_requested_idx"),
+            models.Index(fields=["status"], name="ride_status_idx"),
+            models.Index(fields=["pickup_geohash"], name="ride_pickup_geohash_idx"),
+        ]
+
+
+class PassengerKey(models.Model):
+    """Directory entry of a passenger when passenger data is sharded (see sharding.py).
+
+    Lives on default only. Its AutoField hands out passenger ids for every
+    shard, and its unique email and phone keep those unique across shards.
+    """
+    passenger_id = models.AutoField(primary_key=True)
+    email = models.EmailField()
+    phone = models.CharField(max_length=15)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["email"], name="passengerkey_unique_email"),
+            models.UniqueConstraint(fields=["phone"], name="passengerkey_unique_phone"),
+        ]
+
+
+class ShardSlot(models.Model):
+    """Which database alias holds one slot of passenger data (see sharding.py)."""
+    slot = models.PositiveIntegerField(primary_key=True)
+    alias = models.CharField(max_length=64)
+    updated_at = models.DateTimeField(auto_now=True)
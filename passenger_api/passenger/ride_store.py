@@ -0,0 +1,275 @@
+"""Persistence for booked rides.
+
+How a booking reaches the database is chosen by RIDE_WRITE_MODE:
+
+``sync``
+    The ride is INSERTed before the booking view responds. A 201 means the
+    row is committed.
+
+``write_behind`` (default)
+    The ride is appended to an in-process buffer and the view responds
+    straight away. A background thread writes the buffer with one
+    ``bulk_create`` (per shard, see sharding.py) every
+    RIDE_WRITE_FLUSH_INTERVAL seconds, or sooner once
+    RIDE_WRITE_BATCH_SIZE rides are pending. A 201 means the ride was
+    accepted by this worker, not that it is committed:
+
+    - a clean shutdown (SIGTERM, worker recycling) flushes the buffer;
+    - a hard crash (SIGKILL, OOM kill, host loss) loses the rides still
+      pending, i.e. roughly one flush interval of this worker's bookings
+      and never more than RIDE_WRITE_MAX_PENDING;
+    - rows the database rejects (IntegrityError or DataError, e.g. the
+      passenger was deleted in the meantime) are logged with their ride_id
+      and dropped;
+    - if the database cannot be reached (OperationalError, InterfaceError),
+      the unwritten rides go back to the front of the buffer and the next
+      flush waits, doubling from RIDE_WRITE_FLUSH_INTERVAL up to
+      MAX_RETRY_BACKOFF seconds. Past RIDE_WRITE_MAX_PENDING, the oldest
+      rides are dropped, so an outage cannot grow the buffer without bound.
+
+    If the database falls behind and RIDE_WRITE_MAX_PENDING rides pile up,
+    the booking that hits the limit flushes inline, so memory stays bounded
+    and back-pressure reaches the clients instead of the buffer growing.
+"""
+import atexit
+import logging
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, DataError, IntegrityError, InterfaceError, close_old_connections, transaction
+
+from . import sharding
+from .models import Ride
+
+logger = logging.getLogger('passenger')
+
+MAX_RETRY_BACKOFF = 30.0  # seconds between flushes while the database is unreachable
+# Errors that condemn a row; any other database error means the database itself is unavailable.
+ROW_ERRORS = (IntegrityError, DataError)
+
+
+def build_ride(ride_request_data, passenger_id=None):
+    """Build an unsaved Ride from the booking view's ride_request_data."""
+    return Ride(
+        ride_id=ride_request_data["ride_id"],
+        passenger_id=passenger_id,
+        pickup_latitude=ride_request_data["pickup_location"]["latitude"],
+        pickup_longitude=ride_request_data["pickup_location"]["longitude"],
+        dropoff_latitude=ride_request_data["dropoff_location"]["latitude"],
+        dropoff_longitude=ride_request_data["dropoff_location"]["longitude"],
+        pickup_geohash=ride_request_data["pickup_geohash"],
+        dropoff_geohash=ride_request_data["dropoff_geohash"],
+        ride_type=ride_request_data["ride_type"],
+        estimated_fare=round(ride_request_data["estimated_fare"], 2),
+        surge_multiplier=round(ride_request_data.get("surge_multiplier", 1.0), 2),
+        distance_km=ride_request_data["distance_km"],
+    )
+
+
+class RideWriteBuffer:
+    """Accumulates new rides and writes them in batches.
+
+    ``add`` only takes a lock and appends, so it is safe to call from async
+    views. It returns True when RIDE_WRITE_MAX_PENDING is reached and the
+    caller should ``flush()`` itself. Set ``background=False`` to drive
+    flushing by hand (tests, scripts).
+    """
+
+    def __init__(self, batch_size=500, flush_interval=1.0, max_pending=10000, background=True):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.background = background
+        self._pending = []
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+        self._atexit_registered = False
+        self._failures = 0
+        self._counters = {"buffered": 0, "written": 0, "dropped": 0, "requeued": 0, "flushes": 0}
+
+    def add(self, ride):
+        if self.background:
+            self._ensure_started()
+        with self._cond:
+            self._pending.append(ride)
+            self._counters["buffered"] += 1
+            pending = len(self._pending)
+            # While the database is down, the flusher keeps to its backoff.
+            if pending >= self.batch_size and not self._failures:
+                self._cond.notify()
+        if pending >= self.max_pending:
+            logger.warning("Ride buffer holds %d rides; flushing inline.", pending)
+            return True
+        return False
+
+    def flush(self):
+        """Write every pending ride now. Returns the number written."""
+        with self._flush_lock:
+            with self._cond:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            return self._write(batch)
+
+    def _write(self, batch):
+        close_old_connections()
+        written, retry = 0, []
+        try:
+            for using, rides in sharding.group_rides(batch).items():
+                shard_written, shard_retry = self._write_to(using, rides)
+                written += shard_written
+                retry.extend(shard_retry)
+        finally:
+            close_old_connections()
+
+        with self._cond:
+            self._counters["written"] += written
+            self._counters["dropped"] += len(batch) - written - len(retry)
+            self._counters["flushes"] += 1
+            if retry:
+                self._requeue(retry)
+            else:
+                self._failures = 0
+        return written
+
+    def _requeue(self, rides):
+        """Put `rides` back in front of the pending ones; call with self._cond held."""
+        self._failures += 1
+        self._counters["requeued"] += len(rides)
+        self._pending[:0] = rides
+        overflow = len(self._pending) - self.max_pending
+        if overflow > 0:
+            lost, self._pending = self._pending[:overflow], self._pending[overflow:]
+            self._counters["dropped"] += overflow
+            logger.error("Ride buffer full while the database is unavailable; dropping rides %s",
+                         [str(ride.ride_id) for ride in lost])
+
+    def _backoff(self):
+        return min(self.flush_interval * 2 ** self._failures, MAX_RETRY_BACKOFF)
+
+    def _write_to(self, using, rides):
+        """Write `rides` to one database. Returns (number written, rides to retry later)."""
+        try:
+            with transaction.atomic(using=using):
+                Ride.objects.using(using).bulk_create(rides, batch_size=self.batch_size)
+            return len(rides), []
+        except ROW_ERRORS as e:
+            # One bad row fails the whole INSERT; retry row by row so only it is lost.
+            logger.warning("Bulk insert of %d rides failed (%s); retrying one by one.", len(rides), e)
+        except (DatabaseError, InterfaceError) as e:
+            logger.warning("Database %s unavailable (%s); keeping %d rides for the next flush.", using, e, len(rides))
+            return 0, rides
+        written = 0
+        for i, ride in enumerate(rides):
+            try:
+                with transaction.atomic(using=using):
+                    ride.save(using=using, force_insert=True)
+                written += 1
+            except ROW_ERRORS as row_error:
+                logger.error("Dropping ride %s: %s", ride.ride_id, row_error)
+            except (DatabaseError, InterfaceError) as e:
+                logger.warning("Database %s unavailable (%s); keeping %d rides for the next flush.",
+                               using, e, len(rides) - i)
+                return written, rides[i:]
+        return written, []
+
+    def _ensure_started(self):
+        # A thread started before a fork does not survive in the child.
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="ride-write-buffer", daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.stop)
+                self._atexit_registered = True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopping and self._failures:
+                    self._cond.wait(self._backoff())
+                elif not self._stopping and len(self._pending) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                stopping = self._stopping
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Ride buffer flush failed.")
+            if stopping:
+                return
+
+    def stop(self, timeout=10):
+        """Stop the flusher thread after a final flush."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        self.flush()
+        with self._cond:
+            if self._pending:
+                logger.error("Stopping with %d rides unwritten: the database is unavailable.", len(self._pending))
+
+    def stats(self):
+        with self._cond:
+            counters = dict(self._counters)
+            counters["pending"] = len(self._pending)
+        return counters
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_ride_buffer():
+    """Return the process-wide ride buffer, building it on first use."""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = RideWriteBuffer(
+                    batch_size=settings.RIDE_WRITE_BATCH_SIZE,
+                    flush_interval=settings.RIDE_WRITE_FLUSH_INTERVAL,
+                    max_pending=settings.RIDE_WRITE_MAX_PENDING,
+                )
+    return _buffer
+
+
+def reset_ride_buffer():
+    """Flush and drop the cached instance so the next call rebuilds it from settings."""
+    global _buffer
+    with _buffer_lock:
+        buffer, _buffer = _buffer, None
+    if buffer is not None:
+        buffer.stop()
+
+
+def record_ride(ride_request_data, passenger_id=None):
+    """Persist a booked ride according to RIDE_WRITE_MODE."""
+    ride = build_ride(ride_request_data, passenger_id)
+    if settings.RIDE_WRITE_MODE == "sync":
+        ride.save(force_insert=True)
+    else:
+        buffer = get_ride_buffer()
+        if buffer.add(ride):
+            buffer.flush()
+    return ride
+
+
+async def arecord_ride(ride_request_data, passenger_id=None):
+    ride = build_ride(ride_request_data, passenger_id)
+    if settings.RIDE_WRITE_MODE == "sync":
+        await ride.asave(force_insert=True)
+    else:
+        buffer = get_ride_buffer()
+        if buffer.add(ride):
+            await sync_to_async(buffer.flush)()
+    return ride
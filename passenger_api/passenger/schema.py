@@ -0,0 +1,78 @@
+"""OpenAPI schema served from a file generated at build time.
+
+Generating the schema introspects every view and its extend_schema
+block, tens of milliseconds on every request. The Docker build
+runs ``manage.py spectacular --file openapi.yml`` instead. Each process
+reads that file once and serves it from memory with an ETag, so clients
+that already have the schema get a 304 back.
+
+With DEBUG on, the schema is generated live so changes show up without
+a rebuild. With DEBUG off, it is never generated at request time: a
+missing file answers 503 SCHEMA_NOT_BUILT.
+"""
+import hashlib
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.views.decorators.http import require_safe
+
+SCHEMA_CONTENT_TYPE = "application/vnd.oai.openapi; charset=utf-8"
+
+Schema = namedtuple("Schema", ["content", "etag"])
+
+_schema = None
+_schema_lock = threading.Lock()
+_live_view = None
+
+
+def get_schema():
+    """The prebuilt schema, read once per process; None if it was not built."""
+    global _schema
+    if _schema is None:
+        with _schema_lock:
+            if _schema is None:
+                try:
+                    with open(settings.OPENAPI_SCHEMA_FILE, "rb") as schema_file:
+                        content = schema_file.read()
+                except FileNotFoundError:
+                    return None
+                _schema = Schema(content, f'"{hashlib.sha256(content).hexdigest()[:32]}"')
+    return _schema
+
+
+def reset_schema():
+    global _schema
+    with _schema_lock:
+        _schema = None
+
+
+def _live_schema(request):
+    global _live_view
+    if _live_view is None:
+        from drf_spectacular.views import SpectacularAPIView
+
+        _live_view = SpectacularAPIView.as_view()
+    return _live_view(request)
+
+
+@require_safe
+def schema_view(request):
+    if settings.DEBUG:
+        return _live_schema(request)
+
+    schema = get_schema()
+    if schema is None:
+        return JsonResponse({
+            "error": "The API schema has not been built.",
+            "details": f"Run `python manage.py spectacular --file {settings.OPENAPI_SCHEMA_FILE}` when building the image.",
+            "code": "SCHEMA_NOT_BUILT",
+        }, status=503)
+
+    response = HttpResponse(schema.content, content_type=SCHEMA_CONTENT_TYPE)
+    response["ETag"] = schema.etag
+    # Clients revalidate every time; an unchanged schema costs a 304.
+    patch_cache_control(response, public=True, no_cache=True)
+    return get_conditional_response(request, etag=schema.etag, response=response)
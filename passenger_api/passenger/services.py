@@ -1,30 +1,571 @@
-import requests
+import asyncio
+import random
+import threading
+import time
+import weakref
+
 from django.conf import settings
 
+from . import estimation
+from .metrics import ADMISSION_REJECTED, GEO_ESTIMATE_CONCURRENCY_LIMIT, GEO_ESTIMATES_IN_FLIGHT, GeoEstimateTimer
+from .estimate_cache import get_estimate_cache
+
 
 class NodeAPIError(Exception):
     pass
 
-def get_fare_and_hashed_location(ride_request_data):
-    try:
-        payload = {
-            "pickup_location": ride_request_data['pickup_location'],
-            "dropoff_location": ride_request_data['dropoff_location'],
-            "ride_type": ride_request_data['ride_type'],
-        }
-        url = settings.GEOES_NODE_API_URL
-        headers = {"Content-Type": "application/json"}
-        response = requests.post(
-            url,
-            headers=headers,
-            json=payload
+
+class CircuitOpenError(NodeAPIError):
+    """Raised without touching the network while the estimator circuit is open."""
+    pass
+
+
+class UpstreamBusyError(NodeAPIError):
+    """Raised when this process already has as many estimator calls running as allowed."""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# Only gateway-style failures are worth another attempt; a 500 from the
+# estimator is a deterministic error for that payload (e.g. zero distance).
+RETRYABLE_STATUS_CODES = {502, 503, 504}
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failed calls and lets a
+    single probe through once `reset_timeout` seconds have passed."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return self.CLOSED
+            if self._probing or time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self.OPEN
+
+    def allow_request(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+
+class ConcurrencyLimiter:
+    """Caps how many calls run at once; a caller waits at most `wait` seconds for a slot.
+
+    When the estimator slows down, requests pile up on it and every worker
+    ends up blocked. With a cap, calls beyond it fail fast (or fall back to
+    in-process estimates) and the workers stay free for everything else.
+    A limit of 0 means no limit.
+    """
+
+    def __init__(self, limit, wait=0.0):
+        self.limit = limit
+        self.wait = wait
+        self._slots = threading.BoundedSemaphore(limit) if limit else None
+        self._lock = threading.Lock()
+        self._counters = {"in_flight": 0, "rejected": 0}
+        GEO_ESTIMATE_CONCURRENCY_LIMIT.set(limit)
+
+    def __enter__(self):
+        if self._slots is not None and not self._slots.acquire(timeout=self.wait):
+            self._reject()
+        self._entered()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._exited()
+        if self._slots is not None:
+            self._slots.release()
+        return False
+
+    def _reject(self):
+        with self._lock:
+            self._counters["rejected"] += 1
+        ADMISSION_REJECTED.labels("upstream_busy").inc()
+        raise UpstreamBusyError(f"{self.limit} geo estimator calls already in flight.")
+
+    def _entered(self):
+        with self._lock:
+            self._counters["in_flight"] += 1
+        GEO_ESTIMATES_IN_FLIGHT.inc()
+
+    def _exited(self):
+        GEO_ESTIMATES_IN_FLIGHT.dec()
+        with self._lock:
+            self._counters["in_flight"] -= 1
+
+    def stats(self):
+        with self._lock:
+            return {"limit": self.limit, **self._counters}
+
+
+class AsyncConcurrencyLimiter(ConcurrencyLimiter):
+    """ConcurrencyLimiter for coroutines: ``async with`` waits on the event loop, not a thread."""
+
+    def __init__(self, limit, wait=0.0):
+        super().__init__(limit, wait)
+        self._slots = asyncio.BoundedSemaphore(limit) if limit else None
+
+    async def __aenter__(self):
+        if self._slots is not None:
+            if self._slots.locked():
+                if not self.wait:
+                    self._reject()
+                try:
+                    await asyncio.wait_for(self._slots.acquire(), self.wait)
+                except asyncio.TimeoutError:
+                    self._reject()
+            else:
+                await self._slots.acquire()
+        self._entered()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+class GeoEstimatorClient:
+    """Pooled HTTP client for the Node.js geo estimator.
+
+    Connections are kept alive in a per-process pool, every call is bounded by
+    a deadline, gateway errors and connection failures are retried with full
+    jitter backoff while the deadline allows, and a circuit breaker fails fast
+    once the estimator looks unhealthy.
+    """
+
+    def __init__(self, url, connect_timeout=0.5, read_timeout=2.0, deadline=3.0,
+                 max_retries=2, backoff_base=0.05, backoff_max=0.5, pool_maxsize=20,
+                 breaker=None):
+        self.url = url
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker(failure_threshold=5, reset_timeout=30)
+
+        # Imported on first use; requests is a noticeable share of cold start.
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self._network_errors = (requests.ConnectionError, requests.Timeout)
+        self._request_errors = requests.RequestException
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def estimate(self, payload, deadline=None):
+        if not self.breaker.allow_request():
+            raise CircuitOpenError("Geo estimator is unavailable (circuit open).")
+
+        deadline_at = time.monotonic() + (deadline if deadline is not None else self.deadline)
+        attempt = 0
+        while True:
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                self.breaker.record_failure()
+                raise NodeAPIError("Geo estimator deadline exceeded.")
+
+            retryable = True
+            try:
+                response = self.session.post(
+                    self.url,
+                    json=payload,
+                    timeout=(min(self.connect_timeout, remaining), min(self.read_timeout, remaining)),
+                )
+            except self._network_errors as e:
+                error = NodeAPIError(f"Error communicating with Node.js API: {e}")
+            except self._request_errors as e:
+                # A truncated or undecodable body, or a bad GEOES_NODE_API_URL:
+                # a failure like any other, but not worth another attempt.
+                error = NodeAPIError(f"Error communicating with Node.js API: {e}")
+                retryable = False
+            else:
+                if response.status_code == 200:
+                    try:
+                        res = response.json()
+                    except ValueError as e:
+                        self.breaker.record_failure()
+                        raise NodeAPIError(f"Invalid response from Node.js API: {e}")
+                    self.breaker.record_success()
+                    return res
+
+                error = NodeAPIError(f"Node.js API error: {response.status_code}, {response.text}")
+                retryable = response.status_code in RETRYABLE_STATUS_CODES
+                if response.status_code < 500:
+                    # The estimator answered; the request itself was bad.
+                    self.breaker.record_success()
+                    raise error
+
+            attempt += 1
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+            if not retryable or attempt > self.max_retries or time.monotonic() + delay >= deadline_at:
+                self.breaker.record_failure()
+                raise error
+            time.sleep(delay)
+
+
+class AsyncGeoEstimatorClient:
+    """asyncio counterpart of GeoEstimatorClient for the ASGI booking path.
+
+    Same deadline, retry and circuit breaker semantics, on an aiohttp
+    connection pool (its connector stays cheap with hundreds of pooled
+    connections). An instance is bound to the event loop it is used on.
+    """
+
+    def __init__(self, url, connect_timeout=0.5, read_timeout=2.0, deadline=3.0,
+                 max_retries=2, backoff_base=0.05, backoff_max=0.5, max_connections=100,
+                 breaker=None):
+        self.url = url
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_connections = max_connections
+        self.breaker = breaker or CircuitBreaker(failure_threshold=5, reset_timeout=30)
+        self._session = None
+
+    @property
+    def session(self):
+        # aiohttp sessions must be created inside the loop that uses them.
+        if self._session is None:
+            import aiohttp
+
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                headers={"Content-Type": "application/json"},
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def estimate(self, payload, deadline=None):
+        import aiohttp  # first use only; see GeoEstimatorClient
+
+        if not self.breaker.allow_request():
+            raise CircuitOpenError("Geo estimator is unavailable (circuit open).")
+
+        deadline_at = time.monotonic() + (deadline if deadline is not None else self.deadline)
+        attempt = 0
+        while True:
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                self.breaker.record_failure()
+                raise NodeAPIError("Geo estimator deadline exceeded.")
+
+            retryable = True
+            timeout = aiohttp.ClientTimeout(
+                total=remaining,
+                sock_connect=min(self.connect_timeout, remaining),
+                sock_read=min(self.read_timeout, remaining),
+            )
+            try:
+                async with self.session.post(self.url, json=payload, timeout=timeout) as response:
+                    status_code = response.status
+                    if status_code == 200:
+                        try:
+                            res = await response.json(content_type=None)
+                        except ValueError as e:
+                            self.breaker.record_failure()
+                            raise NodeAPIError(f"Invalid response from Node.js API: {e}")
+                        self.breaker.record_success()
+                        return res
+                    text = await response.text()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = NodeAPIError(f"Error communicating with Node.js API: {e!r}")
+            else:
+                error = NodeAPIError(f"Node.js API error: {status_code}, {text}")
+                retryable = status_code in RETRYABLE_STATUS_CODES
+                if status_code < 500:
+                    self.breaker.record_success()
+                    raise error
+
+            attempt += 1
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+            if not retryable or attempt > self.max_retries or time.monotonic() + delay >= deadline_at:
+                self.breaker.record_failure()
+                raise error
+            await asyncio.sleep(delay)
+
+
+_client = None
+_client_lock = threading.Lock()
+_breaker = None
+_limiter = None
+_async_clients = weakref.WeakKeyDictionary()
+_async_limiters = weakref.WeakKeyDictionary()
+
+
+def get_circuit_breaker():
+    """The estimator breaker, shared by the sync and async clients."""
+    global _breaker
+    if _breaker is None:
+        with _client_lock:
+            if _breaker is None:
+                _breaker = CircuitBreaker(
+                    failure_threshold=settings.GEOES_CIRCUIT_FAILURE_THRESHOLD,
+                    reset_timeout=settings.GEOES_CIRCUIT_RESET_TIMEOUT,
+                )
+    return _breaker
+
+
+def get_upstream_limiter():
+    """The process-wide cap on concurrent estimator calls (GEOES_MAX_CONCURRENCY)."""
+    global _limiter
+    if _limiter is None:
+        with _client_lock:
+            if _limiter is None:
+                _limiter = ConcurrencyLimiter(settings.GEOES_MAX_CONCURRENCY, settings.GEOES_CONCURRENCY_WAIT)
+    return _limiter
+
+
+def get_async_upstream_limiter():
+    """The cap on concurrent estimator calls from the running event loop (GEOES_MAX_CONCURRENCY).
+
+    Separate from get_upstream_limiter(): asyncio and threads cannot wait on
+    the same semaphore. An ASGI worker runs one loop, so this is its cap.
+    """
+    loop = asyncio.get_running_loop()
+    limiter = _async_limiters.get(loop)
+    if limiter is None:
+        limiter = _async_limiters[loop] = AsyncConcurrencyLimiter(
+            settings.GEOES_MAX_CONCURRENCY, settings.GEOES_CONCURRENCY_WAIT
+        )
+    return limiter
+
+
+def get_geo_estimator_client():
+    """Return the process-wide estimator client, building it on first use."""
+    global _client
+    if _client is None:
+        breaker = get_circuit_breaker()
+        with _client_lock:
+            if _client is None:
+                _client = GeoEstimatorClient(
+                    url=settings.GEOES_NODE_API_URL,
+                    connect_timeout=settings.GEOES_CONNECT_TIMEOUT,
+                    read_timeout=settings.GEOES_READ_TIMEOUT,
+                    deadline=settings.GEOES_DEADLINE,
+                    max_retries=settings.GEOES_MAX_RETRIES,
+                    backoff_base=settings.GEOES_RETRY_BACKOFF,
+                    backoff_max=settings.GEOES_RETRY_BACKOFF_MAX,
+                    pool_maxsize=settings.GEOES_POOL_MAXSIZE,
+                    breaker=breaker,
+                )
+    return _client
+
+
+def get_async_geo_estimator_client():
+    """Return the estimator client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncGeoEstimatorClient(
+            url=settings.GEOES_NODE_API_URL,
+            connect_timeout=settings.GEOES_CONNECT_TIMEOUT,
+            read_timeout=settings.GEOES_READ_TIMEOUT,
+            deadline=settings.GEOES_DEADLINE,
+            max_retries=settings.GEOES_MAX_RETRIES,
+            backoff_base=settings.GEOES_RETRY_BACKOFF,
+            backoff_max=settings.GEOES_RETRY_BACKOFF_MAX,
+            max_connections=settings.GEOES_ASYNC_MAX_CONNECTIONS,
+            breaker=get_circuit_breaker(),
         )
+    return client
+
+
+def reset_geo_estimator_client():
+    """Drop the cached clients so the next call rebuilds them from settings."""
+    global _client, _breaker, _limiter
+    with _client_lock:
+        if _client is not None:
+            _client.session.close()
+        _client = None
+        _breaker = None
+        _limiter = None
+        _async_clients.clear()
+        _async_limiters.clear()
+
+
+FALLBACK_SOURCE = "fallback"
 
-        if response.status_code == 200:
-            res = response.json()
+
+def fallback_estimate(payload):
+    """An in-process estimate standing in for the estimator, marked with ``"source": "fallback"``."""
+    res = estimation.estimate(payload["pickup_location"], payload["dropoff_location"], payload["ride_type"])
+    res["source"] = FALLBACK_SOURCE
+    return res
+
+
+def is_fallback(estimate):
+    return bool(estimate) and estimate.get("source") == FALLBACK_SOURCE
+
+
+def estimate_ride(payload):
+    """Resolve an estimate according to GEO_ESTIMATION_MODE.
+
+    'remote' calls the Node service only, 'local' computes in-process only,
+    and 'fallback' calls the Node service and computes in-process when it is
+    unavailable or already has GEOES_MAX_CONCURRENCY calls from this process.
+    Those local stand-ins are marked, see fallback_estimate.
+    """
+    mode = settings.GEO_ESTIMATION_MODE
+    if mode == "local":
+        return estimation.estimate(payload["pickup_location"], payload["dropoff_location"], payload["ride_type"])
+    try:
+        with get_upstream_limiter():
+            return get_geo_estimator_client().estimate(payload)
+    except NodeAPIError:
+        if mode != "fallback":
+            raise
+        return fallback_estimate(payload)
+
+
+async def aestimate_ride(payload):
+    """Async version of estimate_ride."""
+    mode = settings.GEO_ESTIMATION_MODE
+    if mode == "local":
+        return estimation.estimate(payload["pickup_location"], payload["dropoff_location"], payload["ride_type"])
+    try:
+        async with get_async_upstream_limiter():
+            return await get_async_geo_estimator_client().estimate(payload)
+    except NodeAPIError:
+        if mode != "fallback":
+            raise
+        return fallback_estimate(payload)
+
+
+def get_fare_and_hashed_location(ride_request_data):
+    payload = {
+        "pickup_location": ride_request_data['pickup_location'],
+        "dropoff_location": ride_request_data['dropoff_location'],
+        "ride_type": ride_request_data['ride_type'],
+    }
+    with GeoEstimateTimer() as timer:
+        if settings.GEO_ESTIMATION_MODE == "local":
+            timer.source = "local"
+        # In-process estimates are cheaper than the cache key itself.
+        if not settings.ESTIMATE_CACHE_ENABLED or settings.GEO_ESTIMATION_MODE == "local":
+            res = estimate_ride(payload)
+            if is_fallback(res):
+                timer.source = FALLBACK_SOURCE
+            return res
+
+        cache = get_estimate_cache()
+        key = cache.make_key(payload["pickup_location"], payload["dropoff_location"], payload["ride_type"])
+        res = cache.get(key)
+        if res is None:
+            res = estimate_ride(payload)
+            # Not cached, so later hits are never degraded answers in disguise.
+            if is_fallback(res):
+                timer.source = FALLBACK_SOURCE
+            else:
+                cache.set(key, res)
+        else:
+            timer.source = "cache"
+        return res
+
+
+async def aget_fare_and_hashed_location(ride_request_data):
+    """Async version of get_fare_and_hashed_location for the ASGI booking view."""
+    payload = {
+        "pickup_location": ride_request_data['pickup_location'],
+        "dropoff_location": ride_request_data['dropoff_location'],
+        "ride_type": ride_request_data['ride_type'],
+    }
+    with GeoEstimateTimer() as timer:
+        if settings.GEO_ESTIMATION_MODE == "local":
+            timer.source = "local"
+        if not settings.ESTIMATE_CACHE_ENABLED or settings.GEO_ESTIMATION_MODE == "local":
+            res = await aestimate_ride(payload)
+            if is_fallback(res):
+                timer.source = FALLBACK_SOURCE
             return res
+
+        cache = get_estimate_cache()
+        key = cache.make_key(payload["pickup_location"], payload["dropoff_location"], payload["ride_type"])
+        res = await cache.aget(key)
+        if res is None:
+            res = await aestimate_ride(payload)
+            if is_fallback(res):
+                timer.source = FALLBACK_SOURCE
+            else:
+                await cache.aset(key, res)
         else:
-            raise Exception(f"Node.js API error: {response.status_code}, {response.text}")
-    except:
-        # raise Exception(f"Node.js API error: {response.status_code}, {response.text}")
-        raise NodeAPIError(f"Error communicating with Node.js API: {e}")
+            timer.source = "cache"
+        return res
+
+
+def estimate_rides_batch(trips):
+    """Estimate validated trips in one vectorised pass.
+
+    Identical trips are computed once. Returns one entry per input trip: the
+    estimate data, or an EstimationError for trips that cannot be priced.
+    The batch path always computes in-process; see passenger.estimation for
+    how it is kept in line with the Node service.
+    """
+    unique = {}
+    order = []
+    for trip in trips:
+        key = (
+            trip["pickup_location"]["latitude"], trip["pickup_location"]["longitude"],
+            trip["dropoff_location"]["latitude"], trip["dropoff_location"]["longitude"],
+            trip["ride_type"],
+        )
+        order.append(unique.setdefault(key, len(unique)))
+    if not unique:
+        return []
+
+    result = estimation.estimate_batch(*zip(*unique))
+    resolved = []
+    for i, error in enumerate(result["errors"]):
+        if error:
+            resolved.append(estimation.EstimationError(error))
+            continue
+        resolved.append({
+            "pickup_geohash": str(result["pickup_geohash"][i]),
+            "dropoff_geohash": str(result["dropoff_geohash"][i]),
+            "distance_km": float(result["distance_km"][i]),
+            "estimated_fare": float(result["estimated_fare"][i]),
+        })
+    return [resolved[i] for i in order]
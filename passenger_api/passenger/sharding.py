@@ -0,0 +1,398 @@
+"""Horizontal sharding of passenger and ride data.
+
+Passengers fall into SLOT_COUNT slots by ``passenger_id % SLOT_COUNT``. The
+ShardSlot table on default maps every slot to the database alias that holds
+it. A passenger's rides live with the passenger. A ride booked without a
+passenger lives in the slot of its pickup region: the first
+REGION_PRECISION characters of its pickup geohash. Moving a shard's load
+means moving slots (``manage.py shard_passengers rebalance``), so adding a
+shard copies only the rows it takes over, not every row.
+
+Ids must be unique across shards, and so must emails and phones. Default
+therefore keeps a directory of them (PassengerKey). ``create_passenger``
+inserts there first, which allocates the id and rejects a duplicate, then
+inserts the passenger on its shard.
+
+ShardRouter sends the queries of a Passenger or Ride instance, and of its
+related managers, to the instance's shard. Queries not tied to an instance
+name their shard with ``passengers_for()``, or run on every shard with
+``fan_out()`` and ``find_ride()``, one shard after another. Shards have no
+replicas; their reads go to the shard itself.
+
+With PASSENGER_SHARDS empty (the default) none of this applies and both
+tables stay on default.
+"""
+import threading
+import time
+import zlib
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+from django.db.models import Q
+from django.db.models.constants import OnConflict
+from django.db.models.functions import Mod
+from django.utils import timezone
+
+from .accounts import create_account
+
+SLOT_COUNT = 1024
+REGION_PRECISION = 4
+SHARDED_MODELS = ("passenger", "ride")
+DIRECTORY_MODELS = ("passengerkey", "shardslot")
+
+
+def enabled():
+    return bool(settings.PASSENGER_SHARDS)
+
+
+def slot_for_passenger(passenger_id):
+    return int(passenger_id) % SLOT_COUNT
+
+
+def slot_for_region(geohash):
+    return zlib.crc32(geohash[:REGION_PRECISION].encode()) % SLOT_COUNT
+
+
+def slot_for_ride(ride):
+    if ride.passenger_id is not None:
+        return slot_for_passenger(ride.passenger_id)
+    return slot_for_region(ride.pickup_geohash)
+
+
+def even_layout(aliases):
+    """Slot assignments spreading SLOT_COUNT slots over `aliases` in contiguous ranges."""
+    return [aliases[slot * len(aliases) // SLOT_COUNT] for slot in range(SLOT_COUNT)]
+
+
+class ShardMap:
+    """The alias of every slot, read from default and cached for `ttl` seconds.
+
+    A process may route with a stale map for up to `ttl` seconds after a slot
+    moves, which is why ``move_slots`` waits that long before its final copy.
+    """
+
+    def __init__(self, ttl=5.0):
+        self.ttl = ttl
+        self._assignments = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def assignments(self):
+        if self._stale():
+            with self._lock:
+                if self._stale():
+                    self._assignments = self._load()
+                    self._loaded_at = time.monotonic()
+        return self._assignments
+
+    def alias_for(self, slot):
+        return self.assignments()[slot]
+
+    def aliases(self):
+        """Every alias holding at least one slot."""
+        return sorted(set(self.assignments()))
+
+    def _stale(self):
+        return self._assignments is None or time.monotonic() - self._loaded_at >= self.ttl
+
+    def _load(self):
+        from .models import ShardSlot
+
+        rows = dict(ShardSlot.objects.using(DEFAULT_DB_ALIAS).values_list("slot", "alias"))
+        if len(rows) != SLOT_COUNT:
+            raise ImproperlyConfigured(
+                f"The shard map has {len(rows)} of {SLOT_COUNT} slots; run `python manage.py shard_passengers init`."
+            )
+        return tuple(rows[slot] for slot in range(SLOT_COUNT))
+
+
+_shard_map = None
+_shard_map_lock = threading.Lock()
+
+
+def get_shard_map():
+    """Return the process-wide shard map, building it on first use."""
+    global _shard_map
+    if _shard_map is None:
+        with _shard_map_lock:
+            if _shard_map is None:
+                _shard_map = ShardMap(ttl=settings.PASSENGER_SHARD_MAP_TTL)
+    return _shard_map
+
+
+def reset_shard_map():
+    """Drop the cached instance so the next call rebuilds it from settings."""
+    global _shard_map
+    with _shard_map_lock:
+        _shard_map = None
+
+
+def shard_for_passenger(passenger_id):
+    return get_shard_map().alias_for(slot_for_passenger(passenger_id))
+
+
+def shard_for_ride(ride):
+    return get_shard_map().alias_for(slot_for_ride(ride))
+
+
+def passengers_for(passenger_id):
+    """Passenger queryset on the database holding `passenger_id`."""
+    from .models import Passenger
+
+    if not enabled():
+        return Passenger.objects.all()
+    return Passenger.objects.using(shard_for_passenger(passenger_id))
+
+
+async def apassengers_for(passenger_id):
+    if not enabled():
+        return passengers_for(passenger_id)
+    # Looking the shard up may read the shard map, which the ORM only does synchronously.
+    return await sync_to_async(passengers_for)(passenger_id)
+
+
+def passengers_in(passenger_ids):
+    """One Passenger queryset per database holding any of `passenger_ids`."""
+    from .models import Passenger
+
+    if not enabled():
+        return [Passenger.objects.filter(pk__in=passenger_ids)]
+    by_shard = defaultdict(list)
+    for passenger_id in passenger_ids:
+        by_shard[shard_for_passenger(passenger_id)].append(passenger_id)
+    return [Passenger.objects.using(alias).filter(pk__in=ids) for alias, ids in by_shard.items()]
+
+
+def fan_out(queryset):
+    """`queryset` once per shard; just `queryset` when sharding is off."""
+    if not enabled():
+        return [queryset]
+    return [queryset.using(alias) for alias in get_shard_map().aliases()]
+
+
+def find_ride(ride_id):
+    """The ride with `ride_id` on whichever shard has it, or None."""
+    from .models import Ride
+
+    for queryset in fan_out(Ride.objects.filter(ride_id=ride_id)):
+        ride = queryset.first()
+        if ride is not None:
+            return ride
+    return None
+
+
+def group_rides(rides):
+    """{alias: rides} for unsaved rides, by the database each is written to."""
+    from .models import Ride
+
+    if not enabled():
+        return {router.db_for_write(Ride): list(rides)}
+    groups = defaultdict(list)
+    for ride in rides:
+        groups[shard_for_ride(ride)].append(ride)
+    return dict(groups)
+
+
+def create_passenger(**values):
+    """Create a passenger, on its shard when sharding is on.
+
+    A duplicate email or phone raises IntegrityError, as with
+    ``create_account``; with sharding on it is about PassengerKey.
+    """
+    from .models import Passenger, PassengerKey
+
+    if not enabled():
+        return create_account(Passenger, **values)
+    key = create_account(PassengerKey, using=DEFAULT_DB_ALIAS, email=values["email"], phone=values["phone"])
+    try:
+        return create_account(Passenger, using=shard_for_passenger(key.pk), passenger_id=key.pk, **values)
+    except Exception:
+        # Release the email and phone; an id without a passenger is never reused.
+        PassengerKey.objects.using(DEFAULT_DB_ALIAS).filter(pk=key.pk).delete()
+        raise
+
+
+def _instance_shard(instance):
+    if instance._state.db is not None:
+        return instance._state.db
+    if instance._meta.model_name == "ride":
+        return shard_for_ride(instance)
+    if instance.pk is not None:
+        return shard_for_passenger(instance.pk)
+    raise ValueError("A passenger needs an id to be placed on a shard; create it with sharding.create_passenger().")
+
+
+class ShardRouter:
+    """Routes a sharded instance to its shard; everything else falls through."""
+
+    def db_for_read(self, model, **hints):
+        return self._db_for(model, hints.get("instance"))
+
+    def db_for_write(self, model, **hints):
+        return self._db_for(model, hints.get("instance"))
+
+    def _db_for(self, model, instance):
+        if not enabled() or instance is None or model._meta.app_label != "passenger":
+            return None
+        if model._meta.model_name not in SHARDED_MODELS:
+            return None
+        if instance._meta.app_label != "passenger" or instance._meta.model_name not in SHARDED_MODELS:
+            return None
+        return _instance_shard(instance)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if not enabled():
+            return None
+        if all(obj._meta.app_label == "passenger" and obj._meta.model_name in SHARDED_MODELS for obj in (obj1, obj2)):
+            return obj1._state.db == obj2._state.db
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label != "passenger":
+            return None
+        if model_name in DIRECTORY_MODELS:
+            return db == DEFAULT_DB_ALIAS
+        # Every shard gets the passenger and ride tables, whether or not it holds slots yet.
+        return db not in settings.DB_REPLICAS
+
+
+def _passengers_in(slots, alias):
+    from .models import Passenger
+
+    return Passenger.objects.using(alias).annotate(shard_slot=Mod("passenger_id", SLOT_COUNT)).filter(
+        shard_slot__in=slots
+    )
+
+
+def _rides_in(slots, alias):
+    from .models import Ride
+
+    rides = Ride.objects.using(alias)
+    # Anonymous rides are placed by a hash of their pickup region, which SQL cannot compute portably.
+    anonymous = [
+        ride_id
+        for ride_id, geohash in rides.filter(passenger__isnull=True).values_list("ride_id", "pickup_geohash").iterator()
+        if slot_for_region(geohash) in slots
+    ]
+    return rides.annotate(shard_slot=Mod("passenger_id", SLOT_COUNT)).filter(
+        Q(shard_slot__in=slots) | Q(ride_id__in=anonymous)
+    )
+
+
+def _copy(model, queryset, target, batch_size=500):
+    """INSERT every row of `queryset` into `target` as is, skipping rows already there.
+
+    Plain INSERTs rather than bulk_create, which would overwrite the
+    auto_now(_add) timestamps.
+    """
+    connection = connections[target]
+    ops = connection.ops
+    fields = model._meta.concrete_fields
+    columns = ", ".join(ops.quote_name(field.column) for field in fields)
+    placeholders = ", ".join(["%s"] * len(fields))
+    suffix = ops.on_conflict_suffix_sql(fields, OnConflict.IGNORE, None, None)
+    sql = (
+        f"{ops.insert_statement(on_conflict=OnConflict.IGNORE)} {ops.quote_name(model._meta.db_table)} "
+        f"({columns}) VALUES ({placeholders}) {suffix}"
+    ).rstrip()
+
+    copied = 0
+    batch = []
+    rows = queryset.values_list(*(field.attname for field in fields)).iterator(chunk_size=batch_size)
+    for row in rows:
+        batch.append([field.get_db_prep_save(value, connection) for field, value in zip(fields, row)])
+        if len(batch) >= batch_size:
+            copied += _insert_batch(connection, sql, batch)
+            batch = []
+    if batch:
+        copied += _insert_batch(connection, sql, batch)
+    return copied
+
+
+def _insert_batch(connection, sql, batch):
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.executemany(sql, batch)
+    return len(batch)
+
+
+def copy_slots(slots, source, target):
+    """Copy the passengers and rides of `slots` from `source` to `target`. Returns (passengers, rides)."""
+    from .models import Passenger, Ride
+
+    slots = set(slots)
+    return (
+        _copy(Passenger, _passengers_in(slots, source), target),
+        _copy(Ride, _rides_in(slots, source), target),
+    )
+
+
+def delete_slots(slots, alias):
+    """Delete the passengers and rides of `slots` from `alias`. Returns (passengers, rides)."""
+    slots = set(slots)
+    # Rides first: deleting a passenger would otherwise null out its rides' passenger_id.
+    rides, _ = _rides_in(slots, alias).delete()
+    passengers, _ = _passengers_in(slots, alias).delete()
+    return passengers, rides
+
+
+def assign_slots(slots, alias):
+    from .models import ShardSlot
+
+    ShardSlot.objects.using(DEFAULT_DB_ALIAS).filter(slot__in=slots).update(alias=alias, updated_at=timezone.now())
+
+
+def move_slots(slots, source, target, wait=None):
+    """Move `slots` from `source` to `target` while both stay in service.
+
+    1. Copy the rows to `target` while `source` still takes the writes.
+    2. Point the slots at `target`, then wait out the shard map TTL so no
+       process still routes them to `source`.
+    3. Copy again to pick up rows created in the meantime, then delete the
+       slots from `source`.
+
+    Rows only updated (not created) on `source` between the first copy and
+    the switch keep their first-copy values, so move slots when their
+    passengers are quiet. Returns (passengers, rides) moved.
+    """
+    slots = sorted(slots)
+    wait = settings.PASSENGER_SHARD_MAP_TTL if wait is None else wait
+    copy_slots(slots, source, target)
+    assign_slots(slots, target)
+    reset_shard_map()
+    time.sleep(wait)
+    copy_slots(slots, source, target)
+    return delete_slots(slots, source)
+
+
+def rebalance_plan(assignments, shards):
+    """{(source, target): slots} leaving each shard within one slot of an even share.
+
+    Only slots over a shard's share, or on an alias that is no longer a
+    shard, move.
+    """
+    held = {alias: [] for alias in shards}
+    surplus = []
+    for slot, alias in enumerate(assignments):
+        if alias in held:
+            held[alias].append(slot)
+        else:
+            surplus.append((slot, alias))
+
+    share, extra = divmod(SLOT_COUNT, len(shards))
+    # The extra slots go to the shards already holding the most.
+    ranked = sorted(shards, key=lambda alias: -len(held[alias]))
+    quota = {alias: share + (index < extra) for index, alias in enumerate(ranked)}
+    for alias in shards:
+        surplus.extend((slot, alias) for slot in held[alias][quota[alias]:])
+        del held[alias][quota[alias]:]
+
+    plan = defaultdict(list)
+    for alias in shards:
+        while len(held[alias]) < quota[alias]:
+            slot, source = surplus.pop()
+            held[alias].append(slot)
+            plan[(source, alias)].append(slot)
+    return dict(plan)
@@ -0,0 +1,295 @@
+"""Surge multipliers from live demand and supply per geohash cell.
+
+Demand is the number of bookings whose pickup falls in a cell; supply is the
+number of available drivers the driver service reports in that cell. Both are
+kept in sliding windows of SURGE_WINDOW seconds split into fixed buckets, so
+each cell costs a constant amount of memory and recording an event is O(1).
+
+Every SURGE_RECOMPUTE_INTERVAL seconds a background thread samples supply
+from the driver service (``driver/supply/``), recomputes every active cell
+and publishes the result by swapping in a new dict. Reading a multiplier is
+a single dict lookup, so the booking and estimate paths never wait on the
+recomputation.
+
+A cell surges once it has seen at least SURGE_MIN_DEMAND bookings in the
+window and more than SURGE_TARGET_RATIO bookings per available driver:
+
+    multiplier = 1 + SURGE_SENSITIVITY * (demand / supply - SURGE_TARGET_RATIO)
+
+rounded down to SURGE_STEP and capped at SURGE_MAX_MULTIPLIER. Without any
+supply sample yet (driver service unreachable since start-up) nothing surges.
+
+Each web process counts the bookings it served. Behind a load balancer that
+spreads bookings evenly, set SURGE_DEMAND_SCALE to the number of processes so
+every process prices from the fleet-wide demand.
+"""
+import atexit
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+
+from . import geohash
+
+logger = logging.getLogger('passenger')
+
+
+class SlidingWindowCounter:
+    """Event count over the last `size` buckets, kept in a ring of buckets."""
+
+    __slots__ = ("buckets", "total", "head")
+
+    def __init__(self, size):
+        self.buckets = [0] * size
+        self.total = 0
+        self.head = None
+
+    def advance(self, bucket):
+        """Move the window forward to `bucket`, dropping buckets that fell out."""
+        head = self.head
+        if head is None or bucket >= head + len(self.buckets):
+            if self.total:
+                self.buckets = [0] * len(self.buckets)
+                self.total = 0
+            self.head = bucket
+            return
+        size = len(self.buckets)
+        for stale in range(head + 1, bucket + 1):
+            slot = stale % size
+            self.total -= self.buckets[slot]
+            self.buckets[slot] = 0
+        if bucket > head:
+            self.head = bucket
+
+    def add(self, bucket, amount=1):
+        self.advance(bucket)
+        if bucket <= self.head - len(self.buckets):
+            return  # older than the window
+        self.buckets[bucket % len(self.buckets)] += amount
+        self.total += amount
+
+
+class SurgeEngine:
+    """Per-cell demand/supply windows and the multipliers published from them.
+
+    ``record_demand`` and ``multiplier`` are what the request path calls;
+    ``refresh`` samples supply and recomputes. Set ``background=False`` to
+    drive refreshing by hand (tests, replays). Every method takes an optional
+    ``now`` so a replay can run on its own clock.
+    """
+
+    def __init__(self, precision=5, window=300, bucket_seconds=10, target_ratio=1.0, sensitivity=0.5,
+                 max_multiplier=3.0, step=0.1, min_demand=5, demand_scale=1, recompute_interval=5.0,
+                 supply_source=None, background=True):
+        self.precision = precision
+        self.bucket_seconds = bucket_seconds
+        self.buckets = max(1, math.ceil(window / bucket_seconds))
+        self.target_ratio = target_ratio
+        self.sensitivity = sensitivity
+        self.max_multiplier = max_multiplier
+        self.step = step
+        self.min_demand = min_demand
+        self.demand_scale = demand_scale
+        self.recompute_interval = recompute_interval
+        self.supply_source = supply_source
+        self.background = background
+        self._demand = {}
+        self._supply = {}
+        self._samples = SlidingWindowCounter(self.buckets)
+        self._multipliers = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._atexit_registered = False
+
+    def _bucket(self, now):
+        return int((time.time() if now is None else now) // self.bucket_seconds)
+
+    def cell(self, latitude, longitude):
+        return geohash.encode(latitude, longitude, self.precision)
+
+    def record_demand(self, cell, now=None):
+        if self.background:
+            self._ensure_started()
+        bucket = self._bucket(now)
+        with self._lock:
+            counter = self._demand.get(cell)
+            if counter is None:
+                counter = self._demand[cell] = SlidingWindowCounter(self.buckets)
+            counter.add(bucket)
+
+    def record_supply(self, counts, now=None):
+        """Add one supply sample: available drivers per cell at this precision."""
+        bucket = self._bucket(now)
+        with self._lock:
+            self._samples.add(bucket)
+            for cell, available in counts.items():
+                counter = self._supply.get(cell)
+                if counter is None:
+                    counter = self._supply[cell] = SlidingWindowCounter(self.buckets)
+                counter.add(bucket, available)
+
+    def multiplier(self, cell):
+        """Published multiplier for a cell; any longer geohash is truncated to the engine's precision."""
+        return self._multipliers.get(cell[:self.precision], 1.0)
+
+    def multiplier_at(self, latitude, longitude):
+        return self._multipliers.get(self.cell(latitude, longitude), 1.0)
+
+    def price(self, demand, supply):
+        if demand < self.min_demand:
+            return 1.0
+        ratio = demand / max(supply, 1.0)
+        if ratio <= self.target_ratio:
+            return 1.0
+        raw = 1 + self.sensitivity * (ratio - self.target_ratio)
+        stepped = math.floor(raw / self.step + 1e-9) * self.step
+        return round(min(self.max_multiplier, stepped), 2)
+
+    def recompute(self, now=None):
+        """Recompute every active cell and publish the multipliers. Returns the surging cell count."""
+        bucket = self._bucket(now)
+        multipliers = {}
+        with self._lock:
+            self._samples.advance(bucket)
+            samples = self._samples.total
+            # Cells idle for a whole window are dropped, so memory follows active cells.
+            for counters in (self._demand, self._supply):
+                idle = []
+                for cell, counter in counters.items():
+                    counter.advance(bucket)
+                    if not counter.total:
+                        idle.append(cell)
+                for cell in idle:
+                    del counters[cell]
+            supply = self._supply
+            totals = [
+                (cell, counter.total, supply[cell].total if cell in supply else 0)
+                for cell, counter in self._demand.items()
+            ] if samples else []
+        # Priced outside the lock so bookings are not held up by the whole pass.
+        for cell, demand, available in totals:
+            multiplier = self.price(demand * self.demand_scale, available / samples)
+            if multiplier > 1.0:
+                multipliers[cell] = multiplier
+        self._multipliers = multipliers
+        return len(multipliers)
+
+    def refresh(self, now=None):
+        """Sample supply (when a source is configured) and recompute."""
+        if self.supply_source is not None:
+            try:
+                counts = self.supply_source(self.precision)
+            except Exception as e:
+                # Keep pricing from the supply already in the window.
+                logger.warning("Could not sample driver supply: %s", e)
+            else:
+                self.record_supply(counts, now)
+        return self.recompute(now)
+
+    def _ensure_started(self):
+        # A thread started before a fork does not survive in the child.
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="surge-engine", daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.stop)
+                self._atexit_registered = True
+
+    def _run(self):
+        while not self._stop_event.wait(self.recompute_interval):
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Surge recomputation failed.")
+
+    def stop(self, timeout=5):
+        self._stop_event.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "demand_cells": len(self._demand),
+                "supply_cells": len(self._supply),
+                "supply_samples": self._samples.total,
+                "surging_cells": len(self._multipliers),
+            }
+
+
+def fetch_driver_supply(precision):
+    """Available drivers per cell, from the driver service's supply endpoint."""
+    import requests
+
+    response = requests.get(
+        settings.SURGE_SUPPLY_URL, params={"precision": precision}, timeout=settings.SURGE_SUPPLY_TIMEOUT
+    )
+    response.raise_for_status()
+    return response.json()["data"]["cells"]
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_surge_engine():
+    """Return the process-wide surge engine, building it on first use."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = SurgeEngine(
+                    precision=settings.SURGE_GEOHASH_PRECISION,
+                    window=settings.SURGE_WINDOW,
+                    bucket_seconds=settings.SURGE_BUCKET_SECONDS,
+                    target_ratio=settings.SURGE_TARGET_RATIO,
+                    sensitivity=settings.SURGE_SENSITIVITY,
+                    max_multiplier=settings.SURGE_MAX_MULTIPLIER,
+                    step=settings.SURGE_STEP,
+                    min_demand=settings.SURGE_MIN_DEMAND,
+                    demand_scale=settings.SURGE_DEMAND_SCALE,
+                    recompute_interval=settings.SURGE_RECOMPUTE_INTERVAL,
+                    supply_source=fetch_driver_supply if settings.SURGE_SUPPLY_URL else None,
+                )
+    return _engine
+
+
+def reset_surge_engine():
+    """Stop and drop the cached instance so the next call rebuilds it from settings."""
+    global _engine
+    with _engine_lock:
+        engine, _engine = _engine, None
+    if engine is not None:
+        engine.stop()
+
+
+def surge_for_booking(pickup_location):
+    """Count a booking as demand in its pickup cell and return the cell's multiplier."""
+    if not settings.SURGE_ENABLED:
+        return 1.0
+    engine = get_surge_engine()
+    cell = engine.cell(pickup_location["latitude"], pickup_location["longitude"])
+    engine.record_demand(cell)
+    return engine.multiplier(cell)
+
+
+def surge_for_geohash(pickup_geohash):
+    """Multiplier for an estimate, without counting it as demand."""
+    if not settings.SURGE_ENABLED:
+        return 1.0
+    return get_surge_engine().multiplier(pickup_geohash)
+
+
+def apply_surge(fare, multiplier):
+    if multiplier == 1.0:
+        return fare
+    return round(fare * multiplier, 2)
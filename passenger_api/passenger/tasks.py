@@ -1,19 +1,79 @@
+import logging
+
 from celery import shared_task
-from django.core.mail import send_mail
+from django.conf import settings
 from django.apps import apps  # Import apps to get the model dynamically
+from django.db import router
+
+# Shared tasks bind to the current Celery app, so create the project's app first.
+from passenger_api.celery import app as celery_app  # noqa: F401
+
+from . import booking_status, metrics, welcome
+from .estimation import EstimationError
+from .services import FALLBACK_SOURCE, get_fare_and_hashed_location, is_fallback, NodeAPIError
+from .surge import apply_surge
+
+logger = logging.getLogger('passenger')
+
+metrics.connect_task_signals()
 
 @shared_task
 def send_welcome_email(passenger_id):
-    """Task to send a welcome email to the passenger."""
+    """Send one welcome email; kept for tasks queued before batching."""
+    send_welcome_emails.delay([passenger_id])
+
+
+@shared_task(bind=True)
+def send_welcome_emails(self, passenger_ids):
+    """Send the welcome email to a batch of new passengers over one SMTP connection (see welcome.py)."""
     try:
-        Passenger = apps.get_model('passenger', 'Passenger')
-        passenger = Passenger.objects.get(passenger_id=passenger_id)
-        send_mail(
-            subject="Welcome to  Uberv",
-            message=f"Hello {passenger.first_name},\n\nWelcome to Uberv!",
-            from_email="noreply@example.com",
-            recipient_list=[passenger.email],
-        )
-        print(f"Welcome email sent to {passenger.email}")
-    except Passenger.DoesNotExist:
-        print(f"Passenger with ID {passenger_id} does not exist.")
\ No newline at end of file
+        welcome.deliver(passenger_ids, limiter=welcome.get_rate_limiter())
+    except welcome.DeliveryFailed as e:
+        retries = self.request.retries
+        if retries < settings.WELCOME_EMAIL_MAX_RETRIES:
+            raise self.retry(args=[e.unsent], exc=e, countdown=settings.WELCOME_EMAIL_RETRY_DELAY * 2 ** retries)
+        logger.error("Giving up on welcome emails for passengers %s: %s", e.unsent, e.__cause__)
+
+
+@shared_task(bind=True, acks_late=True, max_retries=None)
+def process_ride_booking(self, ride_request_data):
+    """Estimate and store a ride accepted by rides/book/ in queued mode.
+
+    Acknowledged only once it returns, so a worker crash redelivers the
+    booking; storing the ride is idempotent on ride_id.
+    """
+    ride_id = ride_request_data["ride_id"]
+    booking_status.set_status(ride_id, booking_status.PROCESSING)
+
+    try:
+        estimates_and_geohashes = get_fare_and_hashed_location(ride_request_data)
+    except EstimationError as e:
+        booking_status.set_status(ride_id, booking_status.FAILED, code="INVALID_TRIP", details=str(e))
+        return
+    except NodeAPIError as e:
+        retries = self.request.retries
+        if retries < settings.RIDE_BOOKING_MAX_RETRIES:
+            raise self.retry(exc=e, countdown=settings.RIDE_BOOKING_RETRY_DELAY * 2 ** retries)
+        logger.warning("Giving up on queued ride %s: %s", ride_id, e)
+        booking_status.set_status(ride_id, booking_status.FAILED, code="EXTERNAL_API_ERROR", details=str(e))
+        return
+
+    ride_request_data.update({
+        "estimated_fare": apply_surge(
+            estimates_and_geohashes["data"]["estimated_fare"], ride_request_data.get("surge_multiplier", 1.0)
+        ),
+        "distance_km": estimates_and_geohashes["data"]["distance_km"],
+        "pickup_geohash": estimates_and_geohashes["data"]["pickup_geohash"],
+        "dropoff_geohash": estimates_and_geohashes["data"]["dropoff_geohash"],
+    })
+    if is_fallback(estimates_and_geohashes):
+        ride_request_data["estimate_source"] = FALLBACK_SOURCE
+    from .ride_store import build_ride  # imports models; this module loads with the app registry
+
+    Ride = apps.get_model('passenger', 'Ride')
+    ride = build_ride(ride_request_data, ride_request_data.get("passenger_id"))
+    ride_request_data["status"] = ride.status
+    # Written directly rather than through the write-behind buffer: the task
+    # is the unit of durability here, and a redelivered task finds its row.
+    Ride.objects.using(router.db_for_write(Ride, instance=ride)).bulk_create([ride], ignore_conflicts=True)
+    booking_status.set_status(ride_id, ride.status, ride=ride_request_data)
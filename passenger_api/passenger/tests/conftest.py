@@ -0,0 +1,24 @@
+import pytest
+
+from passenger import ride_store
+
+# Test databases standing in for shards; sharding stays off unless a test
+# sets PASSENGER_SHARDS (see test_sharding.py).
+SHARD_ALIASES = ["shard_0", "shard_1"]
+
+
+@pytest.fixture(scope="session")
+def django_db_modify_db_settings(django_db_modify_db_settings_parallel_suffix):
+    from django.db import connections
+
+    default = connections.settings["default"]
+    for alias in SHARD_ALIASES:
+        connections.settings[alias] = {**default, "NAME": f"{default['NAME']}_{alias}", "TEST": dict(default["TEST"])}
+
+
+@pytest.fixture(autouse=True)
+def ride_buffer(monkeypatch):
+    """Buffer booked rides without a flusher thread; tests flush explicitly."""
+    buffer = ride_store.RideWriteBuffer(background=False)
+    monkeypatch.setattr(ride_store, "_buffer", buffer)
+    return buffer
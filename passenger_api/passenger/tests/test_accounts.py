@@ -0,0 +1,92 @@
+import threading
+
+import pytest
+from django.db import IntegrityError, connection, transaction
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from passenger.accounts import duplicate_field, normalize_email
+from passenger.models import Passenger
+
+
+def signup(email, phone):
+    return APIClient().post("/passenger/passengers/", {
+        "email": email, "phone": phone, "first_name": "Jane", "last_name": "Doe",
+    }, format="json")
+
+
+@pytest.mark.django_db
+def test_duplicate_field_reads_integrity_errors():
+    """Test the clashing field is recovered from the database error"""
+    Passenger.objects.create(email="a@example.com", phone="+15550001", first_name="A", last_name="B")
+    for values, field in [
+        ({"email": "a@example.com", "phone": "+15550002"}, "email"),
+        ({"email": "b@example.com", "phone": "+15550001"}, "phone"),
+    ]:
+        with pytest.raises(IntegrityError) as error, transaction.atomic():
+            Passenger.objects.create(first_name="A", last_name="B", **values)
+        assert duplicate_field(error.value, Passenger) == field
+
+
+@pytest.mark.django_db
+def test_signup_is_one_insert(django_assert_num_queries):
+    """Test a signup costs a single INSERT (inside its savepoint)"""
+    with django_assert_num_queries(3):  # SAVEPOINT, INSERT, RELEASE SAVEPOINT
+        response = signup("  New@Example.com", "+1 (555) 000-0003")
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.data["data"]["email"] == normalize_email("New@Example.com")
+    assert response.data["data"]["phone"] == "+15550000003"
+
+
+@pytest.mark.django_db(transaction=True)
+def test_signup_is_one_statement_in_autocommit(django_assert_num_queries):
+    """Test outside a transaction a signup and a duplicate signup are one statement each"""
+    with django_assert_num_queries(1):
+        assert signup("new@example.com", "+15550000003").status_code == status.HTTP_201_CREATED
+    with django_assert_num_queries(1):
+        response = signup("other@example.com", "+15550000003")
+    assert response.data["code"] == "DUPLICATE_PHONE"
+
+
+@pytest.mark.django_db
+def test_signup_rejects_invalid_phone():
+    """Test a phone that cannot be normalized is rejected"""
+    response = signup("new@example.com", "call me")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data["code"] == "INVALID_PHONE"
+
+
+SIGNUP_ATTEMPTS = 50
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_signups_create_one_account():
+    """Test racing signups for the same email create exactly one passenger"""
+    workers = 8
+    barrier = threading.Barrier(workers)
+    codes = []
+
+    def race(n):
+        barrier.wait()
+        try:
+            # The shared in-memory test database fails instead of waiting on
+            # a concurrent writer; a real database makes the INSERT wait.
+            for _ in range(SIGNUP_ATTEMPTS):
+                response = signup("racer@example.com", f"+1555100{n:04d}")
+                if "is locked" not in str(response.data.get("details", "")):
+                    codes.append(response.data.get("code", response.status_code))
+                    break
+            else:
+                codes.append("STILL_LOCKED")
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=race, args=(n,)) for n in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert "STILL_LOCKED" not in codes, f"a signup hit a locked database {SIGNUP_ATTEMPTS} times in a row: {codes}"
+    assert sorted(codes, key=str) == sorted([201] + ["DUPLICATE_EMAIL"] * (workers - 1), key=str)
+    assert Passenger.objects.filter(email="racer@example.com").count() == 1
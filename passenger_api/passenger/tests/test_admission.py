@@ -0,0 +1,273 @@
+import asyncio
+import json
+import threading
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from django.test import Client
+from prometheus_client.parser import text_string_to_metric_families
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from passenger import admission, services
+from passenger.admission import AdmissionController, LeasedBucket, TokenBucket
+from passenger.services import AsyncConcurrencyLimiter, ConcurrencyLimiter, UpstreamBusyError
+
+BOOKING = {
+    "pickup_location": {"latitude": 10.0, "longitude": 20.0},
+    "dropoff_location": {"latitude": 30.0, "longitude": 40.0},
+    "ride_type": "standard",
+}
+ESTIMATE = {
+    "message": "Ride estimate calculated successfully",
+    "data": {"pickup_geohash": "s3y0zh7", "dropoff_geohash": "stq4s3x", "distance_km": 3040.6, "estimated_fare": 6081.2},
+}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(autouse=True)
+def fresh_controller():
+    admission.reset_admission_controller()
+    services.reset_geo_estimator_client()
+    yield
+    admission.reset_admission_controller()
+    services.reset_geo_estimator_client()
+
+
+def book(address="10.0.0.1"):
+    with patch("passenger.views.get_fare_and_hashed_location", return_value=ESTIMATE):
+        return APIClient().post("/passenger/rides/book/", BOOKING, format="json", REMOTE_ADDR=address)
+
+
+def book_async(address="10.0.0.1", estimate=None):
+    estimate = estimate or AsyncMock(return_value=ESTIMATE)
+    with patch("passenger.views.aget_fare_and_hashed_location", estimate):
+        return Client().post(
+            "/passenger/rides/book/async/", json.dumps(BOOKING), content_type="application/json", REMOTE_ADDR=address
+        )
+
+
+def test_token_bucket_allows_a_burst_then_the_rate():
+    """Test a bucket grants its burst at once, then one token per 1/rate seconds"""
+    clock = Clock()
+    bucket = TokenBucket(rate=2, burst=3, clock=clock)
+    assert bucket.take(5) == (3, 0.5)
+    assert bucket.take() == (0, 0.5)
+    clock.now = 0.5
+    assert bucket.take()[0] == 1
+    clock.now = 100
+    assert bucket.take(10)[0] == 3
+
+
+def test_leased_bucket_goes_to_the_shared_bucket_once_per_lease():
+    """Test leased tokens are served locally and dropped once stale"""
+    clock = Clock()
+    shared = MagicMock()
+    shared.take.return_value = (5, 0.0)
+    bucket = LeasedBucket(shared, lease=5, lease_ttl=1.0, clock=clock)
+    assert [bucket.take()[0] for _ in range(5)] == [1] * 5
+    assert shared.take.call_count == 1
+
+    bucket.take()
+    clock.now = 2.0
+    bucket.take()
+    assert shared.take.call_count == 3
+
+
+def test_client_over_its_rate_gets_429(settings):
+    """Test a client past its burst is told when to retry while other clients still get in"""
+    settings.ADMISSION_CLIENT_RATE = 1
+    settings.ADMISSION_CLIENT_BURST = 2
+    assert [book().status_code for _ in range(2)] == [status.HTTP_201_CREATED] * 2
+
+    limited = book()
+    assert limited.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert limited.data["code"] == "RATE_LIMITED"
+    assert limited["Retry-After"] == "1"
+    assert book("10.0.0.2").status_code == status.HTTP_201_CREATED
+
+
+def test_async_route_is_admission_controlled(settings):
+    """Test rides/book/async/ draws on the same buckets as rides/book/"""
+    settings.ADMISSION_CLIENT_RATE = 1
+    settings.ADMISSION_CLIENT_BURST = 2
+    assert book().status_code == status.HTTP_201_CREATED
+    assert book_async().status_code == status.HTTP_201_CREATED
+
+    limited = book_async()
+    assert limited.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert limited.json()["code"] == "RATE_LIMITED"
+    assert limited["Retry-After"] == "1"
+    assert book_async("10.0.0.2").status_code == status.HTTP_201_CREATED
+
+
+def test_client_header_identifies_clients_behind_a_proxy(settings):
+    """Test ADMISSION_CLIENT_HEADER takes the first X-Forwarded-For address"""
+    settings.ADMISSION_CLIENT_HEADER = "X-Forwarded-For"
+    request = MagicMock(headers={"X-Forwarded-For": "203.0.113.7, 10.0.0.1"}, META={"REMOTE_ADDR": "10.0.0.1"})
+    assert admission.client_id(request) == "203.0.113.7"
+
+
+def test_global_limit_sheds_with_503(settings):
+    """Test bookings beyond the global rate are shed as overload"""
+    settings.ADMISSION_GLOBAL_RATE = 1
+    settings.ADMISSION_GLOBAL_BURST = 3
+    responses = [book(f"10.0.0.{n}") for n in range(5)]
+    assert [r.status_code for r in responses] == [201, 201, 201, 503, 503]
+    assert responses[-1].data["code"] == "OVERLOADED"
+    assert responses[-1]["Retry-After"] == "1"
+
+    stats = admission.get_admission_controller().stats()
+    assert (stats["admitted"], stats["overloaded"], stats["shed_ratio"]) == (3, 2, 0.4)
+
+
+def scrape():
+    """The /metrics samples, by name and labels."""
+    response = APIClient().get("/metrics")
+    return {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for family in text_string_to_metric_families(response.content.decode())
+        for sample in family.samples
+    }
+
+
+def test_shedding_stats_are_exported_on_metrics(settings):
+    """Test admissions, rejections per bucket, bucket level and the estimator cap are readable from /metrics"""
+    settings.ADMISSION_GLOBAL_RATE = 0.001
+    settings.ADMISSION_GLOBAL_BURST = 2
+    settings.ADMISSION_CLIENT_RATE = 1
+    settings.ADMISSION_CLIENT_BURST = 5
+    settings.GEOES_MAX_CONCURRENCY = 7
+    before = scrape()
+    responses = [book(f"10.0.1.{n}") for n in range(3)]
+    assert [r.status_code for r in responses] == [201, 201, 503]
+    services.get_upstream_limiter()
+    after = scrape()
+
+    def delta(name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        return after.get(key, 0) - before.get(key, 0)
+
+    assert delta("admission_admitted_total") == 2
+    assert delta("admission_rejected_total", reason="overloaded") == 1
+    assert delta("admission_rejected_total", reason="rate_limited") == 0
+    assert after[("admission_global_bucket_tokens", ())] == pytest.approx(0, abs=0.01)
+    assert after[("admission_tracked_clients", ())] == 3
+    assert after[("geo_estimate_concurrency_limit", ())] == 7
+
+
+def test_redis_outage_falls_back_to_process_buckets():
+    """Test a failing shared bucket leaves the per-process buckets in charge"""
+    redis = MagicMock()
+    redis.register_script.return_value = MagicMock(side_effect=ConnectionError("redis down"))
+    controller = AdmissionController(global_rate=1, global_burst=2, client_rate=1, client_burst=5, client=redis)
+    results = [controller.admit("client") for _ in range(3)]
+    assert results[:2] == [None, None]
+    assert results[2] == ("overloaded", 1)
+    assert controller.stats()["redis_errors"] > 0
+
+
+def test_saturated_estimator_answers_503(settings):
+    """Test a booking finding every estimator slot taken fails fast with Retry-After"""
+    settings.GEO_ESTIMATION_MODE = "remote"
+    settings.ESTIMATE_CACHE_ENABLED = False
+    settings.GEOES_MAX_CONCURRENCY = 1
+    settings.GEOES_CONCURRENCY_WAIT = 0
+    with services.get_upstream_limiter():
+        response = APIClient().post("/passenger/rides/book/", BOOKING, format="json")
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.data["code"] == "UPSTREAM_BUSY"
+    assert response["Retry-After"] == "1"
+
+
+def test_saturated_estimator_falls_back_to_local_estimates(settings):
+    """Test 'fallback' mode prices locally instead of waiting on a saturated estimator"""
+    settings.GEO_ESTIMATION_MODE = "fallback"
+    settings.GEOES_MAX_CONCURRENCY = 1
+    settings.GEOES_CONCURRENCY_WAIT = 0
+    with services.get_upstream_limiter():
+        result = services.estimate_ride(BOOKING)
+    assert result["data"]["distance_km"] > 0
+
+
+def test_concurrency_limiter_caps_calls_in_flight():
+    """Test calls beyond the limit are refused while earlier ones run, and admitted after"""
+    limiter = ConcurrencyLimiter(limit=2, wait=0)
+    started, release = threading.Barrier(3), threading.Event()
+
+    def call():
+        with limiter:
+            started.wait()
+            release.wait(5)
+
+    threads = [threading.Thread(target=call) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    started.wait()
+    assert limiter.stats()["in_flight"] == 2
+    with pytest.raises(UpstreamBusyError):
+        with limiter:
+            pass
+    release.set()
+    for thread in threads:
+        thread.join()
+    with limiter:
+        pass
+    assert limiter.stats() == {"limit": 2, "in_flight": 0, "rejected": 1}
+
+
+def test_saturated_estimator_answers_503_on_the_async_route():
+    """Test the async view maps a full estimator cap to UPSTREAM_BUSY with Retry-After"""
+    response = book_async(estimate=AsyncMock(side_effect=UpstreamBusyError("20 geo estimator calls already in flight.")))
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.json()["code"] == "UPSTREAM_BUSY"
+    assert response["Retry-After"] == "1"
+
+
+def test_async_estimates_go_through_the_concurrency_cap(settings):
+    """Test aestimate_ride is refused once the event loop has GEOES_MAX_CONCURRENCY calls in flight"""
+    settings.GEO_ESTIMATION_MODE = "remote"
+    settings.GEOES_MAX_CONCURRENCY = 1
+    settings.GEOES_CONCURRENCY_WAIT = 0
+
+    async def run():
+        async with services.get_async_upstream_limiter():
+            with pytest.raises(UpstreamBusyError):
+                await services.aestimate_ride(BOOKING)
+        return services.get_async_upstream_limiter().stats()
+
+    assert asyncio.run(run()) == {"limit": 1, "in_flight": 0, "rejected": 1}
+
+
+def test_async_concurrency_limiter_waits_for_a_slot():
+    """Test an async caller gets a slot freed within `wait`, and is refused after it"""
+    async def run():
+        limiter = AsyncConcurrencyLimiter(limit=1, wait=0.5)
+        release = asyncio.Event()
+
+        async def hold():
+            async with limiter:
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        asyncio.get_running_loop().call_later(0.05, release.set)
+        async with limiter:
+            pass
+        await holder
+
+        limiter.wait = 0.05
+        async with limiter:
+            with pytest.raises(UpstreamBusyError):
+                async with limiter:
+                    pass
+        return limiter.stats()
+
+    assert asyncio.run(run()) == {"limit": 1, "in_flight": 0, "rejected": 1}
@@ -0,0 +1,54 @@
+import os
+
+import pytest
+from django.core.management import call_command
+
+from passenger.coldstart import parse_importtime, run_cold_start
+
+# Generous enough for slow CI runners: a regression worth catching (Celery,
+# the schema views and the aiohttp client back in the import path) costs
+# several hundred milliseconds on top of a ~0.6 s start.
+COLD_START_BUDGET_SECONDS = float(os.getenv("COLD_START_BUDGET_SECONDS", "1.5"))
+
+DEFERRED_MODULES = ["celery", "kombu", "aiohttp", "drf_spectacular.views"]
+
+
+def test_wsgi_cold_start_defers_celery_schema_views_and_http_clients():
+    """Test loading the WSGI app and URLconf imports none of the first-use dependencies"""
+    loaded = run_cold_start("wsgi").modules
+    assert "passenger.views" in loaded
+    assert [module for module in DEFERRED_MODULES if module in loaded] == []
+
+
+@pytest.mark.parametrize("target", ["wsgi", "check"])
+def test_cold_start_within_budget(target):
+    """Test the best of three cold starts stays under COLD_START_BUDGET_SECONDS"""
+    seconds = min(run_cold_start(target).seconds for _ in range(3))
+    assert seconds < COLD_START_BUDGET_SECONDS, f"{target} cold start took {seconds:.2f}s"
+
+
+def test_celery_app_loads_on_first_access():
+    """Test the project's celery_app is still reachable for `celery -A passenger_api`"""
+    import passenger_api
+
+    assert passenger_api.celery_app.main == "passenger_api"
+    with pytest.raises(AttributeError):
+        passenger_api.missing
+
+
+def test_parse_importtime():
+    """Test importtime lines parse into module, self and cumulative microseconds"""
+    stderr = (
+        "import time: self [us] | cumulative | imported package\n"
+        "import time:       120 |        120 |     json.decoder\n"
+        "import time:       300 |        420 | json\n"
+    )
+    assert parse_importtime(stderr) == [("json.decoder", 120, 120), ("json", 300, 420)]
+
+
+def test_profile_imports_command(capsys):
+    """Test the command prints the wall time and the slowest imports"""
+    call_command("profile_imports", "--top", "3")
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].startswith("wsgi: ")
+    assert len(lines) == 5
@@ -0,0 +1,138 @@
+import asyncio
+
+import pytest
+from django.db import DatabaseError, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from passenger import db_router
+from passenger.db_router import PIN_COOKIE, ReplicaMonitor, ReplicaPinningMiddleware, ReplicaRouter, use_primary
+from passenger.models import Passenger
+
+router = ReplicaRouter()
+
+
+@pytest.fixture
+def replicas(monkeypatch, settings):
+    """Two replicas, both healthy, checked by hand."""
+    settings.DB_REPLICAS = ["replica_0", "replica_1"]
+    lags = {"replica_0": 0.0, "replica_1": 0.0}
+
+    def replica_lag(alias):
+        if isinstance(lags[alias], Exception):
+            raise lags[alias]
+        return lags[alias]
+
+    monkeypatch.setattr(db_router, "replica_lag", replica_lag)
+    monitor = ReplicaMonitor(settings.DB_REPLICAS, max_lag=5.0, background=False)
+    monitor.check()
+    monkeypatch.setattr(db_router, "_monitor", monitor)
+    return lags
+
+
+def test_reads_use_default_without_replicas(settings):
+    settings.DB_REPLICAS = []
+    assert router.db_for_read(Passenger) == "default"
+    assert router.db_for_write(Passenger) == "default"
+
+
+def test_reads_are_spread_over_healthy_replicas(replicas):
+    """Test reads go to replicas and writes to default"""
+    assert {router.db_for_read(Passenger) for _ in range(50)} == {"replica_0", "replica_1"}
+    assert router.db_for_write(Passenger) == "default"
+
+
+def test_lagging_or_failing_replicas_are_skipped(replicas):
+    """Test a replica over the lag limit or failing its check stops serving reads until it recovers"""
+    replicas["replica_0"] = 30.0
+    replicas["replica_1"] = DatabaseError("connection refused")
+    db_router._monitor.check()
+    assert router.db_for_read(Passenger) == "default"
+    assert db_router._monitor.lags() == {"replica_0": 30.0, "replica_1": None}
+
+    replicas["replica_1"] = 0.5
+    db_router._monitor.check()
+    assert router.db_for_read(Passenger) == "replica_1"
+
+
+def test_unchecked_replicas_are_not_used():
+    assert ReplicaMonitor(["replica_0"], background=False).healthy() == ()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_reads_inside_a_transaction_use_default(replicas):
+    with transaction.atomic():
+        assert router.db_for_read(Passenger) == "default"
+    assert router.db_for_read(Passenger) != "default"
+
+
+def test_use_primary_pins_reads(replicas):
+    with use_primary():
+        assert router.db_for_read(Passenger) == "default"
+    assert router.db_for_read(Passenger) != "default"
+
+
+def routed_view(routes):
+    def get_response(request):
+        routes.append(router.db_for_read(Passenger))
+        if request.method == "POST":
+            router.db_for_write(Passenger)
+        routes.append(router.db_for_read(Passenger))
+        return HttpResponse()
+    return get_response
+
+
+def test_middleware_pins_writes_and_the_writing_client(replicas, settings):
+    """Test a write pins the rest of the request and, via the cookie, the client's next requests"""
+    factory = RequestFactory()
+    routes = []
+    middleware = ReplicaPinningMiddleware(routed_view(routes))
+
+    response = middleware(factory.get("/"))
+    assert routes[-2:] != ["default", "default"]
+    assert PIN_COOKIE not in response.cookies
+
+    response = middleware(factory.post("/"))
+    assert routes[-2:] == ["default", "default"]
+    assert response.cookies[PIN_COOKIE]["max-age"] == settings.DB_REPLICA_STICKY_SECONDS
+
+    pinned = factory.get("/")
+    pinned.COOKIES[PIN_COOKIE] = "1"
+    middleware(pinned)
+    assert routes[-2:] == ["default", "default"]
+    assert router.db_for_read(Passenger) != "default"  # the pin ends with the request
+
+
+def test_async_middleware_sees_writes_made_in_sync_code(replicas):
+    """Test a write from a sync_to_async ORM call still sets the cookie"""
+    from asgiref.sync import sync_to_async
+
+    async def get_response(request):
+        await sync_to_async(router.db_for_write)(Passenger)
+        return HttpResponse()
+
+    middleware = ReplicaPinningMiddleware(get_response)
+    response = asyncio.run(middleware(RequestFactory().post("/")))
+    assert PIN_COOKIE in response.cookies
+
+
+def test_replicas_never_migrate():
+    assert router.allow_migrate("default", "passenger") is True
+    assert router.allow_migrate("replica_0", "passenger") is False
+
+
+def test_background_monitor_checks_replicas(monkeypatch):
+    """Test the monitor thread checks replicas without a request waiting on it"""
+    checked = []
+    monkeypatch.setattr(db_router, "replica_lag", lambda alias: checked.append(alias) or 0.0)
+    monitor = ReplicaMonitor(["replica_0"], check_interval=0.01)
+    try:
+        assert monitor.healthy() in [(), ("replica_0",)]
+        for _ in range(100):
+            if monitor.healthy():
+                break
+            monitor._stopping.wait(0.01)
+        assert monitor.healthy() == ("replica_0",)
+    finally:
+        monitor.stop()
+    assert checked
@@ -0,0 +1,97 @@
+
+import pytest
+from unittest.mock import patch
+from django.core.cache import caches
+from passenger import geohash
+from passenger.estimate_cache import EstimateCache, LRUCache
+from passenger.services import get_fare_and_hashed_location
+
+
+PICKUP = {"latitude": 37.7749, "longitude": -122.4194}
+DROPOFF = {"latitude": 37.8044, "longitude": -122.2711}
+
+ESTIMATE = {
+    "message": "Ride estimate calculated successfully",
+    "data": {
+        "pickup_geohash": "9q8yyk8",
+        "dropoff_geohash": "9q9p1dh",
+        "distance_km": 13.36,
+        "estimated_fare": 26.72,
+    },
+}
+
+
+@pytest.fixture
+def estimate_cache():
+    caches["estimates"].clear()
+    cache = EstimateCache(local=LRUCache(maxsize=100, ttl=60))
+    with patch("passenger.services.get_estimate_cache", return_value=cache):
+        yield cache
+    caches["estimates"].clear()
+
+
+def test_geohash_matches_ngeohash():
+    """Test encodings match the values ngeohash returns in geo_estimator"""
+    assert geohash.encode(37.7749, -122.4194, 7) == "9q8yyk8"
+    assert geohash.encode(37.8044, -122.2711, 7) == "9q9p1dh"
+    assert geohash.encode(0, 0, 7) == "7zzzzzz"
+    assert geohash.encode(-33.8688, 151.2093, 7) == "r3gx2f7"
+
+
+def test_lru_evicts_least_recently_used():
+    """Test the local tier is bounded and keeps recently read keys"""
+    lru = LRUCache(maxsize=2, ttl=60)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    lru.get("a")
+    lru.set("c", 3)
+    assert lru.get("a") == 1
+    assert lru.get("b") is None
+    assert len(lru) == 2
+
+
+def test_lru_expires_entries():
+    """Test entries past their TTL are treated as misses"""
+    lru = LRUCache(maxsize=2, ttl=0)
+    lru.set("a", 1)
+    assert lru.get("a") is None
+
+
+def test_key_uses_cells_and_ride_type(estimate_cache):
+    """Test nearby points share a key and ride types do not"""
+    nearby = {"latitude": 37.77491, "longitude": -122.41941}
+    key = estimate_cache.make_key(PICKUP, DROPOFF, "standard")
+    assert key == estimate_cache.make_key(nearby, DROPOFF, "standard")
+    assert key != estimate_cache.make_key(PICKUP, DROPOFF, "premium")
+
+
+def test_remote_hit_populates_local(estimate_cache):
+    """Test a shared-tier hit is promoted into the in-process tier"""
+    key = estimate_cache.make_key(PICKUP, DROPOFF, "standard")
+    caches["estimates"].set(key, ESTIMATE)
+
+    assert estimate_cache.get(key) == ESTIMATE
+    assert estimate_cache.get(key) == ESTIMATE
+    stats = estimate_cache.stats()
+    assert stats["remote_hits"] == 1
+    assert stats["local_hits"] == 1
+
+
+def test_fare_lookup_served_from_cache(estimate_cache):
+    """Test repeated estimates for the same cells call the estimator once"""
+    ride = {"pickup_location": PICKUP, "dropoff_location": DROPOFF, "ride_type": "standard"}
+    with patch("passenger.services.GeoEstimatorClient.estimate", return_value=ESTIMATE) as estimate:
+        assert get_fare_and_hashed_location(ride) == ESTIMATE
+        assert get_fare_and_hashed_location(ride) == ESTIMATE
+    assert estimate.call_count == 1
+    assert estimate_cache.stats()["misses"] == 1
+    assert estimate_cache.stats()["hit_ratio"] == 0.5
+
+
+def test_invalidate_clears_both_tiers(estimate_cache):
+    """Test invalidation forces the next lookup back to the estimator"""
+    key = estimate_cache.make_key(PICKUP, DROPOFF, "standard")
+    estimate_cache.set(key, ESTIMATE)
+    estimate_cache.invalidate()
+    assert estimate_cache.get(key) is None
+    assert caches["estimates"].get(key) is None
@@ -0,0 +1,93 @@
+
+import json
+import math
+from pathlib import Path
+
+import pytest
+from unittest.mock import patch
+from django.test import override_settings
+from passenger import estimation
+from passenger.services import NodeAPIError, get_fare_and_hashed_location
+
+
+# Generated from the geo_estimator sources by geo_estimator/scripts/parity_fixture.js
+PARITY_CASES = json.loads((Path(__file__).parent / "fixtures" / "geo_estimator_parity.json").read_text())
+
+
+@pytest.mark.parametrize("case", PARITY_CASES, ids=lambda c: f"{c['pickup_location']}->{c['dropoff_location']}:{c['ride_type']}")
+def test_estimate_matches_node(case):
+    """Test the scalar port returns exactly what the Node service returns"""
+    if "error" in case:
+        with pytest.raises(estimation.EstimationError, match=case["error"]):
+            estimation.estimate(case["pickup_location"], case["dropoff_location"], case["ride_type"])
+        return
+
+    data = estimation.estimate(case["pickup_location"], case["dropoff_location"], case["ride_type"])["data"]
+    assert data == {
+        "pickup_geohash": case["pickup_geohash"],
+        "dropoff_geohash": case["dropoff_geohash"],
+        "distance_km": case["distance_km"],
+        "estimated_fare": case["estimated_fare"],
+    }
+
+
+def test_estimate_batch_matches_node():
+    """Test the vectorised path returns exactly what the Node service returns"""
+    result = estimation.estimate_batch(
+        [c["pickup_location"]["latitude"] for c in PARITY_CASES],
+        [c["pickup_location"]["longitude"] for c in PARITY_CASES],
+        [c["dropoff_location"]["latitude"] for c in PARITY_CASES],
+        [c["dropoff_location"]["longitude"] for c in PARITY_CASES],
+        [c["ride_type"] for c in PARITY_CASES],
+    )
+    for i, case in enumerate(PARITY_CASES):
+        assert result["pickup_geohash"][i] == case["pickup_geohash"]
+        assert result["dropoff_geohash"][i] == case["dropoff_geohash"]
+        assert result["distance_km"][i] == case["distance_km"]
+        assert result["errors"][i] == case.get("error")
+        if "error" in case:
+            assert math.isnan(result["estimated_fare"][i])
+        else:
+            assert result["estimated_fare"][i] == case["estimated_fare"]
+
+
+def test_js_round_rounds_halves_up():
+    """Test rounding follows Math.round rather than Python's banker's rounding"""
+    assert estimation._js_round(2.5) == 3
+    assert estimation._js_round(-2.5) == -2
+    assert estimation._js_round(0.49999999999999994) == 0
+
+
+RIDE = {
+    "pickup_location": {"latitude": 37.7749, "longitude": -122.4194},
+    "dropoff_location": {"latitude": 37.8044, "longitude": -122.2711},
+    "ride_type": "standard",
+}
+
+
+@override_settings(GEO_ESTIMATION_MODE="local", ESTIMATE_CACHE_ENABLED=False)
+def test_local_mode_skips_estimator():
+    """Test local mode never calls the Node service"""
+    with patch("passenger.services.GeoEstimatorClient.estimate") as remote:
+        res = get_fare_and_hashed_location(RIDE)
+    remote.assert_not_called()
+    assert res["data"]["pickup_geohash"] == "9q8yyk8"
+
+
+@override_settings(GEO_ESTIMATION_MODE="fallback", ESTIMATE_CACHE_ENABLED=False)
+def test_fallback_mode_used_when_estimator_down():
+    """Test fallback mode computes in-process when the estimator fails"""
+    with patch("passenger.services.GeoEstimatorClient.estimate", side_effect=NodeAPIError("down")):
+        res = get_fare_and_hashed_location(RIDE)
+    assert res == {
+        **estimation.estimate(RIDE["pickup_location"], RIDE["dropoff_location"], RIDE["ride_type"]),
+        "source": "fallback",
+    }
+
+
+@override_settings(GEO_ESTIMATION_MODE="remote", ESTIMATE_CACHE_ENABLED=False)
+def test_remote_mode_propagates_estimator_errors():
+    """Test remote mode does not silently fall back"""
+    with patch("passenger.services.GeoEstimatorClient.estimate", side_effect=NodeAPIError("down")):
+        with pytest.raises(NodeAPIError):
+            get_fare_and_hashed_location(RIDE)
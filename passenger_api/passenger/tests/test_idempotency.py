@@ -0,0 +1,181 @@
+import json
+import threading
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.response import Response
+from django.test import Client
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework.views import APIView
+
+from passenger import idempotency
+from passenger.idempotency import idempotent
+from passenger.models import Passenger, Ride
+from passenger.services import NodeAPIError
+
+ESTIMATE = {
+    "message": "Ride estimate calculated successfully",
+    "data": {"pickup_geohash": "s3y0zh7", "dropoff_geohash": "stq4s3x", "distance_km": 3040.6, "estimated_fare": 6081.2},
+}
+BOOKING = {
+    "pickup_location": {"latitude": 10.0, "longitude": 20.0},
+    "dropoff_location": {"latitude": 30.0, "longitude": 40.0},
+    "ride_type": "standard",
+}
+SIGNUP = {"email": "rider@example.com", "phone": "+15550001234", "first_name": "Ada", "last_name": "Lovelace"}
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    caches["idempotency"].clear()
+    yield
+    caches["idempotency"].clear()
+
+
+class SlowView(APIView):
+    """Answers once `release` is set, counting the calls that got through."""
+
+    calls = 0
+    release = threading.Event()
+
+    @idempotent("slow")
+    def post(self, request):
+        SlowView.calls += 1
+        SlowView.release.wait(5)
+        return Response({"call": SlowView.calls}, status=status.HTTP_201_CREATED)
+
+
+def slow_post(key, body=None):
+    request = APIRequestFactory().post("/slow/", body or {"a": 1}, format="json", HTTP_IDEMPOTENCY_KEY=key)
+    return SlowView.as_view()(request)
+
+
+@pytest.mark.django_db
+def test_repeated_signup_replays_the_first_response():
+    """Test a retried signup returns the original 201 without creating a second passenger"""
+    client = APIClient()
+    first = client.post("/passenger/passengers/", SIGNUP, format="json", HTTP_IDEMPOTENCY_KEY="signup-1")
+    second = client.post("/passenger/passengers/", SIGNUP, format="json", HTTP_IDEMPOTENCY_KEY="signup-1")
+    assert first.status_code == second.status_code == status.HTTP_201_CREATED
+    assert second.data == first.data
+    assert second["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first
+    assert Passenger.objects.count() == 1
+
+    # Without a key, the same body is a duplicate signup as before.
+    third = client.post("/passenger/passengers/", SIGNUP, format="json")
+    assert third.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_repeated_booking_calls_the_estimator_once(settings):
+    """Test a retried booking replays the ride it created instead of estimating and writing again"""
+    settings.RIDE_WRITE_MODE = "sync"
+    client = APIClient()
+    with patch("passenger.views.get_fare_and_hashed_location", return_value=ESTIMATE) as estimate:
+        first = client.post("/passenger/rides/book/", BOOKING, format="json", HTTP_IDEMPOTENCY_KEY="ride-1")
+        second = client.post("/passenger/rides/book/", BOOKING, format="json", HTTP_IDEMPOTENCY_KEY="ride-1")
+        other = client.post("/passenger/rides/book/", BOOKING, format="json", HTTP_IDEMPOTENCY_KEY="ride-2")
+    assert estimate.call_count == 2
+    assert second.data["data"]["ride_id"] == first.data["data"]["ride_id"] != other.data["data"]["ride_id"]
+    assert Ride.objects.count() == 2
+
+
+@pytest.mark.django_db
+def test_repeated_async_booking_replays_the_first_response(settings):
+    """Test a retried booking on the async route replays instead of estimating and writing again"""
+    settings.RIDE_WRITE_MODE = "sync"
+    body = json.dumps(BOOKING)
+    with patch("passenger.views.aget_fare_and_hashed_location", new_callable=AsyncMock, return_value=ESTIMATE) as estimate:
+        first, second = [
+            Client().post("/passenger/rides/book/async/", body, content_type="application/json", HTTP_IDEMPOTENCY_KEY="ride-1")
+            for _ in range(2)
+        ]
+        reused = Client().post(
+            "/passenger/rides/book/async/", json.dumps({**BOOKING, "ride_type": "premium"}),
+            content_type="application/json", HTTP_IDEMPOTENCY_KEY="ride-1",
+        )
+    assert estimate.call_count == 1
+    assert first.status_code == second.status_code == status.HTTP_201_CREATED
+    assert second.json() == first.json()
+    assert second["Idempotent-Replayed"] == "true"
+    assert Ride.objects.count() == 1
+    assert reused.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    assert reused.json()["code"] == "IDEMPOTENCY_KEY_REUSED"
+
+    # Both booking routes share the key space.
+    with patch("passenger.views.get_fare_and_hashed_location", return_value=ESTIMATE):
+        sync = APIClient().post("/passenger/rides/book/", BOOKING, format="json", HTTP_IDEMPOTENCY_KEY="ride-1")
+    assert sync.data["data"]["ride_id"] == first.json()["data"]["ride_id"]
+
+
+@pytest.mark.django_db
+def test_server_errors_are_not_replayed():
+    """Test a booking that failed upstream runs again on retry"""
+    client = APIClient()
+    with patch("passenger.views.get_fare_and_hashed_location", side_effect=[NodeAPIError("down"), ESTIMATE]):
+        failed = client.post("/passenger/rides/book/", BOOKING, format="json", HTTP_IDEMPOTENCY_KEY="ride-1")
+        retried = client.post("/passenger/rides/book/", BOOKING, format="json", HTTP_IDEMPOTENCY_KEY="ride-1")
+    assert failed.status_code == status.HTTP_502_BAD_GATEWAY
+    assert retried.status_code == status.HTTP_201_CREATED
+    assert "Idempotent-Replayed" not in retried
+
+
+@pytest.mark.django_db
+def test_key_reused_with_another_body_is_refused():
+    """Test a key cannot replay a response to a different request"""
+    client = APIClient()
+    client.post("/passenger/passengers/", SIGNUP, format="json", HTTP_IDEMPOTENCY_KEY="signup-1")
+    response = client.post(
+        "/passenger/passengers/", {**SIGNUP, "email": "other@example.com"}, format="json", HTTP_IDEMPOTENCY_KEY="signup-1"
+    )
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    assert response.data["code"] == "IDEMPOTENCY_KEY_REUSED"
+
+
+def test_invalid_key_is_refused():
+    """Test an empty or oversized key is a 400"""
+    for key in ["", "x" * (idempotency.MAX_KEY_LENGTH + 1)]:
+        response = slow_post(key)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data["code"] == "INVALID_IDEMPOTENCY_KEY"
+
+
+def test_concurrent_duplicates_wait_for_the_first_response():
+    """Test duplicates arriving mid-request get the first response rather than running the handler"""
+    SlowView.calls = 0
+    SlowView.release.clear()
+    responses = []
+    threads = [threading.Thread(target=lambda: responses.append(slow_post("burst"))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while SlowView.calls == 0:
+        threading.Event().wait(0.01)
+    SlowView.release.set()
+    for thread in threads:
+        thread.join()
+
+    assert SlowView.calls == 1
+    assert [response.data for response in responses] == [{"call": 1}] * 4
+    assert sum(response.has_header("Idempotent-Replayed") for response in responses) == 3
+
+
+def test_duplicate_gives_up_while_the_first_is_running(settings):
+    """Test a duplicate waiting longer than IDEMPOTENCY_WAIT gets a 409"""
+    settings.IDEMPOTENCY_WAIT = 0
+    caches["idempotency"].add(idempotency._lock_key("slow", "busy"), "someone-else")
+    response = slow_post("busy")
+    assert response.status_code == status.HTTP_409_CONFLICT
+    assert response.data["code"] == "IDEMPOTENCY_KEY_IN_USE"
+
+
+def test_cache_outage_runs_the_request(settings):
+    """Test the handler still runs when the idempotency cache is down"""
+    SlowView.calls = 0
+    SlowView.release.set()
+    with patch.object(caches["idempotency"], "get", side_effect=ConnectionError("redis down")):
+        response = slow_post("key")
+    assert response.status_code == status.HTTP_201_CREATED
+    assert SlowView.calls == 1
@@ -0,0 +1,129 @@
+import io
+import json
+
+import pytest
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from passenger.accounts import normalize_phone
+from passenger.importer import PassengerImporter, import_passengers
+from passenger.models import Passenger
+
+
+def ndjson(*rows):
+    return [json.dumps(row) + "\n" for row in rows]
+
+
+def person(n, **overrides):
+    row = {"email": f"rider{n}@example.com", "phone": f"+1555000{n:04d}", "first_name": "Ada", "last_name": "Lovelace"}
+    row.update(overrides)
+    return row
+
+
+def test_normalize_phone():
+    """Test separators are stripped, 00 becomes + and junk is refused"""
+    assert normalize_phone(" +1 (555) 000-1234 ") == "+15550001234"
+    assert normalize_phone("0044 20 7946 0958") == "+442079460958"
+    assert normalize_phone("12345") is None
+    assert normalize_phone("phone") is None
+
+
+@pytest.mark.django_db
+def test_import_creates_and_normalizes():
+    """Test valid rows are created with normalized email and phone"""
+    result = import_passengers(ndjson(person(1, email=" Rider1@Example.COM "), person(2, phone="+1 555 000-0002")))
+    assert (result.rows, result.created, result.rejected) == (2, 2, 0)
+    assert set(Passenger.objects.values_list("email", "phone")) == {
+        ("rider1@example.com", "+15550000001"), ("rider2@example.com", "+15550000002"),
+    }
+
+
+@pytest.mark.django_db
+def test_import_rejects_per_row():
+    """Test invalid and duplicate rows are reported by row number while the rest are imported"""
+    Passenger.objects.create(email="rider1@example.com", phone="+15559999999", first_name="A", last_name="B")
+    lines = ndjson(
+        person(1),                              # exists in the database
+        person(2),
+        person(3, email="RIDER2@example.com"),  # duplicate of row 2 after normalisation
+        person(4, phone="+15550000002"),        # phone of row 2
+        person(5, phone="12"),
+        person(6, last_name=""),
+    ) + ["not json\n", "\n"] + ndjson(person(7))
+    result = import_passengers(lines, chunk_size=3)
+
+    assert (result.rows, result.created, result.rejected) == (8, 2, 6)
+    assert sorted((reject["row"], reject["code"]) for reject in result.rejects) == [
+        (1, "DUPLICATE_EMAIL"),
+        (3, "DUPLICATE_EMAIL"),
+        (4, "DUPLICATE_PHONE"),
+        (5, "INVALID_PHONE"),
+        (6, "MISSING_FIELDS"),
+        (7, "INVALID_ROW"),
+    ]
+    assert Passenger.objects.filter(email__in=["rider2@example.com", "rider7@example.com"]).count() == 2
+
+
+@pytest.mark.django_db
+def test_insert_conflict_rejects_only_conflicting_rows():
+    """Test a passenger created between the check and the INSERT rejects just that row"""
+    Passenger.objects.create(email="rider1@example.com", phone="+15559999999", first_name="A", last_name="B")
+    importer = PassengerImporter()
+    importer._insert([(1, person(1)), (2, person(2))])
+    assert importer.created == 1
+    assert importer.rejects[0]["code"] == "DUPLICATE_EMAIL"
+    assert Passenger.objects.get(email="rider2@example.com").created_at is not None
+
+
+@pytest.mark.django_db
+def test_import_csv_queries_once_per_chunk(django_assert_max_num_queries):
+    """Test duplicate detection costs one query per chunk, not one per row"""
+    lines = ["email,phone,first_name,last_name\n"] + [
+        f"rider{n}@example.com,+1555000{n:04d},Ada,Lovelace\n" for n in range(100)
+    ]
+    # Per chunk of 50: one duplicate check and one bulk INSERT (plus savepoints).
+    with django_assert_max_num_queries(2 * 4):
+        result = import_passengers(lines, format="csv", chunk_size=50)
+    assert result.created == 100
+
+
+@pytest.mark.django_db
+def test_import_endpoint_streams_body():
+    """Test the endpoint imports an NDJSON body and a CSV upload"""
+    client = APIClient()
+    body = "".join(ndjson(person(1), person(1)))
+    response = client.generic("POST", "/passenger/passengers/import/", body, content_type="application/x-ndjson")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data["data"]["created"] == 1
+    assert response.data["data"]["rejects"][0]["code"] == "DUPLICATE_EMAIL"
+    assert response.data["data"]["rejects_truncated"] is False
+
+    upload = SimpleUploadedFile(
+        "riders.csv", b"email,phone,first_name,last_name\nrider2@example.com,+15550000002,Ada,Lovelace\n",
+        content_type="text/csv",
+    )
+    response = client.post("/passenger/passengers/import/", {"file": upload}, format="multipart")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data["data"]["created"] == 1
+    assert Passenger.objects.count() == 2
+
+
+def test_import_endpoint_requires_data():
+    """Test an empty import request is rejected"""
+    response = APIClient().post("/passenger/passengers/import/", {}, format="multipart")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data["code"] == "BAD_REQUEST"
+
+
+@pytest.mark.django_db
+def test_import_command(tmp_path):
+    """Test the management command imports a file and writes rejects"""
+    source = tmp_path / "riders.ndjson"
+    source.write_text("".join(ndjson(person(1), person(2, email="bad"))))
+    rejects = tmp_path / "rejects.ndjson"
+    out = io.StringIO()
+    call_command("import_passengers", str(source), rejects=str(rejects), stdout=out)
+    assert "Imported 1 of 2 passengers (1 rejected)" in out.getvalue()
+    assert json.loads(rejects.read_text())["code"] == "INVALID_EMAIL"
@@ -0,0 +1,107 @@
+import json
+import logging
+
+import pytest
+
+from passenger.log import DebugSampler, JsonFormatter, QueueingHandler
+
+
+@pytest.fixture
+def log_file(tmp_path):
+    return tmp_path / "passenger.log"
+
+
+@pytest.fixture
+def make_logger():
+    loggers = []
+
+    def make(handler, level=logging.DEBUG):
+        logger = logging.getLogger(f"passenger.tests.log{len(loggers)}")
+        logger.propagate = False
+        logger.setLevel(level)
+        logger.addHandler(handler)
+        loggers.append((logger, handler))
+        return logger
+
+    yield make
+    for logger, handler in loggers:
+        logger.removeHandler(handler)
+        handler.close()
+
+
+def read_lines(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_json_formatter_includes_extra_fields_and_exceptions():
+    """Test records become one JSON object with their extra fields and traceback"""
+    record = logging.makeLogRecord({
+        "name": "passenger", "levelno": logging.ERROR, "levelname": "ERROR",
+        "msg": "Ride %s failed", "args": ("r1",), "ride": {"ride_type": "standard"},
+    })
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        import sys
+        record.exc_info = sys.exc_info()
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["message"] == "Ride r1 failed"
+    assert entry["level"] == "ERROR" and entry["logger"] == "passenger"
+    assert entry["ride"] == {"ride_type": "standard"}
+    assert "ValueError: boom" in entry["exc_info"]
+
+
+def test_handler_writes_json_lines_from_the_background_thread(log_file, make_logger):
+    """Test queued records all reach the file once flushed"""
+    handler = QueueingHandler(str(log_file))
+    handler.setFormatter(JsonFormatter())
+    logger = make_logger(handler)
+    for n in range(1000):
+        logger.info("booking %d", n, extra={"n": n})
+    handler.flush()
+    lines = read_lines(log_file)
+    assert [line["n"] for line in lines] == list(range(1000))
+    assert lines[0]["message"] == "booking 0"
+
+
+def test_full_queue_drops_and_reports(log_file, make_logger, monkeypatch):
+    """Test a full queue drops records instead of blocking, and says so later"""
+    handler = QueueingHandler(str(log_file), max_queue=2)
+    handler.setFormatter(JsonFormatter())
+    logger = make_logger(handler)
+    monkeypatch.setattr(handler, "_ensure_started", lambda: None)  # writer stalled
+    for n in range(5):
+        logger.warning("record %d", n)
+    assert handler.dropped == 3
+
+    monkeypatch.undo()
+    handler._ensure_started()
+    handler.flush()
+    logger.warning("after")
+    handler.flush()
+    messages = [line["message"] for line in read_lines(log_file)]
+    assert messages == ["record 0", "record 1", "Log queue was full; dropped 3 records.", "after"]
+
+
+def test_disabled_levels_are_never_formatted(log_file, make_logger):
+    """Test a DEBUG call below the logger's level never renders its arguments"""
+    class Loud:
+        def __str__(self):
+            raise AssertionError("formatted")
+
+    handler = QueueingHandler(str(log_file))
+    logger = make_logger(handler, level=logging.INFO)
+    logger.debug("ride %s", Loud())
+    handler.flush()
+    assert not log_file.exists()
+
+
+def test_debug_sampler_only_thins_debug_records():
+    """Test sampling applies to DEBUG and lets INFO and above through"""
+    debug = logging.makeLogRecord({"levelno": logging.DEBUG})
+    info = logging.makeLogRecord({"levelno": logging.INFO})
+    assert not DebugSampler(rate=0).filter(debug)
+    assert DebugSampler(rate=0).filter(info)
+    assert DebugSampler(rate=1).filter(debug)
+    kept = sum(DebugSampler(rate=0.1).filter(debug) for _ in range(10000))
+    assert 700 < kept < 1300
@@ -0,0 +1,157 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+from django.core.cache import caches
+from django.test import AsyncClient
+from prometheus_client import REGISTRY
+from rest_framework.test import APIClient
+
+from passenger import metrics
+from passenger.estimate_cache import EstimateCache, LRUCache
+from passenger.services import NodeAPIError, aget_fare_and_hashed_location, get_fare_and_hashed_location
+
+RIDE = {
+    "pickup_location": {"latitude": 37.7749, "longitude": -122.4194},
+    "dropoff_location": {"latitude": 37.8044, "longitude": -122.2711},
+    "ride_type": "standard",
+}
+ESTIMATE = {"data": {"pickup_geohash": "9q8yyk8", "dropoff_geohash": "9q9p1dh", "distance_km": 13.36, "estimated_fare": 26.72}}
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+@pytest.fixture
+def estimate_cache():
+    caches["estimates"].clear()
+    with patch("passenger.services.get_estimate_cache", return_value=EstimateCache(local=LRUCache(maxsize=10, ttl=60))):
+        yield
+    caches["estimates"].clear()
+
+
+@pytest.mark.django_db
+def test_requests_are_timed_per_view_with_their_queries():
+    """Test a request records latency and query counts under its URL name"""
+    labels = {"view": "add-passenger", "method": "GET", "status": "200"}
+    before = sample("http_request_duration_seconds_count", **labels)
+    queries_before = sample("db_queries_per_request_sum", view="add-passenger")
+
+    assert APIClient().get("/passenger/passengers/", {"count": "true"}).status_code == 200
+
+    assert sample("http_request_duration_seconds_count", **labels) == before + 1
+    assert sample("db_queries_per_request_sum", view="add-passenger") == queries_before + 2
+    assert sample("http_requests_in_progress", method="GET") == 0
+
+
+def test_metrics_endpoint_serves_the_registry():
+    """Test /metrics returns the Prometheus text format, on the async path too"""
+    response = APIClient().get("/metrics")
+    assert response.status_code == 200
+    assert response["Content-Type"].startswith("text/plain")
+    assert b"http_request_duration_seconds_bucket" in response.content
+
+    before = sample("http_request_duration_seconds_count", view="metrics", method="GET", status="200")
+    assert asyncio.run(AsyncClient().get("/metrics")).status_code == 200
+    assert sample("http_request_duration_seconds_count", view="metrics", method="GET", status="200") == before + 1
+
+
+def test_multiprocess_registry_reads_the_shared_directory(tmp_path, monkeypatch):
+    """Test PROMETHEUS_MULTIPROC_DIR switches /metrics to aggregating worker files"""
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    assert metrics.metrics_registry() is not REGISTRY
+    monkeypatch.delenv("PROMETHEUS_MULTIPROC_DIR")
+    assert metrics.metrics_registry() is REGISTRY
+
+
+def test_geo_estimates_are_timed_by_source(estimate_cache):
+    """Test estimator calls and cache hits are told apart"""
+    estimator = sample("geo_estimate_duration_seconds_count", source="estimator", outcome="ok")
+    cache = sample("geo_estimate_duration_seconds_count", source="cache", outcome="ok")
+    with patch("passenger.services.GeoEstimatorClient.estimate", return_value=ESTIMATE):
+        get_fare_and_hashed_location(RIDE)
+        asyncio.run(aget_fare_and_hashed_location(RIDE))
+    assert sample("geo_estimate_duration_seconds_count", source="estimator", outcome="ok") == estimator + 1
+    assert sample("geo_estimate_duration_seconds_count", source="cache", outcome="ok") == cache + 1
+
+
+def test_estimate_cache_lookups_are_counted_by_tier(estimate_cache):
+    """Test the cache's hits per tier, misses and Redis errors reach Prometheus"""
+    def counts():
+        return (
+            sample("estimate_cache_hits_total", tier="local"),
+            sample("estimate_cache_hits_total", tier="remote"),
+            sample("estimate_cache_misses_total"),
+            sample("estimate_cache_errors_total", tier="remote"),
+        )
+
+    before = counts()
+    with patch("passenger.services.GeoEstimatorClient.estimate", return_value=ESTIMATE):
+        get_fare_and_hashed_location(RIDE)  # miss, then stored in both tiers
+        get_fare_and_hashed_location(RIDE)  # local hit
+    cache = EstimateCache(local=LRUCache(maxsize=10, ttl=60))
+    key = cache.make_key(RIDE["pickup_location"], RIDE["dropoff_location"], RIDE["ride_type"])
+    assert cache.get(key) == ESTIMATE  # remote hit in a fresh process
+    with patch.object(caches["estimates"], "get", side_effect=ConnectionError("redis down")):
+        cache.get("estimate:v1:standard:unknown")  # error, then miss
+    assert tuple(after - prior for after, prior in zip(counts(), before)) == (1, 1, 2, 1)
+
+
+def test_fallback_estimates_are_labelled_fallback(estimate_cache, settings):
+    """Test local stand-ins for a failed estimator call are told apart from upstream answers, and not cached"""
+    settings.GEO_ESTIMATION_MODE = "fallback"
+    fallback = sample("geo_estimate_duration_seconds_count", source="fallback", outcome="ok")
+    estimator = sample("geo_estimate_duration_seconds_count", source="estimator", outcome="ok")
+    with patch("passenger.services.GeoEstimatorClient.estimate", side_effect=NodeAPIError("down")), \
+            patch("passenger.services.AsyncGeoEstimatorClient.estimate", side_effect=NodeAPIError("down")):
+        response = APIClient().post("/passenger/rides/book/", RIDE, format="json")
+        asyncio.run(aget_fare_and_hashed_location(RIDE))
+    assert response.status_code == 201
+    assert response.data["data"]["estimate_source"] == "fallback"
+    assert sample("geo_estimate_duration_seconds_count", source="fallback", outcome="ok") == fallback + 2
+    assert sample("geo_estimate_duration_seconds_count", source="estimator", outcome="ok") == estimator
+
+    with patch("passenger.services.GeoEstimatorClient.estimate", return_value=ESTIMATE):
+        assert "source" not in get_fare_and_hashed_location(RIDE)
+        response = APIClient().post("/passenger/rides/book/", RIDE, format="json")
+    assert "estimate_source" not in response.data["data"]
+
+
+def test_geo_estimate_errors_are_counted(estimate_cache):
+    """Test a failing estimator call is counted by exception"""
+    errors = sample("geo_estimate_errors_total", error="NodeAPIError")
+    with patch("passenger.services.GeoEstimatorClient.estimate", side_effect=NodeAPIError("down")):
+        with pytest.raises(NodeAPIError):
+            get_fare_and_hashed_location(RIDE)
+    assert sample("geo_estimate_errors_total", error="NodeAPIError") == errors + 1
+    assert sample("geo_estimate_duration_seconds_count", source="estimator", outcome="error") >= 1
+
+
+def test_celery_tasks_record_queue_wait_and_duration():
+    """Test the task signals time queueing from the publish stamp and the run by state"""
+    headers = {}
+    metrics._stamp_task(headers=headers)
+    task = SimpleNamespace(name="passenger.tasks.demo", request=SimpleNamespace(published_at=headers["published_at"], retries=0))
+    waits = sample("celery_task_queue_wait_seconds_count", task=task.name)
+    runs = sample("celery_task_duration_seconds_count", task=task.name, state="SUCCESS")
+
+    metrics._task_prerun(task_id="t1", task=task)
+    metrics._task_postrun(task_id="t1", task=task, state="SUCCESS")
+
+    assert sample("celery_task_queue_wait_seconds_count", task=task.name) == waits + 1
+    assert sample("celery_task_duration_seconds_count", task=task.name, state="SUCCESS") == runs + 1
+    assert "t1" not in metrics._task_started
+
+
+def test_importing_tasks_connects_task_signals():
+    """Test the task metric receivers are connected once passenger.tasks is loaded"""
+    from celery.signals import before_task_publish, task_postrun
+
+    import passenger.tasks  # noqa: F401
+
+    metrics.connect_task_signals()  # connecting twice must not double count
+    lookups = [key for key, _ in before_task_publish.receivers] + [key for key, _ in task_postrun.receivers]
+    assert sum(key[0] == "passenger.metrics._stamp_task" for key in lookups) == 1
+    assert sum(key[0] == "passenger.metrics._task_postrun" for key in lookups) == 1
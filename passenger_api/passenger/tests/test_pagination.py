@@ -0,0 +1,90 @@
+import datetime
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from passenger.models import Passenger
+from passenger.pagination import PageQueryError, decode_cursor, encode_cursor
+
+
+@pytest.fixture
+def passengers():
+    """25 passengers, ten of which share one created_at to exercise the tie-break"""
+    Passenger.objects.bulk_create(
+        Passenger(email=f"rider{n}@example.com", phone=f"+1555{n:07d}", first_name="Ada", last_name="Lovelace")
+        for n in range(25)
+    )
+    base = timezone.now() - datetime.timedelta(days=1)
+    for n, passenger in enumerate(Passenger.objects.order_by("passenger_id")):
+        created_at = base if 10 <= n < 20 else base + datetime.timedelta(minutes=n)
+        Passenger.objects.filter(pk=passenger.pk).update(created_at=created_at)
+    return list(Passenger.objects.order_by("-created_at", "-passenger_id").values_list("passenger_id", flat=True))
+
+
+def list_passengers(**params):
+    return APIClient().get("/passenger/passengers/", params)
+
+
+def test_cursor_round_trip():
+    """Test a cursor decodes to the row it was made from"""
+    created_at = timezone.now()
+    assert decode_cursor(encode_cursor(created_at, 42)) == (created_at, 42)
+    for cursor in ["", "not a cursor", encode_cursor(created_at, 1)[:-3], "WyJ4IiwxXQ"]:
+        with pytest.raises(PageQueryError):
+            decode_cursor(cursor)
+
+
+@pytest.mark.django_db
+def test_pages_cover_every_passenger_once(passengers):
+    """Test walking the cursor returns every passenger once, newest first, across tied timestamps"""
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 4, **({"cursor": cursor} if cursor else {})}
+        response = list_passengers(**params)
+        assert response.status_code == status.HTTP_200_OK
+        data = response.data["data"]
+        assert "count" not in data
+        seen += [row["passenger_id"] for row in data["passengers"]]
+        cursor = data["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == passengers
+
+
+@pytest.mark.django_db
+def test_page_is_one_query_on_only_the_requested_columns(passengers):
+    """Test a page is a single SELECT of the requested fields plus the keyset columns"""
+    first = list_passengers(limit=10).data["data"]["next_cursor"]
+    with CaptureQueriesContext(connection) as queries:
+        response = list_passengers(fields="email", limit=10, cursor=first)
+    assert len(queries) == 1
+    sql = queries[0]["sql"]
+    assert '"email"' in sql and '"phone"' not in sql and '"first_name"' not in sql and "OFFSET" not in sql
+    assert all(list(row) == ["email"] for row in response.data["data"]["passengers"])
+
+
+@pytest.mark.django_db
+def test_count_only_on_request(passengers):
+    """Test the total is returned only when count is asked for"""
+    response = list_passengers(limit=5, count="true")
+    assert response.data["data"]["count"] == 25
+    assert len(response.data["data"]["passengers"]) == 5
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("params, code", [
+    ({"fields": "email,password"}, "INVALID_FIELDS"),
+    ({"limit": "0"}, "INVALID_LIMIT"),
+    ({"limit": "100000"}, "INVALID_LIMIT"),
+    ({"limit": "ten"}, "INVALID_LIMIT"),
+    ({"cursor": "bogus"}, "INVALID_CURSOR"),
+])
+def test_invalid_page_queries(params, code):
+    """Test malformed listing parameters are rejected"""
+    response = list_passengers(**params)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data["code"] == code
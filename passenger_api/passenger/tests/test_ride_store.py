@@ -0,0 +1,118 @@
+import time
+import uuid
+from unittest.mock import patch
+
+import pytest
+from django.db import OperationalError
+from django.db.models.query import QuerySet
+
+from passenger.models import Passenger, Ride
+from passenger.ride_store import RideWriteBuffer, build_ride
+
+
+def ride_request_data(**overrides):
+    data = {
+        "ride_id": str(uuid.uuid4()),
+        "pickup_location": {"latitude": 37.7749, "longitude": -122.4194},
+        "dropoff_location": {"latitude": 37.8044, "longitude": -122.2711},
+        "ride_type": "standard",
+        "estimated_fare": 26.72,
+        "distance_km": 13.36,
+        "pickup_geohash": "9q8yyk8",
+        "dropoff_geohash": "9q9p1dh",
+    }
+    data.update(overrides)
+    return data
+
+
+def test_build_ride_maps_booking_fields():
+    """Test the booking dict is mapped onto an unsaved Ride"""
+    data = ride_request_data()
+    ride = build_ride(data, passenger_id=3)
+    assert str(ride.ride_id) == data["ride_id"]
+    assert ride.passenger_id == 3
+    assert (ride.pickup_latitude, ride.dropoff_longitude) == (37.7749, -122.2711)
+    assert ride.status == Ride.STATUS_REQUESTED
+
+
+@pytest.mark.django_db
+def test_flush_writes_pending_rides_in_one_batch():
+    """Test pending rides are written together and counted"""
+    buffer = RideWriteBuffer(background=False)
+    for _ in range(3):
+        buffer.add(build_ride(ride_request_data()))
+    assert Ride.objects.count() == 0
+
+    assert buffer.flush() == 3
+    assert Ride.objects.count() == 3
+    assert buffer.stats() == {"buffered": 3, "written": 3, "dropped": 0, "requeued": 0, "flushes": 1, "pending": 0}
+
+
+@pytest.mark.django_db
+def test_flush_drops_only_rejected_rows():
+    """Test a row the database rejects does not take the rest of the batch with it"""
+    existing = build_ride(ride_request_data())
+    existing.save()
+    buffer = RideWriteBuffer(background=False)
+    buffer.add(build_ride(ride_request_data()))
+    buffer.add(build_ride(ride_request_data(ride_id=str(existing.ride_id))))  # duplicate key
+
+    assert buffer.flush() == 1
+    assert Ride.objects.count() == 2
+    assert buffer.stats()["dropped"] == 1
+
+
+@pytest.mark.django_db
+def test_flush_keeps_rides_while_the_database_is_unavailable():
+    """Test a connection error puts the batch back and backs off instead of dropping accepted rides"""
+    buffer = RideWriteBuffer(flush_interval=1.0, background=False)
+    for _ in range(3):
+        buffer.add(build_ride(ride_request_data()))
+
+    with patch.object(QuerySet, "bulk_create", side_effect=OperationalError("server closed the connection")), \
+            patch.object(Ride, "save") as save:
+        assert buffer.flush() == 0
+    save.assert_not_called()
+    stats = buffer.stats()
+    assert (stats["pending"], stats["requeued"], stats["dropped"]) == (3, 3, 0)
+    assert buffer._backoff() == 2.0
+
+    assert buffer.flush() == 3
+    assert Ride.objects.count() == 3
+    assert buffer._failures == 0
+
+
+@pytest.mark.django_db
+def test_requeued_rides_are_bounded_by_max_pending():
+    """Test an outage drops the oldest rides past max_pending rather than growing the buffer"""
+    buffer = RideWriteBuffer(max_pending=2, background=False)
+    rides = [build_ride(ride_request_data()) for _ in range(3)]
+    for ride in rides:
+        buffer.add(ride)
+    with patch.object(QuerySet, "bulk_create", side_effect=OperationalError("down")):
+        buffer.flush()
+    assert buffer._pending == rides[1:]
+    assert buffer.stats()["dropped"] == 1
+
+
+def test_add_asks_caller_to_flush_at_max_pending():
+    """Test the buffer signals back-pressure once max_pending rides are waiting"""
+    buffer = RideWriteBuffer(max_pending=2, background=False)
+    assert buffer.add(build_ride(ride_request_data())) is False
+    assert buffer.add(build_ride(ride_request_data())) is True
+
+
+@pytest.mark.django_db(transaction=True)
+def test_background_flush_on_batch_size():
+    """Test the flusher thread writes as soon as a full batch is pending"""
+    passenger = Passenger.objects.create(email="rider@example.com", phone="5550100", first_name="A", last_name="B")
+    buffer = RideWriteBuffer(batch_size=2, flush_interval=60)
+    try:
+        buffer.add(build_ride(ride_request_data(), passenger.passenger_id))
+        buffer.add(build_ride(ride_request_data(), passenger.passenger_id))
+        deadline = time.monotonic() + 5
+        while buffer.stats()["written"] < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        buffer.stop()
+    assert passenger.rides.count() == 2
@@ -0,0 +1,57 @@
+import pytest
+
+from passenger import schema
+
+
+@pytest.fixture
+def schema_file(tmp_path, settings):
+    path = tmp_path / "openapi.yml"
+    path.write_bytes(b"openapi: 3.0.3\ninfo:\n  title: Passenger API\n")
+    settings.OPENAPI_SCHEMA_FILE = str(path)
+    schema.reset_schema()
+    yield path
+    schema.reset_schema()
+
+
+def test_prebuilt_schema_is_served_with_an_etag(client, schema_file):
+    """Test the schema route serves the built file and answers 304 to a matching If-None-Match"""
+    response = client.get("/passenger/schema/")
+    assert response.status_code == 200
+    assert response.content == schema_file.read_bytes()
+    assert response["Content-Type"].startswith("application/vnd.oai.openapi")
+    assert "no-cache" in response["Cache-Control"]
+
+    not_modified = client.get("/passenger/schema/", HTTP_IF_NONE_MATCH=response["ETag"])
+    assert not_modified.status_code == 304
+    assert client.get("/passenger/schema/", HTTP_IF_NONE_MATCH='"stale"').status_code == 200
+
+
+def test_prebuilt_schema_is_read_once(client, schema_file):
+    """Test the file is read on the first request only"""
+    first = client.get("/passenger/schema/").content
+    schema_file.write_bytes(b"openapi: 3.1.0\n")
+    assert client.get("/passenger/schema/").content == first
+
+
+def test_missing_schema_is_503_outside_debug(client, tmp_path, settings):
+    """Test a missing schema file is reported rather than generated live"""
+    settings.OPENAPI_SCHEMA_FILE = str(tmp_path / "missing.yml")
+    schema.reset_schema()
+    response = client.get("/passenger/schema/")
+    assert response.status_code == 503
+    assert response.json()["code"] == "SCHEMA_NOT_BUILT"
+
+
+def test_debug_generates_the_schema_live(client, tmp_path, settings):
+    """Test DEBUG serves a freshly generated schema describing the passenger views"""
+    settings.DEBUG = True
+    settings.OPENAPI_SCHEMA_FILE = str(tmp_path / "missing.yml")
+    response = client.get("/passenger/schema/")
+    assert response.status_code == 200
+    assert b"/passenger/rides/book/" in response.content
+    assert not response.has_header("ETag")
+
+
+def test_schema_route_only_allows_safe_methods(client, schema_file):
+    assert client.post("/passenger/schema/").status_code == 405
+    assert client.head("/passenger/schema/").status_code == 200
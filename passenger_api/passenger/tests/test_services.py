@@ -0,0 +1,193 @@
+
+import asyncio
+
+import pytest
+import requests
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from rest_framework import status
+from rest_framework.test import APIClient
+from unittest.mock import patch, MagicMock
+from passenger.services import (
+    AsyncGeoEstimatorClient,
+    CircuitBreaker,
+    CircuitOpenError,
+    GeoEstimatorClient,
+    NodeAPIError,
+)
+
+
+PAYLOAD = {
+    "pickup_location": {"latitude": 37.7749, "longitude": -122.4194},
+    "dropoff_location": {"latitude": 37.8044, "longitude": -122.2711},
+    "ride_type": "standard",
+}
+
+ESTIMATE = {
+    "message": "Ride estimate calculated successfully",
+    "data": {
+        "pickup_geohash": "9q8yyk8",
+        "dropoff_geohash": "9q9p1dh",
+        "distance_km": 13.36,
+        "estimated_fare": 26.72,
+    },
+}
+
+
+def make_response(status_code, body=None):
+    response = MagicMock()
+    response.status_code = status_code
+    response.json.return_value = body
+    response.text = str(body)
+    return response
+
+
+@pytest.fixture
+def client():
+    return GeoEstimatorClient(
+        url="http://geo-estimator.test/api/estimate",
+        deadline=1.0,
+        max_retries=2,
+        backoff_base=0.001,
+        backoff_max=0.001,
+        breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60),
+    )
+
+
+def test_estimate_success(client):
+    """Test a healthy estimator response is returned as-is"""
+    with patch.object(client.session, "post", return_value=make_response(200, ESTIMATE)) as post:
+        assert client.estimate(PAYLOAD) == ESTIMATE
+    assert post.call_count == 1
+    assert post.call_args.kwargs["timeout"][1] <= client.read_timeout
+
+
+def test_estimate_retries_gateway_errors(client):
+    """Test 503s and connection errors are retried within the budget"""
+    responses = [make_response(503, {}), requests.ConnectionError("reset"), make_response(200, ESTIMATE)]
+    with patch.object(client.session, "post", side_effect=responses) as post:
+        assert client.estimate(PAYLOAD) == ESTIMATE
+    assert post.call_count == 3
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_estimate_does_not_retry_client_errors(client):
+    """Test a 400 is raised immediately and does not count against the breaker"""
+    with patch.object(client.session, "post", return_value=make_response(400, {"error": "Missing required fields."})) as post:
+        with pytest.raises(NodeAPIError):
+            client.estimate(PAYLOAD)
+    assert post.call_count == 1
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_estimate_gives_up_after_max_retries(client):
+    """Test retries are bounded"""
+    with patch.object(client.session, "post", side_effect=requests.Timeout("slow")) as post:
+        with pytest.raises(NodeAPIError):
+            client.estimate(PAYLOAD)
+    assert post.call_count == client.max_retries + 1
+
+
+def test_circuit_opens_and_fails_fast(client):
+    """Test the breaker stops calling the estimator after repeated failures"""
+    with patch.object(client.session, "post", side_effect=requests.ConnectionError("down")) as post:
+        for _ in range(2):
+            with pytest.raises(NodeAPIError):
+                client.estimate(PAYLOAD)
+        calls = post.call_count
+
+        with pytest.raises(CircuitOpenError):
+            client.estimate(PAYLOAD)
+        assert post.call_count == calls
+    assert client.breaker.state == CircuitBreaker.OPEN
+
+
+def test_circuit_half_open_probe_closes_on_success():
+    """Test a successful probe after the reset timeout closes the breaker"""
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.allow_request()
+    assert not breaker.allow_request()  # only one probe at a time
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_failed_probe_with_any_request_error_reopens_the_circuit():
+    """Test a non-connection RequestException during the half-open probe is a failure, not a stuck probe"""
+    client = GeoEstimatorClient(
+        url="http://geo-estimator.test/api/estimate", breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    )
+    client.breaker.record_failure()
+    with patch.object(client.session, "post", side_effect=requests.exceptions.ChunkedEncodingError("truncated")) as post:
+        with pytest.raises(NodeAPIError):
+            client.estimate(PAYLOAD)
+    assert post.call_count == 1
+
+    # The failed probe was recorded, so with reset_timeout=0 the next call probes again.
+    with patch.object(client.session, "post", return_value=make_response(200, ESTIMATE)):
+        assert client.estimate(PAYLOAD) == ESTIMATE
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_missing_estimator_url_is_a_node_api_error():
+    """Test an unset GEOES_NODE_API_URL fails as NodeAPIError (502) rather than an unhandled 500"""
+    client = GeoEstimatorClient(url=None)
+    with pytest.raises(NodeAPIError):
+        client.estimate(PAYLOAD)
+
+
+def test_book_ride_estimator_unavailable():
+    """Test the booking view maps estimator failures to 502"""
+    data = {
+        "pickup_location": {"latitude": 10.0, "longitude": 20.0},
+        "dropoff_location": {"latitude": 30.0, "longitude": 40.0},
+        "ride_type": "standard"
+    }
+    with patch('passenger.views.get_fare_and_hashed_location', side_effect=CircuitOpenError("circuit open")):
+        response = APIClient().post('/passenger/rides/book/', data, format='json')
+    assert response.status_code == status.HTTP_502_BAD_GATEWAY
+    assert response.data["code"] == "EXTERNAL_API_ERROR"
+
+
+def run_async_estimate(handler, **kwargs):
+    async def go():
+        app = web.Application()
+        app.router.add_post("/api/estimate", handler)
+        async with TestServer(app) as server:
+            client = AsyncGeoEstimatorClient(
+                url=str(server.make_url("/api/estimate")),
+                deadline=1.0,
+                backoff_base=0.001,
+                backoff_max=0.001,
+                breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60),
+                **kwargs,
+            )
+            try:
+                return await client.estimate(PAYLOAD)
+            finally:
+                await client.close()
+    return asyncio.run(go())
+
+
+def test_async_estimate_retries_then_succeeds():
+    """Test the async client retries gateway errors like the sync one"""
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            return web.Response(status=503)
+        return web.json_response(ESTIMATE)
+
+    assert run_async_estimate(handler) == ESTIMATE
+    assert len(calls) == 2
+
+
+def test_async_estimate_times_out():
+    """Test a slow estimator surfaces as NodeAPIError once the deadline is spent"""
+    async def handler(request):
+        await asyncio.sleep(1)
+        return web.json_response(ESTIMATE)
+
+    with pytest.raises(NodeAPIError):
+        run_async_estimate(handler, read_timeout=0.05, max_retries=1)
@@ -0,0 +1,48 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+
+PRINT_DATABASE = (
+    "import json, passenger_api.settings as s\n"
+    "print(json.dumps(s.DATABASES['default'], default=str))\n"
+)
+
+
+def database_settings(**env):
+    """DATABASES['default'] as the settings module builds it under `env`."""
+    output = subprocess.run(
+        [sys.executable, "-c", PRINT_DATABASE],
+        cwd=settings.BASE_DIR, env={**os.environ, **env}, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output)
+
+
+def test_sqlite_is_the_default():
+    """Test the services stay on SQLite unless DB_ENGINE says otherwise"""
+    database = database_settings(DB_ENGINE="sqlite3")
+    assert database["ENGINE"] == "django.db.backends.sqlite3"
+
+
+def test_postgresql_is_pooled_with_timeouts_and_prepared_statements():
+    """Test DB_ENGINE=postgresql configures the pool, health checks, statement timeout and prepares"""
+    database = database_settings(DB_ENGINE="postgresql", DB_HOST="db", DB_STATEMENT_TIMEOUT_MS="2500", DB_POOL_MAX_SIZE="8")
+    assert database["ENGINE"] == "django.db.backends.postgresql"
+    assert database["HOST"] == "db"
+    assert database["CONN_MAX_AGE"] == 0  # the pool owns connection reuse
+    assert database["CONN_HEALTH_CHECKS"] is True
+    assert database["OPTIONS"]["pool"] == {"min_size": 2, "max_size": 8, "timeout": 10.0}
+    assert database["OPTIONS"]["options"] == "-c statement_timeout=2500"
+    assert database["OPTIONS"]["server_side_binding"] is True
+    assert database["OPTIONS"]["prepare_threshold"] == 5
+
+
+def test_postgresql_without_pool_keeps_persistent_connections():
+    """Test DB_POOL_MAX_SIZE=0 falls back to persistent connections, and an empty threshold disables prepares"""
+    database = database_settings(DB_ENGINE="postgresql", DB_POOL_MAX_SIZE="0", DB_PREPARE_THRESHOLD="")
+    assert "pool" not in database["OPTIONS"]
+    assert database["CONN_MAX_AGE"] == 600
+    assert database["OPTIONS"]["server_side_binding"] is False
+    assert database["OPTIONS"]["prepare_threshold"] is None
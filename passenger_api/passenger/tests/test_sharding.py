@@ -0,0 +1,254 @@
+import io
+import json
+from collections import Counter
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from django.core.management import call_command
+from django.db import OperationalError
+from django.db.models.query import QuerySet
+from django.test import Client
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from passenger import sharding
+from passenger.importer import import_passengers
+from passenger.models import Passenger, PassengerKey, Ride, ShardSlot
+from passenger.sharding import SLOT_COUNT, ShardRouter
+
+SHARDS = ["shard_0", "shard_1"]
+pytestmark = pytest.mark.django_db(databases=["default", *SHARDS])
+
+ESTIMATE = {
+    "message": "Ride estimate calculated successfully",
+    "data": {"pickup_geohash": "s3y0zh7", "dropoff_geohash": "stq4s3x", "distance_km": 3040.6, "estimated_fare": 6081.2},
+}
+BOOKING = {
+    "pickup_location": {"latitude": 10.0, "longitude": 20.0},
+    "dropoff_location": {"latitude": 30.0, "longitude": 40.0},
+    "ride_type": "standard",
+}
+
+
+def person(n, **overrides):
+    return {"email": f"rider{n}@example.com", "phone": f"+1555000{n:04d}", "first_name": "Ada", "last_name": "Lovelace", **overrides}
+
+
+@pytest.fixture
+def shards(settings):
+    """Sharding on: even slots on shard_0, odd slots on shard_1."""
+    settings.PASSENGER_SHARDS = SHARDS
+    settings.PASSENGER_SHARD_MAP_TTL = 0
+    ShardSlot.objects.bulk_create(ShardSlot(slot=slot, alias=SHARDS[slot % 2]) for slot in range(SLOT_COUNT))
+    sharding.reset_shard_map()
+    yield
+    sharding.reset_shard_map()
+
+
+def where(passenger_id):
+    return [alias for alias in ["default", *SHARDS] if Passenger.objects.using(alias).filter(pk=passenger_id).exists()]
+
+
+def test_slots():
+    """Test passengers are slotted by id and anonymous rides by pickup region"""
+    assert sharding.slot_for_passenger(SLOT_COUNT + 3) == 3
+    assert sharding.slot_for_region("s3y0zh7") == sharding.slot_for_region("s3y0abc")
+    assert sharding.slot_for_ride(Ride(passenger_id=7, pickup_geohash="s3y0zh7")) == 7
+    assert sharding.slot_for_ride(Ride(pickup_geohash="s3y0zh7")) == sharding.slot_for_region("s3y0")
+    assert Counter(sharding.even_layout(SHARDS)) == {"shard_0": 512, "shard_1": 512}
+
+
+def test_rebalance_moves_only_the_surplus():
+    """Test adding a shard moves a third of the slots, all onto the new shard"""
+    assignments = sharding.even_layout(SHARDS)
+    plan = sharding.rebalance_plan(assignments, [*SHARDS, "shard_2"])
+    assert {target for _, target in plan} == {"shard_2"}
+    assert sum(len(slots) for slots in plan.values()) == 341
+
+    for (_, target), slots in plan.items():
+        for slot in slots:
+            assignments[slot] = target
+    assert sorted(Counter(assignments).values()) == [341, 341, 342]
+    assert sharding.rebalance_plan(assignments, [*SHARDS, "shard_2"]) == {}
+
+
+def test_router_keeps_the_directory_on_default():
+    """Test the directory tables migrate on default only and the rest on every shard"""
+    router = ShardRouter()
+    assert router.allow_migrate("default", "passenger", "passengerkey") is True
+    assert router.allow_migrate("shard_0", "passenger", "shardslot") is False
+    assert router.allow_migrate("shard_0", "passenger", "passenger") is True
+    assert router.allow_migrate("shard_0", "auth", "user") is None
+
+
+def test_signup_lands_on_the_passengers_shard(shards):
+    """Test signups get ids from the directory and rows on the shard of their slot"""
+    client = APIClient()
+    first = client.post("/passenger/passengers/", person(1), format="json")
+    second = client.post("/passenger/passengers/", person(2), format="json")
+    assert first.status_code == second.status_code == status.HTTP_201_CREATED
+
+    first_id, second_id = first.data["data"]["passenger_id"], second.data["data"]["passenger_id"]
+    assert where(first_id) == [sharding.shard_for_passenger(first_id)]
+    assert where(second_id) == [sharding.shard_for_passenger(second_id)]
+    assert {where(first_id)[0], where(second_id)[0]} == set(SHARDS)
+    assert PassengerKey.objects.count() == 2
+
+
+def test_duplicates_are_caught_across_shards(shards):
+    """Test an email taken on one shard is refused for a passenger bound for the other"""
+    client = APIClient()
+    client.post("/passenger/passengers/", person(1), format="json")
+    response = client.post("/passenger/passengers/", person(2, email="rider1@example.com"), format="json")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data["code"] == "DUPLICATE_EMAIL"
+    assert PassengerKey.objects.count() == 1
+    assert sum(Passenger.objects.using(alias).count() for alias in SHARDS) == 1
+
+
+def test_listing_merges_every_shard(shards):
+    """Test the passenger list pages through all shards newest first, with the total"""
+    ids = [sharding.create_passenger(**person(n)).passenger_id for n in range(5)]
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, "count": "true", **({"cursor": cursor} if cursor else {})}
+        data = APIClient().get("/passenger/passengers/", params).data["data"]
+        assert data["count"] == 5
+        seen += [row["passenger_id"] for row in data["passengers"]]
+        cursor = data["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == ids[::-1]
+
+
+def test_rides_follow_their_passenger(shards, settings):
+    """Test a booked ride is stored on its passenger's shard and found again by id"""
+    settings.RIDE_WRITE_MODE = "sync"
+    passenger = sharding.create_passenger(**person(1))
+    with patch("passenger.views.get_fare_and_hashed_location", return_value=ESTIMATE):
+        response = APIClient().post(
+            "/passenger/rides/book/", {**BOOKING, "passenger_id": passenger.passenger_id}, format="json"
+        )
+    assert response.status_code == status.HTTP_201_CREATED
+
+    ride_id = response.data["data"]["ride_id"]
+    shard = sharding.shard_for_passenger(passenger.passenger_id)
+    assert Ride.objects.using(shard).filter(ride_id=ride_id, passenger_id=passenger.passenger_id).exists()
+    assert list(passenger.rides.values_list("ride_id", flat=True)) == [Ride.objects.using(shard).get().ride_id]
+
+    status_response = APIClient().get(f"/passenger/rides/{ride_id}/status/")
+    assert status_response.status_code == status.HTTP_200_OK
+    assert status_response.data["data"]["status"] == "requested"
+
+
+def test_buffered_rides_are_written_per_shard(shards, ride_buffer):
+    """Test a flush splits the batch by shard: passengers' rides with them, anonymous ones by region"""
+    passenger = sharding.create_passenger(**person(1))
+    with patch("passenger.views.get_fare_and_hashed_location", return_value=ESTIMATE):
+        booked = APIClient().post("/passenger/rides/book/", {**BOOKING, "passenger_id": passenger.pk}, format="json")
+        anonymous = APIClient().post("/passenger/rides/book/", BOOKING, format="json")
+    assert ride_buffer.flush() == 2
+
+    passenger_shard = sharding.shard_for_passenger(passenger.pk)
+    region_shard = SHARDS[sharding.slot_for_region("s3y0zh7") % 2]
+    assert Ride.objects.using(passenger_shard).filter(ride_id=booked.data["data"]["ride_id"]).exists()
+    assert Ride.objects.using(region_shard).filter(ride_id=anonymous.data["data"]["ride_id"]).exists()
+
+
+def test_booking_checks_the_passengers_shard(shards):
+    """Test a passenger id whose shard does not have it is refused"""
+    response = APIClient().post("/passenger/rides/book/", {**BOOKING, "passenger_id": 999}, format="json")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data["code"][0] == "INVALID_PASSENGER"
+
+
+def test_async_booking_checks_the_passengers_shard(shards):
+    """Test the async booking view finds a passenger on its shard"""
+    passenger = sharding.create_passenger(**person(1))
+    body = json.dumps({**BOOKING, "passenger_id": passenger.pk})
+    with patch("passenger.views.aget_fare_and_hashed_location", AsyncMock(return_value=ESTIMATE)):
+        found = Client().post("/passenger/rides/book/async/", body, content_type="application/json")
+    missing = Client().post(
+        "/passenger/rides/book/async/", json.dumps({**BOOKING, "passenger_id": 999}), content_type="application/json"
+    )
+    assert found.status_code == status.HTTP_201_CREATED
+    assert missing.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_move_slot_keeps_rows_intact(shards, settings):
+    """Test moving a slot copies its passengers and rides as they were and removes them from the source"""
+    settings.RIDE_WRITE_MODE = "sync"
+    moving = sharding.create_passenger(**person(1))
+    staying = sharding.create_passenger(**person(3))
+    slot = sharding.slot_for_passenger(moving.pk)
+    source = sharding.shard_for_passenger(moving.pk)
+    target = next(alias for alias in SHARDS if alias != source)
+    with patch("passenger.views.get_fare_and_hashed_location", return_value=ESTIMATE):
+        APIClient().post("/passenger/rides/book/", {**BOOKING, "passenger_id": moving.pk}, format="json")
+
+    assert sharding.move_slots([slot], source, target, wait=0) == (1, 1)
+
+    assert where(moving.pk) == [target]
+    moved = sharding.passengers_for(moving.pk).get(pk=moving.pk)
+    assert (moved.email, moved.created_at) == (moving.email, moving.created_at)
+    assert moved.rides.count() == 1
+    assert not Ride.objects.using(source).filter(passenger_id=moving.pk).exists()
+    assert where(staying.pk) == [sharding.shard_for_passenger(staying.pk)]
+
+
+def test_init_adopts_default_and_rebalance_spreads_it(settings):
+    """Test an unsharded deployment keeps its data through init and rebalance"""
+    existing = [Passenger.objects.create(**person(n)) for n in range(3)]
+    settings.PASSENGER_SHARDS = SHARDS
+    settings.PASSENGER_SHARD_MAP_TTL = 0
+    sharding.reset_shard_map()
+    try:
+        call_command("shard_passengers", "init", stdout=io.StringIO())
+        assert set(sharding.get_shard_map().aliases()) == {"default"}
+        created = sharding.create_passenger(**person(3))
+        assert created.pk == existing[-1].pk + 1
+        assert where(created.pk) == ["default"]
+
+        call_command("shard_passengers", "rebalance", wait=0, stdout=io.StringIO())
+        assert Counter(sharding.get_shard_map().assignments()) == {"shard_0": 512, "shard_1": 512}
+        for passenger in [*existing, created]:
+            assert where(passenger.pk) == [sharding.shard_for_passenger(passenger.pk)]
+
+        out = io.StringIO()
+        call_command("shard_passengers", "status", stdout=out)
+        assert "shard_0" in out.getvalue() and "default" not in out.getvalue()
+    finally:
+        sharding.reset_shard_map()
+
+
+def test_import_checks_the_directory_and_writes_shards(shards):
+    """Test a sharded import rejects duplicates known to the directory and spreads the rest"""
+    sharding.create_passenger(**person(1))
+    lines = [json.dumps(row) + "\n" for row in (person(1), person(2), person(3))]
+    result = import_passengers(lines)
+    assert (result.created, result.rejected) == (2, 1)
+    assert result.rejects[0]["code"] == "DUPLICATE_EMAIL"
+    for key in PassengerKey.objects.all():
+        assert where(key.pk) == [sharding.shard_for_passenger(key.pk)]
+
+
+def test_import_reports_rows_of_a_failed_shard(shards):
+    """Test a shard failing mid-import rejects only its rows, which a retry then imports"""
+    bulk_create = QuerySet.bulk_create
+
+    def shard_1_down(queryset, objs, *args, **kwargs):
+        if queryset.model is Passenger and queryset.db == "shard_1":
+            raise OperationalError("shard_1 is down")
+        return bulk_create(queryset, objs, *args, **kwargs)
+
+    rows = [person(n) for n in range(1, 5)]
+    with patch.object(QuerySet, "bulk_create", shard_1_down):
+        result = import_passengers([json.dumps(row) + "\n" for row in rows])
+    assert (result.created, result.rejected) == (2, 2)
+    assert {reject["code"] for reject in result.rejects} == {"WRITE_FAILED"}
+    assert Passenger.objects.using("shard_0").count() == PassengerKey.objects.count() == 2
+
+    failed = [rows[reject["row"] - 1] for reject in result.rejects]
+    retried = import_passengers([json.dumps(row) + "\n" for row in failed])
+    assert (retried.created, retried.rejected) == (2, 0)
+    assert sum(Passenger.objects.using(alias).count() for alias in SHARDS) == PassengerKey.objects.count() == 4
@@ -0,0 +1,50 @@
+"""The modules copied into every service must not drift apart.
+
+passenger_api, driver_api and admin_api are built from separate Docker
+contexts, so shared code lives in each of them. These tests run from a full
+checkout and are skipped where only this service is present.
+"""
+import ast
+from pathlib import Path
+
+import pytest
+from django.conf import settings
+
+REPO = Path(settings.BASE_DIR).parent
+APPS = ["passenger_api/passenger", "driver_api/driver", "admin_api/admin_app"]
+IDENTICAL = ["accounts.py", "coldstart.py", "db_router.py"]
+
+pytestmark = pytest.mark.skipif(
+    not all((REPO / app).is_dir() for app in APPS), reason="needs the other services checked out alongside"
+)
+
+
+def definitions(path):
+    """Top-level functions, classes and assignments of a module, by name, as AST dumps."""
+    found = {}
+    for node in ast.parse(path.read_text()).body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            found[node.name] = ast.dump(node)
+        elif isinstance(node, ast.Assign):
+            for target in node.targets:
+                if isinstance(target, ast.Name):
+                    found[target.id] = ast.dump(node)
+    return found
+
+
+@pytest.mark.parametrize("module", IDENTICAL)
+def test_shared_modules_are_identical(module):
+    """Test each service carries the same copy of the shared modules"""
+    copies = {app: (REPO / app / module).read_text() for app in APPS}
+    assert len(set(copies.values())) == 1, f"{module} differs between {', '.join(APPS)}"
+
+
+def test_metrics_share_their_common_definitions():
+    """Test driver and admin metrics match, and passenger's extends them unchanged"""
+    driver, admin = (REPO / APPS[1] / "metrics.py").read_text(), (REPO / APPS[2] / "metrics.py").read_text()
+    assert driver == admin
+
+    common = definitions(REPO / APPS[1] / "metrics.py")
+    passenger = definitions(REPO / APPS[0] / "metrics.py")
+    changed = sorted(name for name, dump in common.items() if passenger.get(name) != dump)
+    assert not changed, f"passenger metrics.py differs from the shared copy in {changed}"
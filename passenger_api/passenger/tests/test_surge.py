@@ -0,0 +1,138 @@
+import pytest
+from rest_framework import status
+from rest_framework.test import APIClient
+from unittest.mock import patch
+
+from passenger import surge
+from passenger.surge import SlidingWindowCounter, SurgeEngine
+
+CELL = "9q8yy"
+
+
+def engine(**overrides):
+    options = {"window": 60, "bucket_seconds": 10, "min_demand": 2, "background": False}
+    options.update(overrides)
+    return SurgeEngine(**options)
+
+
+def test_sliding_window_drops_old_buckets():
+    """Test events leave the window once their bucket is older than the window"""
+    counter = SlidingWindowCounter(3)
+    counter.add(0)
+    counter.add(1, 2)
+    counter.add(2)
+    assert counter.total == 4
+    counter.add(3)
+    assert counter.total == 4  # bucket 0 fell out
+    counter.add(1)  # late, but still inside the window
+    assert counter.total == 5
+    counter.add(0)  # too old
+    assert counter.total == 5
+    counter.advance(10)
+    assert counter.total == 0
+
+
+def test_price_rounds_down_and_caps():
+    """Test multipliers follow the demand/supply ratio in steps up to the cap"""
+    e = engine(target_ratio=1.0, sensitivity=0.5, max_multiplier=2.0, step=0.1)
+    assert e.price(demand=1, supply=0) == 1.0  # below min_demand
+    assert e.price(demand=10, supply=10) == 1.0
+    assert e.price(demand=25, supply=10) == 1.7
+    assert e.price(demand=100, supply=10) == 2.0
+
+
+def test_recompute_publishes_per_cell_multipliers():
+    """Test a cell with more bookings than drivers surges and a balanced one does not"""
+    e = engine()
+    e.record_supply({CELL: 2, "9q8yz": 10}, now=0)
+    for _ in range(6):
+        e.record_demand(CELL, now=1)
+        e.record_demand("9q8yz", now=1)
+    assert e.multiplier(CELL) == 1.0  # not published yet
+
+    assert e.recompute(now=2) == 1
+    assert e.multiplier(CELL) == 2.0
+    assert e.multiplier(CELL + "k8p") == 2.0
+    assert e.multiplier("9q8yz") == 1.0
+
+
+def test_supply_is_averaged_over_samples():
+    """Test supply is the average of the samples in the window"""
+    e = engine()
+    e.record_supply({CELL: 1}, now=0)
+    e.record_supply({CELL: 5}, now=10)
+    for _ in range(9):
+        e.record_demand(CELL, now=10)
+    e.recompute(now=10)
+    assert e.multiplier(CELL) == 2.0  # 9 bookings / 3 drivers on average
+
+
+def test_no_surge_without_supply_samples():
+    """Test nothing surges before the driver service has been sampled"""
+    e = engine()
+    for _ in range(20):
+        e.record_demand(CELL, now=0)
+    assert e.recompute(now=0) == 0
+
+
+def test_idle_cells_are_dropped():
+    """Test cells with nothing left in the window are forgotten"""
+    e = engine()
+    e.record_supply({CELL: 1}, now=0)
+    for _ in range(5):
+        e.record_demand(CELL, now=0)
+    e.recompute(now=0)
+    assert e.multiplier(CELL) > 1.0
+
+    e.recompute(now=120)
+    assert e.multiplier(CELL) == 1.0
+    assert e.stats()["demand_cells"] == 0
+    assert e.stats()["supply_cells"] == 0
+
+
+def test_refresh_keeps_pricing_when_supply_source_fails():
+    """Test a failed supply poll keeps the samples already in the window"""
+    calls = []
+
+    def source(precision):
+        calls.append(precision)
+        if len(calls) > 1:
+            raise ConnectionError("driver service down")
+        return {CELL: 1}
+
+    e = engine(supply_source=source)
+    e.refresh(now=0)
+    for _ in range(4):
+        e.record_demand(CELL, now=5)
+    e.refresh(now=5)
+    assert calls == [5, 5]
+    assert e.multiplier(CELL) == 2.5
+
+
+@pytest.mark.django_db
+def test_booking_applies_surge(settings):
+    """Test a booking counts as demand and is priced with its cell's multiplier"""
+    settings.SURGE_ENABLED = True
+    settings.RIDE_WRITE_MODE = "sync"
+    e = engine(min_demand=1)
+    e.record_supply({"s3y0z": 1}, now=None)
+    e.record_demand("s3y0z")
+    e.record_demand("s3y0z")
+    e.recompute()
+    estimate = {"data": {
+        "pickup_geohash": "s3y0zh7", "dropoff_geohash": "sv8wrqf", "distance_km": 3040.6, "estimated_fare": 6081.2,
+    }}
+    data = {
+        "pickup_location": {"latitude": 10.0, "longitude": 20.0},
+        "dropoff_location": {"latitude": 30.0, "longitude": 40.0},
+        "ride_type": "standard",
+    }
+    with patch.object(surge, "_engine", e), \
+            patch('passenger.views.get_fare_and_hashed_location', return_value=estimate):
+        response = APIClient().post('/passenger/rides/book/', data, format='json')
+
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.data["data"]["surge_multiplier"] == 1.5
+    assert response.data["data"]["estimated_fare"] == 9121.8
+    assert e.stats()["demand_cells"] == 1
+    assert e._demand["s3y0z"].total == 3
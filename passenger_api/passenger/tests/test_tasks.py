@@ -0,0 +1,71 @@
+import uuid
+
+import pytest
+from unittest.mock import patch
+
+from passenger import booking_status
+from passenger.estimation import EstimationError
+from passenger.models import Ride
+from passenger.services import NodeAPIError
+from passenger.tasks import process_ride_booking
+
+
+ESTIMATE = {
+    "message": "Ride estimate calculated successfully",
+    "data": {
+        "pickup_geohash": "9q8yyk8",
+        "dropoff_geohash": "9q9p1dh",
+        "distance_km": 13.36,
+        "estimated_fare": 26.72,
+    },
+}
+
+
+@pytest.fixture
+def queued_booking(settings):
+    settings.RIDE_BOOKING_RETRY_DELAY = 0
+    ride_id = str(uuid.uuid4())
+    booking_status.set_status(ride_id, booking_status.QUEUED)
+    return {
+        "ride_id": ride_id,
+        "passenger_id": None,
+        "pickup_location": {"latitude": 37.7749, "longitude": -122.4194},
+        "dropoff_location": {"latitude": 37.8044, "longitude": -122.2711},
+        "ride_type": "standard",
+        "status": booking_status.QUEUED,
+        "booking_time": "2024-12-16 14:00:00",
+    }
+
+
+@pytest.mark.django_db
+def test_process_ride_booking_stores_ride(queued_booking):
+    """Test the worker estimates, stores the ride and publishes its status"""
+    with patch('passenger.tasks.get_fare_and_hashed_location', return_value=ESTIMATE):
+        process_ride_booking.apply(args=[queued_booking])
+        process_ride_booking.apply(args=[queued_booking])  # redelivery
+
+    assert Ride.objects.filter(ride_id=queued_booking["ride_id"]).count() == 1
+    status = booking_status.get_status(queued_booking["ride_id"])
+    assert status["status"] == Ride.STATUS_REQUESTED
+    assert status["ride"]["estimated_fare"] == 26.72
+
+
+def test_process_ride_booking_retries_estimator_errors(queued_booking, settings):
+    """Test estimator outages are retried and reported once retries run out"""
+    settings.RIDE_BOOKING_MAX_RETRIES = 2
+    with patch('passenger.tasks.get_fare_and_hashed_location', side_effect=NodeAPIError("down")) as estimate:
+        process_ride_booking.apply(args=[queued_booking])
+
+    assert estimate.call_count == 3
+    status = booking_status.get_status(queued_booking["ride_id"])
+    assert status["status"] == booking_status.FAILED
+    assert status["code"] == "EXTERNAL_API_ERROR"
+
+
+def test_process_ride_booking_invalid_trip(queued_booking):
+    """Test trips the estimator rejects fail without retrying"""
+    with patch('passenger.tasks.get_fare_and_hashed_location', side_effect=EstimationError("Distance exceeds the maximum")) as estimate:
+        process_ride_booking.apply(args=[queued_booking])
+
+    assert estimate.call_count == 1
+    assert booking_status.get_status(queued_booking["ride_id"])["code"] == "INVALID_TRIP"
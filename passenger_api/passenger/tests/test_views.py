@@ -3,8 +3,11 @@ import pytest
 import uuid
 from rest_framework import status
 from rest_framework.test import APIClient
-from unittest.mock import patch
-from passenger.models import Passenger 
+from unittest.mock import patch, AsyncMock
+from django.test import Client
+from passenger.models import Passenger, Ride
+from passenger import estimation
+from passenger.services import NodeAPIError
 
 
 # @pytest.mark.django_db
@@ -40,12 +43,12 @@ def test_passenger_create_duplicate_email(api_client, create_passenger):
     """Test duplicate email"""
     existing_passenger = Passenger.objects.create(
         email="existing_email@example.com",
-        phone="1234567890",
+        phone="5556667777",
         first_name="John",
         last_name="Doe"
     )
     data = {
-        "email": "existing_email@example.com", 
+        "email": "Existing_Email@example.com ",
         "phone": "9876543210",
         "first_name": "Jane",
         "last_name": "Doe"
@@ -59,13 +62,13 @@ def test_passenger_create_duplicate_phone(api_client, create_passenger):
     """Test duplicate phone"""
     existing_passenger = Passenger.objects.create(
         email="email@example.com",
-        phone="1234567890",
+        phone="5556667777",
         first_name="John",
         last_name="Doe"
     )
     data = {
         "email": "new_email@example.com",
-        "phone": "1234567890",  # Already in database
+        "phone": "555-666-7777",  # Already in database, once normalized
         "first_name": "Jane",
         "last_name": "Doe"
     }
@@ -284,3 +287,237 @@ def test_book_ride_server_error(api_client):
 
 
 
+
+
+def batch_trip(ride_type="standard", pickup=(40.7128, -74.0060), dropoff=(40.7306, -73.9352)):
+    return {
+        "pickup_location": {"latitude": pickup[0], "longitude": pickup[1]},
+        "dropoff_location": {"latitude": dropoff[0], "longitude": dropoff[1]},
+        "ride_type": ride_type,
+    }
+
+
+def test_batch_estimate_success(api_client):
+    """Test every valid trip gets an estimate, in request order"""
+    data = {"trips": [batch_trip(), batch_trip("premium")]}
+    response = api_client.post('/passenger/rides/estimate/batch/', data, format='json')
+    assert response.status_code == status.HTTP_200_OK
+    results = response.data["data"]
+    assert [r["index"] for r in results] == [0, 1]
+    assert results[0]["data"]["pickup_geohash"] == "dr5regw"
+    assert results[1]["data"]["estimated_fare"] == round(results[0]["data"]["distance_km"] * 3, 2)
+
+
+def test_batch_estimate_dedupes_identical_trips(api_client):
+    """Test identical trips are computed once and fanned back out"""
+    data = {"trips": [batch_trip(), batch_trip(), batch_trip("premium"), batch_trip()]}
+    with patch('passenger.services.estimation.estimate_batch', wraps=estimation.estimate_batch) as estimate_batch:
+        response = api_client.post('/passenger/rides/estimate/batch/', data, format='json')
+    assert response.status_code == status.HTTP_200_OK
+    assert estimate_batch.call_count == 1
+    assert len(estimate_batch.call_args.args[0]) == 2
+    results = response.data["data"]
+    assert results[0]["data"] == results[1]["data"] == results[3]["data"]
+
+
+def test_batch_estimate_per_item_errors(api_client):
+    """Test invalid trips are reported individually without failing the batch"""
+    data = {"trips": [
+        batch_trip(),
+        batch_trip("luxury"),
+        {"pickup_location": {"latitude": 10.0}, "ride_type": "standard"},
+        batch_trip(dropoff=(40.7128, -74.0060)),
+        "not-a-trip",
+    ]}
+    response = api_client.post('/passenger/rides/estimate/batch/', data, format='json')
+    assert response.status_code == status.HTTP_200_OK
+    results = response.data["data"]
+    assert "data" in results[0]
+    assert results[1]["code"] == "INVALID_RIDE_TYPE"
+    assert results[2]["code"] == "BAD_REQUEST"
+    assert results[3]["code"] == "INVALID_TRIP"
+    assert results[4]["code"] == "BAD_REQUEST"
+
+
+def test_batch_estimate_requires_trips(api_client):
+    """Test a missing or empty trips list is rejected"""
+    response = api_client.post('/passenger/rides/estimate/batch/', {"trips": []}, format='json')
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data["code"] == "BAD_REQUEST"
+
+
+def test_batch_estimate_too_large(api_client, settings):
+    """Test batches over the configured limit are rejected"""
+    settings.BATCH_ESTIMATE_MAX_TRIPS = 2
+    data = {"trips": [batch_trip()] * 3}
+    response = api_client.post('/passenger/rides/estimate/batch/', data, format='json')
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data["code"] == "BATCH_TOO_LARGE"
+
+
+ASYNC_ESTIMATE = {
+    "message": "Ride estimate calculated successfully",
+    "data": {
+        "pickup_geohash": "s3y0zh7",
+        "dropoff_geohash": "stq4s3x",
+        "distance_km": 3040.6,
+        "estimated_fare": 6081.2,
+    },
+}
+
+
+def test_book_ride_async_valid():
+    """Test the async booking endpoint returns the same body as the sync one"""
+    data = {
+        "pickup_location": {"latitude": 10.0, "longitude": 20.0},
+        "dropoff_location": {"latitude": 30.0, "longitude": 40.0},
+        "ride_type": "standard"
+    }
+    with patch('passenger.views.aget_fare_and_hashed_location', new_callable=AsyncMock, return_value=ASYNC_ESTIMATE):
+        response = Client().post('/passenger/rides/book/async/', data, content_type='application/json')
+    assert response.status_code == status.HTTP_201_CREATED
+    body = response.json()
+    assert body["message"] == "Ride request created successfully."
+    assert "ride_id" in body["data"]
+    assert body["data"]["estimated_fare"] == 6081.2
+
+
+def test_book_ride_async_missing_fields():
+    """Test the async endpoint validates like the sync one"""
+    data = {
+        "pickup_location": {"latitude": 10.0, "longitude": 20.0},
+        "ride_type": "standard"
+    }
+    response = Client().post('/passenger/rides/book/async/', data, content_type='application/json')
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["code"][0] == "BAD_REQUEST"
+
+
+def test_book_ride_async_estimator_unavailable():
+    """Test the async endpoint maps estimator failures to 502"""
+    data = {
+        "pickup_location": {"latitude": 10.0, "longitude": 20.0},
+        "dropoff_location": {"latitude": 30.0, "longitude": 40.0},
+        "ride_type": "standard"
+    }
+    with patch('passenger.views.aget_fare_and_hashed_location', new_callable=AsyncMock, side_effect=NodeAPIError("down")):
+        response = Client().post('/passenger/rides/book/async/', data, content_type='application/json')
+    assert response.status_code == status.HTTP_502_BAD_GATEWAY
+    assert response.json()["code"] == "EXTERNAL_API_ERROR"
+
+
+@pytest.mark.django_db
+def test_book_ride_is_persisted_write_behind(api_client, create_passenger, ride_buffer):
+    """Test a booking is buffered and stored for its passenger on flush"""
+    data = {
+        "pickup_location": {"latitude": 10.0, "longitude": 20.0},
+        "dropoff_location": {"latitude": 30.0, "longitude": 40.0},
+        "ride_type": "standard",
+        "passenger_id": create_passenger.passenger_id,
+    }
+    with patch('passenger.views.get_fare_and_hashed_location', return_value=ASYNC_ESTIMATE):
+        response = api_client.post('/passenger/rides/book/', data, format='json')
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.data["data"]["status"] == "requested"
+    assert not Ride.objects.exists()
+
+    ride_buffer.flush()
+    ride = Ride.objects.get(ride_id=response.data["data"]["ride_id"])
+    assert ride.passenger == create_passenger
+    assert ride.pickup_geohash == "s3y0zh7"
+    assert str(ride.estimated_fare) == "6081.20"
+
+
+@pytest.mark.django_db
+def test_book_ride_sync_write_mode(api_client, settings):
+    """Test RIDE_WRITE_MODE=sync commits the ride before responding"""
+    settings.RIDE_WRITE_MODE = "sync"
+    data = {
+        "pickup_location": {"latitude": 10.0, "longitude": 20.0},
+        "dropoff_location": {"latitude": 30.0, "longitude": 40.0},
+        "ride_type": "premium",
+    }
+    with patch('passenger.views.get_fare_and_hashed_location', return_value=ASYNC_ESTIMATE):
+        response = api_client.post('/passenger/rides/book/', data, format='json')
+    assert response.status_code == status.HTTP_201_CREATED
+    assert Ride.objects.filter(ride_id=response.data["data"]["ride_id"], passenger__isnull=True).exists()
+
+
+@pytest.mark.django_db
+def test_book_ride_unknown_passenger(api_client):
+    """Test a booking for a passenger that does not exist is rejected"""
+    data = {
+        "pickup_location": {"latitude": 10.0, "longitude": 20.0},
+        "dropoff_location": {"latitude": 30.0, "longitude": 40.0},
+        "ride_type": "standard",
+        "passenger_id": 999,
+    }
+    response = api_client.post('/passenger/rides/book/', data, format='json')
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data["code"][0] == "INVALID_PASSENGER"
+
+
+def test_book_ride_queued_mode(api_client, settings):
+    """Test queued mode answers 202 and leaves estimation to the worker"""
+    settings.RIDE_BOOKING_MODE = "queued"
+    data = {
+        "pickup_location": {"latitude": 10.0, "longitude": 20.0},
+        "dropoff_location": {"latitude": 30.0, "longitude": 40.0},
+        "ride_type": "standard",
+    }
+    with patch('passenger.tasks.process_ride_booking.delay') as delay, \
+            patch('passenger.views.get_fare_and_hashed_location') as estimate:
+        response = api_client.post('/passenger/rides/book/', data, format='json')
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    ride_id = response.data["data"]["ride_id"]
+    assert response.data["data"]["status"] == "queued"
+    assert response.data["data"]["status_url"] == f"/passenger/rides/{ride_id}/status/"
+    assert delay.call_args.args[0]["ride_id"] == ride_id
+    estimate.assert_not_called()
+
+    response = api_client.get(f"/passenger/rides/{ride_id}/status/")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data["data"] == {"ride_id": ride_id, "status": "queued"}
+
+
+def test_book_ride_queue_unavailable(api_client, settings):
+    """Test a broker outage is reported as 503 rather than a lost booking"""
+    from kombu.exceptions import OperationalError
+
+    settings.RIDE_BOOKING_MODE = "queued"
+    data = {
+        "pickup_location": {"latitude": 10.0, "longitude": 20.0},
+        "dropoff_location": {"latitude": 30.0, "longitude": 40.0},
+        "ride_type": "standard",
+    }
+    with patch('passenger.tasks.process_ride_booking.delay', side_effect=OperationalError("Connection refused")):
+        response = api_client.post('/passenger/rides/book/', data, format='json')
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.data["code"] == "QUEUE_UNAVAILABLE"
+
+
+@pytest.mark.django_db
+def test_ride_status_unknown_ride(api_client):
+    """Test the status endpoint 404s for ids it has never seen"""
+    response = api_client.get(f"/passenger/rides/{uuid.uuid4()}/status/")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert response.data["code"] == "RIDE_NOT_FOUND"
+
+
+@pytest.mark.django_db
+def test_ride_status_reads_stored_ride(api_client, settings):
+    """Test rides that reached the database are reported from there"""
+    settings.RIDE_WRITE_MODE = "sync"
+    data = {
+        "pickup_location": {"latitude": 10.0, "longitude": 20.0},
+        "dropoff_location": {"latitude": 30.0, "longitude": 40.0},
+        "ride_type": "standard",
+    }
+    with patch('passenger.views.get_fare_and_hashed_location', return_value=ASYNC_ESTIMATE):
+        booked = api_client.post('/passenger/rides/book/', data, format='json').data["data"]
+
+    response = api_client.get(f"/passenger/rides/{booked['ride_id']}/status/")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data["data"]["status"] == "requested"
+    assert response.data["data"]["ride"]["estimated_fare"] == 6081.2
+    assert response.data["data"]["ride"]["pickup_geohash"] == booked["pickup_geohash"]
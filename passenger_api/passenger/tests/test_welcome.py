@@ -0,0 +1,172 @@
+import json
+import smtplib
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from passenger import welcome
+from passenger.importer import import_passengers
+from passenger.models import Passenger
+from passenger.tasks import send_welcome_emails
+
+
+class FlakyBackend(locmem.EmailBackend):
+    """locmem, except that the first message to an address in ``failing`` drops the connection."""
+
+    failing = set()
+    opened = 0
+    refuse_opens = 0
+
+    def open(self):
+        FlakyBackend.opened += 1
+        if FlakyBackend.refuse_opens:
+            FlakyBackend.refuse_opens -= 1
+            raise smtplib.SMTPConnectError(421, "Service not available")
+
+    def send_messages(self, messages):
+        for message in messages:
+            if message.to[0] in FlakyBackend.failing:
+                FlakyBackend.failing.discard(message.to[0])
+                raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+        return super().send_messages(messages)
+
+
+@pytest.fixture
+def backend(settings):
+    settings.EMAIL_BACKEND = "passenger.tests.test_welcome.FlakyBackend"
+    FlakyBackend.failing, FlakyBackend.opened, FlakyBackend.refuse_opens = set(), 0, 0
+    return FlakyBackend
+
+
+@pytest.fixture
+def batcher(monkeypatch, settings):
+    """Welcome emails on, batched by hand in twos."""
+    settings.WELCOME_EMAILS = True
+    batcher = welcome.WelcomeEmailBatcher(batch_size=2, background=False)
+    monkeypatch.setattr(welcome, "_batcher", batcher)
+    return batcher
+
+
+@pytest.fixture
+def passengers():
+    return [
+        Passenger.objects.create(email=f"rider{n}@example.com", phone=f"+1555000{n:04d}", first_name=f"Rider{n}", last_name="Doe")
+        for n in range(3)
+    ]
+
+
+def test_rate_limiter_spaces_calls():
+    """Test calls are spaced 1/rate apart without saving up idle time"""
+    now = [0.0]
+    limiter = welcome.RateLimiter(10, clock=lambda: now[0], sleep=lambda seconds: now.__setitem__(0, now[0] + seconds))
+    for _ in range(3):
+        limiter.wait()
+    assert now[0] == pytest.approx(0.2)
+
+    now[0] += 5
+    before = now[0]
+    limiter.wait()
+    limiter.wait()
+    assert now[0] == pytest.approx(before + 0.1)
+
+
+def test_rate_limiter_is_shared_by_concurrent_tasks(settings):
+    """Test batches sending at once in one process share WELCOME_EMAIL_RATE instead of each getting it"""
+    settings.WELCOME_EMAIL_RATE = 50
+    welcome.reset_rate_limiter()
+    limiter = welcome.get_rate_limiter()
+    threads = [threading.Thread(target=lambda: [welcome.get_rate_limiter().wait() for _ in range(3)]) for _ in range(4)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 12 sends at 50/s: the first goes at once, the last 11 intervals later.
+    assert time.monotonic() - started >= 11 / 50
+    assert welcome.get_rate_limiter() is limiter
+    welcome.reset_rate_limiter()
+
+
+@pytest.mark.django_db
+def test_batch_is_one_query_and_one_connection(passengers, backend):
+    """Test a batch loads its recipients with one query and sends over one connection"""
+    ids = [passenger.pk for passenger in passengers]
+    with CaptureQueriesContext(connection) as queries:
+        assert welcome.deliver(ids + [999]) == 3
+    assert len(queries) == 1
+    assert backend.opened == 1
+    assert [message.to for message in mail.outbox] == [[passenger.email] for passenger in passengers]
+    assert mail.outbox[0].body.startswith("Hello Rider0,")
+
+
+@pytest.mark.django_db
+def test_failed_batch_retries_only_the_unsent(passengers, backend, settings):
+    """Test a dropped connection retries the rest of the batch without resending"""
+    settings.WELCOME_EMAIL_RETRY_DELAY = 0
+    backend.failing = {passengers[1].email}
+    send_welcome_emails.apply(args=[[passenger.pk for passenger in passengers]])
+    assert sorted(message.to[0] for message in mail.outbox) == sorted(passenger.email for passenger in passengers)
+
+
+@pytest.mark.django_db
+def test_unreachable_relay_retries_the_whole_batch(passengers, backend, settings):
+    """Test a connect failure is retried like a dropped connection rather than losing the batch"""
+    settings.WELCOME_EMAIL_RETRY_DELAY = 0
+    backend.refuse_opens = 1
+    with pytest.raises(welcome.DeliveryFailed):
+        welcome.deliver([passenger.pk for passenger in passengers])
+
+    backend.refuse_opens = 1
+    send_welcome_emails.apply(args=[[passenger.pk for passenger in passengers]])
+    assert backend.opened == 3
+    assert sorted(message.to[0] for message in mail.outbox) == sorted(passenger.email for passenger in passengers)
+
+
+@pytest.mark.django_db
+def test_signups_are_queued_in_batches(batcher):
+    """Test signups only queue a task per batch of new passengers"""
+    client = APIClient()
+    for n in range(3):
+        response = client.post(
+            "/passenger/passengers/",
+            {"email": f"new{n}@example.com", "phone": f"+1555100{n:04d}", "first_name": "Ada", "last_name": "Lovelace"},
+            format="json",
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+
+    with patch("passenger.tasks.send_welcome_emails.apply_async") as apply_async:
+        assert batcher.flush() == 2
+    ids = list(Passenger.objects.order_by("pk").values_list("pk", flat=True))
+    assert [call.args[0] for call in apply_async.call_args_list] == [[ids[:2]], [ids[2:]]]
+
+
+@pytest.mark.django_db
+def test_signups_send_nothing_when_off(settings):
+    """Test WELCOME_EMAILS=False leaves new passengers alone"""
+    settings.WELCOME_EMAILS = False
+    with patch("passenger.welcome.get_welcome_batcher") as get_batcher:
+        welcome.queue_welcome_emails([1])
+    get_batcher.assert_not_called()
+
+
+@pytest.mark.django_db
+def test_imported_passengers_are_welcomed_on_the_batch_queue(batcher, settings):
+    """Test a bulk import queues every imported passenger on the batch queue, bypassing the batcher"""
+    settings.WELCOME_EMAIL_BATCH_SIZE = 2
+    rows = [{"email": f"imp{n}@example.com", "phone": f"+1555200{n:04d}", "first_name": "Ada", "last_name": "Lovelace"} for n in range(3)]
+    with patch("passenger.tasks.send_welcome_emails.apply_async") as apply_async:
+        result = import_passengers([json.dumps(row) + "\n" for row in rows])
+    assert result.created == 3
+
+    assert all(call.kwargs == {"queue": "batch"} for call in apply_async.call_args_list)
+    queued = sorted(pk for call in apply_async.call_args_list for pk in call.args[0][0])
+    assert queued == sorted(Passenger.objects.values_list("pk", flat=True))
+    assert batcher.flush() == 0
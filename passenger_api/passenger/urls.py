@@ -1,7 +1,18 @@
 from django.urls import path
-from .views import PassengerCreateView, PassengerRideBookingView
+from .views import (
+    PassengerCreateView,
+    PassengerImportView,
+    PassengerRideBookingView,
+    PassengerRideBookingAsyncView,
+    PassengerRideEstimateBatchView,
+    PassengerRideStatusView,
+)
 
 urlpatterns = [
     path("passengers/", PassengerCreateView.as_view(), name="add-passenger"),
+    path("passengers/import/", PassengerImportView.as_view(), name="import-passengers"),
     path('rides/book/', PassengerRideBookingView.as_view(), name='book-ride-passenger'),
+    path('rides/book/async/', PassengerRideBookingAsyncView.as_view(), name='book-ride-passenger-async'),
+    path('rides/<uuid:ride_id>/status/', PassengerRideStatusView.as_view(), name='ride-status'),
+    path('rides/estimate/batch/', PassengerRideEstimateBatchView.as_view(), name='batch-estimate-rides'),
 ]
\ No newline at end of file
@@ -1,21 +1,42 @@
 
+from asgiref.sync import sync_to_async
 from django.shortcuts import render
+from django.conf import settings
 from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework.views import APIView
 from rest_framework import status
 # from drf_spectacular.utils import extend_schema, OpenApiResponse, OpenApiParameter
 from drf_spectacular.utils import extend_schema, OpenApiParameter, OpenApiExample, OpenApiResponse, OpenApiTypes
 from rest_framework.response import Response
-from .models import Passenger
+from .models import Passenger, PassengerKey, Ride
 from django.db import IntegrityError
 from django.core.exceptions import ValidationError
 import datetime
+import json
 import uuid 
-from .tasks import send_welcome_email
-from .services import get_fare_and_hashed_location
+from django.urls import reverse
+from . import booking_status
+from .services import (
+    FALLBACK_SOURCE, get_fare_and_hashed_location, aget_fare_and_hashed_location, estimate_rides_batch, is_fallback,
+    NodeAPIError, UpstreamBusyError,
+)
+from .estimation import EstimationError
+from .ride_store import record_ride, arecord_ride
+from .surge import apply_surge, surge_for_booking, surge_for_geohash
+from .importer import import_passengers
+from .pagination import PageQueryError, keyset_page_across, parse_page_query
+from .accounts import duplicate_field, normalize_email, normalize_phone
+from . import idempotency, sharding, welcome
+from .admission import aadmitted, admitted
+from .idempotency import aidempotent, idempotent
 import logging
 
 logger = logging.getLogger('passenger')
+# One DEBUG line per booking; sampled (see LOG_BOOKING_DEBUG_SAMPLE_RATE).
+booking_logger = logging.getLogger('passenger.booking')
 
 
 
@@ -23,17 +44,33 @@ ERROR_MESSAGES = {
     "MISSING_FIELDS_PASSENGER_CREATE": "The [email, phone, first_name, last_name] fields are required.",
     "DUPLICATE_EMAIL": "A user with this email address already exists.",
     "DUPLICATE_PHONE": "A user with this phone number already exists.",
+    "INVALID_PHONE": "The phone number must have 7 to 15 digits, optionally prefixed with '+'.",
 
     "MISSING_FIELDS_RIDE_BOOOKING": "The [pickup_location, dropoff_location, ride_type] fields are required.",
     "INVALID_RIDE_TYPE": "Invalid ride_type '{ride_type}'. Allowed values are {valid_ride_types}.",
     "INVALID_LOCATION": "pickup_location and dropoff_location must include 'latitude' and 'longitude'.",
+    "INVALID_PASSENGER": "passenger_id must be the id of an existing passenger.",
+    "QUEUE_UNAVAILABLE": "Ride requests cannot be queued right now. Please try again later.",
+    "RIDE_NOT_FOUND": "No ride with this id was found.",
+    "EXTERNAL_API_ERROR": "Failed to get fare estimates and location data.",
+    "UPSTREAM_BUSY": "Fare estimates are at capacity right now. Please try again shortly.",
+    "INVALID_TRIP": "A fare cannot be estimated for this trip.",
+    "MISSING_TRIPS_BATCH_ESTIMATE": "The [trips] field is required and must be a non-empty list.",
+    "BATCH_TOO_LARGE": "A batch can contain at most {max_trips} trips.",
+    "INVALID_FIELDS": "fields must be a comma-separated list of {allowed_fields}.",
+    "INVALID_LIMIT": "limit must be an integer between 1 and {max_limit}.",
+    "INVALID_CURSOR": "cursor must be a next_cursor returned by a previous page.",
+    "MISSING_IMPORT_FILE": "Send the passengers as an NDJSON or CSV request body, or as a multipart [file] upload.",
     "SERVER_ERROR": "An unexpected error occurred. Please try again later."
 }
 
 
+PASSENGER_LIST_FIELDS = ["passenger_id", "email", "phone", "first_name", "last_name", "created_at", "updated_at"]
+
 
 class PassengerCreateView(APIView):
     @extend_schema(
+        parameters=[idempotency.SCHEMA_PARAMETER],
         request={
             "application/json": {
                 "example": {
@@ -71,6 +108,13 @@ class PassengerCreateView(APIView):
                     "code": "BAD_REQUEST",
                 },
             ),
+            status.HTTP_409_CONFLICT: OpenApiResponse(
+                description="A request with the same Idempotency-Key is still running.",
+                response={
+                    "error": "A request with this Idempotency-Key is still being processed. Retry shortly.",
+                    "code": "IDEMPOTENCY_KEY_IN_USE",
+                },
+            ),
             status.HTTP_500_INTERNAL_SERVER_ERROR: OpenApiResponse(
                 description="Internal server error.",
                 response={
@@ -121,6 +165,7 @@ class PassengerCreateView(APIView):
             ),
         ],
     )
+    @idempotent("passenger-create")
     def post(self, request):
         email = request.data.get('email')
         phone = request.data.get('phone')
@@ -133,19 +178,17 @@ class PassengerCreateView(APIView):
                 "code": "BAD_REQUEST"
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        if Passenger.objects.filter(email=email).exists():
-            return Response(
-                {"error": ERROR_MESSAGES["DUPLICATE_EMAIL"]},
-               status=status.HTTP_400_BAD_REQUEST,
-            )
-        if Passenger.objects.filter(phone=phone).exists():
-            return Response(
-                {"error": ERROR_MESSAGES["DUPLICATE_PHONE"]},
-                status=status.HTTP_400_BAD_REQUEST,
-            )
-        
-        try: 
-            passenger = Passenger.objects.create(
+        email = normalize_email(str(email))
+        phone = normalize_phone(str(phone))
+        if phone is None:
+            return Response({
+                "error": ERROR_MESSAGES["INVALID_PHONE"],
+                "code": "INVALID_PHONE"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            # One INSERT; the unique constraints catch duplicates, even concurrent ones.
+            passenger = sharding.create_passenger(
                 email=email,
                 phone=phone,
                 first_name=first_name,
@@ -161,7 +204,7 @@ class PassengerCreateView(APIView):
                 "updated_at": passenger.updated_at,
             }
 
-            # send_welcome_email.delay(passenger.passenger_id)
+            welcome.queue_welcome_emails([passenger.passenger_id])
 
             return Response(
                 {
@@ -176,12 +219,19 @@ class PassengerCreateView(APIView):
                 "details": e.message_dict,
                 "code": "VALIDATION_ERROR"
             }, status=status.HTTP_400_BAD_REQUEST)
-        
+
         except IntegrityError as e:
-            return Response({
-                "error": "Database Integrity Error",
-                "details": str(e)
-            }, status=status.HTTP_400_BAD_REQUEST)
+            field = duplicate_field(e, Passenger) or duplicate_field(e, PassengerKey)
+            if field is None:
+                return Response({
+                    "error": "Database Integrity Error",
+                    "details": str(e)
+                }, status=status.HTTP_400_BAD_REQUEST)
+            code = "DUPLICATE_EMAIL" if field == "email" else "DUPLICATE_PHONE"
+            return Response(
+                {"error": ERROR_MESSAGES[code], "code": code},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
         except Exception as e:
             return Response({
@@ -189,6 +239,57 @@ class PassengerCreateView(APIView):
                 "details": str(e)
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @extend_schema(
+        parameters=[
+            OpenApiParameter("fields", str, description=f"Comma-separated columns to return, from {PASSENGER_LIST_FIELDS} (default all)."),
+            OpenApiParameter("limit", int, description="Passengers per page (default LIST_DEFAULT_LIMIT, at most LIST_MAX_LIMIT)."),
+            OpenApiParameter("cursor", str, description="next_cursor from the previous page; omit for the first page."),
+            OpenApiParameter("count", bool, description="Also return the total number of passengers (scans the table)."),
+        ],
+        responses={
+            status.HTTP_200_OK: OpenApiResponse(
+                description="One page of passengers, newest first.",
+                response={
+                    "data": {
+                        "passengers": [
+                            {"passenger_id": 1, "email": "passenger@example.com", "created_at": "2023-10-01T12:34:56Z"},
+                        ],
+                        "next_cursor": "WyIyMDIzLTEwLTAxVDEyOjM0OjU2KzAwOjAwIiwxXQ",
+                    },
+                },
+            ),
+            status.HTTP_400_BAD_REQUEST: OpenApiResponse(
+                description="Invalid fields, limit or cursor.",
+                response={
+                    "error": "limit must be an integer between 1 and 500.",
+                    "details": "Invalid limit: 0",
+                    "code": "INVALID_LIMIT",
+                },
+            ),
+        },
+        description="Keyset-paginated passenger listing. next_cursor is null on the last page.",
+    )
+    def get(self, request):
+        try:
+            query = parse_page_query(
+                request.query_params, PASSENGER_LIST_FIELDS, settings.LIST_DEFAULT_LIMIT, settings.LIST_MAX_LIMIT
+            )
+        except PageQueryError as e:
+            return Response({
+                "error": ERROR_MESSAGES[e.code].format(
+                    allowed_fields=PASSENGER_LIST_FIELDS, max_limit=settings.LIST_MAX_LIMIT
+                ),
+                "details": e.details,
+                "code": e.code,
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        passengers = sharding.fan_out(Passenger.objects.all())
+        page = keyset_page_across(passengers, query.fields, query.limit, query.cursor, query.with_count)
+        data = {"passengers": page.rows, "next_cursor": page.next_cursor}
+        if page.count is not None:
+            data["count"] = page.count
+        return Response({"data": data}, status=status.HTTP_200_OK)
+
 # {
 #   "pickup_location": { "latitude": 37.7749, "longitude": -122.4194 },
 #   "dropoff_location": { "latitude": 37.8044, "longitude": -122.2711 },
@@ -197,68 +298,196 @@ class PassengerCreateView(APIView):
 # }
     
 
-class PassengerRideBookingView(APIView):
-    VALID_RIDE_TYPES = ["standard", "premium"]
+VALID_RIDE_TYPES = ["standard", "premium"]
 
-    def validate_request_data(self, pickup_location, dropoff_location, ride_type):
-        """Validate the request data."""
-        if not all([pickup_location, dropoff_location, ride_type]):
+
+def validate_ride_request(pickup_location, dropoff_location, ride_type):
+    """Validate one ride request. Shared by bookings and batch estimates."""
+    if not all([pickup_location, dropoff_location, ride_type]):
+        raise ValidationError({
+            "error": ERROR_MESSAGES["MISSING_FIELDS_RIDE_BOOOKING"],
+            "code": "BAD_REQUEST"
+        })
+
+    if ride_type not in VALID_RIDE_TYPES:
+        raise ValidationError({
+            "error": ERROR_MESSAGES["INVALID_RIDE_TYPE"].format(
+                ride_type=ride_type, valid_ride_types=VALID_RIDE_TYPES
+            ),
+            "code": "INVALID_RIDE_TYPE"
+        })
+
+    for location in [pickup_location, dropoff_location]:
+        if not isinstance(location, dict):
             raise ValidationError({
-                "error": ERROR_MESSAGES["MISSING_FIELDS_RIDE_BOOOKING"],
-                "code": "BAD_REQUEST"
+                "error": ERROR_MESSAGES["INVALID_LOCATION"],
+                "details": f"Location must be an object, got: {location}",
+                "code": "INVALID_LOCATION"
             })
-
-        if ride_type not in self.VALID_RIDE_TYPES:
+        lat, lon = location.get("latitude"), location.get("longitude")
+        if lat is None or lon is None:
             raise ValidationError({
-                "error": ERROR_MESSAGES["INVALID_RIDE_TYPE"].format(
-                    ride_type=ride_type, valid_ride_types=self.VALID_RIDE_TYPES
-                ),
-                "code": "INVALID_RIDE_TYPE"
+                "error": ERROR_MESSAGES["INVALID_LOCATION"],
+                "details": f"Latitude or longitude is missing for location: {location}",
+                "code": "INVALID_LOCATION"
+            })
+        if not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in (lat, lon)):
+            raise ValidationError({
+                "error": ERROR_MESSAGES["INVALID_LOCATION"],
+                "details": f"Latitude and longitude must be numbers for location: {location}",
+                "code": "INVALID_LOCATION"
             })
+        if not (-90 <= lat <= 90) or not (-180 <= lon <= 180):
+            raise ValidationError({
+                "error": ERROR_MESSAGES["INVALID_LOCATION"],
+                "details": f"Invalid latitude ({lat}) or longitude ({lon}) range.",
+                "code": "INVALID_LOCATION"
+            })
+
+
+def validate_passenger_id(passenger_id):
+    """Check the optional passenger_id of a booking is a positive integer."""
+    if passenger_id is None:
+        return
+    if not isinstance(passenger_id, int) or isinstance(passenger_id, bool) or passenger_id < 1:
+        raise ValidationError({
+            "error": ERROR_MESSAGES["INVALID_PASSENGER"],
+            "details": f"Invalid passenger_id: {passenger_id}",
+            "code": "INVALID_PASSENGER"
+        })
+
+
+def passenger_not_found(passenger_id):
+    return ValidationError({
+        "error": ERROR_MESSAGES["INVALID_PASSENGER"],
+        "details": f"Passenger {passenger_id} does not exist.",
+        "code": "INVALID_PASSENGER"
+    })
+
+
+def build_ride_request_data(pickup_location, dropoff_location, ride_type, passenger_id=None):
+    return {
+        "ride_id": str(uuid.uuid4()),
+        "passenger_id": passenger_id,
+        "pickup_location": {
+            "latitude": pickup_location.get("latitude"),
+            "longitude": pickup_location.get("longitude")
+        },
+        "dropoff_location": {
+            "latitude": dropoff_location.get("latitude"),
+            "longitude": dropoff_location.get("longitude")
+        },
+        "ride_type": ride_type,
+        "status": Ride.STATUS_REQUESTED,
+        "booking_time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def ride_to_data(ride):
+    """Render a stored Ride like the data of a booking response."""
+    return {
+        "ride_id": str(ride.ride_id),
+        "passenger_id": ride.passenger_id,
+        "pickup_location": {"latitude": ride.pickup_latitude, "longitude": ride.pickup_longitude},
+        "dropoff_location": {"latitude": ride.dropoff_latitude, "longitude": ride.dropoff_longitude},
+        "ride_type": ride.ride_type,
+        "status": ride.status,
+        "booking_time": ride.requested_at.strftime("%Y-%m-%d %H:%M:%S"),
+        "estimated_fare": float(ride.estimated_fare),
+        "surge_multiplier": float(ride.surge_multiplier),
+        "distance_km": ride.distance_km,
+        "pickup_geohash": ride.pickup_geohash,
+        "dropoff_geohash": ride.dropoff_geohash,
+    }
 
-        for location in [pickup_location, dropoff_location]:
-            lat, lon = location.get("latitude"), location.get("longitude")
-            if lat is None or lon is None:
-                raise ValidationError({
-                    "error": ERROR_MESSAGES["INVALID_LOCATION"],
-                    "details": f"Latitude or longitude is missing for location: {location}",
-                    "code": "INVALID_LOCATION"
-                })
-            if not (-90 <= lat <= 90) or not (-180 <= lon <= 180):
-                raise ValidationError({
-                    "error": ERROR_MESSAGES["INVALID_LOCATION"],
-                    "details": f"Invalid latitude ({lat}) or longitude ({lon}) range.",
-                    "code": "INVALID_LOCATION"
-                })
+
+class PassengerRideBookingView(APIView):
+    VALID_RIDE_TYPES = VALID_RIDE_TYPES
+
+    def validate_request_data(self, pickup_location, dropoff_location, ride_type):
+        """Validate the request data."""
+        validate_ride_request(pickup_location, dropoff_location, ride_type)
+
+    def enqueue(self, ride_request_data):
+        """Hand a validated booking to the Celery workers and answer 202."""
+        # Imported here so Celery only loads once a booking is queued.
+        from kombu.exceptions import OperationalError as BrokerError
+
+        from .tasks import process_ride_booking
+
+        ride_id = ride_request_data["ride_id"]
+        ride_request_data["status"] = booking_status.QUEUED
+        booking_status.set_status(ride_id, booking_status.QUEUED)
+        try:
+            process_ride_booking.delay(ride_request_data)
+        except BrokerError as e:
+            logger.error("Could not queue ride %s: %s", ride_id, e)
+            booking_status.set_status(ride_id, booking_status.FAILED, code="QUEUE_UNAVAILABLE", details=str(e))
+            return Response({
+                "error": ERROR_MESSAGES["QUEUE_UNAVAILABLE"],
+                "details": str(e),
+                "code": "QUEUE_UNAVAILABLE"
+            }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        return Response({
+            "message": "Ride request accepted.",
+            "data": {
+                **ride_request_data,
+                "status_url": reverse("ride-status", args=[ride_id]),
+            }
+        }, status=status.HTTP_202_ACCEPTED)
 
     @extend_schema(
+        parameters=[idempotency.SCHEMA_PARAMETER],
         request={
             "application/json": {
                 "example": {
                     "pickup_location": {"latitude": 40.7128, "longitude": -74.0060},
                     "dropoff_location": {"latitude": 34.0522, "longitude": -118.2437},
                     "ride_type": "standard",
+                    "passenger_id": 1,
                 }
             }
         },
         responses={
             status.HTTP_201_CREATED: OpenApiResponse(
-                description="Ride request created successfully.",
+                description="Ride request created successfully. `estimate_source` is `fallback` when the fare "
+                            "was computed locally because the geo estimator was unavailable or at capacity "
+                            "(GEO_ESTIMATION_MODE=fallback); it is absent otherwise.",
                 response={
                     "message": "Ride request created successfully.",
                     "data": {
                         "ride_id": "uuid",
+                        "passenger_id": 1,
                         "pickup_location": {"latitude": 40.7128, "longitude": -74.0060},
                         "dropoff_location": {"latitude": 34.0522, "longitude": -118.2437},
                         "ride_type": "standard",
+                        "status": "requested",
                         "booking_time": "2023-10-01 12:34:56",
                         "estimated_fare": 25.50,
+                        "surge_multiplier": 1.0,
                         "distance_km": 10.5,
                         "pickup_geohash": "example_geohash",
                         "dropoff_geohash": "example_geohash",
                     },
                 },
             ),
+            status.HTTP_202_ACCEPTED: OpenApiResponse(
+                description="Ride request queued (RIDE_BOOKING_MODE=queued); poll status_url for progress.",
+                response={
+                    "message": "Ride request accepted.",
+                    "data": {
+                        "ride_id": "uuid",
+                        "passenger_id": 1,
+                        "pickup_location": {"latitude": 40.7128, "longitude": -74.0060},
+                        "dropoff_location": {"latitude": 34.0522, "longitude": -118.2437},
+                        "ride_type": "standard",
+                        "status": "queued",
+                        "booking_time": "2023-10-01 12:34:56",
+                        "status_url": "/passenger/rides/uuid/status/",
+                    },
+                },
+            ),
             status.HTTP_400_BAD_REQUEST: OpenApiResponse(
                 description="Validation error.",
                 response={
@@ -270,6 +499,13 @@ class PassengerRideBookingView(APIView):
                     "code": "VALIDATION_ERROR",
                 },
             ),
+            status.HTTP_409_CONFLICT: OpenApiResponse(
+                description="A request with the same Idempotency-Key is still running.",
+                response={
+                    "error": "A request with this Idempotency-Key is still being processed. Retry shortly.",
+                    "code": "IDEMPOTENCY_KEY_IN_USE",
+                },
+            ),
             status.HTTP_502_BAD_GATEWAY: OpenApiResponse(
                 description="External API error.",
                 response={
@@ -278,6 +514,22 @@ class PassengerRideBookingView(APIView):
                     "code": "EXTERNAL_API_ERROR",
                 },
             ),
+            status.HTTP_429_TOO_MANY_REQUESTS: OpenApiResponse(
+                description="This client is over ADMISSION_CLIENT_RATE; see Retry-After.",
+                response={
+                    "error": "Too many ride requests from this client. Retry after 1 seconds.",
+                    "code": "RATE_LIMITED",
+                },
+            ),
+            status.HTTP_503_SERVICE_UNAVAILABLE: OpenApiResponse(
+                description="Overloaded (OVERLOADED, UPSTREAM_BUSY; see Retry-After) or the booking queue "
+                            "is unavailable (QUEUE_UNAVAILABLE, queued mode only).",
+                response={
+                    "error": "Ride requests cannot be queued right now. Please try again later.",
+                    "details": "[Errno 111] Connection refused",
+                    "code": "QUEUE_UNAVAILABLE",
+                },
+            ),
             status.HTTP_500_INTERNAL_SERVER_ERROR: OpenApiResponse(
                 description="Internal server error.",
                 response={
@@ -305,53 +557,50 @@ class PassengerRideBookingView(APIView):
             ),
         ],
     )
+    @admitted
+    @idempotent("ride-booking")
     def post(self, request):
         pickup_location = request.data.get("pickup_location")
         dropoff_location = request.data.get("dropoff_location")
         ride_type = request.data.get("ride_type")
+        passenger_id = request.data.get("passenger_id")
 
         try:
             self.validate_request_data(pickup_location, dropoff_location, ride_type)
+            validate_passenger_id(passenger_id)
+            if passenger_id is not None and not sharding.passengers_for(passenger_id).filter(pk=passenger_id).exists():
+                raise passenger_not_found(passenger_id)
 
-            pickup_lat = pickup_location.get("latitude")
-            pickup_lng = pickup_location.get("longitude")
-            dropoff_lat = dropoff_location.get("latitude")
-            dropoff_lng = dropoff_location.get("longitude")
+            ride_request_data = build_ride_request_data(pickup_location, dropoff_location, ride_type, passenger_id)
+            # Priced at request time, so a queued booking keeps the surge it was quoted.
+            ride_request_data["surge_multiplier"] = surge_for_booking(pickup_location)
 
-
-            ride_request_data = {
-                "ride_id": str(uuid.uuid4()),
-                "pickup_location": {
-                    "latitude": pickup_lat,
-                    "longitude": pickup_lng
-                },
-                "dropoff_location": {
-                    "latitude": dropoff_lat,
-                    "longitude": dropoff_lng
-                },
-                "ride_type": ride_type,
-                "booking_time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            }
+            if settings.RIDE_BOOKING_MODE == "queued":
+                return self.enqueue(ride_request_data)
 
             estimates_and_geohashes = get_fare_and_hashed_location(ride_request_data)
 
             if not estimates_and_geohashes:
                 return Response({
-                    "error": "Failed to get fare estimates and location data.",
+                    "error": ERROR_MESSAGES["EXTERNAL_API_ERROR"],
                     "details": "The external API did not return any data.",
                     "code": "EXTERNAL_API_ERROR"
                 }, status=status.HTTP_502_BAD_GATEWAY)
             
-            print(estimates_and_geohashes)
-           
             ride_request_data.update({
-                "estimated_fare": estimates_and_geohashes["data"]["estimated_fare"],
+                "estimated_fare": apply_surge(
+                    estimates_and_geohashes["data"]["estimated_fare"], ride_request_data["surge_multiplier"]
+                ),
                 "distance_km": estimates_and_geohashes["data"]["distance_km"],
                 "pickup_geohash": estimates_and_geohashes["data"]["pickup_geohash"],
                 "dropoff_geohash": estimates_and_geohashes["data"]["dropoff_geohash"],
             })
+            if is_fallback(estimates_and_geohashes):
+                ride_request_data["estimate_source"] = FALLBACK_SOURCE
+
+            booking_logger.debug("Ride booked", extra={"ride": ride_request_data})
 
-            logger.debug(f"Updated ride_request_data: {ride_request_data}")
+            record_ride(ride_request_data, passenger_id)
 
             return Response({
                 "message": "Ride request created successfully.",
@@ -369,8 +618,32 @@ class PassengerRideBookingView(APIView):
                 "code": e.message_dict.get("code", "VALIDATION_ERROR")
             }, status=status.HTTP_400_BAD_REQUEST)
 
+        except EstimationError as e:
+            return Response({
+                "error": ERROR_MESSAGES["INVALID_TRIP"],
+                "details": str(e),
+                "code": "INVALID_TRIP"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        except UpstreamBusyError as e:
+            response = Response({
+                "error": ERROR_MESSAGES["UPSTREAM_BUSY"],
+                "details": str(e),
+                "code": "UPSTREAM_BUSY"
+            }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            response["Retry-After"] = str(e.retry_after)
+            return response
+
+        except NodeAPIError as e:
+            logger.warning("Geo estimator call failed: %s", e)
+            return Response({
+                "error": ERROR_MESSAGES["EXTERNAL_API_ERROR"],
+                "details": str(e),
+                "code": "EXTERNAL_API_ERROR"
+            }, status=status.HTTP_502_BAD_GATEWAY)
+
         except Exception as e:
-            logger.debug(f"Error Updated ride_request_data: {e}")
+            logger.exception("Ride booking failed")
             return Response({
                 "error": ERROR_MESSAGES["SERVER_ERROR"],
                 "details": str(e),
@@ -378,3 +651,413 @@ class PassengerRideBookingView(APIView):
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@method_decorator(csrf_exempt, name="dispatch")
+class PassengerRideBookingAsyncView(View):
+    """Async twin of PassengerRideBookingView for ASGI deployments.
+
+    DRF views are synchronous, so this is a plain Django view: the worker is
+    released while the geo estimator call is awaited instead of blocking on it.
+    Request and response bodies are the same as rides/book/, and so are
+    admission control and Idempotency-Key handling.
+    """
+
+    @aadmitted
+    @aidempotent("ride-booking")
+    async def post(self, request):
+        try:
+            body = json.loads(request.body or b"{}")
+        except ValueError:
+            body = None
+        if not isinstance(body, dict):
+            return JsonResponse({
+                "error": "Request body must be a JSON object.",
+                "code": "BAD_REQUEST"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        pickup_location = body.get("pickup_location")
+        dropoff_location = body.get("dropoff_location")
+        ride_type = body.get("ride_type")
+        passenger_id = body.get("passenger_id")
+
+        try:
+            validate_ride_request(pickup_location, dropoff_location, ride_type)
+            validate_passenger_id(passenger_id)
+            if passenger_id is not None:
+                passengers = await sharding.apassengers_for(passenger_id)
+                if not await passengers.filter(pk=passenger_id).aexists():
+                    raise passenger_not_found(passenger_id)
+
+            ride_request_data = build_ride_request_data(pickup_location, dropoff_location, ride_type, passenger_id)
+            # The surge lookup reads the cache synchronously; keep it off the event loop.
+            ride_request_data["surge_multiplier"] = await sync_to_async(
+                surge_for_booking, thread_sensitive=False
+            )(pickup_location)
+
+            estimates_and_geohashes = await aget_fare_and_hashed_location(ride_request_data)
+
+            if not estimates_and_geohashes:
+                return JsonResponse({
+                    "error": ERROR_MESSAGES["EXTERNAL_API_ERROR"],
+                    "details": "The external API did not return any data.",
+                    "code": "EXTERNAL_API_ERROR"
+                }, status=status.HTTP_502_BAD_GATEWAY)
+
+            ride_request_data.update({
+                "estimated_fare": apply_surge(
+                    estimates_and_geohashes["data"]["estimated_fare"], ride_request_data["surge_multiplier"]
+                ),
+                "distance_km": estimates_and_geohashes["data"]["distance_km"],
+                "pickup_geohash": estimates_and_geohashes["data"]["pickup_geohash"],
+                "dropoff_geohash": estimates_and_geohashes["data"]["dropoff_geohash"],
+            })
+            if is_fallback(estimates_and_geohashes):
+                ride_request_data["estimate_source"] = FALLBACK_SOURCE
+
+            booking_logger.debug("Ride booked", extra={"ride": ride_request_data})
+
+            await arecord_ride(ride_request_data, passenger_id)
+
+            return JsonResponse({
+                "message": "Ride request created successfully.",
+                "data": ride_request_data
+            }, status=status.HTTP_201_CREATED)
+
+        except ValidationError as e:
+            missing_fields = [field for field in ["pickup_location", "dropoff_location", "ride_type"] if not body.get(field)]
+            return JsonResponse({
+                "error": e.message_dict.get("error", "Validation error."),
+                "details": {
+                    "missing_fields": missing_fields,
+                    "message": e.message_dict.get("details", "The provided data is invalid.")
+                },
+                "code": e.message_dict.get("code", "VALIDATION_ERROR")
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        except EstimationError as e:
+            return JsonResponse({
+                "error": ERROR_MESSAGES["INVALID_TRIP"],
+                "details": str(e),
+                "code": "INVALID_TRIP"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        except UpstreamBusyError as e:
+            response = JsonResponse({
+                "error": ERROR_MESSAGES["UPSTREAM_BUSY"],
+                "details": str(e),
+                "code": "UPSTREAM_BUSY"
+            }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            response["Retry-After"] = str(e.retry_after)
+            return response
+
+        except NodeAPIError as e:
+            logger.warning("Geo estimator call failed: %s", e)
+            return JsonResponse({
+                "error": ERROR_MESSAGES["EXTERNAL_API_ERROR"],
+                "details": str(e),
+                "code": "EXTERNAL_API_ERROR"
+            }, status=status.HTTP_502_BAD_GATEWAY)
+
+        except Exception as e:
+            logger.exception("Ride booking failed")
+            return JsonResponse({
+                "error": ERROR_MESSAGES["SERVER_ERROR"],
+                "details": str(e),
+                "code": "SERVER_ERROR",
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class PassengerRideStatusView(APIView):
+    @extend_schema(
+        responses={
+            status.HTTP_200_OK: OpenApiResponse(
+                description="Current status of the ride.",
+                response={
+                    "message": "Ride status retrieved successfully.",
+                    "data": {
+                        "ride_id": "uuid",
+                        "status": "requested",
+                        "ride": {
+                            "ride_id": "uuid",
+                            "passenger_id": 1,
+                            "pickup_location": {"latitude": 40.7128, "longitude": -74.0060},
+                            "dropoff_location": {"latitude": 34.0522, "longitude": -118.2437},
+                            "ride_type": "standard",
+                            "status": "requested",
+                            "booking_time": "2023-10-01 12:34:56",
+                            "estimated_fare": 25.50,
+                            "surge_multiplier": 1.0,
+                            "distance_km": 10.5,
+                            "pickup_geohash": "example_geohash",
+                            "dropoff_geohash": "example_geohash",
+                        },
+                    },
+                },
+            ),
+            status.HTTP_404_NOT_FOUND: OpenApiResponse(
+                description="Unknown ride.",
+                response={
+                    "error": "No ride with this id was found.",
+                    "code": "RIDE_NOT_FOUND",
+                },
+            ),
+        },
+        examples=[
+            OpenApiExample(
+                "Queued",
+                value={"message": "Ride status retrieved successfully.", "data": {"ride_id": "uuid", "status": "queued"}},
+                response_only=True,
+            ),
+            OpenApiExample(
+                "Failed",
+                value={
+                    "message": "Ride status retrieved successfully.",
+                    "data": {
+                        "ride_id": "uuid",
+                        "status": "failed",
+                        "error": "Failed to get fare estimates and location data.",
+                        "details": "Geo estimator is unavailable (circuit open).",
+                        "code": "EXTERNAL_API_ERROR",
+                    },
+                },
+                response_only=True,
+            ),
+        ],
+    )
+    def get(self, request, ride_id):
+        booking = booking_status.get_status(ride_id)
+
+        # Queue progress only lives in the cache; once stored, the row is authoritative.
+        if booking is None or booking["status"] not in (booking_status.QUEUED, booking_status.PROCESSING, booking_status.FAILED):
+            ride = sharding.find_ride(ride_id)
+            if ride is not None:
+                booking = {"ride_id": str(ride.ride_id), "status": ride.status, "ride": ride_to_data(ride)}
+
+        if booking is None:
+            return Response({
+                "error": ERROR_MESSAGES["RIDE_NOT_FOUND"],
+                "code": "RIDE_NOT_FOUND"
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        if booking["status"] == booking_status.FAILED:
+            booking = {**booking, "error": ERROR_MESSAGES.get(booking.get("code"), ERROR_MESSAGES["SERVER_ERROR"])}
+
+        return Response({
+            "message": "Ride status retrieved successfully.",
+            "data": booking
+        }, status=status.HTTP_200_OK)
+
+
+class PassengerRideEstimateBatchView(APIView):
+    @extend_schema(
+        request={
+            "application/json": {
+                "example": {
+                    "trips": [
+                        {
+                            "pickup_location": {"latitude": 40.7128, "longitude": -74.0060},
+                            "dropoff_location": {"latitude": 40.7306, "longitude": -73.9352},
+                            "ride_type": "standard",
+                        },
+                        {
+                            "pickup_location": {"latitude": 40.7128, "longitude": -74.0060},
+                            "dropoff_location": {"latitude": 40.7306, "longitude": -73.9352},
+                            "ride_type": "luxury",
+                        },
+                    ]
+                }
+            }
+        },
+        responses={
+            status.HTTP_200_OK: OpenApiResponse(
+                description="Per-trip estimates, in request order. Each item has either `data` or `error`.",
+                response={
+                    "message": "Ride estimates calculated successfully.",
+                    "data": [
+                        {
+                            "index": 0,
+                            "data": {
+                                "pickup_geohash": "dr5regw",
+                                "dropoff_geohash": "dr5rvsq",
+                                "distance_km": 6.3,
+                                "estimated_fare": 12.6,
+                                "surge_multiplier": 1.0,
+                            },
+                        },
+                        {
+                            "index": 1,
+                            "error": "Invalid ride_type 'luxury'. Allowed values are ['standard', 'premium'].",
+                            "code": "INVALID_RIDE_TYPE",
+                        },
+                    ],
+                },
+            ),
+            status.HTTP_400_BAD_REQUEST: OpenApiResponse(
+                description="The batch itself is malformed or too large.",
+                response={
+                    "error": "The [trips] field is required and must be a non-empty list.",
+                    "code": "BAD_REQUEST",
+                },
+            ),
+        },
+        description="Estimate fares for many trips in one request. Identical trips are computed once.",
+    )
+    def post(self, request):
+        trips = request.data.get("trips")
+        if not isinstance(trips, list) or not trips:
+            return Response({
+                "error": ERROR_MESSAGES["MISSING_TRIPS_BATCH_ESTIMATE"],
+                "code": "BAD_REQUEST"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        if len(trips) > settings.BATCH_ESTIMATE_MAX_TRIPS:
+            return Response({
+                "error": ERROR_MESSAGES["BATCH_TOO_LARGE"].format(max_trips=settings.BATCH_ESTIMATE_MAX_TRIPS),
+                "code": "BATCH_TOO_LARGE"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        results = [None] * len(trips)
+        valid = []
+        for index, trip in enumerate(trips):
+            trip = trip if isinstance(trip, dict) else {}
+            try:
+                validate_ride_request(trip.get("pickup_location"), trip.get("dropoff_location"), trip.get("ride_type"))
+            except ValidationError as e:
+                results[index] = {
+                    "index": index,
+                    "error": e.message_dict["error"][0],
+                    "code": e.message_dict["code"][0],
+                }
+            else:
+                valid.append(index)
+
+        try:
+            estimates = estimate_rides_batch([trips[i] for i in valid])
+        except Exception as e:
+            logger.exception("Batch estimate failed")
+            return Response({
+                "error": ERROR_MESSAGES["SERVER_ERROR"],
+                "details": str(e),
+                "code": "SERVER_ERROR",
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        for index, estimate in zip(valid, estimates):
+            if isinstance(estimate, EstimationError):
+                results[index] = {
+                    "index": index,
+                    "error": ERROR_MESSAGES["INVALID_TRIP"],
+                    "details": str(estimate),
+                    "code": "INVALID_TRIP",
+                }
+            else:
+                # Duplicate trips share one estimate dict; price into a copy.
+                surge = surge_for_geohash(estimate["pickup_geohash"])
+                results[index] = {"index": index, "data": {
+                    **estimate,
+                    "estimated_fare": apply_surge(estimate["estimated_fare"], surge),
+                    "surge_multiplier": surge,
+                }}
+
+        return Response({
+            "message": "Ride estimates calculated successfully.",
+            "data": results
+        }, status=status.HTTP_200_OK)
+
+
+class PassengerImportView(APIView):
+    """Bulk-create passengers from an NDJSON or CSV stream.
+
+    The body is read line by line rather than parsed up front, so large
+    files are not held in memory. See passenger.importer for the pipeline.
+    """
+
+    CSV_CONTENT_TYPES = ("text/csv", "application/csv")
+
+    @extend_schema(
+        request={
+            "application/x-ndjson": {"type": "string", "format": "binary"},
+            "text/csv": {"type": "string", "format": "binary"},
+            "multipart/form-data": {
+                "type": "object",
+                "properties": {"file": {"type": "string", "format": "binary"}},
+            },
+        },
+        responses={
+            status.HTTP_200_OK: OpenApiResponse(
+                description="Import finished. Rejected rows are listed (up to PASSENGER_IMPORT_MAX_REPORTED_REJECTS).",
+                response={
+                    "message": "Passenger import finished.",
+                    "data": {
+                        "rows": 3,
+                        "created": 2,
+                        "rejected": 1,
+                        "rejects": [
+                            {
+                                "row": 3,
+                                "code": "DUPLICATE_EMAIL",
+                                "error": "A user with this email address already exists.",
+                                "email": "passenger@example.com",
+                            },
+                        ],
+                        "rejects_truncated": False,
+                    },
+                },
+            ),
+            status.HTTP_400_BAD_REQUEST: OpenApiResponse(
+                description="No import data was sent.",
+                response={
+                    "error": ERROR_MESSAGES["MISSING_IMPORT_FILE"],
+                    "code": "BAD_REQUEST",
+                },
+            ),
+        },
+        description="Import many passengers at once. Emails are lower-cased and phones stripped of separators; "
+                    "rows that are invalid or duplicate an existing passenger (or an earlier row) are rejected "
+                    "individually. Rows rejected with WRITE_FAILED were not stored and can be sent again on their "
+                    "own. NDJSON has one JSON object per line; CSV needs an "
+                    "`email,phone,first_name,last_name` header.",
+    )
+    def post(self, request):
+        content_type = request.content_type.split(";")[0].strip().lower()
+        if content_type == "multipart/form-data":
+            upload = request.FILES.get("file")
+            if upload is None:
+                return self.missing_file()
+            lines = upload
+            is_csv = upload.name.lower().endswith(".csv") or upload.content_type in self.CSV_CONTENT_TYPES
+        else:
+            lines = request.stream
+            if lines is None:
+                return self.missing_file()
+            is_csv = content_type in self.CSV_CONTENT_TYPES
+
+        try:
+            result = import_passengers(
+                lines,
+                format="csv" if is_csv else "ndjson",
+                chunk_size=settings.PASSENGER_IMPORT_CHUNK_SIZE,
+                max_reported_rejects=settings.PASSENGER_IMPORT_MAX_REPORTED_REJECTS,
+            )
+        except Exception as e:
+            logger.exception("Passenger import failed")
+            return Response({
+                "error": ERROR_MESSAGES["SERVER_ERROR"],
+                "details": str(e),
+                "code": "SERVER_ERROR",
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return Response({
+            "message": "Passenger import finished.",
+            "data": {
+                "rows": result.rows,
+                "created": result.created,
+                "rejected": result.rejected,
+                "rejects": result.rejects,
+                "rejects_truncated": result.rejected > len(result.rejects),
+            }
+        }, status=status.HTTP_200_OK)
+
+    def missing_file(self):
+        return Response({
+            "error": ERROR_MESSAGES["MISSING_IMPORT_FILE"],
+            "code": "BAD_REQUEST"
+        }, status=status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,271 @@
+"""Welcome emails, sent in batches.
+
+Signups hand new passenger ids to ``queue_welcome_emails``. Each process
+collects them for WELCOME_EMAIL_BATCH_WINDOW seconds, or until
+WELCOME_EMAIL_BATCH_SIZE are pending, and queues one ``send_welcome_emails``
+task per batch. Imports queue theirs straight away, on the batch queue. The
+task loads the whole batch with one query per database and sends it over a
+single SMTP connection, pacing the messages to WELCOME_EMAIL_RATE per second
+so a signup campaign or a bulk import does not flood the mail relay. The
+pace is shared by every task in a worker process (get_rate_limiter()), so a
+threads pool running ten batches at once still sends at that rate in total.
+
+A hard crash loses the ids still being collected, at most one window's
+worth; a clean shutdown queues them. If the broker is down, the batch is
+logged and dropped: a missing welcome email is not worth failing a signup.
+"""
+import atexit
+import logging
+import smtplib
+import threading
+import time
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+
+from . import sharding
+from .db_router import use_primary
+
+logger = logging.getLogger('passenger')
+
+FROM_EMAIL = "noreply@example.com"
+SUBJECT = "Welcome to  Uberv"
+BULK_QUEUE = "batch"
+
+
+def welcome_message(passenger, connection=None):
+    return EmailMessage(
+        subject=SUBJECT,
+        body=f"Hello {passenger.first_name},\n\nWelcome to Uberv!",
+        from_email=FROM_EMAIL,
+        to=[passenger.email],
+        connection=connection,
+    )
+
+
+class RateLimiter:
+    """Spaces calls to ``wait()`` at least 1/rate seconds apart; rate 0 never waits.
+
+    Time not used is not saved up, so a batch arriving after a quiet spell
+    does not go out in one burst. Safe to share between threads: each call
+    books its slot under a lock and sleeps outside it.
+    """
+
+    def __init__(self, rate, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.interval = 1.0 / rate if rate else 0.0
+        self.clock = clock
+        self.sleep = sleep
+        self._next = None
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = self.clock()
+            if self._next is None or self._next < now:
+                self._next = now
+            slot = self._next
+            self._next += self.interval
+        if slot > now:
+            self.sleep(slot - now)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Return the process-wide limiter for WELCOME_EMAIL_RATE, building it on first use."""
+    global _limiter
+    if _limiter is None or _limiter.rate != settings.WELCOME_EMAIL_RATE:
+        with _limiter_lock:
+            if _limiter is None or _limiter.rate != settings.WELCOME_EMAIL_RATE:
+                _limiter = RateLimiter(settings.WELCOME_EMAIL_RATE)
+    return _limiter
+
+
+def reset_rate_limiter():
+    """Drop the cached instance so the next call rebuilds it from settings."""
+    global _limiter
+    with _limiter_lock:
+        _limiter = None
+
+
+class DeliveryFailed(Exception):
+    """The mail server failed part way through a batch; ``unsent`` lists who still needs an email."""
+
+    def __init__(self, unsent):
+        super().__init__(f"{len(unsent)} welcome emails not sent")
+        self.unsent = unsent
+
+
+def load_recipients(passenger_ids):
+    """The passengers in `passenger_ids` that exist, by id; one query per database."""
+    recipients = {}
+    # Queued right after the signups commit; a replica may not have them yet.
+    with use_primary():
+        for queryset in sharding.passengers_in(passenger_ids):
+            for passenger in queryset.only("passenger_id", "email", "first_name"):
+                recipients[passenger.passenger_id] = passenger
+    return recipients
+
+
+def deliver(passenger_ids, limiter=None):
+    """Email every passenger in `passenger_ids` over one connection. Returns the number sent.
+
+    Each message waits its turn on `limiter` (a RateLimiter); None sends unpaced.
+    """
+    recipients = load_recipients(passenger_ids)
+    missing = sorted(set(passenger_ids) - set(recipients))
+    if missing:
+        logger.warning("No welcome email for passengers that do not exist: %s", missing)
+
+    sent = 0
+    connection = get_connection()
+    try:
+        try:
+            connection.open()
+        except (smtplib.SMTPException, OSError) as e:
+            raise DeliveryFailed(list(recipients)) from e
+        for passenger_id, passenger in recipients.items():
+            if limiter is not None:
+                limiter.wait()
+            try:
+                welcome_message(passenger, connection).send()
+            except (smtplib.SMTPException, OSError) as e:
+                raise DeliveryFailed(list(recipients)[sent:]) from e
+            sent += 1
+    finally:
+        connection.close()
+    logger.info("Sent %d welcome emails.", sent)
+    return sent
+
+
+class WelcomeEmailBatcher:
+    """Collects new passenger ids and queues them as batched tasks.
+
+    ``add`` only takes a lock and appends. Set ``background=False`` to drive
+    flushing by hand (tests, scripts).
+    """
+
+    def __init__(self, batch_size=100, window=2.0, background=True):
+        self.batch_size = batch_size
+        self.window = window
+        self.background = background
+        self._pending = []
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+        self._atexit_registered = False
+
+    def add(self, passenger_ids):
+        if self.background:
+            self._ensure_started()
+        with self._cond:
+            self._pending.extend(passenger_ids)
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+    def flush(self):
+        """Queue every pending id now. Returns the number of tasks queued."""
+        with self._flush_lock:
+            with self._cond:
+                pending, self._pending = self._pending, []
+            return _queue_batches(pending, self.batch_size)
+
+    def _ensure_started(self):
+        # A thread started before a fork does not survive in the child.
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="welcome-email-batcher", daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.stop)
+                self._atexit_registered = True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopping and len(self._pending) < self.batch_size:
+                    self._cond.wait(self.window)
+                stopping = self._stopping
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Queueing welcome emails failed.")
+            if stopping:
+                return
+
+    def stop(self, timeout=10):
+        """Stop the batching thread after a final flush."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        self.flush()
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_welcome_batcher():
+    """Return the process-wide batcher, building it on first use."""
+    global _batcher
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = WelcomeEmailBatcher(
+                    batch_size=settings.WELCOME_EMAIL_BATCH_SIZE,
+                    window=settings.WELCOME_EMAIL_BATCH_WINDOW,
+                )
+    return _batcher
+
+
+def reset_welcome_batcher():
+    """Flush and drop the cached instance so the next call rebuilds it from settings."""
+    global _batcher
+    with _batcher_lock:
+        batcher, _batcher = _batcher, None
+    if batcher is not None:
+        batcher.stop()
+
+
+def _queue_batches(passenger_ids, batch_size, **options):
+    """Queue send_welcome_emails for `passenger_ids` in batches. Returns the number of tasks queued."""
+    # Imported here so Celery only loads once there is mail to send.
+    from kombu.exceptions import OperationalError as BrokerError
+
+    from .tasks import send_welcome_emails
+
+    batches = [passenger_ids[start:start + batch_size] for start in range(0, len(passenger_ids), batch_size)]
+    for batch in batches:
+        try:
+            send_welcome_emails.apply_async([batch], **options)
+        except BrokerError as e:
+            logger.error("Could not queue welcome emails for passengers %s: %s", batch, e)
+    return len(batches)
+
+
+def queue_welcome_emails(passenger_ids, bulk=False):
+    """Welcome the given new passengers, if WELCOME_EMAILS is on.
+
+    Passengers created in bulk (imports) already come in chunks: they skip
+    the batcher and go to the batch queue, so a large import does not hold
+    up the emails of people signing up meanwhile.
+    """
+    if not settings.WELCOME_EMAILS or not passenger_ids:
+        return
+    if bulk:
+        _queue_batches(list(passenger_ids), settings.WELCOME_EMAIL_BATCH_SIZE, queue=BULK_QUEUE)
+    else:
+        get_welcome_batcher().add(passenger_ids)
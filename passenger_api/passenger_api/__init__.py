@@ -1,7 +1,14 @@
-from __future__ import absolute_import, unicode_literals
-
-# Ensure Celery app always imported when Django starts
-# so that shared tasks use this app.
-from .celery import app as celery_app
+# The Celery app is built on first use rather than on every Django start:
+# web workers only need it once a booking is queued (passenger.tasks imports
+# it then), and `celery -A passenger_api` resolves `celery_app` through
+# __getattr__ below.
 
 __all__ = ('celery_app',)
+
+
+def __getattr__(name):
+    if name == 'celery_app':
+        from .celery import app
+
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -16,19 +16,42 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView, SpectacularRedocView
+from passenger.metrics import metrics_view
+from passenger.schema import schema_view
+from django.utils.module_loading import import_string
+from django.views.decorators.csrf import csrf_exempt
+
+
+def lazy_view(view_path, **initkwargs):
+    """Import a class-based view on its first request.
+
+    Used for the Swagger and ReDoc views so drf_spectacular stays out of
+    cold start; the docs are rarely hit in production.
+    """
+    view = None
+
+    @csrf_exempt
+    def dispatch(request, *args, **kwargs):
+        nonlocal view
+        if view is None:
+            view = import_string(view_path).as_view(**initkwargs)
+        return view(request, *args, **kwargs)
+
+    return dispatch
+
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('passenger/', include("passenger.urls")),
+    path('metrics', metrics_view, name='metrics'),
 
-    path('passenger/schema/', SpectacularAPIView.as_view(), name='schema'),
+    path('passenger/schema/', schema_view, name='schema'),
 
     # Swagger UI
-    path('', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
+    path('', lazy_view('drf_spectacular.views.SpectacularSwaggerView', url_name='schema'), name='swagger-ui'),
 
     # ReDoc UI
-    path('passenger/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
+    path('passenger/redoc/', lazy_view('drf_spectacular.views.SpectacularRedocView', url_name='schema'), name='redoc'),
 
 ]
@@ -0,0 +1,2 @@
+-- One database per service; POSTGRES_DB creates the passenger one.
+CREATE DATABASE driver;